@@ -0,0 +1,131 @@
+#-----------------------------------------------------------------------------------------
+# Name:        analysiscacheTest.py
+# Purpose:     To test the analysis results cache (memory and disk tiers) and its use
+#              by the analysis functions of the zdde module. These tests don't require
+#              Zemax.
+#
+# Licence:     MIT License
+#-----------------------------------------------------------------------------------------
+'''test functions in the module analysiscache
+'''
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import collections
+import numpy as np
+import pyzdde.analysiscache as acache
+import pyzdde.zdde as pyz
+
+POPinfo = collections.namedtuple('POPinfo', ['surf', 'peakIrr', 'gridX'])
+
+#%% Helper class
+
+class FakeLink(object):
+    """minimal stand-in of the PyZDDE link for the ``_cachedAnalysis`` decorator"""
+    apr = False
+
+    def __init__(self, lensFile):
+        self.lensFile = lensFile
+        self.nRuns = 0
+        self._anaCache = None
+        self._lensGeneration = 0
+        self._sessionId = 'test'
+
+    def zGetFile(self):
+        return self.lensFile
+
+    _lensFingerprint = pyz.PyZDDE._lensFingerprint
+    zSetAnalysisCache = pyz.PyZDDE.zSetAnalysisCache
+    zInvalidateAnalysisCache = pyz.PyZDDE.zInvalidateAnalysisCache
+
+    @pyz._cachedAnalysis(lambda a: 'Hps' if a['which'] == 'huygens' else 'Fps')
+    def zGetPSF(self, which='fft', settingsFile=None, txtFile=None,
+                keepFile=False, timeout=120, asArray=False):
+        self.nRuns += 1
+        return POPinfo(3, 1.5*self.nRuns, 64), np.arange(16.0).reshape(4, 4)
+
+#%% Test functions
+
+def test_memory_and_disk_tiers():
+    """test the LRU memory tier, the disk tier and the invalidation"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = acache.AnalysisCache(maxSize=2, cacheDir=tmpdir)
+        result = (POPinfo(3, 1.25, np.int32(64)), [[1.0, 2.0], [3.0, 4.0]],
+                  np.eye(3), {'a' : (1, None)})
+        keys = [cache.makeKey(('lens.zmx', 'abc'), 'Pop', 'cfg', (('n', i),))
+                for i in range(3)]
+        for key in keys:
+            cache.put(key, result)
+        assert len(cache) == 2 and all(key in cache for key in keys)
+        # the first key is only on disk now
+        cache2 = acache.AnalysisCache(cacheDir=tmpdir)
+        for c in (cache, cache2):
+            info, lst, arr, dct = c.get(keys[0])
+            assert info == (3, 1.25, 64) and info._fields == POPinfo._fields
+            assert lst == [[1.0, 2.0], [3.0, 4.0]] and dct == {'a' : (1, None)}
+            assert np.array_equal(arr, np.eye(3)) and not arr.flags.writeable
+        # results returned are copies
+        lst.append(0)
+        assert len(cache2.get(keys[0])[1]) == 2
+        other = cache.makeKey(('lens.zmx', 'abc'), 'Mtf', 'cfg')
+        cache.put(other, [1, 2])
+        cache.invalidate('Pop')
+        assert not any(key in cache for key in keys)
+        assert cache.get(other) == [1, 2]
+        cache.clear()
+        assert cache.get(other) is None and os.listdir(tmpdir) == []
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_cached_analysis():
+    """test the keys used by the analysis functions"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        lensFile = os.path.join(tmpdir, 'lens.zmx')
+        with open(lensFile, 'w') as f:
+            f.write('VERS 1\n')
+        ln = FakeLink(lensFile)
+        ln.zGetPSF()
+        ln.zGetPSF()
+        assert ln.nRuns == 2     # the cache is not enabled
+        ln.zSetAnalysisCache()
+        info, arr = ln.zGetPSF()
+        arr[:] = -1     # the result of a miss doesn't alias the cache
+        assert np.array_equal(ln.zGetPSF()[1], np.arange(16.0).reshape(4, 4))
+        assert ln.zGetPSF()[0] == info and ln.zGetPSF('fft')[0] == info
+        assert ln.nRuns == 3
+        ln.zGetPSF('huygens')
+        ln.zGetPSF(asArray=True)
+        ln.zGetPSF(keepFile=True)    # bypass
+        assert ln.nRuns == 6
+        # change of the settings file
+        cfgFile = os.path.join(tmpdir, 'lens_pyzdde_FFTPSF.CFG')
+        with open(cfgFile, 'w') as f:
+            f.write('settings')
+        ln.zGetPSF()
+        ln.zGetPSF(settingsFile=cfgFile)
+        assert ln.nRuns == 7
+        # change of the lens
+        ln._lensGeneration += 1
+        ln.zGetPSF()
+        assert ln.nRuns == 8
+        ln.zInvalidateAnalysisCache('Fps', lensChanged=False)
+        ln.zGetPSF()
+        assert ln.nRuns == 9
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_lens_preserving_commands():
+    """test the classification of the DDE commands for the lens fingerprint"""
+    for cmd in ('GetSurfaceData,1,2', 'GetTextFile,a.txt,Pop,,0', 'PushLens,1'):
+        assert pyz._isLensPreservingCmd(cmd)
+    for cmd in ('GetRefresh', 'SetSurfaceData,1,2,3', 'NSCTrace,1,0', 'Optimize,5'):
+        assert not pyz._isLensPreservingCmd(cmd)
+
+
+if __name__ == '__main__':
+    test_memory_and_disk_tiers()
+    test_cached_analysis()
+    test_lens_preserving_commands()
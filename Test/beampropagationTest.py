@@ -0,0 +1,127 @@
+#-----------------------------------------------------------------------------------------
+# Name:        beampropagationTest.py
+# Purpose:     To test the local propagation of beam files in the beampropagation module
+#              against the analytic propagation of Gaussian beams. These tests don't
+#              require Zemax.
+#
+# Licence:     MIT License
+#-----------------------------------------------------------------------------------------
+'''test functions in the module beampropagation
+'''
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import warnings
+import numpy as np
+import pyzdde.zfileutils as zfu
+import pyzdde.beampropagation as bp
+
+lamda, w0 = 0.00055, 0.05
+zR = np.pi*w0**2/lamda
+
+#%% Helper functions
+
+def gaussianBeam(n=128, dx=0.005, ispol=False):
+    """returns a ``zbfData`` Gaussian beam at its waist"""
+    hdr = zfu.zbfHeader(1, n, n, int(ispol), 0, dx, dx, 0.0, 0.0, zR, zR, w0, w0,
+                        lamda, 1.0, 0.5, 0.5)
+    x, y = zfu.beamFileAxes(hdr)
+    Ex = gaussianField(x, y, 0.0)
+    return zfu.zbfData(hdr, Ex, 0.5j*Ex if ispol else None)
+
+def gaussianField(x, y, z):
+    """paraxial field of the Gaussian beam at the distance ``z`` from its waist"""
+    q = 1 + 1j*z/zR
+    return np.exp(-(x[None, :]**2 + y[:, None]**2)/(w0**2*q))/q
+
+#%% Test functions
+
+def test_angular_spectrum_and_fresnel():
+    """test both methods against the analytic propagation of a Gaussian beam,
+    forwards and backwards
+    """
+    beam = gaussianBeam()
+    zc = bp.criticalDistance(beam.header)
+    assert np.isclose(zc, 128*0.005**2/lamda)
+    for z in (3.0, -3.0, 50.0, -50.0):
+        beam2 = bp.propagateBeam(beam, z)
+        hdr = beam2.header
+        assert hdr.zposition_x == z and hdr.zposition_y == z
+        assert hdr.waist_x == w0 and hdr.rayleigh_x == zR
+        assert hdr.receiver_eff == 0 and hdr.system_eff == 0
+        if abs(z) < zc:   # angular spectrum keeps the grid
+            assert hdr.dx == beam.header.dx
+        else:             # Fresnel rescales it
+            assert np.isclose(hdr.dx, lamda*abs(z)/(128*0.005))
+        x, y = zfu.beamFileAxes(hdr)
+        assert np.allclose(beam2.Ex, gaussianField(x, y, z), atol=1e-5)
+        energy = (abs(beam2.Ex)**2).sum()*hdr.dx*hdr.dy
+        assert np.isclose(energy, np.pi*w0**2/2)
+        assert np.allclose(bp.beamWidth(beam2), w0*np.sqrt(1 + (z/zR)**2), rtol=1e-5)
+
+def test_batched_propagation():
+    """test that batched propagation matches single propagations and reuses
+    the propagator and its transfer functions
+    """
+    beam = gaussianBeam(ispol=True)
+    zs = [0.0, 1.0, 2.0, 4.0, 20.0]
+    beams = bp.propagateBeam(beam, zs)
+    assert len(beams) == len(zs)
+    assert np.allclose(beams[0].Ex, beam.Ex) and np.allclose(beams[0].Ey, beam.Ey)
+    for z, beam2 in zip(zs, beams):
+        single = bp.propagateBeam(beam, z)
+        assert np.allclose(single.Ex, beam2.Ex) and np.allclose(single.Ey, beam2.Ey)
+        assert np.allclose(beam2.Ey, 0.5j*beam2.Ex)
+    propagators = [p for p in bp._propagator_cache.values()
+                   if p.wavelength == lamda and p.d == (0.005, 0.005)]
+    assert any(len(p._transfer) >= 4 for p in propagators)
+    p = bp.getBeamPropagator((128, 128), (0.005, 0.005), lamda)
+    assert p is bp.getBeamPropagator((128, 128), (0.005, 0.005), lamda)
+    assert p.transferFunction(1.0) is p.transferFunction(1.0)
+
+def test_padding_and_warnings():
+    """test that the automatic padding prevents the wrap-around of the light
+    diffracted by a truncated beam, and the sampling warnings
+    """
+    beam = gaussianBeam(n=64, dx=0.002)   # truncated by the grid
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        info = bp.beamSampling(beam)
+        assert info.edge_energy > 1e-3
+        padded = bp.propagateBeam(beam, 0.4, method='angular')
+        unpadded = bp.propagateBeam(beam, 0.4, method='angular', pad=1)
+        reference = bp.propagateBeam(beam, 0.4, method='angular', pad=8)
+    assert any('edges of the grid' in str(m.message) for m in w)
+    errPadded = abs(padded.Ex - reference.Ex).max()
+    errUnpadded = abs(unpadded.Ex - reference.Ex).max()
+    assert errPadded < 1e-3 < errUnpadded
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        bp.propagateBeam(gaussianBeam(), 1.0, method='fresnel')
+    assert any('Fresnel' in str(m.message) for m in w)
+
+def test_propagate_beam_file():
+    """test the propagation of a beam file written back to a beam file
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        inFile = os.path.join(tmpdir, 'waist.zbf')
+        outFile = os.path.join(tmpdir, 'propagated.zbf')
+        beam = gaussianBeam(ispol=True)
+        zfu.writeBeamFileArray(inFile, beam.header, beam.Ex, beam.Ey)
+        beam2 = bp.propagateBeamFile(inFile, 30.0, outFile)
+        read = zfu.readBeamFileArray(outFile)
+        assert read.header == beam2.header
+        assert np.array_equal(read.Ex, beam2.Ex) and np.array_equal(read.Ey, beam2.Ey)
+        x, y = zfu.beamFileAxes(read.header)
+        assert np.allclose(read.Ex, gaussianField(x, y, 30.0), atol=1e-5)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    test_angular_spectrum_and_fresnel()
+    test_batched_propagation()
+    test_padding_and_warnings()
+    test_propagate_beam_file()
@@ -0,0 +1,107 @@
+#-----------------------------------------------------------------------------------------
+# Name:        fibercouplingTest.py
+# Purpose:     To test the fiber coupling overlap integrals of the fibercoupling module
+#              against the analytic coupling efficiency of Gaussian beams. These tests
+#              don't require Zemax.
+#
+# Licence:     MIT License
+#-----------------------------------------------------------------------------------------
+'''test functions in the module fibercoupling
+'''
+from __future__ import print_function
+import numpy as np
+import pyzdde.zfileutils as zfu
+import pyzdde.fibercoupling as fc
+
+lamda = 0.00155
+
+#%% Helper functions
+
+def gaussianBeam(w, n=96, dx=0.0005, tilt=0.0, ispol=False):
+    """returns a ``zbfData`` Gaussian beam of waist ``w`` tilted in x"""
+    hdr = zfu.zbfHeader(1, n, n, int(ispol), 0, dx, dx, 0.0, 0.0, 1.0, 1.0, w, w,
+                        lamda, 1.0, 0.0, 0.0)
+    Ex = fc.gaussianMode(hdr, 2*w, tilt=(tilt, 0.0))
+    return zfu.zbfData(hdr, Ex, 0.5*Ex if ispol else None)
+
+def gaussianCoupling(w1, w2, offset=0.0, tilt=0.0):
+    """analytic coupling efficiency of two Gaussian beams"""
+    s = w1**2 + w2**2
+    k = 2*np.pi/lamda
+    return ((2*w1*w2/s)**2*np.exp(-2*offset**2/s)
+            *np.exp(-(k*np.sin(tilt))**2*w1**2*w2**2/(2*s)))
+
+#%% Test functions
+
+def test_gaussian_coupling():
+    """test the coupling map against the analytic coupling of Gaussian beams
+    for offsets, tilts and mode field diameters
+    """
+    w1 = 0.004
+    beam = gaussianBeam(w1)
+    mfds = [0.008, 0.009, (0.010, 0.010)]
+    tilts = [(0.0, 0.0), (0.02, 0.0), (0.0, -0.03)]
+    cmap = fc.fiberCouplingMap(beam, mfds, tilts=tilts)
+    assert cmap.receiver_eff.shape == (3, 3, 96, 96)
+    assert cmap.system_eff == 1.0
+    assert np.array_equal(cmap.x, zfu.beamFileAxes(beam.header)[0])
+    for t, (tx, ty) in enumerate(tilts):
+        for m, mfd in enumerate([0.008, 0.009, 0.010]):
+            w2 = mfd/2
+            eff = cmap.receiver_eff[t, m]
+            assert np.isclose(eff[48, 48], gaussianCoupling(w1, w2, tilt=tx or ty))
+            for i in (52, 40, 60):   # lateral offsets along x and y
+                off = cmap.x[i]
+                ref = gaussianCoupling(w1, w2, off, tx or ty)
+                assert np.isclose(eff[48, i], ref, atol=1e-9)
+                assert np.isclose(eff[i, 48], ref, atol=1e-9)
+    # a tilted beam couples best into the fiber with the same tilt
+    tilted = gaussianBeam(w1, tilt=0.02)
+    cmap = fc.fiberCouplingMap(tilted, [2*w1], tilts=tilts)
+    assert np.isclose(cmap.receiver_eff[1, 0, 48, 48], 1.0)
+    assert np.isclose(cmap.receiver_eff[0, 0].max(), gaussianCoupling(w1, w1, tilt=0.02))
+
+def test_coupling_map_direct_overlap():
+    """test that the FFT correlation matches the direct overlap integrals of
+    an arbitrary polarized beam with shifted and tilted modes
+    """
+    rs = np.random.RandomState(3)
+    beam = gaussianBeam(0.003, n=48, ispol=True)
+    Ex = beam.Ex*(1 + 0.3*rs.normal(size=(48, 48)))*np.exp(1j*rs.normal(size=(48, 48)))
+    beam = beam._replace(Ex=Ex, Ey=np.roll(Ex, 3, axis=1))
+    hdr = beam.header
+    fiberMode = fc.gaussianMode(hdr, (0.006, 0.007))*(1 + 0.1j*np.arange(48)/48)
+    tilt = (0.01, 0.005)
+    cmap = fc.fiberCouplingMap(beam, mfds=[0.005], modes=[fiberMode],
+                               tilts=[tilt], sourcePower=2.0)
+    power = ((abs(beam.Ex)**2).sum() + (abs(beam.Ey)**2).sum())*hdr.dx*hdr.dy
+    assert np.isclose(cmap.system_eff, power/2.0)
+    assert np.allclose(cmap.coupling, cmap.system_eff*cmap.receiver_eff)
+    k = 2*np.pi/lamda
+    x, y = zfu.beamFileAxes(hdr)
+    for j, i in ((24, 24), (20, 30), (2, 45), (40, 5)):
+        W = fc.gaussianMode(hdr, 0.005, center=(x[i], y[j]), tilt=tilt)
+        assert np.isclose(cmap.receiver_eff[0, 0, j, i], fc.receiverEfficiency(beam, W))
+        shifted = np.zeros_like(fiberMode)   # arbitrary mode shifted on the grid
+        sj, si = j - 24, i - 24
+        shifted[max(sj, 0):48 + min(sj, 0), max(si, 0):48 + min(si, 0)] = \
+            fiberMode[max(-sj, 0):48 + min(-sj, 0), max(-si, 0):48 + min(-si, 0)]
+        tiltPhase = np.exp(1j*k*(np.sin(tilt[0])*x[None, :] + np.sin(tilt[1])*y[:, None]))
+        overlap = [abs((E*np.conj(shifted*tiltPhase)).sum())**2 for E in (beam.Ex, beam.Ey)]
+        norm = power/(hdr.dx*hdr.dy)*(abs(fiberMode)**2).sum()
+        assert np.isclose(cmap.receiver_eff[0, 1, j, i], sum(overlap)/norm)
+
+def test_system_efficiency_from_header():
+    """test that the system efficiency computed by Zemax is used by default
+    """
+    beam = gaussianBeam(0.004)
+    beam = beam._replace(header=beam.header._replace(system_eff=0.8))
+    cmap = fc.fiberCouplingMap(beam, [0.008])
+    assert cmap.system_eff == 0.8
+    assert np.isclose(cmap.coupling[0, 0, 48, 48], 0.8)
+
+
+if __name__ == '__main__':
+    test_gaussian_coupling()
+    test_coupling_map_direct_overlap()
+    test_system_efficiency_from_header()
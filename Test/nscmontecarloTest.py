@@ -0,0 +1,136 @@
+#-----------------------------------------------------------------------------------------
+# Name:        nscmontecarloTest.py
+# Purpose:     To test the accumulation of the detector data of independent NSC traces in
+#              the nscmontecarlo module, with simulated Zemax links. These tests don't
+#              require Zemax.
+#
+# Licence:     MIT License
+#-----------------------------------------------------------------------------------------
+'''test functions in the module nscmontecarlo
+'''
+from __future__ import print_function
+import numpy as np
+import pyzdde.zdde as pyz
+import pyzdde.nscmontecarlo as mc
+
+#%% Helper classes
+
+def detectorData(seed, det, rays=1000):
+    """simulated flux of a 4x5 detector traced with a seed"""
+    rs = np.random.RandomState(seed*100 + det)
+    return rs.poisson(10.0*np.arange(1, 21).reshape(4, 5)*rays/1000.0)/rays
+
+class FakeTrace(object):
+    """future of a simulated trace that finishes after ``polls`` checks"""
+    def __init__(self, link, seed, polls):
+        self.link, self.seed, self.polls = link, seed, polls
+        self.readouts = []
+
+    def then(self, readout):
+        self.readouts.append(readout)
+        return self
+
+    def done(self):
+        self.polls -= 1
+        return self.polls < 0
+
+    def result(self):
+        status = self.link.statuses.get(self.seed, 0)
+        if isinstance(status, Exception):
+            raise status
+        data = [r(self.link) for r in self.readouts] if status == 0 else []
+        return pyz.nscTraceResult(status, 1.0, data)
+
+class FakeLink(object):
+    """simulated Zemax link whose traces take ``polls`` checks"""
+    def __init__(self, polls, statuses=None):
+        self.polls, self.statuses = polls, statuses or {}
+        self.seed, self.cleared, self.traces = None, 0, []
+
+    def zNSCDetectorClear(self, surfNum, detectNum=0):
+        self.cleared += 1
+
+    def zNSCTraceAsync(self, surfNum, srcNum, randomSeed=0, timeout=3600, **kwargs):
+        self.seed = randomSeed
+        self.traces.append((randomSeed, kwargs))
+        return FakeTrace(self, randomSeed, self.polls)
+
+    def zGetDetectorArray(self, surfNum, detectNum, dtype=0):
+        if self.seed in self.statuses.get('readoutErrors', ()):
+            raise IOError('detector file not found')
+        return detectorData(self.seed, detectNum)
+
+#%% Test functions
+
+def test_running_statistics():
+    """test the running mean and variance against numpy"""
+    data = np.random.RandomState(1).normal(3.0, 2.0, size=(50, 3, 4))
+    stats = mc.RunningStatistics()
+    assert stats.relativeNoise() == np.inf
+    for x in data:
+        stats.add(x)
+    assert stats.n == 50
+    assert np.allclose(stats.mean, data.mean(axis=0))
+    assert np.allclose(stats.variance, data.var(axis=0, ddof=1))
+    assert np.allclose(stats.stderr, data.std(axis=0, ddof=1)/np.sqrt(50))
+    assert np.isclose(stats.relativeNoise(), stats.stderr.sum()/stats.mean.sum())
+
+def test_monte_carlo_runs():
+    """test the distribution of the jobs over the links, the accumulation of
+    the detectors and the early stop
+    """
+    links = [FakeLink(0, {4 : -5}), FakeLink(2, {4 : -5})]
+    res = mc.runMonteCarlo(links, [3, 7], relNoise=0, maxJobs=12, pollInterval=0,
+                           traceArgs=dict(split=1))
+    assert not res.converged and res.nJobs == 11 and res.failed == [(4, -5)]
+    assert sorted(res.seeds) == [s for s in range(1, 13) if s != 4]
+    assert all(len(ln.traces) > 1 and ln.traces[0][1] == dict(split=1) for ln in links)
+    assert sum(ln.cleared for ln in links) == 12
+    for det in (3, 7):
+        data = np.array([detectorData(s, det) for s in res.seeds])
+        assert np.allclose(res.mean[det], data.mean(axis=0))
+        assert np.allclose(res.std[det], data.std(axis=0, ddof=1))
+        assert np.allclose(res.stderr[det], res.std[det]/np.sqrt(11))
+        assert np.isclose(res.relNoise[det], res.stderr[det].sum()/res.mean[det].sum())
+    assert len(res.history) == 11 and res.history[-1] == max(res.relNoise.values())
+    # early stop once the target noise is reached
+    calls = []
+    res = mc.runMonteCarlo(FakeLink(1), 3, relNoise=0.03, maxJobs=200, pollInterval=0,
+                           seeds=range(10, 400), callback=lambda n, noise: calls.append(n))
+    assert res.converged and 4 <= res.nJobs < 200 and res.history[-1] <= 0.03
+    assert res.history[-2] > 0.03 and calls == list(range(1, res.nJobs + 1))
+    assert res.seeds == list(range(10, 10 + res.nJobs))
+
+def test_monte_carlo_errors():
+    """test that the jobs raising exceptions are reported without aborting
+    the run, and that their links are not used anymore
+    """
+    err = RuntimeError('Unable to establish a conversation with server')
+    statuses = {3 : err, 'readoutErrors' : (6,)}
+    links = [FakeLink(p, statuses) for p in (0, 1, 2)]
+    res = mc.runMonteCarlo(links, 3, relNoise=0, maxJobs=10, pollInterval=0)
+    assert len(res.failed) == 2 and dict(res.failed)[3] is err
+    assert isinstance(dict(res.failed)[6], IOError)
+    assert sorted(res.seeds + [3, 6]) == list(range(1, 11)) and res.nJobs == 8
+    # the links of the jobs 3 and 6 are retired, the third one runs the rest
+    assert sorted(ln.traces[-1][0] for ln in links)[:2] == [3, 6]
+    data = np.array([detectorData(s, 3) for s in res.seeds])
+    assert np.allclose(res.mean[3], data.mean(axis=0))
+
+def test_monte_carlo_all_failed():
+    """test the result of a run whose jobs all fail"""
+    err = RuntimeError('DDE error')
+    res = mc.runMonteCarlo([FakeLink(0, {1 : -5, 2 : err})], [3, 7], maxJobs=2,
+                           pollInterval=0)
+    assert res.nJobs == 0 and res.seeds == [] and not res.converged
+    assert res.failed == [(1, -5), (2, err)] and res.history == []
+    for det in (3, 7):
+        assert res.mean[det] is None and res.std[det] is None and res.stderr[det] is None
+        assert res.relNoise[det] == np.inf
+
+
+if __name__ == '__main__':
+    test_running_statistics()
+    test_monte_carlo_runs()
+    test_monte_carlo_errors()
+    test_monte_carlo_all_failed()
@@ -0,0 +1,155 @@
+#-----------------------------------------------------------------------------------------
+# Name:        raybinningTest.py
+# Purpose:     To test the binning of the ray segments of ZRD files in the raybinning
+#              module against histograms of the whole files. These tests don't require
+#              Zemax.
+#
+# Licence:     MIT License
+#-----------------------------------------------------------------------------------------
+'''test functions in the module raybinning
+'''
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyzdde.zfileutils as zfu
+import pyzdde.raybinning as rb
+
+curDir = os.path.dirname(os.path.realpath(__file__))
+testdata = os.path.join(curDir, 'testdata')
+
+#%% Helper functions
+
+def copyTestFile(tmpdir, name):
+    """copies a test ZRD file to ``tmpdir`` (such that its index is written there)"""
+    dst = os.path.join(tmpdir, name)
+    shutil.copy(os.path.join(testdata, name), dst)
+    return dst
+
+def directHistogram(segments, u, v, uEdges, vEdges, mask):
+    return np.histogram2d(u[mask], v[mask], (uEdges, vEdges),
+                          weights=segments['intensity'][mask])[0]
+
+#%% Test functions
+
+def test_irradiance_and_polar_bins():
+    """test the binned power of uncompressed and compressed files against
+    histograms of all their segments, with filters and chunks
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name in ('ColorFringes_TenRays_SplitRays_UFD.ZRD',
+                     'ColorFringes_TenRays_SplitRays_CBD.ZRD',
+                     'ColorFringes_TenRays_SplitRays_CFD.ZRD'):
+            zrdfile = copyTestFile(tmpdir, name)
+            seg = zfu.readZRDArray(zrdfile).segments
+            obj = np.bincount(seg['hit_object']).argmax()
+            xlim = (seg['x'].min() - 1, seg['x'].max() + 1)
+            ylim = (seg['y'].min() - 1, seg['y'].max() + 1)
+            bins = [rb.IrradianceBins(8, 6, xlim, ylim),
+                    rb.PolarBins(9, 4, thetaMax=180)]
+            for filters in (dict(), dict(hit_object=obj), dict(level=[1, 2])):
+                mask = np.ones(len(seg), dtype=bool)
+                for field, wanted in filters.items():
+                    mask &= np.isin(seg[field], wanted)
+                irr, polar = rb.binZRDFile(zrdfile, bins, chunkSize=3, **filters)
+                ref = directHistogram(seg, seg['x'], seg['y'], irr.uEdges, irr.vEdges, mask)
+                assert np.allclose(irr.power, ref)
+                assert irr.hits.sum() == mask.sum()
+                area = np.diff(irr.uEdges)[0]*np.diff(irr.vEdges)[0]
+                assert np.allclose(irr.data, ref/area)
+                theta = np.degrees(np.arccos(np.clip(seg['n'], -1, 1)))
+                phi = np.degrees(np.arctan2(seg['m'], seg['l'])) % 360
+                ref = directHistogram(seg, theta, phi, polar.uEdges, polar.vEdges, mask)
+                assert np.allclose(polar.power, ref)
+                # the solid angles of the polar bins add up to the sphere
+                assert np.isclose(bins[1].binSize().sum(), 4*np.pi)
+            # the hits kept in memory are binned again without the file
+            hits = rb.extractHits(zrdfile, hit_object=obj, chunkSize=4)
+            assert len(hits) == (seg['hit_object'] == obj).sum()
+            again = rb.binHits(hits, bins[0])
+            assert np.allclose(again.power, rb.binZRDFile(zrdfile, bins[0], hit_object=obj).power)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_angular_bins_and_rotation():
+    """test the angular bins and the local frame of the bins
+    """
+    hits = np.zeros(4, dtype=[(name, np.float64) for name in rb._hitFields])
+    hits['l'] = [0.1, -0.5, 0.0, 0.3]
+    hits['m'] = [0.2, 0.1, 0.0, 0.0]
+    hits['n'] = np.sqrt(1 - hits['l']**2 - hits['m']**2)*[1, 1, 1, -1]
+    hits['x'] = [1.0, 2.0, 3.0, 4.0]
+    hits['intensity'] = [1.0, 2.0, 3.0, 4.0]
+    ang = rb.binHits(hits, rb.AngularBins(4, 4))
+    assert ang.power.sum() == 6.0        # the backward segment is ignored
+    assert ang.power[2, 2] == 4.0 and ang.power[1, 2] == 2.0
+    size = rb.AngularBins(4, 4).binSize()
+    assert np.isnan(size[0, 0]) and np.isclose(size[1, 1], 0.25/np.sqrt(0.875))
+    # local frame with x along the global z-axis, centered at x = 2
+    R = np.array([[0.0, 0.0, 1.0], [0.0, 1.0, 0.0], [-1.0, 0.0, 0.0]])
+    irr = rb.binHits(hits, rb.IrradianceBins(2, 1, (-1, 1), (-1, 1), (2.0, 0, 0), R))
+    assert irr.hits.sum() == 4 and irr.power.sum() == 10.0   # all at local x = 0
+    ang = rb.binHits(hits, rb.AngularBins(2, 2, rotation=R))
+    assert ang.power.sum() == 2.0   # only l < 0 is forward in the local frame
+
+def test_parallel_binning():
+    """test that the binning by a pool of processes matches the serial one
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        zrdfile = copyTestFile(tmpdir, 'Beamsplitter_TenRay_SplitRays_UFD.ZRD')
+        bins = rb.IrradianceBins(16, 16, (-20, 20), (-20, 20))
+        serial = rb.binZRDFile(zrdfile, bins, chunkSize=2)
+        parallel = rb.binZRDFile(zrdfile, bins, chunkSize=2, processes=2)
+        assert os.path.isdir(zrdfile + '.idx')
+        assert np.allclose(serial.power, parallel.power)
+        assert np.array_equal(serial.hits, parallel.hits)
+        seg = zfu.readZRDArray(zrdfile).segments
+        inside = (abs(seg['x']) <= 20) & (abs(seg['y']) <= 20)
+        assert serial.hits.sum() == inside.sum()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_compressed_file_blocks():
+    """test the binning of compressed files by chunks smaller than the file,
+    with an index scanned by blocks smaller than the file
+    """
+    tmpdir = tempfile.mkdtemp()
+    block = zfu._ZRD_SCAN_BLOCK
+    try:
+        zfu._ZRD_SCAN_BLOCK = 7   # segments (rays) per block of the scan
+        for name in ('ColorFringes_TenRays_SplitRays_CBD.ZRD',
+                     'ColorFringes_TenRays_SplitRays_CFD.ZRD'):
+            zrdfile = copyTestFile(tmpdir, name)
+            full = zfu.readZRDArray(zrdfile)
+            assert len(full.segments) > 3*zfu._ZRD_SCAN_BLOCK
+            for useIndex in (True, False):
+                zrd = zfu.ZRDFile(zrdfile, useIndex=useIndex)
+                assert isinstance(zrd._segStarts, np.memmap)
+                assert np.array_equal(zrd.offsets, full.offsets)
+                assert np.array_equal(zrd.segments(), full.segments)
+                tmpIndex = zrd._tmpIndexDir
+                assert (tmpIndex is None) == useIndex
+                zrd.close()
+                assert tmpIndex is None or not os.path.exists(tmpIndex)
+            seg = full.segments
+            bins = rb.IrradianceBins(5, 5, (seg['x'].min(), seg['x'].max()),
+                                     (seg['y'].min(), seg['y'].max()))
+            irr = rb.binZRDFile(zrdfile, bins, chunkSize=2)
+            assert len(full.offsets) - 1 > 2
+            ref = np.histogram2d(seg['x'], seg['y'], (irr.uEdges, irr.vEdges),
+                                 weights=seg['intensity'])[0]
+            assert np.allclose(irr.power, ref) and irr.hits.sum() == len(seg)
+    finally:
+        zfu._ZRD_SCAN_BLOCK = block
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    test_irradiance_and_polar_bins()
+    test_angular_bins_and_rotation()
+    test_parallel_binning()
+    test_compressed_file_blocks()
@@ -0,0 +1,449 @@
+#-----------------------------------------------------------------------------------------
+# Name:        zddeHelpersTest.py
+# Purpose:     To test the module level helper functions of the zdde module that are
+#              used for parsing the analysis text files. These tests don't require
+#              Zemax.
+#
+# Licence:     MIT License
+#-----------------------------------------------------------------------------------------
+'''test the text file parsing helper functions in the module zdde
+'''
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pyzdde.zdde as pyz
+import pyzdde.zfileutils as zfu
+
+#%% Test functions
+
+def test_get2DArray():
+    """test that ``_get2DArray()`` returns the same data as ``_get2DList()``
+    """
+    rs = np.random.RandomState(1)
+    grid = rs.normal(size=(7, 5))
+    line_list = ['Header line', 'Grid size: 5 by 7', '']
+    line_list += ['   '.join('{:.6E}'.format(v) for v in row) for row in grid]
+    line_list += ['', 'Footer 1 2 3']
+    for kwargs in ({}, {'startCol':1}, {'endCol':4}, {'startCol':1, 'stride':2}):
+        data = pyz._get2DArray(line_list, 3, 7, **kwargs)
+        assert isinstance(data, np.ndarray) and data.dtype == np.float64
+        assert data.flags['C_CONTIGUOUS']
+        assert np.array_equal(data, np.array(pyz._get2DList(line_list, 3, 7, **kwargs)))
+    assert np.allclose(pyz._get2DArray(line_list, 3, 7), grid, rtol=1e-6)
+    # subset of lines
+    assert np.array_equal(pyz._get2DArray(line_list, 4, 2),
+                          np.array(pyz._get2DList(line_list, 4, 2)))
+    # rows of unequal length
+    ragged = ['1 2 3', '4 5 6 7', '8 9']
+    try:
+        pyz._get2DArray(ragged, 0, 3)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ragged rows should be rejected')
+    assert np.array_equal(pyz._get2DArray(ragged, 0, 3, endCol=2),
+                          [[1, 2], [4, 5], [8, 9]])
+    assert np.array_equal(pyz._get2DArray(ragged, 0, 3, startCol=1, endCol=2),
+                          [[2], [5], [9]])
+
+def test_text_file_index():
+    """test the single-pass index of the analysis text files
+    """
+    line_list = ['Listing of POP Irradiance Data', '',
+                 'File : C:\\ZEMAX\\Samples\\lens.zmx', 'Date : 1/2/2016',
+                 'Surface 3: FIBER', 'Grid size (X by Y): 4 by 3',
+                 'Point spacing (X by Y): 1.0000E-002 by 1.0000E-002 Millimeters',
+                 'Peak Irradiance = 1.2345E+001 Watts/Millimeters^2, Total Power = 1.0000E+000 Watts',
+                 '']
+    grid = [' '.join(['{:.4E}'.format(0.5*(i + j)) for i in range(4)]) for j in range(3)]
+    line_list += grid + ['', 'Field: 0.0000 deg', '-1.2 3.4', '5.6 7.8', 'Field: 1.0000 deg']
+    idx = pyz._TextFileIndex(line_list)
+    assert len(idx) == len(line_list)
+    assert idx[5] == line_list[5]
+    assert idx.blocks == [(9, 12), (14, 16)]
+    assert idx.find('Grid size') == 5
+    assert idx.find('Irradiance Data', patAtStart=False) == 0
+    assert idx.find('Field:', start=14) == 16
+    assert idx.find('Non existing') is None
+    assert idx.findAll(r'Field:\s') == [13, 16]
+    pat = r'(-?\d\.\d{4,6}[Ee][-\+]\d{2,3}\s*){4}'
+    start = idx.findData(pat)
+    assert start == pyz._getFirstLineOfInterest(line_list, pat) == 9
+    assert idx.findData(r'-?\d\.\d\s') == 14
+    assert idx.block(10) == (9, 12)
+    assert idx.block(12) is None
+    assert np.array_equal(pyz._get2DArray(idx, start, 3),
+                          np.array(pyz._get2DList(line_list, start, 3)))
+
+def test_get_rgb_array():
+    """test the bulk conversion of the image simulation pixel data
+    """
+    rs = np.random.RandomState(2)
+    height, width = 5, 7
+    img = rs.randint(0, 256, size=(height, width, 3))
+    line_list = ['Bitmap Width : 7 pixels', 'xpix  ypix  R  G  B']
+    for xpix in range(width):
+        for ypix in range(height):
+            line_list.append('{} {} {} {} {}'.format(xpix, ypix, *img[ypix, xpix]))
+    for chunkSize in (2**20, 12):
+        arr = pyz._getRGBArray(line_list, 2, width, height, chunkSize=chunkSize)
+        assert arr.dtype == np.uint8 and arr.shape == (height, width, 3)
+        assert np.array_equal(arr, img)
+    outFile = os.path.join(tempfile.mkdtemp(), 'imgsim.npy')
+    arr = pyz._getRGBArray(line_list, 2, width, height, outFile, chunkSize=12)
+    assert isinstance(arr, np.memmap)
+    del arr
+    assert np.array_equal(np.load(outFile, mmap_mode='r'), img)
+    shutil.rmtree(os.path.dirname(outFile))
+
+def test_decode_text():
+    """test the one pass decoding of the text files written by Zemax
+    """
+    text = u'Listing of data\r\nGrid: 1,5000E-002  -2,25\r\nWavelength: 0,55 \u00b5m \r\n\r\n'
+    expected = [u'Listing of data', u'Grid: 1.5000E-002  -2.25',
+                u'Wavelength: 0.55 \u00b5m', u'']
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for encoding, bom in (('utf-16-le', b'\xff\xfe'), ('utf-16-le', b''),
+                              ('utf-16-be', b'\xfe\xff'), ('utf-8', b'\xef\xbb\xbf')):
+            fileName = os.path.join(tmpdir, 'test.txt')
+            with open(fileName, 'wb') as f:
+                f.write(bom + text.encode(encoding))
+            assert pyz._readLinesFromFile(pyz._openFile(fileName)) == expected
+            assert list(pyz._getDecodedLineFromFile(pyz._openFile(fileName))) == expected
+    finally:
+        shutil.rmtree(tmpdir)
+    # ascii text, without decimal commas
+    assert pyz._decodeText(b'a 1.5\nb 2\n') == [u'a 1.5', u'b 2']
+    assert pyz._decodeText(b'') == []
+    # the commas of the headers and labels of a file with decimal points
+    # don't run the decimal separators replacement
+    calls = []
+    replace = zfu.checkDecimalSeparators
+    zfu.checkDecimalSeparators = lambda text: calls.append(text) or replace(text)
+    try:
+        header = (b'Detector 1, NSCG Surface 1: Size 2,000 W X 2,000 H Millimeters, '
+                  b'Pixels 3 W X 2 H, Total Hits = 1,200\n')
+        lines = pyz._decodeText(header + b'0.5 1.25 -3.0E-002\n')
+        assert lines[0] == header.decode('ascii').rstrip() and lines[1] == u'0.5 1.25 -3.0E-002'
+        assert calls == []
+        assert pyz._decodeText(b'Pixels 3, 2\n0,5 1,25\n') == [u'Pixels 3, 2', u'0.5 1.25']
+        assert len(calls) == 1
+    finally:
+        zfu.checkDecimalSeparators = replace
+def _zemax_float(v):
+    """format a float like Zemax, with 3 digits exponents"""
+    mantissa, exponent = '{:.4E}'.format(v).split('E')
+    return '{}E{:+04d}'.format(mantissa, int(exponent))
+
+def _detector_text(detNum, grid=None, rowData=None):
+    """returns the lines of the text of a rectangle detector in a detector
+    viewer text file"""
+    yPix, xPix = grid.shape if grid is not None else (3, len(rowData))
+    lines = ['Detector {}, NSCG Surface 1: '.format(detNum),
+             'Size 2.000 W X 1.500 H Millimeters, Pixels {} W X {} H, '
+             'Total Hits = 1000'.format(xPix, yPix), '',
+             'Peak Irradiance : 1.2345E+003 Watts/cm^2',
+             'Total Power     : 1.0000E+000 Watts', '',
+             'Smoothing : None', 'Data Type : Incoherent Irradiance',
+             'Detector X : 0.0000', 'Detector Y : 0.0000', 'Detector Z : 10.0000',
+             'Detector Tilt X : 0.0000', 'Detector Tilt Y : 0.0000',
+             'Detector Tilt Z : 0.0000', 'Position Units : Millimeters',
+             'Units : Watts/cm^2', '']
+    if grid is not None:
+        lines.append('     ' + ' '.join('{:11d}'.format(i + 1) for i in range(xPix)))
+        for i, row in enumerate(grid):
+            lines.append('{:4d} '.format(i + 1) + ' '.join(_zemax_float(v) for v in row))
+    else:
+        lines.append('Row Center, Y = 0.0000E+000 Millimeters')
+        lines.append('')
+        coords = np.linspace(-0.75, 0.75, xPix)
+        for c, v in zip(coords, rowData):
+            lines.append('{}  {}'.format(_zemax_float(c), _zemax_float(v)))
+    return lines + ['']
+
+def test_detector_viewer_reader():
+    """test the numpy reader of the detector viewer text files, for 2-D and
+    cross-section data and several detectors in one file
+    """
+    rs = np.random.RandomState(3)
+    grid = np.round(rs.uniform(0, 10, (5, 7)), 3)
+    rowData = np.round(rs.uniform(0, 10, 6), 3)
+    lines = (['Listing of Detector Viewer Data', '', 'File : C:\\lens.zmx', 'Date : 1/2/2016', '']
+             + _detector_text(1, grid=grid) + _detector_text(2, rowData=rowData))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fileName = os.path.join(tmpdir, 'dvw.txt')
+        with open(fileName, 'wb') as f:
+            f.write(u'\r\n'.join(lines).encode('utf-16'))
+        det1, det2 = zfu.readDetectorViewerData(pyz, fileName)
+        assert (det1.info.detNum, det1.info.xPix, det1.info.yPix) == (1, 7, 5)
+        assert det1.info.peakIrr == 1234.5 and det1.info.rowOrCol is None
+        assert np.allclose(det1.row(2), grid[2]) and np.allclose(det1.col(4), grid[:, 4])
+        assert det1._grid is None   # rows and columns don't read the whole grid
+        assert det1.grid.shape == (5, 7) and np.allclose(det1.grid, grid)
+        coords, values = det1.crossSection('col', 1)
+        assert np.allclose(values, grid[:, 1]) and np.allclose(coords, [-0.6, -0.3, 0, 0.3, 0.6])
+        assert det2.info.detNum == 2 and det2.info.rowOrCol == 'row'
+        assert np.allclose(det2.values, rowData) and len(det2.coordinates) == 6
+        # the legacy reader (first detector) returns the same data
+        info, gridList = zfu.readDetectorViewerTextFile(pyz, fileName, True)
+        assert info == det1.info and np.allclose(gridList, grid)
+        info, gridArr = zfu.readDetectorViewerTextFile(pyz, fileName, True, asArray=True)
+        assert info == det1.info and np.array_equal(gridArr, det1.grid)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_prescription():
+    """test the parsing of the sections of a prescription text file
+    """
+    lines = ['System/Prescription Data', '', 'File : C:\\lens.zmx', '',
+             'GENERAL LENS DATA:', '', 'Surfaces                :  3',
+             'Stop                    :  1', 'Effective Focal Length  :  98.5',
+             '', 'SURFACE DATA SUMMARY:', '',
+             'Surf     Type         Radius      Thickness  Glass   Diameter  Conic',
+             ' OBJ STANDARD       Infinity       Infinity               0      0',
+             ' STO STANDARD          51.25              5  N-BK7       20      0',
+             '   2 STANDARD         -51.25          95.36              20      0',
+             ' IMA STANDARD       Infinity                       0.1048      0',
+             '', 'INDEX OF REFRACTION DATA:', '',
+             'Surf     Glass    Temp   Pres   0.486133  0.587562  0.656273',
+             '  0              20.00   1.00   1.00000000  1.00000000  1.00000000',
+             '  1     N-BK7    20.00   1.00   1.52237629  1.51680004  1.51432235',
+             '  2              20.00   1.00   1.00000000  1.00000000  1.00000000',
+             '', 'GLOBAL VERTEX COORDINATES, ORIENTATIONS, AND ROTATION/OFFSET MATRICES:',
+             '', 'Reference Surface: 1', '',
+             'Surf      R11            R12            R13            X',
+             '          R21            R22            R23            Y',
+             '          R31            R32            R33            Z', '']
+    for surf, z in ((1, 0.0), (2, 5.0), (3, 100.36)):
+        lines += ['{:4d}  1.0  0.0  0.0  0.0E+000'.format(surf),
+                  '      0.0  1.0  0.0  0.0E+000',
+                  '      0.0  0.0  1.0  {:.4E}'.format(z), '']
+    lines += ['CARDINAL POINTS:', '']
+    for wave in range(2):
+        lines += ['Wavelength : {}'.format(wave + 1),
+                  'Focal Length            :     -98.50      98.50',
+                  'Focal Planes            :    -96.{}       1.86'.format(wave),
+                  'Principal Planes        :      2.0{}     -96.64'.format(wave),
+                  'Anti-Principal Planes   :    -195.0      99.36', '']
+    pre = zfu.Prescription(lines)
+    assert set(pre.sections) == set(['GENERAL LENS DATA', 'SURFACE DATA SUMMARY',
+        'INDEX OF REFRACTION DATA', 'CARDINAL POINTS',
+        'GLOBAL VERTEX COORDINATES, ORIENTATIONS, AND ROTATION/OFFSET MATRICES'])
+    assert pre.sectionLines('SURFACE DATA SUMMARY')[0] == 'SURFACE DATA SUMMARY:'
+    assert pre.generalLensData['Effective Focal Length'] == '98.5'
+    summary = pre.surfaceDataSummary
+    assert [row[0] for row in summary] == ['OBJ', 'STO', 2, 'IMA']
+    assert summary[1][1][:4] == ['STANDARD', '51.25', '5', 'N-BK7']
+    assert pre.surfaceDataSummary is summary    # parsed once
+    vertex = pre.globalVertex
+    assert list(vertex) == [1, 2, 3] and vertex[3].z == 100.36
+    assert vertex[2].R == ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+    cardinals = pre.cardinalPoints
+    assert cardinals['Principal Planes'] == [(2.0, -96.64), (2.01, -96.64)]
+    assert cardinals['Focal Planes'][1] == (-96.1, 1.86)
+    assert len(cardinals['Anti-Principal Planes']) == 2
+    indices = pre.indices
+    assert indices.wavelengths == (0.486133, 0.587562, 0.656273)
+    assert indices.surfaces[1] == ('N-BK7', (1.52237629, 1.51680004, 1.51432235))
+    assert indices.surfaces[2][0] == ''
+    assert zfu.Prescription([]).globalVertex == {}
+
+
+class FakeDetectorLink(pyz.PyZDDE):
+    """PyZDDE link with a simulated Detector Rectangle"""
+    def __init__(self, flux):
+        pyz.PyZDDE.__init__(self)
+        self.flux = flux
+        self.pixelCalls = 0
+
+    def zGetNSCParameter(self, surfNum, objNum, paramNum):
+        ny, nx = self.flux.shape
+        return {1 : 2.0, 2 : 1.5, 3 : nx, 4 : ny}[paramNum]
+
+    def zNSCDetectorData(self, surfNum, detectNum, pixel, dtype):
+        flux = self.flux.ravel()
+        if pixel == 0:
+            return float('{:.10E}'.format(flux.sum()))
+        self.pixelCalls += 1
+        scale = flux.size/(4*2.0*1.5) if dtype == 1 else 1.0
+        return float('{:.10E}'.format(flux[pixel - 1]*scale))
+
+def test_detector_array():
+    """test the chunked readout of the pixels of a detector"""
+    rs = np.random.RandomState(5)
+    flux = rs.exponential(size=(6, 9))*(rs.uniform(size=(6, 9)) > 0.3)
+    ln = FakeDetectorLink(flux)
+    data = ln.zGetDetectorArray(1, 3)
+    assert data.shape == (6, 9) and np.allclose(data, flux, rtol=1e-9)
+    assert ln.pixelCalls == 54
+    chunks = []
+    irr = ln.zGetDetectorArray(1, 3, dtype=1, chunkSize=20,
+                               callback=lambda n, total: chunks.append((n, total)))
+    assert np.allclose(irr, flux*54/12.0)
+    assert chunks == [(20, 54), (40, 54), (54, 54)]
+    ln = FakeDetectorLink(flux*0)
+    assert not ln.zGetDetectorArray(1, 3).any() and ln.pixelCalls == 0
+
+
+class FakeConversation(object):
+    """DDE conversation answering the NSCTrace command when ``release`` is
+    set, and the detector totals at once (or timing out if ``busy``)"""
+    def __init__(self, release=None, reply='OK'):
+        self.release, self.reply = release, reply
+        self.items, self.busy = [], False
+
+    def Request(self, item, timeout=None):
+        self.items.append(item)
+        if item.startswith('NSCTrace'):
+            self.release.wait(5)
+            reply = self.reply
+        elif self.busy:
+            reply = '-998'
+        else:
+            reply = {'0' : '1.5E+000', '-3' : '42'}[item.split(',')[3]]
+        return reply.encode('ascii') if pyz._global_pyver3 else reply
+
+class FakeTraceLink(pyz.PyZDDE):
+    """PyZDDE link whose NSC traces are simulated"""
+    def __init__(self, reply='OK'):
+        pyz.PyZDDE.__init__(self)
+        self.release = threading.Event()
+        self.traceConversation = FakeConversation(self.release, reply)
+        self._conversation = FakeConversation()
+
+    def _newConversation(self):
+        return self.traceConversation
+
+def test_nsc_trace_async():
+    """test the polling, chaining, timeout and cancellation of the
+    non-blocking NSC trace
+    """
+    ln = FakeTraceLink()
+    trace = ln.zNSCTraceAsync(1, 0, split=1, randomSeed=7, detectors=[4, 5],
+                              pollInterval=0.0)
+    trace.then(lambda link: 'readout').then(lambda link: link is ln)
+    assert not trace.done() and trace.running()
+    progress = trace.progress()
+    assert not progress.done and progress.elapsed >= 0
+    assert progress.detectors == {4 : (1.5, 42), 5 : (1.5, 42)}
+    try:
+        trace.result(timeout=0.01)
+    except pyz._TimeoutError:
+        pass
+    else:
+        raise AssertionError('result() should time out')
+    ln.release.set()
+    result = trace.result()
+    assert result == (0, trace.elapsed, ['readout', True])
+    assert trace.done() and not trace.cancel()
+    assert ln.traceConversation.items == ['NSCTrace,1,0,1,0,0,0,7,0']
+    # a failed trace doesn't run the readouts
+    ln = FakeTraceLink(reply='-5')
+    ln.release.set()
+    trace = ln.zNSCTraceAsync(1, 2).then(lambda link: 1/0)
+    assert trace.result(timeout=5) == (-5, trace.elapsed, [])
+    # a cancelled trace is abandoned
+    ln = FakeTraceLink()
+    trace = ln.zNSCTraceAsync(1, 0, detectors=[4])
+    assert trace.cancel() and trace.cancelled() and trace.done()
+    assert trace.result().status == -2 and trace.progress().detectors == {}
+    ln.release.set()
+    # the detectors aren't read anymore once a read timed out
+    ln = FakeTraceLink()
+    ln._conversation.busy = True
+    trace = ln.zNSCTraceAsync(1, 0, detectors=[4, 5], pollInterval=0.0)
+    assert trace.progress().detectors == {} and trace.progress().detectors == {}
+    assert ln._conversation.items == ['NSCDetectorData,1,4,0,0']
+    ln.release.set()
+    assert trace.result(timeout=5).status == 0
+    try:
+        ln.zNSCTraceAsync(1, 0, save=1, saveFilename='rays.txt')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('an invalid file name should be rejected')
+
+class FakeSettingsLink(pyz.PyZDDE):
+    """PyZDDE link whose ``zModifySettings()`` writes the integer settings
+    of ``fields`` (key : offset) to the settings files"""
+    def __init__(self, tmpdir, fields):
+        pyz.PyZDDE.__init__(self)
+        self.tmpdir, self.fields, self.calls = tmpdir, fields, []
+
+    def zGetFile(self):
+        return os.path.join(self.tmpdir, 'lens.zmx')
+
+    def zModifySettings(self, fileName, mType, value):
+        self.calls.append(mType)
+        if mType in self.fields:
+            cfg = zfu.readCFGFile(fileName)
+            cfg.setValue(self.fields[mType], 'i', value)
+            cfg.save()
+        return 0
+
+def test_local_settings_write():
+    """test that the settings whose location is known are written locally by
+    the zModify*Settings() functions, and the others using zModifySettings()
+    """
+    tmpdir = tempfile.mkdtemp()
+    fftpsf = zfu.cfgAnalysisIds['Fps']
+    known = dict(zfu.cfgKeys.get(fftpsf, {}))
+    try:
+        ln = FakeSettingsLink(tmpdir, {'PSF_SAMP' : 0x20, 'PSF_WAVE' : 0x24})
+        cfgFile = ln.zSetFFTPSFSettings()
+        assert ln.calls == []
+        assert ln.zCalibrateSettingsKey(cfgFile, 'PSF_SAMP', 7) == (0x20, 'i')
+        assert ln.calls == ['PSF_SAMP']
+        del ln.calls[:]
+        ln.zSetFFTPSFSettings(cfgFile, sample=3, wave=2, dtype=1)
+        assert ln.calls == ['PSF_TYPE', 'PSF_SAMP', 'PSF_WAVE']
+        del ln.calls[:]
+        status = ln.zModifyFFTPSFSettings(cfgFile, dtype=1, sample=4, wave=0,
+                                          localWrite=True)
+        assert status == (0, 0, 0) and ln.calls == ['PSF_TYPE', 'PSF_WAVE']
+        cfg = zfu.readCFGFile(cfgFile)
+        assert cfg.get('PSF_SAMP') == 4 and cfg.getValue(0x24, 'i') == 0
+    finally:
+        zfu.cfgKeys.pop(fftpsf, None)
+        if known:
+            zfu.cfgKeys[fftpsf] = known
+        shutil.rmtree(tmpdir)
+
+def test_text_file_names():
+    """test the names of the text files of the analysis functions"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ln = pyz.PyZDDE()
+        ln.zGetFile = lambda: os.path.join(tmpdir, 'lens.zmx')
+        kept = pyz._txtAndSettingsToUse(ln, None, None, 'Pop', keepFile=True)[0]
+        assert kept == os.path.join(tmpdir, 'popData.txt')
+        names = [pyz._txtAndSettingsToUse(ln, None, None, 'Pop')[0] for _ in range(2)]
+        assert names[0] != names[1] and kept not in names
+        assert all(os.path.dirname(n) == tmpdir for n in names)
+        given = os.path.join(tmpdir, 'my.txt')
+        assert pyz._txtAndSettingsToUse(ln, given, None, 'Pop', keepFile=True)[0] == given
+        scratch = os.path.join(tmpdir, 'scratch')
+        os.mkdir(scratch)
+        ln.zSetScratchDir(scratch)
+        kept = pyz._txtAndSettingsToUse(ln, None, None, 'Mtf', keepFile=True)[0]
+        assert kept == os.path.join(scratch, 'fftMtfAnalysisFile.txt')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    test_get2DArray()
+    test_text_file_index()
+    test_get_rgb_array()
+    test_decode_text()
+    test_detector_viewer_reader()
+    test_prescription()
+    test_detector_array()
+    test_nsc_trace_async()
+    test_local_settings_write()
+    test_text_file_names()
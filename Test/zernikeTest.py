@@ -0,0 +1,100 @@
+#-----------------------------------------------------------------------------------------
+# Name:        zernikeTest.py
+# Purpose:     To test the Zernike basis and the local fitting functions in the zernike
+#              module. These tests don't require Zemax.
+#
+# Licence:     MIT License
+#-----------------------------------------------------------------------------------------
+'''test functions in the module zernike
+'''
+from __future__ import print_function
+import numpy as np
+import pyzdde.zernike as zern
+
+#%% Test functions
+
+def test_term_ordering():
+    """test the (n, m) ordering of the Fringe and Standard terms against the
+    Zemax manual
+    """
+    fringe = [(0, 0), (1, 1), (1, -1), (2, 0), (2, 2), (2, -2), (3, 1), (3, -1),
+              (4, 0), (3, 3), (3, -3), (4, 2), (4, -2), (5, 1), (5, -1), (6, 0)]
+    assert [zern.zernikeNM(j, 'fringe') for j in range(1, 17)] == fringe
+    assert zern.zernikeNM(36, 'fringe') == (10, 0)
+    assert zern.zernikeNM(37, 'fringe') == (12, 0)
+    standard = [(0, 0), (1, 1), (1, -1), (2, 0), (2, -2), (2, 2), (3, -1),
+                (3, 1), (3, -3), (3, 3), (4, 0)]
+    assert [zern.zernikeNM(j, 'standard') for j in range(1, 12)] == standard
+    assert zern.zernikeNM(231, 'standard') == (20, -20)
+
+def test_term_values():
+    """test a few terms against their closed form expressions
+    """
+    rho, theta = np.array([0.3, 0.7, 1.0]), np.array([0.2, 1.1, 2.5])
+    # Fringe Z9 = 6p^4 - 6p^2 + 1
+    assert np.allclose(zern.zernikeTerm(9, rho, theta, 'fringe'),
+                       6*rho**4 - 6*rho**2 + 1)
+    # Fringe Z13 = (4p^2 - 3)p^2 sin(2t)
+    assert np.allclose(zern.zernikeTerm(13, rho, theta, 'fringe'),
+                       (4*rho**2 - 3)*rho**2*np.sin(2*theta))
+    # Standard Z8 = sqrt(8)(3p^3 - 2p) cos(t)
+    assert np.allclose(zern.zernikeTerm(8, rho, theta, 'standard'),
+                       np.sqrt(8)*(3*rho**3 - 2*rho)*np.cos(theta))
+    # Annular Z4 = sqrt(3)(2p^2 - 1 - e^2)/(1 - e^2)
+    e = 0.4
+    assert np.allclose(zern.zernikeTerm(4, rho, theta, 'annular', e),
+                       np.sqrt(3)*(2*rho**2 - 1 - e**2)/(1 - e**2))
+    # Annular terms reduce to the Standard terms without obscuration
+    assert np.allclose(zern.zernikeTerm(24, rho, theta, 'annular', 0.0),
+                       zern.zernikeTerm(24, rho, theta, 'standard'))
+
+def test_orthonormality():
+    """test that the Standard and Annular terms are orthonormal over the
+    (annular) pupil
+    """
+    for which, eps in (('standard', 0.0), ('annular', 0.3)):
+        nodes, weights = np.polynomial.legendre.leggauss(40)
+        rho = np.sqrt(0.5*(1 - eps**2)*nodes + 0.5*(1 + eps**2))
+        theta = np.arange(96)*2*np.pi/96
+        r, t = np.meshgrid(rho, theta)
+        w = np.meshgrid(0.5*weights, theta)[0]/len(theta)
+        basis = zern.zernikeBasis(r.ravel(), t.ravel(), 66, which, eps)
+        gram = (basis*w.ravel()[:, None]).T.dot(basis)
+        assert np.allclose(gram, np.eye(66), atol=1e-8)
+
+def test_fit_many_fields():
+    """test that the fit recovers the coefficients of synthetic wavefront maps
+    for many fields in one call, including maps with vignetted points
+    """
+    rs = np.random.RandomState(0)
+    for which, nterms, eps in (('fringe', 37, 0.0), ('standard', 45, 0.0),
+                               ('annular', 28, 0.25)):
+        fitter = zern.getZernikeFitter(which, nterms, 48, eps)
+        coeff = rs.uniform(-1, 1, (5, nterms))
+        opd = fitter.evaluate(coeff)
+        assert opd.shape == (5, 48, 48)
+        opd[2, 10:14, 20:30] = np.nan   # vignetted rays in one field
+        fitted, rmsFitErr = zern.fitZernike(opd, which, nterms, eps)
+        assert fitted.shape == (5, nterms)
+        assert np.allclose(fitted, coeff, atol=1e-8)
+        assert np.all(rmsFitErr < 1e-8)
+        single, err = fitter.fit(opd[0])
+        assert single.shape == (nterms,)
+        assert np.allclose(single, coeff[0], atol=1e-8)
+
+def test_fitter_cache():
+    """test that fitters (and their pseudo-inverses) are reused
+    """
+    f1 = zern.getZernikeFitter('standard', 15, 32, 0.0)
+    f2 = zern.getZernikeFitter('standard', 15, 32, 0)
+    assert f1 is f2
+    assert f1.pinv.shape == (15, f1.mask.sum())
+    assert zern.getZernikeFitter('standard', 15, 32, 0.1) is not f1
+
+
+if __name__ == '__main__':
+    test_term_ordering()
+    test_term_values()
+    test_orthonormality()
+    test_fit_many_fields()
+    test_fitter_cache()
@@ -90,6 +90,190 @@ def test_uncompressed_zrd_read_write():
                              get_full_path(f2Write), 'i')
     print("Uncompressed ZRD read/write successful.")
     
+def test_zrd_array_read():
+    """test the vectorized (numpy) reader of the uncompressed ZRD files against
+    the segment layout of the file
+    """
+    import struct
+    ufdfiles = ['ColorFringes_TenRays_SplitRays_UFD.ZRD',
+                'Beamsplitter_TenRay_SplitRays_UFD.ZRD']
+    for f in ufdfiles:
+        zrd = zfu.readZRDArray(get_full_path(f))
+        nRays, nSegs = len(zrd.offsets) - 1, len(zrd.segments)
+        assert zrd.info.file_type == 'uncompressed' and zrd.info.zrd_type == 0
+        assert zrd.offsets[-1] == nSegs
+        assert os.path.getsize(get_full_path(f)) == 8 + 4*nRays + 208*nSegs
+        with open(get_full_path(f), 'rb') as fh:
+            fh.seek(8)
+            n = struct.unpack('i', fh.read(4))[0]
+            first = struct.unpack('I9i21d', fh.read(208))
+        assert n == zrd.offsets[1] - zrd.offsets[0]
+        assert tuple(zrd.segments[0].tolist()) == first
+        rays = zfu.readZRDFile(get_full_path(f))
+        assert len(rays) == nRays
+        assert rays[-1].x == zrd.segments['x'][zrd.offsets[-2]:].tolist()
+    
+def test_zrd_file_random_access():
+    """test the memory-mapped access to the rays of a ZRD file and its index
+    """
+    import tempfile, shutil
+    import numpy as np
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fileName = os.path.join(tmpdir, 'rays.ZRD')
+        shutil.copy(get_full_path('Beamsplitter_TenRay_SplitRays_UFD.ZRD'), fileName)
+        full = zfu.readZRDArray(fileName)
+        assert not os.path.exists(fileName + '.idx')
+        with zfu.ZRDFile(fileName) as zrd:
+            assert os.path.exists(zrd.indexFile)
+            assert len(zrd) == len(full.offsets) - 1 and zrd.nSegments == len(full.segments)
+            ray = zrd[3]
+            assert not ray.flags.owndata and not ray.flags.writeable
+            assert np.array_equal(ray, full.segments[full.offsets[3]:full.offsets[4]])
+            assert np.array_equal(zrd[-1], full.segments[full.offsets[-2]:])
+            assert [len(r) for r in zrd[2:8:3]] == list(zrd.numSegs[2:8:3])
+            chunks = list(zrd.iterChunks(chunkSize=3))
+            assert len(chunks) == 4 and chunks[1].offsets[0] == 0
+            assert np.array_equal(np.concatenate([c.segments for c in chunks]), full.segments)
+            obj = zrd[0]['hit_object'][1]
+            expected = [i for i in range(len(zrd)) if obj in zrd[i]['hit_object']]
+            assert zrd.raysHittingObject(obj, chunkSize=4).tolist() == expected
+            assert len(zrd.raysHittingObject(99)) == 0
+        # the index is reused
+        with zfu.ZRDFile(fileName) as zrd:
+            stamp = np.load(os.path.join(zrd.indexFile, 'stamp.npy'))
+            assert zrd._readIndex(stamp) is not None
+            assert isinstance(zrd.offsets, np.memmap)
+            assert np.array_equal(zrd.segments(), full.segments)
+    finally:
+        shutil.rmtree(tmpdir)
+    
+def test_compressed_zrd_array_read():
+    """test the decoding of the compressed ZRD files (CBD, CFD) against the
+    uncompressed file of the same system
+    """
+    import numpy as np
+    ufd = zfu.readZRDArray(get_full_path('ColorFringes_TenRays_SplitRays_UFD.ZRD'))
+    for f, fields in (('ColorFringes_TenRays_SplitRays_CBD.ZRD',
+                       ('status', 'level', 'hit_object', 'parent', 'xybin', 'lmbin')),
+                      ('ColorFringes_TenRays_SplitRays_CFD.ZRD',
+                       ('status', 'level', 'hit_object', 'hit_face', 'in_object',
+                        'parent', 'xybin', 'lmbin'))):
+        zrd = zfu.readZRDArray(get_full_path(f))
+        assert zrd.info.zrd_version == ufd.info.zrd_version
+        assert np.array_equal(zrd.offsets, ufd.offsets)
+        assert zrd.segments.dtype == ufd.segments.dtype
+        for name in fields:
+            assert np.array_equal(zrd.segments[name], ufd.segments[name]), name
+        # the first rays start from the same points
+        assert np.allclose(zrd.segments['x'], ufd.segments['x'], atol=1e-6)
+        assert np.allclose(zrd.segments['y'], ufd.segments['y'], atol=1e-6)
+        # wavelength of the rays
+        assert np.all(zrd.segments['nx'][zrd.offsets[:-1]] > 0.4)
+        # the index isn't stored in CBD files, and is 1 (air) by default
+        air = ufd.segments['index'] == 1.0
+        assert np.all(zrd.segments['index'][air] == 1.0)
+        if f.endswith('CBD.ZRD'):
+            assert np.all(zrd.segments['index'] == 1.0)
+    cfd = zrd.segments
+    assert np.array_equal(cfd['index'] == 1.0, ufd.segments['index'] == 1.0)
+    assert np.allclose(cfd['path_to'], ufd.segments['path_to'], atol=1e-4)
+    assert np.allclose(cfd['nz'], ufd.segments['nz'], atol=1e-4)
+    assert np.allclose(cfd['exr']**2 + cfd['exi']**2 + cfd['eyr']**2 + cfd['eyi']**2,
+                       cfd['intensity'], rtol=1e-4)
+    rays = zfu.readZRDFile(get_full_path('ColorFringes_TenRays_NoSplitRays_CBD.ZRD'))
+    assert len(rays) == 10 and rays[0].file_type == 'compressed'
+    # a parent number that isn't an earlier segment of the ray is rejected
+    with open(get_full_path('ColorFringes_TenRays_SplitRays_CBD.ZRD'), 'rb') as f:
+        buf = bytearray(f.read())
+    segStarts, flags, _, numSegs = zfu._scanCompressedZRD(bytes(buf), False)
+    second = segStarts[1] + 1 + (4 if flags[1] & 1 else 2)
+    buf[second] = (buf[second] & 0xF0) | 0x0F
+    badFile = get_full_path('zrdfile_test_CBD_parent.ZRD')
+    try:
+        with open(badFile, 'wb') as f:
+            f.write(buf)
+        try:
+            zfu.readZRDArray(badFile)
+        except NotImplementedError as e:
+            assert 'parent 15 of segment 1' in str(e)
+        else:
+            assert False, 'NotImplementedError not raised'
+    finally:
+        os.remove(badFile)
+    
+def test_ray_database():
+    """test the columnar ray database, its filters and the per-ray views
+    """
+    import numpy as np
+    fileName = get_full_path('Beamsplitter_TenRay_SplitRays_UFD.ZRD')
+    db = zfu.RayDatabase.fromFile(fileName)
+    rays = zfu.readZRDFile(fileName)
+    assert len(db) == len(rays) and db.nSegments == sum(len(r.status) for r in rays)
+    ray = db[4]
+    assert not hasattr(ray, '__dict__')
+    assert len(ray) == len(rays[4].status) and ray.x.tolist() == rays[4].x
+    assert ray.segments.base is not None and ray.wavelength == rays[4].nx[0]
+    # per-ray field layout tables are shared by the legacy objects
+    assert 'uncompressed_zrd' not in vars(rays[0])
+    # filters
+    mask = db.segmentMask(hit_object=3, level=[1, 2])
+    expected = [(s['hit_object'] == 3 and s['level'] in (1, 2)) for s in db.segments]
+    assert mask.tolist() == expected
+    ghost = db.statusMask('ghosted')
+    assert np.array_equal(ghost, (db['status'] & 32) == 32)
+    assert np.array_equal(db.statusMask(['terminated', 'ghosted'], anyFlag=True),
+                          (db['status'] & 33) != 0)
+    # lineage: descendants have a marked ancestor, ancestors a marked descendant
+    desc = db.descendantsMask(mask)
+    parent = db.parentIndex
+    for i in range(db.nSegments):
+        assert desc[i] == (mask[i] or (parent[i] >= 0 and desc[parent[i]]))
+    anc = db.ancestorsMask(mask)
+    assert np.all(anc[parent[mask & (parent >= 0)]]) and np.all(anc[mask])
+    assert not np.any(db.ancestorsMask(mask, includeSelf=False) & mask & ~anc)
+    # selection
+    hitRays = db.raysWhere(db.segmentMask(hit_object=7))
+    sub = db.select(hitRays[::2])
+    assert len(sub) == len(hitRays[::2])
+    assert np.array_equal(sub[1].segments, db[hitRays[2]].segments)
+    assert np.array_equal(db.select(np.arange(len(db)) < 3).offsets, db.offsets[:4])
+    back = zfu.RayDatabase.fromRays(db.toRays())
+    assert np.array_equal(back.segments, db.segments) and back.info == db.info
+    
+def test_zrd_array_write():
+    """test that the vectorized writer reproduces the uncompressed and compressed
+    ZRD files byte by byte
+    """
+    import tempfile, shutil, filecmp
+    import numpy as np
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for f, file_type in (('ColorFringes_TenRays_SplitRays_UFD.ZRD', 'uncompressed'),
+                             ('Beamsplitter_TenRay_SplitRays_UFD.ZRD', 'uncompressed'),
+                             ('ColorFringes_TenRays_SplitRays_CBD.ZRD', 'compressed basic'),
+                             ('ColorFringes_TenRays_NoSplitRays_CBD.ZRD', 'compressed basic'),
+                             ('ColorFringes_TenRays_SplitRays_CFD.ZRD', 'compressed full')):
+            f2Write = os.path.join(tmpdir, f)
+            zfu.writeZRDArray(zfu.readZRDArray(get_full_path(f)), f2Write, file_type)
+            assert filecmp.cmp(get_full_path(f), f2Write, shallow=False), f
+        # uncompressed to compressed, through the legacy API
+        ufd = get_full_path('ColorFringes_TenRays_SplitRays_UFD.ZRD')
+        f2Write = os.path.join(tmpdir, 'ufd2cfd.ZRD')
+        zfu.writeZRDFile(zfu.readZRDFile(ufd), f2Write, 'compressed')
+        db0, db1 = zfu.RayDatabase.fromFile(ufd), zfu.RayDatabase.fromFile(f2Write)
+        assert db1.info.file_type == 'compressed full'
+        assert np.array_equal(db0.offsets, db1.offsets)
+        for name in db0.fields:
+            assert np.allclose(db0[name], db1[name].astype(np.float32)), name
+        # subset of rays
+        sub = db0.select([1, 4])
+        f2Write = os.path.join(tmpdir, 'subset.ZRD')
+        zfu.writeZRDArray(sub, f2Write)
+        assert np.array_equal(zfu.readZRDArray(f2Write).segments, sub.segments)
+    finally:
+        shutil.rmtree(tmpdir)
+    
 def test_compressed_zrd_read_write(): 
     """test the functions for reading and writing compressed ZRD file formats CBD 
     (compressed basic data) and CFD (compressed full data)
@@ -128,7 +312,315 @@ def test_compressed_zrd_read_write():
     #    cfdf2Write = 'zrdfile_test_CFD_write.ZRD'
     #    zfu.writeZRDFile(ufdzrd, get_full_path(cfdf2Write), 'compressed')
         
-    
+
+def test_scratch_file_manager():
+    """test unique scratch file names, background deletion and session cleanup
+    """
+    import tempfile, shutil
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sfm = zfu.ScratchFileManager()
+        names = set(sfm.newFileName('popData.txt', tmpdir) for _ in range(5))
+        assert len(names) == 5
+        assert all(os.path.dirname(n) == tmpdir and n.endswith('.txt') for n in names)
+        other = zfu.ScratchFileManager()
+        assert not names.intersection([other.newFileName('popData.txt', tmpdir)])
+        sfm.directory = os.path.join(tmpdir, 'sub')
+        assert os.path.dirname(sfm.newFileName('a.txt', tmpdir)) == sfm.directory
+        # completion detection & background deletion
+        assert not zfu.waitForFile(os.path.join(tmpdir, 'missing.txt'), timeout=0.01)
+        for n in names:
+            with open(n, 'w') as f:
+                f.write('data')
+            assert zfu.waitForFile(n, timeout=0)
+            sfm.remove(n)
+        sfm.flush()
+        assert not any(os.path.exists(n) for n in names)
+        # files tracked for the end of session
+        cfg = os.path.join(tmpdir, 'lens_pyzdde_POP.CFG')
+        with open(cfg, 'w') as f:
+            f.write('cfg')
+        sfm.track(cfg)
+        assert sfm.trackedFiles == set([cfg])
+        assert sfm.cleanup() == set()
+        assert not os.path.exists(cfg) and not sfm.trackedFiles
+        # the background thread ends when the manager is closed
+        worker = sfm._worker
+        assert worker.is_alive()
+        with open(cfg, 'w') as f:
+            f.write('cfg')
+        sfm.remove(cfg)
+        assert sfm.close() == set()
+        assert not worker.is_alive() and not os.path.exists(cfg)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_cfg_file_read_write():
+    """test the local reading and writing of the analysis settings files, using
+    the settings files in ZMXFILES
+    """
+    import tempfile, shutil
+    zmxdir = os.path.join(os.path.dirname(testdir), 'ZMXFILES')
+    reset = zfu.readCFGFile(os.path.join(zmxdir, 'RESET_SETTINGS_POP_IRR.CFG'))
+    fiber = zfu.readCFGFile(os.path.join(zmxdir, 'Fiber_Coupling_POPunittest.CFG'))
+    assert reset.analysisId == fiber.analysisId == zfu.cfgAnalysisIds['Pop']
+    assert reset.get('POP_SAMPX') == 1 and fiber.get('POP_SAMPY') == 4
+    assert fiber.get('POP_WIDEX') == 40.0
+    assert reset.get('POP_SOURCEFILE') == 'LENS.ZBF'
+    assert fiber.get('POP_SOURCEFILE') == 'Cylinder Lens.ZBF'
+    # changing the known keys of the reset file reproduces these bytes of the
+    # settings file saved by Zemax
+    tmpdir = tempfile.mkdtemp()
+    try:
+        tmpFile = os.path.join(tmpdir, 'test_pyzdde_POP.CFG')
+        settings = dict((key, fiber.get(key)) for key in fiber.keys())
+        cfg = zfu.writeCFGFile(reset.fileName, settings, tmpFile)
+        assert zfu.readCFGFile(tmpFile).data == cfg.data
+        for key in fiber.keys():
+            offset, fmt = zfu.cfgKeys[522][key]
+            size = 520 if fmt.startswith('U') else {'i':4, 'd':8}[fmt]
+            assert cfg.data[offset:offset + size] == fiber.data[offset:offset + size]
+        # calibration of a new key
+        after = reset.copy()
+        after.setValue(0x4d0, 'd', 0.0125)
+        (start, end), = zfu.diffCFGFiles(reset, after)
+        assert 0x4d0 <= start < end <= 0x4d8
+        assert zfu.calibrateCFGKey('POP_TEST', reset, after, 0.0125) == (0x4d0, 'd')
+        assert after.get('POP_TEST') == 0.0125
+        del zfu.cfgKeys[522]['POP_TEST']
+        try:
+            reset.set('POP_UNKNOWN', 1)
+        except KeyError:
+            pass
+        else:
+            raise AssertionError('Expected KeyError for unknown key')
+    finally:
+        shutil.rmtree(tmpdir)
+
+#%% Beam file utils test
+
+def _write_test_beam_file(fileName, version, Ex, Ey=None):
+    """writes a beam file with the fields ``Ex``, ``Ey`` of shape (ny, nx)"""
+    import struct
+    ny, nx = Ex.shape
+    with open(fileName, 'wb') as f:
+        f.write(struct.pack('5i', version, nx, ny, Ey is not None, 0))
+        f.write(struct.pack('4i', 4, 5, 6, 7))
+        f.write(struct.pack('2d', 0.01, 0.02))
+        if version == 0:
+            f.write(struct.pack('8d', 1.5, 10.0, 0.55, 2.5, 20.0, 0.3, 0.4, 1.0))
+        else:
+            f.write(struct.pack('10d', 1.5, 10.0, 0.3, 2.5, 20.0, 0.4, 0.55, 1.0, 0.9, 0.8))
+            f.write(struct.pack('8d', *range(1, 9)))
+        for E in (Ex, Ey):
+            if E is not None:
+                f.write(E.astype('<c16').tobytes())
+
+def test_beam_file_array_read():
+    """test the numpy reader of the Zemax beam files (ZBF) against the legacy
+    reader
+    """
+    import tempfile, shutil
+    import numpy as np
+    rs = np.random.RandomState(5)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for version, shape, pol in ((1, (6, 6), True), (0, (4, 4), False), (1, (3, 5), True)):
+            Ex = rs.normal(size=shape) + 1j*rs.normal(size=shape)
+            Ey = rs.normal(size=shape) + 1j*rs.normal(size=shape) if pol else None
+            fileName = os.path.join(tmpdir, 'beam.zbf')
+            _write_test_beam_file(fileName, version, Ex, Ey)
+            for mmap in (False, True):
+                beam = zfu.readBeamFileArray(fileName, mmap=mmap)
+                hdr = beam.header
+                assert (hdr.version, hdr.nx, hdr.ny, hdr.ispol) == (version, shape[1], shape[0], pol)
+                assert (hdr.dx, hdr.dy, hdr.lamda, hdr.waist_x, hdr.waist_y) == (0.01, 0.02, 0.55, 0.3, 0.4)
+                assert beam.Ex.dtype == np.complex128 and np.array_equal(beam.Ex, Ex)
+                assert (beam.Ey is None) if not pol else np.array_equal(beam.Ey, Ey)
+            assert isinstance(beam.Ex, np.memmap)
+            del beam
+            x, y = zfu.beamFileAxes(hdr)
+            assert len(x) == shape[1] and x[shape[1]//2] == 0 and np.isclose(y[1] - y[0], 0.02)
+            if shape[0] != shape[1]:
+                continue   # the legacy reader only supports square grids
+            new = zfu.readBeamFile(fileName)
+            zfu._global_np = False
+            try:
+                legacy = zfu.readBeamFile(fileName)
+            finally:
+                zfu._global_np = True
+            assert new == legacy
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_beam_file_array_write():
+    """test the vectorized beam file writer against the legacy writer and the
+    reader
+    """
+    import tempfile, shutil, filecmp
+    import numpy as np
+    rs = np.random.RandomState(6)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        n = 8
+        parts = [rs.normal(size=(n, n)) for _ in range(4)]
+        parts[1][0, :3] = [0.0, -0.0, np.inf]
+        for version, ispol in ((0, True), (1, True), (1, False)):
+            args = (version, (n, n), ispol, 0, (0.01, 0.01), (1.0, 1.5), (10.0, 11.0),
+                    (0.1, 0.2), 0.633, 1.0, 0.5, 0.25)
+            newFile = os.path.join(tmpdir, 'new.zbf')
+            legacyFile = os.path.join(tmpdir, 'legacy.zbf')
+            assert zfu.writeBeamFile(newFile, *(args + ([p.tolist() for p in parts],))) == 0
+            zfu._global_np = False
+            try:
+                assert zfu.writeBeamFile(legacyFile, *(args + (parts,))) == 0
+            finally:
+                zfu._global_np = True
+            assert filecmp.cmp(newFile, legacyFile, shallow=False)
+        # complex arrays, non square grid
+        Ex = rs.normal(size=(5, 7)) + 1j*rs.normal(size=(5, 7))
+        Ey = rs.normal(size=(5, 7)) + 1j*rs.normal(size=(5, 7))
+        _write_test_beam_file(legacyFile, 1, Ex, Ey)
+        hdr = zfu.readBeamFileArray(legacyFile).header
+        zfu.writeBeamFileArray(newFile, hdr._replace(nx=0, ny=0, ispol=0), Ex, (Ey.real, Ey.imag))
+        assert filecmp.cmp(newFile, legacyFile, shallow=False)
+        beam = zfu.readBeamFileArray(newFile)
+        assert np.array_equal(beam.Ex, Ex) and np.array_equal(beam.Ey, Ey)
+        zfu.writeBeamFileArray(newFile, hdr, Ex)
+        beam = zfu.readBeamFileArray(newFile)
+        assert beam.header.ispol == 0 and beam.Ey is None and np.array_equal(beam.Ex, Ex)
+        args = (1, (7, 5), 1, 0, (0.01, 0.02), (1.5, 2.5), (10.0, 20.0), (0.3, 0.4),
+                0.55, 1.0, 0.9, 0.8)
+        assert zfu.writeBeamFile(newFile, *(args + ((Ex, Ey),))) == 0
+        assert filecmp.cmp(newFile, legacyFile, shallow=False)
+        # a version 0 file is written back unchanged, with the same waists
+        _write_test_beam_file(legacyFile, 0, Ex[:, :5], Ey[:, :5])
+        beam = zfu.readBeamFileArray(legacyFile)
+        assert (beam.header.waist_x, beam.header.waist_y) == (0.3, 0.4)
+        zfu.writeBeamFileArray(newFile, beam.header, beam.Ex, beam.Ey)
+        assert filecmp.cmp(newFile, legacyFile, shallow=False)
+        assert zfu.readBeamFileArray(newFile).header == beam.header
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_grid_sag_file():
+    """test the chunked grid sag writer against the row by row formatting, and
+    the finite difference derivatives of a sag map
+    """
+    import tempfile, shutil
+    import numpy as np
+    nx, ny, delx, dely = 41, 31, 0.05, 0.04
+    x = (np.arange(nx) - nx//2)*delx
+    y = -(np.arange(ny) - ny//2)*dely   # the first row is at the top
+    X, Y = np.meshgrid(x, y)
+    sag = 0.3*X**2 - 0.2*X*Y + 0.1*Y**2
+    dzdx, dzdy, d2zdxdy = zfu.gridSagDerivatives(sag, delx, dely)
+    assert np.allclose(dzdx, (0.6*X - 0.2*Y).ravel())
+    assert np.allclose(dzdy, (-0.2*X + 0.2*Y).ravel())
+    assert np.allclose(d2zdxdy, -0.2)
+    dzdx[5] = -0.0
+    rs = np.random.RandomState(4)
+    d2zdxdy = rs.normal(size=nx*ny)*10.0**rs.randint(-95, 95, nx*ny)
+    d2zdxdy[[7, 8, 9]] = [9.9999999995, 1.00000000005, 0.0]
+    d2zdxdy[1000] = 1e-150   # 3-digit exponent
+    tmpdir = tempfile.mkdtemp()
+    try:
+        chunk = zfu._GRID_SAG_CHUNK
+        zfu._GRID_SAG_CHUNK = 100   # several chunks
+        try:
+            fname = zfu.gridSagFile(sag.ravel(), dzdx, dzdy, d2zdxdy, nx, ny, delx,
+                                    dely, 0, 0, 0, 'sag', 'test', '.DAT', fdir=tmpdir)
+        finally:
+            zfu._GRID_SAG_CHUNK = chunk
+        assert fname == os.path.join(tmpdir, 'sag.DAT')
+        with open(fname) as f:
+            lines = f.read().splitlines()
+        assert lines[0] == '! test'
+        assert lines[3] == '41 31  5.000000000E-02  4.000000000E-02 0  0.000000000E+00  0.000000000E+00'
+        rows = zip(sag.ravel(), dzdx, dzdy, d2zdxdy)
+        assert lines[4:] == ['{: 12.9E} {: 12.9E} {: 12.9E} {: 12.9E}'.format(*row)
+                             for row in rows]
+        z, fname = zfu.randomGridSagFile(nx=5, ny=4, fname='rand', fdir=tmpdir)
+        data = np.loadtxt(fname, skiprows=4)
+        assert data.shape == (20, 4) and np.allclose(data[:, 0], z.ravel())
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_source_file_write():
+    """test the binary and text NSC source files and the source samplers
+    """
+    import tempfile, shutil, struct
+    import numpy as np
+    tmpdir = tempfile.mkdtemp()
+    chunk = zfu._SOURCE_CHUNK
+    try:
+        zfu._SOURCE_CHUNK = 1000   # several chunks
+        rays = zfu.sampleLambertianSource(5000, power=2.0, size=(1.0, 0.5),
+                                          wavelength=0.55, seed=0)
+        assert np.isclose(rays.n.mean(), 2/3.0, atol=0.01)  # <cos(theta)>
+        assert np.allclose(rays.l**2 + rays.m**2 + rays.n**2, 1)
+        assert np.abs(rays.x).max() <= 0.5 and np.abs(rays.y).max() <= 0.25
+        binFile = os.path.join(tmpdir, 'led.dat')
+        assert zfu.writeSourceFile(binFile, *rays, description='LED', units='mm') == 5000
+        assert os.path.getsize(binFile) == 208 + 5000*8*4
+        with open(binFile, 'rb') as f:
+            assert struct.unpack('<iI', f.read(8)) == (1010, 5000)
+        read, header = zfu.readSourceFile(binFile)
+        assert header['description'] == 'LED' and header['units'] == 3
+        assert header['ray_format_type'] == 2 and header['flux_type'] == 0
+        assert np.isclose(header['source_flux'], 2.0)
+        assert np.isclose(header['wavelength'], 0.55)
+        assert header['inclination_end'] <= 90
+        for a, b in zip(read, rays):
+            assert np.allclose(a, b, atol=1e-6)
+        # text, flux only format, from a Gaussian beam
+        rays = zfu.sampleGaussianSource(4000, waist=(0.5, 0.2), divergence=0.01, seed=1)
+        assert np.isclose(rays.x.std(), 0.25, rtol=0.05)
+        assert np.isclose(rays.y.std(), 0.1, rtol=0.05)
+        assert np.isclose(np.arctan(rays.l/rays.n).std(), 0.005, rtol=0.05)
+        txtFile = os.path.join(tmpdir, 'laser.dat')
+        zfu.writeSourceFile(txtFile, *rays, file_format='text')
+        with open(txtFile) as f:
+            assert f.readline().split() == ['4000', '0']
+        read, header = zfu.readSourceFile(txtFile)
+        assert header is None and read.wavelength is None
+        for a, b in zip(read[:7], rays[:7]):
+            assert np.allclose(a, b, rtol=1e-9)
+        # streaming writer and direction cosine checks
+        l = np.array([1.0, 0.0, 0.0])
+        m = np.array([0.0, 2.0, 0.0])
+        n = np.array([0.0, 0.0, 1.0])
+        try:
+            zfu.writeSourceFile(binFile, l, l, l, l, m, n, 1.0, 0.6)
+        except ValueError:
+            pass
+        else:
+            assert False, 'non-normalized direction cosines not detected'
+        with zfu.SourceFileWriter(binFile, normalize=True, flux_type='lumens') as w:
+            w.write(l, l, l, l, m, n, 1.0, 0.6)
+            w.write(l, l, l, n, l, m, 0.5, np.array([0.6, 0.7, 0.8]))
+        read, header = zfu.readSourceFile(binFile)
+        assert header['nrays'] == 6 and header['flux_type'] == 1
+        assert header['wavelength'] == 0 and np.isclose(header['ray_set_flux'], 4.5)
+        assert np.allclose(read.m[:3], [0, 1, 0])
+        src = zfu.NSQSource()
+        src.set_rays(*rays[:7], wavelength=np.full(4000, 0.55))
+        assert len(src.rays) == 4000 and src.rays[3].y == rays.y[3]
+    finally:
+        zfu._SOURCE_CHUNK = chunk
+        shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':  
     test_uncompressed_zrd_read_write()
-    test_compressed_zrd_read_write()
\ No newline at end of file
+    test_zrd_array_read()
+    test_zrd_file_random_access()
+    test_compressed_zrd_array_read()
+    test_ray_database()
+    test_zrd_array_write()
+    test_compressed_zrd_read_write()
+    test_scratch_file_manager()
+    test_cfg_file_read_write()
+    test_beam_file_array_read()
+    test_beam_file_array_write()
+    test_grid_sag_file()
+    test_source_file_write()
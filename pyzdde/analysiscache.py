@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Name:        analysiscache.py
+# Purpose:     Cache of the parsed results of the Zemax analyses (POP, PSF,
+#              MTF, Zernike, detector viewer) keyed by the lens state and the
+#              content of the settings (.CFG) file.
+# Licence:     MIT License
+#              This file is subject to the terms and conditions of the MIT License.
+#              For further details, please refer to LICENSE.txt
+#-------------------------------------------------------------------------------
+'''Cache of the parsed results of the analysis functions of PyZDDE.
+
+The cache has an in-memory LRU tier and an optional persistent on-disk tier
+in which every result is stored as a ``.npz`` file (numpy arrays) with a JSON
+description of the structure of the result (namedtuples, tuples, lists,
+dicts and scalars).
+
+A cache key combines a fingerprint of the lens, the 3-letter analysis code,
+a content hash of the settings file used, and the parameters of the call.
+The cache is used by the PyZDDE link object once enabled with
+``zSetAnalysisCache()``; see the notes of that method for the definition of
+the lens fingerprint.
+'''
+from __future__ import print_function, division
+import os as _os
+import collections as _co
+import hashlib as _hashlib
+import json as _json
+import threading as _threading
+import copy as _copy
+
+import pyzdde.config as _config
+_global_pyver3 = _config._global_pyver3
+
+try:
+    import numpy as _np
+except ImportError:
+    _global_np = False
+else:
+    _global_np = True
+
+if _global_pyver3:
+    _string_types = (str,)
+else:
+    _string_types = (str, unicode)
+
+# cache of file content hashes keyed by (file name, mtime, size)
+_file_hash_cache = {}
+
+def fileHash(fileName):
+    """returns the SHA-1 hex digest of the content of a file, or ``None``
+    if the file doesn't exist
+
+    The digests are memoized on the (file name, modification time, size)
+    of the file, so that the file is read only if it has changed.
+
+    Parameters
+    ----------
+    fileName : string
+        filename with full path
+
+    Returns
+    -------
+    digest : string or None
+        hex digest of the file content
+    """
+    try:
+        st = _os.stat(fileName)
+    except OSError:
+        return None
+    stamp = (fileName, st.st_mtime, st.st_size)
+    digest = _file_hash_cache.get(stamp)
+    if digest is None:
+        sha = _hashlib.sha1()
+        with open(fileName, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _file_hash_cache[stamp] = digest
+    return digest
+
+def _keyDigest(key):
+    """SHA-1 hex digest of the (repr of) a cache key"""
+    return _hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+#%% Results (de)serialization for the disk tier
+
+_namedtuple_classes = {}
+
+def _getNamedtupleClass(typename, fields):
+    fields = tuple(fields)
+    cls = _namedtuple_classes.get((typename, fields))
+    if cls is None:
+        cls = _co.namedtuple(typename, fields)
+        _namedtuple_classes[(typename, fields)] = cls
+    return cls
+
+def _encode(obj, arrays):
+    """returns a JSON-serializable description of ``obj``; the numpy arrays
+    are appended to the list ``arrays`` and referenced by index
+    """
+    if obj is None or isinstance(obj, (bool, float) + _string_types):
+        return obj
+    if isinstance(obj, int) or (not _global_pyver3 and isinstance(obj, long)):
+        return obj
+    if _global_np and isinstance(obj, _np.ndarray):
+        arrays.append(obj)
+        return {'__ndarray__' : len(arrays) - 1}
+    if _global_np and isinstance(obj, _np.generic):
+        return obj.item()
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return {'__namedtuple__' : type(obj).__name__,
+                'fields' : list(obj._fields),
+                'values' : [_encode(v, arrays) for v in obj]}
+    if isinstance(obj, tuple):
+        return {'__tuple__' : [_encode(v, arrays) for v in obj]}
+    if isinstance(obj, list):
+        return [_encode(v, arrays) for v in obj]
+    if isinstance(obj, dict):
+        if not all(isinstance(k, _string_types) for k in obj):
+            raise TypeError('Only dicts with string keys can be stored')
+        return {'__dict__' : dict((k, _encode(v, arrays)) for k, v in obj.items())}
+    raise TypeError('Objects of type {} cannot be stored'.format(type(obj)))
+
+def _decode(desc, arrays):
+    """inverse of ``_encode()``"""
+    if isinstance(desc, list):
+        return [_decode(v, arrays) for v in desc]
+    if not isinstance(desc, dict):
+        return desc
+    if '__ndarray__' in desc:
+        return arrays['arr_{}'.format(desc['__ndarray__'])]
+    if '__namedtuple__' in desc:
+        cls = _getNamedtupleClass(desc['__namedtuple__'], desc['fields'])
+        return cls(*[_decode(v, arrays) for v in desc['values']])
+    if '__tuple__' in desc:
+        return tuple(_decode(v, arrays) for v in desc['__tuple__'])
+    return dict((k, _decode(v, arrays)) for k, v in desc['__dict__'].items())
+
+def _copyResult(obj, copyArrays=False):
+    """returns a copy of a cached result that can be modified by the caller
+    without altering the cache. The numpy arrays are returned as read-only
+    views instead of being copied, or as read-only copies if ``copyArrays``
+    is ``True`` (to store the results of the callers)
+    """
+    if _global_np and isinstance(obj, _np.ndarray):
+        view = obj.copy() if copyArrays else obj.view()
+        view.flags.writeable = False
+        return view
+    if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+        return type(obj)(*[_copyResult(v, copyArrays) for v in obj])
+    if isinstance(obj, tuple):
+        return tuple(_copyResult(v, copyArrays) for v in obj)
+    if isinstance(obj, list):
+        return [_copyResult(v, copyArrays) for v in obj]
+    if isinstance(obj, dict):
+        return dict((k, _copyResult(v, copyArrays)) for k, v in obj.items())
+    return _copy.copy(obj)
+
+#%% Cache
+
+class AnalysisCache(object):
+    """LRU cache of analysis results with an optional on-disk tier
+
+    Parameters
+    ----------
+    maxSize : integer, optional
+        maximum number of results kept in memory
+    cacheDir : string, optional
+        directory of the persistent tier. If ``None`` (default), the
+        results are only cached in memory. The directory is created if it
+        doesn't exist. Requires Numpy.
+
+    Notes
+    -----
+    The keys are tuples whose second element is the 3-letter analysis code
+    (see ``makeKey()``), which is used by ``invalidate()``.
+    """
+    def __init__(self, maxSize=32, cacheDir=None):
+        if cacheDir is not None:
+            if not _global_np:
+                raise ImportError('The on-disk cache requires Numpy')
+            if not _os.path.isdir(cacheDir):
+                _os.makedirs(cacheDir)
+        self.maxSize = maxSize
+        self.cacheDir = cacheDir
+        self._mem = _co.OrderedDict()
+        self._lock = _threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def makeKey(lensFingerprint, anaType, settingsHash, params=()):
+        """returns a cache key
+
+        Parameters
+        ----------
+        lensFingerprint : tuple
+            fingerprint of the lens
+        anaType : string
+            3-letter analysis code, such as 'Pop'
+        settingsHash : string or None
+            content hash of the settings file used for the analysis
+        params : tuple, optional
+            other parameters of the call, as ``(name, value)`` pairs
+
+        Returns
+        -------
+        key : tuple
+        """
+        return (tuple(lensFingerprint), anaType, settingsHash, tuple(params))
+
+    def __len__(self):
+        return len(self._mem)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._mem:
+                return True
+        fileName = self._diskFile(key)
+        return fileName is not None and _os.path.isfile(fileName)
+
+    def _diskFile(self, key):
+        if self.cacheDir is None:
+            return None
+        return _os.path.join(self.cacheDir, '{}_{}.npz'.format(key[1], _keyDigest(key)))
+
+    def get(self, key, default=None):
+        """returns the (copy of the) result stored for ``key``, looking up
+        the memory tier first and then the disk tier
+        """
+        with self._lock:
+            if key in self._mem:
+                value = self._mem.pop(key)
+                self._mem[key] = value  # most recently used
+                self.hits += 1
+                return _copyResult(value)
+        value = self._diskGet(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return default
+        with self._lock:
+            self.hits += 1
+            self._memPut(key, value)
+        return _copyResult(value)
+
+    def put(self, key, value):
+        """store the result ``value`` for ``key`` in the memory tier, and in
+        the disk tier if enabled. Results that cannot be serialized are only
+        kept in memory. The numpy arrays of ``value`` are copied, such that
+        the caller can modify them without altering the cache
+        """
+        value = _copyResult(value, copyArrays=True)
+        with self._lock:
+            self._memPut(key, value)
+        self._diskPut(key, value)
+
+    def _memPut(self, key, value):
+        self._mem.pop(key, None)
+        self._mem[key] = value
+        while len(self._mem) > self.maxSize:
+            self._mem.popitem(last=False)
+
+    def _diskGet(self, key):
+        fileName = self._diskFile(key)
+        if fileName is None or not _os.path.isfile(fileName):
+            return None
+        try:
+            with _np.load(fileName, allow_pickle=False) as data:
+                meta = _json.loads(bytes(data['__meta__']).decode('utf-8'))
+                if meta['key'] != repr(key):  # hash collision
+                    return None
+                arrays = dict((name, data[name]) for name in data.files
+                              if name != '__meta__')
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return _decode(meta['value'], arrays)
+
+    def _diskPut(self, key, value):
+        fileName = self._diskFile(key)
+        if fileName is None:
+            return
+        arrays = []
+        try:
+            desc = _encode(value, arrays)
+        except TypeError:
+            return
+        meta = _json.dumps({'key' : repr(key), 'value' : desc}).encode('utf-8')
+        npzArrays = dict(('arr_{}'.format(i), arr) for i, arr in enumerate(arrays))
+        npzArrays['__meta__'] = _np.frombuffer(meta, dtype=_np.uint8)
+        tmpFile = fileName[:-4] + '_{}.tmp.npz'.format(_os.getpid())
+        _np.savez(tmpFile, **npzArrays)
+        try:
+            _os.rename(tmpFile, fileName)
+        except OSError:  # Windows doesn't replace an existing file
+            _os.remove(fileName)
+            _os.rename(tmpFile, fileName)
+
+    def invalidate(self, anaType=None, disk=True):
+        """remove the cached results
+
+        Parameters
+        ----------
+        anaType : string or list of strings, optional
+            3-letter code(s) of the analyses to remove. If ``None``
+            (default), all the results are removed.
+        disk : bool, optional
+            if ``True`` (default), the results are also removed from the
+            disk tier
+
+        Returns
+        -------
+        None
+        """
+        if isinstance(anaType, _string_types):
+            anaType = [anaType]
+        with self._lock:
+            for key in list(self._mem):
+                if anaType is None or key[1] in anaType:
+                    del self._mem[key]
+        if disk and self.cacheDir is not None:
+            for fileName in _os.listdir(self.cacheDir):
+                if not fileName.endswith('.npz'):
+                    continue
+                if anaType is None or fileName.split('_')[0] in anaType:
+                    try:
+                        _os.remove(_os.path.join(self.cacheDir, fileName))
+                    except OSError:
+                        pass
+
+    def clear(self):
+        """remove all the cached results, from memory and disk"""
+        self.invalidate()
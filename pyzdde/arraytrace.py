@@ -22,6 +22,12 @@ modes discussed in the Zemax manual
     3. zGetPolTraceArray()
     4. zGetPolTraceDirectArray()
     5. zGetNSCTraceArray()
+
+and the following functions for fast wavefront analysis over many fields,
+which require Numpy
+
+    1. zGetWavefrontMapArray()
+    2. zGetZernikeArray()
 """
 from __future__ import print_function
 import os as _os
@@ -33,6 +39,14 @@ import collections as _co
 if _sys.version_info[0] > 2:
     xrange = range
 
+try:
+    import numpy as _np
+except ImportError:
+    _global_np = False
+else:
+    _global_np = True
+    import pyzdde.zernike as _zern
+
 # Ray data structure as defined in Zemax manual
 class DdeArrayData(_ct.Structure):
     _fields_ = [(  'x', _ct.c_double), ('y', _ct.c_double), ('z', _ct.c_double),
@@ -44,6 +58,18 @@ class DdeArrayData(_ct.Structure):
                 ('wave', _ct.c_int),   ('error', _ct.c_int),
                 ('vigcode', _ct.c_int), ('want_opd', _ct.c_int)]
 
+if _global_np:
+    # Numpy view of the ray data structure (see ``_getRayDataView()``)
+    _rayDataDtype = _np.dtype([(name, _np.float64 if ctype is _ct.c_double else _np.int32)
+                               for name, ctype in DdeArrayData._fields_])
+
+def _getRayDataView(rd):
+    """returns a numpy structured array that shares the memory of the ctypes
+    ray data array ``rd``. It allows filling and reading the ray data
+    structure without looping over the elements in Python
+    """
+    return _np.frombuffer(rd, dtype=_rayDataDtype)
+
 def _is64bit():
     """return True if Python version is 64 bit
     """
@@ -918,6 +944,125 @@ def zGetNSCTraceArray(x=0.0, y=0.0, z=0.0, l=0.0, m=0.0, n=1.0, Exr=0.0, Exi=0.0
     else:
         return ret
 
+def zGetWavefrontMapArray(hx=0.0, hy=0.0, sampling=32, waveNum=1,
+                          obscuration=0.0, timeout=60000):
+    """Trace a square grid of pupil rays with OPD computation for one or more
+    fields, and return the wavefront maps as Numpy arrays.
+
+    The rays of all the fields are traced in a single array trace on the
+    lens file in the LDE of main Zemax application (not in the DDE server)
+
+    Parameters
+    ----------
+    hx, hy : float or sequence of floats, optional
+        normalized field heights. If sequences are passed, they must have
+        the same length, one element per field
+    sampling : integer, optional
+        number of pupil points along each side of the square pupil grid
+    waveNum : integer, optional
+        wavelength number
+    obscuration : float, optional
+        central obscuration ratio. Pupil points with a normalized radial
+        coordinate smaller than ``obscuration`` are not traced.
+    timeout : integer, optional
+        command timeout specified in milli-seconds
+
+    Returns
+    -------
+    opd : ndarray
+        wavefront maps (OPD in waves) of shape (nfields, sampling, sampling).
+        The rows are along ``py`` and the columns along ``px``, both going
+        from -1 to 1. Points outside the pupil, and rays that were vignetted
+        or could not be traced, are set to ``NaN``.
+
+    If ray tracing fails, a single integer error code is returned,
+    which has the following meaning: -1 = Couldn't retrieve data in
+    PostArrayTraceMessage, -999 = Couldn't communicate with Zemax,
+    -998 = timeout reached
+
+    Notes
+    -----
+    The opd can only be computed if the last surface is the image surface.
+    """
+    hx = _np.atleast_1d(_np.asarray(hx, dtype=_np.float64))
+    hy = _np.atleast_1d(_np.asarray(hy, dtype=_np.float64))
+    px, py, mask = _zern.pupilGrid(sampling, obscuration)
+    nfields, npts = len(hx), len(px)
+    numRays = nfields*npts
+    rd = getRayDataArray(numRays, tType=0, mode=0, endSurf=-1)
+    rays = _getRayDataView(rd)[1:]
+    rays['x'] = _np.repeat(hx, npts)
+    rays['y'] = _np.repeat(hy, npts)
+    rays['z'] = _np.tile(px, nfields)
+    rays['l'] = _np.tile(py, nfields)
+    rays['intensity'] = 1.0
+    rays['wave'] = waveNum
+    rays['want_opd'] = 1
+    ret = zArrayTrace(rd, timeout)
+    if ret != 0:
+        return ret
+    opd = _np.where((rays['error'] == 0) & (rays['vigcode'] == 0),
+                    rays['opd'], _np.nan)
+    opdMap = _np.full((nfields, sampling, sampling), _np.nan)
+    opdMap[:, mask] = opd.reshape(nfields, npts)
+    return opdMap
+
+def zGetZernikeArray(hx=0.0, hy=0.0, which='fringe', nterms=None, sampling=32,
+                     waveNum=1, obscuration=0.0, timeout=60000):
+    """Compute the Zernike Fringe, Standard, or Annular coefficients of the
+    wavefront for one or more fields, by fitting the wavefront maps obtained
+    from a single array trace (see ``zGetWavefrontMapArray()``).
+
+    This is a fast alternative to calling ``zGetZernike()`` for each field
+    within sweeps. The coefficients are fitted locally using a cached basis,
+    and thus may differ slightly from those computed by Zemax, depending
+    on the ``sampling``.
+
+    Parameters
+    ----------
+    hx, hy : float or sequence of floats, optional
+        normalized field heights. If sequences are passed, they must have
+        the same length, one element per field
+    which : string, optional
+        ``fringe`` for "Fringe" zernike terms (default), ``standard``
+        for "Standard" zernike terms, and ``annular`` for "Annular"
+        zernike terms.
+    nterms : integer, optional
+        number of terms to fit. Default is the maximum number of terms
+        supported by Zemax for the type (37 for ``fringe``, 231 otherwise)
+    sampling : integer, optional
+        number of pupil points along each side of the square pupil grid
+    waveNum : integer, optional
+        wavelength number
+    obscuration : float, optional
+        central obscuration ratio. It defines the annulus of the ``annular``
+        terms, and excludes the obscured rays from the fit.
+    timeout : integer, optional
+        command timeout specified in milli-seconds
+
+    Returns
+    -------
+    zCoeff : ndarray
+        the Zernike coefficients (in waves) of shape (nfields, nterms). The
+        column ``j - 1`` corresponds to the term ``Zj`` of the Zemax manual.
+    rmsFitErr : ndarray
+        RMS fit error (in waves) of each field
+
+    If ray tracing fails, a single integer error code is returned (see
+    ``zGetWavefrontMapArray()``)
+
+    Examples
+    --------
+    >>> hy = np.linspace(0, 1, 11)
+    >>> zCoeff, rmsFitErr = at.zGetZernikeArray(hy=hy, which='standard', nterms=37)
+    >>> defocus = zCoeff[:, 3]
+    """
+    opd = zGetWavefrontMapArray(hx, hy, sampling, waveNum, obscuration, timeout)
+    if not isinstance(opd, _np.ndarray):
+        return opd
+    fitter = _zern.getZernikeFitter(which, nterms, sampling, obscuration)
+    return fitter.fit(opd)
+
 # ###########################################################################
 # Basic test functions
 # Please note that some of the following tests require Zemax to be running
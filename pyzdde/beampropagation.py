@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Name:        beampropagation.py
+# Purpose:     Local free-space propagation of the beams stored in Zemax beam
+#              files (ZBF) using the angular spectrum and Fresnel methods.
+# Licence:     MIT License
+#              This file is subject to the terms and conditions of the MIT License.
+#              For further details, please refer to LICENSE.txt
+#-------------------------------------------------------------------------------
+'''Free-space propagation of Zemax beam files (ZBF) with numpy FFTs.
+
+Two methods are provided, similar to those used by the physical optics
+propagation (POP) of Zemax:
+
+* the angular spectrum method, which keeps the sampling of the beam and is
+  accurate in the near field, i.e. for distances shorter than the critical
+  distance ``N*dx**2/lambda`` of the grid;
+* the (single FFT) Fresnel transform, which rescales the grid to
+  ``lambda*z/(N*dx)`` and is used in the far field.
+
+The spatial frequencies of the grid and the transfer functions of the
+angular spectrum method are computed once per combination of grid and
+wavelength (see ``getBeamPropagator()``), so that propagating a beam to many
+distances requires a single forward FFT and one inverse FFT per distance.
+The beams are read and written with ``zfileutils.readBeamFileArray()`` and
+``zfileutils.writeBeamFileArray()``.
+'''
+from __future__ import print_function, division
+import math as _math
+import collections as _co
+import warnings as _warnings
+import numpy as _np
+
+import pyzdde.zfileutils as _zfu
+
+# cache of the BeamPropagator objects keyed by (shape, sampling, wavelength)
+_propagator_cache = {}
+_PROPAGATOR_CACHE_SIZE = 8
+# number of transfer functions kept by each propagator
+_TRANSFER_CACHE_SIZE = 16
+# fraction of the energy of the beam (or of its spectrum) near the edges of
+# the grid above which a sampling warning is issued
+_WARN_TOL = 1e-3
+
+# sampling diagnostics of a beam
+samplingInfo = _co.namedtuple('samplingInfo', ['critical_distance', 'edge_energy',
+                                               'spectrum_edge_energy'])
+
+#%% Helper functions
+
+def _fastSize(n):
+    """smallest integer >= n whose only prime factors are 2, 3 and 5"""
+    best = 2**int(_math.ceil(_math.log(max(n, 1), 2)))
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+def _wavelength(header):
+    """wavelength of the beam in the medium, in lens units"""
+    return header.lamda/header.index
+
+def _bandEdge(coord, power, tol):
+    """returns the smallest ``c`` such that the fraction of ``power`` at
+    ``|coord| > c`` is at most ``tol``"""
+    order = _np.argsort(_np.abs(coord), kind='mergesort')
+    cum = _np.cumsum(power[order])
+    if cum[-1] <= 0:
+        return 0.0
+    idx = min(_np.searchsorted(cum, (1 - tol)*cum[-1]), len(cum) - 1)
+    return abs(coord[order][idx])
+
+def _edgeFraction(power):
+    """fraction of the 2-D ``power`` in the outer 1/16 of the rows and
+    columns, with the zero (origin) sample at the center"""
+    ny, nx = power.shape
+    by, bx = max(1, ny//16), max(1, nx//16)
+    total = power.sum()
+    if total <= 0:
+        return 0.0
+    inner = power[by:ny-by, bx:nx-bx].sum()
+    return float((total - inner)/total)
+
+def criticalDistance(header, shape=None):
+    """returns the critical propagation distance of the grid of a beam
+
+    Below the critical distance ``N*dx**2/lambda`` the transfer function of
+    the angular spectrum method is adequately sampled, and above it the
+    quadratic phase of the Fresnel transform is.
+
+    Parameters
+    ----------
+    header : namedtuple
+        ``zbfHeader`` of the beam
+    shape : 2-tuple, optional
+        (ny, nx) number of samples of the (padded) grid. Default is the
+        number of samples of the beam
+
+    Returns
+    -------
+    zc : float
+        critical distance in lens units (smallest of the x and y values)
+    """
+    ny, nx = shape or (header.ny, header.nx)
+    wavelength = _wavelength(header)
+    return min(nx*header.dx**2, ny*header.dy**2)/wavelength
+
+def beamSampling(beam):
+    """returns the sampling diagnostics of a beam
+
+    Parameters
+    ----------
+    beam : namedtuple
+        ``zbfData`` returned by ``zfileutils.readBeamFileArray()``
+
+    Returns
+    -------
+    info : namedtuple
+        ``samplingInfo`` with the fields:
+
+        * critical_distance : critical distance of the grid (see
+          ``criticalDistance()``)
+        * edge_energy : fraction of the energy in the outer 1/16 of the
+          grid. A large value means that the beam is truncated by the grid.
+        * spectrum_edge_energy : fraction of the energy in the outer 1/16
+          of the spatial frequencies. A large value means that the beam is
+          undersampled.
+    """
+    E = _zfu._zbfFields(beam)
+    power = (abs(E)**2).sum(axis=0)
+    spec = _np.fft.fftshift(_np.fft.fft2(_np.fft.ifftshift(E, axes=(-2, -1))),
+                            axes=(-2, -1))
+    specPower = (abs(spec)**2).sum(axis=0)
+    return samplingInfo(criticalDistance(beam.header), _edgeFraction(power),
+                        _edgeFraction(specPower))
+
+def _padShape(header, E, distance, tol, maxPad):
+    """returns the (ny, nx) size of the zero-padded grid that prevents the
+    light diffracted over ``distance`` from wrapping around into the grid
+    of the beam"""
+    ny, nx = E.shape[-2:]
+    wavelength = _wavelength(header)
+    power = (abs(E)**2).sum(axis=0)
+    spec = _np.fft.fft2(_np.fft.ifftshift(E, axes=(-2, -1)))
+    specPower = (abs(spec)**2).sum(axis=0)
+    shape = []
+    for axis, n, d in ((0, ny, header.dy), (1, nx, header.dx)):
+        other = 1 - axis
+        coord = (_np.arange(n) - n//2)*d
+        support = 2*_bandEdge(coord, power.sum(axis=other), tol)
+        fmax = _bandEdge(_np.fft.fftfreq(n, d), specPower.sum(axis=other), tol)
+        sinMax = min(wavelength*fmax, 0.999)
+        spread = 2*abs(distance)*sinMax/_math.sqrt(1 - sinMax**2)
+        # light leaving the padded grid reappears on its opposite side, so the
+        # grid must hold all the light spreading from the support of the beam
+        width = support + spread
+        npad = _fastSize(max(n, int(_math.ceil(width/d))))
+        if npad > maxPad*n:
+            _warnings.warn('The padding required to propagate the beam over {} '
+                           'is larger than maxPad; the field may be affected by '
+                           'wrap-around'.format(distance))
+            npad = int(maxPad*n)
+        shape.append(npad)
+    return tuple(shape)
+
+def _pad(E, shape):
+    """zero-pads the fields ``E`` to ``shape`` keeping the origin sample"""
+    ny, nx = E.shape[-2:]
+    oy, ox = shape[0]//2 - ny//2, shape[1]//2 - nx//2
+    out = _np.zeros(E.shape[:-2] + tuple(shape), dtype=_np.complex128)
+    out[..., oy:oy+ny, ox:ox+nx] = E
+    return out
+
+def _crop(E, shape):
+    """inverse of ``_pad()``"""
+    ny, nx = shape
+    oy, ox = E.shape[-2]//2 - ny//2, E.shape[-1]//2 - nx//2
+    return E[..., oy:oy+ny, ox:ox+nx]
+
+#%% Propagator
+
+class BeamPropagator(object):
+    """angular spectrum and Fresnel propagation of fields sampled on a fixed
+    grid at a fixed wavelength
+
+    The spatial frequencies of the grid are computed once on creation, and
+    the last transfer functions used are cached. Use ``getBeamPropagator()``
+    to get a cached propagator.
+
+    Parameters
+    ----------
+    shape : 2-tuple
+        (ny, nx) number of samples of the fields
+    d : 2-tuple
+        (dx, dy) grid spacing
+    wavelength : float
+        wavelength in the medium, in the units of ``d``
+
+    Notes
+    -----
+    The fields are arrays of shape (..., ny, nx) whose sample
+    ``(ny//2, nx//2)`` is at the origin, as in beam files. The constant
+    phase ``2*pi*z/wavelength`` of the propagation is omitted.
+    """
+    def __init__(self, shape, d, wavelength):
+        self.shape = tuple(shape)
+        self.d = tuple(d)
+        self.wavelength = wavelength
+        ny, nx = self.shape
+        fx = _np.fft.fftfreq(nx, d[0])
+        fy = _np.fft.fftfreq(ny, d[1])
+        arg = 1 - (wavelength*fy[:, None])**2 - (wavelength*fx[None, :])**2
+        self._propagating = arg > 0
+        # (kz - k) of the plane waves, in FFT order
+        self._kzMinusK = (2*_math.pi/wavelength)*(_np.sqrt(_np.maximum(arg, 0)) - 1)
+        self._transfer = _co.OrderedDict()
+
+    @property
+    def criticalDistance(self):
+        """critical distance of the grid (see ``criticalDistance()``)"""
+        (ny, nx), (dx, dy) = self.shape, self.d
+        return min(nx*dx**2, ny*dy**2)/self.wavelength
+
+    def transferFunction(self, distance):
+        """returns the angular spectrum transfer function (in FFT order) for
+        the propagation over ``distance``; the evanescent waves are removed
+        """
+        distance = float(distance)
+        H = self._transfer.pop(distance, None)
+        if H is None:
+            H = _np.where(self._propagating, _np.exp(1j*distance*self._kzMinusK), 0)
+            while len(self._transfer) >= _TRANSFER_CACHE_SIZE:
+                self._transfer.popitem(last=False)
+        self._transfer[distance] = H  # most recently used
+        return H
+
+    def angularSpectrum(self, E, distances):
+        """propagate fields with the angular spectrum method
+
+        Parameters
+        ----------
+        E : ndarray
+            complex fields of shape (..., ny, nx)
+        distances : float or sequence of floats
+            propagation distance(s)
+
+        Returns
+        -------
+        E2 : ndarray
+            propagated fields on the same grid, of the shape of ``E`` for a
+            single distance, or of shape (len(distances), ...) otherwise
+        """
+        axes = (-2, -1)
+        spec = _np.fft.fft2(_np.fft.ifftshift(E, axes=axes))
+        out = [_np.fft.fftshift(_np.fft.ifft2(spec*self.transferFunction(z)), axes=axes)
+               for z in _np.atleast_1d(distances)]
+        return out[0] if _np.ndim(distances) == 0 else _np.array(out)
+
+    def fresnel(self, E, distance):
+        """propagate fields with the single FFT Fresnel transform
+
+        Parameters
+        ----------
+        E : ndarray
+            complex fields of shape (..., ny, nx)
+        distance : float
+            non-zero propagation distance
+
+        Returns
+        -------
+        E2 : ndarray
+            propagated fields of the shape of ``E``
+        d2 : 2-tuple
+            (dx, dy) spacing of the output grid, ``|lambda*z|/(N*d)``
+        """
+        if distance < 0:  # the backward kernel is the conjugate of the forward one
+            E2, d2 = self.fresnel(_np.conj(E), -distance)
+            return _np.conj(E2), d2
+        (ny, nx), (dx, dy) = self.shape, self.d
+        lz = self.wavelength*distance
+        dx2, dy2 = lz/(nx*dx), lz/(ny*dy)
+        x1, y1 = (_np.arange(nx) - nx//2)*dx, (_np.arange(ny) - ny//2)*dy
+        x2, y2 = (_np.arange(nx) - nx//2)*dx2, (_np.arange(ny) - ny//2)*dy2
+        chirp1 = _np.exp(1j*_math.pi*y1**2/lz)[:, None]*_np.exp(1j*_math.pi*x1**2/lz)
+        chirp2 = _np.exp(1j*_math.pi*y2**2/lz)[:, None]*_np.exp(1j*_math.pi*x2**2/lz)
+        axes = (-2, -1)
+        spec = _np.fft.fftshift(_np.fft.fft2(_np.fft.ifftshift(E*chirp1, axes=axes)),
+                                axes=axes)
+        return spec*chirp2*(dx*dy/(1j*lz)), (dx2, dy2)
+
+def getBeamPropagator(shape, d, wavelength):
+    """returns a (cached) ``BeamPropagator`` for the grid and wavelength
+
+    Parameters
+    ----------
+    shape : 2-tuple
+        (ny, nx) number of samples of the fields
+    d : 2-tuple
+        (dx, dy) grid spacing
+    wavelength : float
+        wavelength in the medium, in the units of ``d``
+
+    Returns
+    -------
+    propagator : BeamPropagator
+    """
+    key = (tuple(shape), tuple(float(v) for v in d), float(wavelength))
+    propagator = _propagator_cache.get(key)
+    if propagator is None:
+        if len(_propagator_cache) >= _PROPAGATOR_CACHE_SIZE:
+            _propagator_cache.pop(next(iter(_propagator_cache)))
+        propagator = BeamPropagator(*key)
+        _propagator_cache[key] = propagator
+    return propagator
+
+#%% Beam propagation
+
+def propagateBeam(beam, distances, method='auto', pad='auto', maxPad=4, tol=1e-6):
+    """propagate a beam in free space (in the medium of the beam)
+
+    Parameters
+    ----------
+    beam : namedtuple
+        ``zbfData`` returned by ``zfileutils.readBeamFileArray()``
+    distances : float or sequence of floats
+        propagation distance(s) in lens units. Negative distances propagate
+        the beam backwards.
+    method : string, optional
+        ``auto`` (default), ``angular`` or ``fresnel``. ``auto`` uses the
+        angular spectrum method for the distances shorter than the critical
+        distance of the grid (see ``criticalDistance()``), and the Fresnel
+        transform for the longer ones.
+    pad : string or integer, optional
+        zero-padding of the grid for the angular spectrum method. ``auto``
+        (default) pads the grid such that the light diffracted over the
+        longest distance doesn't wrap around into the grid of the beam;
+        an integer is a fixed padding factor, and ``1`` disables the
+        padding. The propagated beams are cropped back to the grid of the
+        input beam.
+    maxPad : integer, optional
+        maximum padding factor used by ``pad='auto'``
+    tol : float, optional
+        fraction of the energy of the beam (and of its spectrum) that may be
+        ignored when computing the ``auto`` padding
+
+    Returns
+    -------
+    beam2 : namedtuple or list of namedtuples
+        propagated ``zbfData`` beam(s), one per distance. In the header, the
+        z positions of the pilot beam are advanced by the distance, while
+        its waists and Rayleigh ranges are unchanged; the grid spacing
+        ``dx``, ``dy`` is that of the output grid, which differs from that
+        of the input beam for the Fresnel transform. The fiber coupling
+        efficiencies are reset to zero.
+
+    Notes
+    -----
+    1. A ``RuntimeWarning`` is issued if the beam is truncated by or
+       undersampled on its grid (see ``beamSampling()``), or if the forced
+       method is used outside of its range of validity.
+    2. The constant phase ``2*pi*z*index/lamda`` of the propagation is
+       omitted.
+
+    Examples
+    --------
+    >>> beam = zfu.readBeamFileArray('waist.zbf')
+    >>> beams = propagateBeam(beam, np.linspace(0, 20, 41))
+    >>> widths = [beamWidth(b) for b in beams]
+    """
+    assert method in ('auto', 'angular', 'fresnel'), \
+        "method must be 'auto', 'angular' or 'fresnel'"
+    hdr = beam.header
+    E = _zfu._zbfFields(beam)
+    shape = E.shape[-2:]
+    wavelength = _wavelength(hdr)
+    zs = _np.atleast_1d(_np.asarray(distances, dtype=_np.float64))
+    info = beamSampling(beam)
+    if info.edge_energy > _WARN_TOL:
+        _warnings.warn('{:.2g} of the energy of the beam is near the edges of the '
+                       'grid'.format(info.edge_energy), RuntimeWarning)
+    if info.spectrum_edge_energy > _WARN_TOL:
+        _warnings.warn('The beam is undersampled ({:.2g} of its spectrum is near '
+                       'the Nyquist frequency)'.format(info.spectrum_edge_energy),
+                       RuntimeWarning)
+    zc = info.critical_distance
+    if method == 'auto':
+        useAngular = _np.abs(zs) <= zc
+    else:
+        useAngular = _np.repeat(method == 'angular', len(zs))
+    results = [None]*len(zs)
+    angular = _np.flatnonzero(useAngular)
+    if len(angular):
+        if pad == 'auto':
+            padShape = _padShape(hdr, E, _np.abs(zs[angular]).max(), tol, maxPad)
+        else:
+            padShape = tuple(int(pad*n) for n in shape)
+        propagator = getBeamPropagator(padShape, (hdr.dx, hdr.dy), wavelength)
+        if _np.abs(zs[angular]).max() > propagator.criticalDistance:
+            _warnings.warn('The transfer function of the angular spectrum method is '
+                           'undersampled beyond a distance of {:.4g}'
+                           .format(propagator.criticalDistance), RuntimeWarning)
+        Epad = _pad(E, padShape)
+        spec = _np.fft.fft2(_np.fft.ifftshift(Epad, axes=(-2, -1)))
+        for i in angular:
+            E2 = _np.fft.fftshift(_np.fft.ifft2(spec*propagator.transferFunction(zs[i])),
+                                  axes=(-2, -1))
+            results[i] = (_crop(E2, shape), (hdr.dx, hdr.dy))
+    fresnel = _np.flatnonzero(~useAngular)
+    if len(fresnel):
+        if _np.abs(zs[fresnel]).min() < zc:
+            _warnings.warn('The quadratic phase of the Fresnel transform is '
+                           'undersampled below a distance of {:.4g}'.format(zc),
+                           RuntimeWarning)
+        propagator = getBeamPropagator(shape, (hdr.dx, hdr.dy), wavelength)
+        for i in fresnel:
+            results[i] = propagator.fresnel(E, zs[i]) if zs[i] else (E.copy(), (hdr.dx, hdr.dy))
+    beams = []
+    for z, (E2, (dx, dy)) in zip(zs, results):
+        hdr2 = hdr._replace(dx=dx, dy=dy, zposition_x=hdr.zposition_x + z,
+                            zposition_y=hdr.zposition_y + z, receiver_eff=0,
+                            system_eff=0)
+        beams.append(_zfu.zbfData(hdr2, E2[0], E2[1] if len(E2) == 2 else None))
+    return beams[0] if _np.ndim(distances) == 0 else beams
+
+def propagateBeamFile(beamfilename, distance, outfilename, **kwargs):
+    """propagate the beam of a beam file and write the result to another
+    beam file
+
+    Parameters
+    ----------
+    beamfilename : string
+        the filename of the beam file to read
+    distance : float
+        propagation distance in lens units
+    outfilename : string
+        the filename of the beam file to write
+    **kwargs
+        other arguments of ``propagateBeam()``
+
+    Returns
+    -------
+    beam2 : namedtuple
+        propagated ``zbfData`` beam
+    """
+    beam2 = propagateBeam(_zfu.readBeamFileArray(beamfilename), float(distance),
+                          **kwargs)
+    _zfu.writeBeamFileArray(outfilename, beam2.header, beam2.Ex, beam2.Ey)
+    return beam2
+
+def beamWidth(beam):
+    """returns the second moment (1/e^2 radius) widths of a beam
+
+    Parameters
+    ----------
+    beam : namedtuple
+        ``zbfData`` beam
+
+    Returns
+    -------
+    wx, wy : float
+        ``2*sqrt(<(x - <x>)**2>)`` and ``2*sqrt(<(y - <y>)**2>)``, which are
+        the 1/e^2 radii of Gaussian beams
+    """
+    x, y = _zfu.beamFileAxes(beam.header)
+    power = (abs(_zfu._zbfFields(beam))**2).sum(axis=0)
+    px, py = power.sum(axis=0), power.sum(axis=1)
+    total = power.sum()
+    mx, my = (px*x).sum()/total, (py*y).sum()/total
+    wx = 2*_math.sqrt((px*(x - mx)**2).sum()/total)
+    wy = 2*_math.sqrt((py*(y - my)**2).sum()/total)
+    return wx, wy
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Name:        fibercoupling.py
+# Purpose:     Local computation of the fiber coupling efficiency of the beams
+#              stored in Zemax beam files (ZBF) for many fiber positions,
+#              tilts and modes.
+# Licence:     MIT License
+#              This file is subject to the terms and conditions of the MIT License.
+#              For further details, please refer to LICENSE.txt
+#-------------------------------------------------------------------------------
+'''Fiber coupling overlap integrals of Zemax beam files (ZBF).
+
+The receiver efficiency of a fiber is the normalized overlap integral of the
+beam with the mode of the fiber, as computed by the physical optics
+propagation (POP) of Zemax::
+
+    receiver_eff = |sum(E*conj(W))|**2/(sum(|E|**2)*sum(|W|**2))
+
+(summed over both polarizations of polarized beams). The efficiencies for all
+the lateral positions of the fiber on the grid of the beam are obtained at
+once as the cross-correlation of the beam with the mode, computed with
+zero-padded FFTs. A tilt of the fiber adds a linear phase to its mode, which
+is applied to the beam instead, so that the spectra of the modes are computed
+once per call. A tolerance map of the coupling efficiency thus needs a single
+POP run that saves the beam at the fiber (see ``zfileutils.readBeamFileArray()``).
+'''
+from __future__ import print_function, division
+import math as _math
+import collections as _co
+import numpy as _np
+
+import pyzdde.zfileutils as _zfu
+
+# fiber coupling efficiencies as functions of the tilt, mode and lateral
+# position of the fiber
+couplingMap = _co.namedtuple('couplingMap', ['x', 'y', 'tilts', 'system_eff',
+                                             'receiver_eff', 'coupling'])
+
+#%% Fiber modes
+
+def gaussianMode(header, mfd, center=(0.0, 0.0), tilt=(0.0, 0.0)):
+    """returns the Gaussian mode of a fiber sampled on the grid of a beam
+
+    Parameters
+    ----------
+    header : namedtuple
+        ``zbfHeader`` of the beam
+    mfd : float or 2-tuple
+        mode field diameter(s), i.e. twice the 1/e^2 radius of the
+        irradiance, in lens units. A 2-tuple sets the x and y diameters
+    center : 2-tuple, optional
+        (x, y) position of the fiber in lens units
+    tilt : 2-tuple, optional
+        (x, y) tilt angles of the fiber axis in radians, i.e. the angles
+        between the axis and the z-axis in the xz and yz planes
+
+    Returns
+    -------
+    W : ndarray
+        complex field of shape (ny, nx) of the mode, with unit amplitude at
+        its center
+    """
+    mfdx, mfdy = (mfd, mfd) if _np.ndim(mfd) == 0 else mfd
+    x, y = _zfu.beamFileAxes(header)
+    x, y = x - center[0], y - center[1]
+    k = 2*_math.pi*header.index/header.lamda
+    wx = _np.exp(-(x/(0.5*mfdx))**2 + 1j*k*_math.sin(tilt[0])*x)
+    wy = _np.exp(-(y/(0.5*mfdy))**2 + 1j*k*_math.sin(tilt[1])*y)
+    return wy[:, None]*wx[None, :]
+
+def _systemEfficiency(beam, sourcePower):
+    """fraction of the source power in the beam"""
+    hdr = beam.header
+    if sourcePower is None:
+        return hdr.system_eff if hdr.system_eff else 1.0
+    power = (abs(_zfu._zbfFields(beam))**2).sum()*hdr.dx*hdr.dy
+    return power/sourcePower
+
+#%% Overlap integrals
+
+def receiverEfficiency(beam, mode):
+    """returns the receiver efficiency of a fiber, i.e. the normalized
+    overlap integral of the beam with the mode of the fiber
+
+    Parameters
+    ----------
+    beam : namedtuple
+        ``zbfData`` returned by ``zfileutils.readBeamFileArray()``
+    mode : ndarray
+        complex field of the mode of the fiber, sampled on the grid of the
+        beam (see ``gaussianMode()``)
+
+    Returns
+    -------
+    receiver_eff : float
+    """
+    E = _zfu._zbfFields(beam)
+    W = _np.asarray(mode)
+    overlap = (E*_np.conj(W)).sum(axis=(-2, -1))
+    norm = (abs(E)**2).sum()*(abs(W)**2).sum()
+    return float((abs(overlap)**2).sum()/norm)
+
+def fiberCouplingMap(beam, mfds=None, modes=None, tilts=((0.0, 0.0),),
+                     sourcePower=None):
+    """returns the fiber coupling efficiencies of a beam for all the
+    lateral positions of the fiber on the grid of the beam, and for many
+    tilts and modes of the fiber
+
+    Parameters
+    ----------
+    beam : namedtuple
+        ``zbfData`` returned by ``zfileutils.readBeamFileArray()``
+    mfds : sequence, optional
+        mode field diameters (floats or (x, y) 2-tuples) of Gaussian fiber
+        modes (see ``gaussianMode()``)
+    modes : sequence of ndarrays, optional
+        arbitrary complex fiber modes sampled on the grid of the beam and
+        centered at its origin, for example the ``Ex`` field of a beam file
+        of the mode. The Gaussian modes of ``mfds`` come first.
+    tilts : sequence of 2-tuples, optional
+        (x, y) tilt angles of the fiber in radians (see ``gaussianMode()``).
+        Default is no tilt.
+    sourcePower : float, optional
+        total power of the source, used to compute the system efficiency
+        as the fraction of it in the beam. If ``None`` (default), the system
+        efficiency of the header of the beam is used if it was computed by
+        Zemax, and 1 otherwise.
+
+    Returns
+    -------
+    cmap : namedtuple
+        ``couplingMap`` with the fields:
+
+        * x, y : 1-D arrays of the lateral positions of the fiber, which are
+          the coordinates of the samples of the beam (see
+          ``zfileutils.beamFileAxes()``)
+        * tilts : array of shape (ntilts, 2) of the tilt angles
+        * system_eff : system efficiency
+        * receiver_eff : array of shape (ntilts, nmodes, ny, nx) of the
+          receiver efficiencies; ``receiver_eff[t, m, j, i]`` is that of the
+          mode ``m`` tilted by ``tilts[t]`` and centered at ``(x[i], y[j])``
+        * coupling : ``system_eff*receiver_eff``
+
+    Notes
+    -----
+    The beam and the modes are zero-padded to twice their size, such that
+    the cross-correlations are not affected by wrap-around. The modes
+    should be entirely sampled by the grid.
+
+    Examples
+    --------
+    >>> beam = zfu.readBeamFileArray('fiber.zbf')
+    >>> cmap = fiberCouplingMap(beam, mfds=[0.008, 0.0085, 0.009],
+    ...                         tilts=[(0, 0), (0.01, 0)])
+    >>> best = cmap.coupling.max(axis=(-2, -1))   # best position
+    """
+    hdr = beam.header
+    E = _zfu._zbfFields(beam)
+    ny, nx = E.shape[-2:]
+    W = [gaussianMode(hdr, mfd) for mfd in (mfds or [])]
+    W.extend(_np.asarray(m, dtype=_np.complex128) for m in (modes or []))
+    if not W:
+        raise ValueError('No fiber mode given')
+    if any(m.shape != (ny, nx) for m in W):
+        raise ValueError('The modes must be sampled on the grid of the beam')
+    W = _np.array(W)
+    tilts = _np.atleast_2d(_np.asarray(tilts, dtype=_np.float64))
+    pshape = (2*ny, 2*nx)
+    axes = (-2, -1)
+    # the conjugate spectra of the modes, shared by all the tilts
+    modeSpec = _np.conj(_np.fft.fft2(W, s=pshape))[:, None]
+    modeNorm = (abs(W)**2).sum(axis=axes)
+    beamNorm = (abs(E)**2).sum()
+    x, y = _zfu.beamFileAxes(hdr)
+    k = 2*_math.pi*hdr.index/hdr.lamda
+    receiver = _np.empty((len(tilts), len(W), ny, nx))
+    for t, (tx, ty) in enumerate(tilts):
+        tiltPhase = (_np.exp(-1j*k*_math.sin(ty)*y)[:, None]
+                     *_np.exp(-1j*k*_math.sin(tx)*x)[None, :])
+        spec = _np.fft.fft2(E*tiltPhase, s=pshape)
+        # corr[m, p, j, i] = sum(E*conj(W shifted by (j, i) samples))
+        corr = _np.fft.fftshift(_np.fft.ifft2(spec*modeSpec), axes=axes)
+        corr = corr[..., ny - ny//2:2*ny - ny//2, nx - nx//2:2*nx - nx//2]
+        receiver[t] = (abs(corr)**2).sum(axis=1)/(modeNorm[:, None, None]*beamNorm)
+    system = _systemEfficiency(beam, sourcePower)
+    return couplingMap(x, y, tilts, system, receiver, system*receiver)
@@ -162,32 +162,19 @@ def get_cardinal_points(ln):
        in which, the object side data is with respect to the first surface in the LDE. 
     2. If there are more than one wavelength, then the distances are averaged.  
     """
-    zmxdir = _os.path.split(ln.zGetFile())[0]
-    textFileName = _os.path.join(zmxdir, "tmp.txt") 
-    ln.zGetTextFile(textFileName, 'Pre', "None", 0)
-    line_list = _pyz._readLinesFromFile(_pyz._openFile(textFileName))
+    cardinalPoints = ln.zGetPrescription().cardinalPoints
+    focalPlanes = cardinalPoints.get('Focal Planes', [])
+    principalPlanes = cardinalPoints.get('Principal Planes', [])
     ppObj, ppImg, fpObj, fpImg = 0.0, 0.0, 0.0, 0.0
-    count = 0
-    for line_num, line in enumerate(line_list):
-        # Extract the Focal plane distances
-        if "Focal Planes" in line:
-            fpObj += float(line.split()[3])
-            fpImg += float(line.split()[4])
-        # Extract the Principal plane distances.
-        if "Principal Planes" in line and "Anti" not in line:
-            ppObj += float(line.split()[3])
-            ppImg += float(line.split()[4])
-            count +=1  #Increment (wavelength) counter for averaging
     # Calculate the average (for all wavelengths) of the principal plane distances
     # This is only there for extracting a single point ... ideally the design
     # should have just one wavelength define!
+    count = len(principalPlanes)
     if count > 0:
-        fpObj = fpObj/count
-        fpImg = fpImg/count
-        ppObj = ppObj/count
-        ppImg = ppImg/count
-    # Delete the temporary file
-    _pyz._deleteFile(textFileName)
+        fpObj = sum(fp[0] for fp in focalPlanes)/count
+        fpImg = sum(fp[1] for fp in focalPlanes)/count
+        ppObj = sum(pp[0] for pp in principalPlanes)/count
+        ppImg = sum(pp[1] for pp in principalPlanes)/count
     cardinals = _co.namedtuple('cardinals', ['Fo', 'Fi', 'Ho', 'Hi'])
     return cardinals(fpObj, fpImg, ppObj, ppImg)
       
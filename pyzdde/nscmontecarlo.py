@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Name:        nscmontecarlo.py
+# Purpose:     Monte Carlo runs of independent NSC traces over several Zemax
+#              links, with accumulation of the detector data and early stop
+#              on a target noise.
+# Licence:     MIT License
+#              This file is subject to the terms and conditions of the MIT License.
+#              For further details, please refer to LICENSE.txt
+#-------------------------------------------------------------------------------
+'''Monte Carlo NSC traces with accumulation of the detector data.
+
+Stray light and illumination studies need many independent NSC traces of the
+same system, each with a different seed of the random number generator of
+Zemax. ``runMonteCarlo()`` distributes the traces (jobs) over one or more
+PyZDDE links, each connected to a Zemax instance with the same lens loaded,
+reads the detectors after each trace with ``zGetDetectorArray()``, and
+accumulates the mean and variance of every pixel over the jobs. The standard
+error of the mean gives the noise of the detector maps, and the run stops
+once the relative noise reaches the target.
+
+The traces are started with ``zNSCTraceAsync()``, such that all the links
+trace at the same time, while the detectors are read and accumulated in the
+calling thread.
+'''
+from __future__ import print_function, division
+import time as _time
+import collections as _co
+import numpy as _np
+
+# results of a Monte Carlo run; the detector data are dictionaries keyed by
+# the object numbers of the detectors
+monteCarloResult = _co.namedtuple('monteCarloResult', ['mean', 'std', 'stderr',
+                                                       'relNoise', 'nJobs', 'seeds',
+                                                       'failed', 'converged',
+                                                       'history'])
+
+class RunningStatistics(object):
+    """Running mean and variance of arrays (Welford's algorithm)
+
+    Parameters
+    ----------
+    shape : tuple, optional
+        shape of the arrays. If ``None`` (default), the shape of the first
+        array added is used
+
+    Attributes
+    ----------
+    n : integer
+        number of arrays added
+    mean : ndarray
+        mean of the arrays (``None`` if no array was added and the shape
+        wasn't given, as are ``variance``, ``std`` and ``stderr``)
+    """
+    def __init__(self, shape=None):
+        self.n = 0
+        self.mean = None if shape is None else _np.zeros(shape)
+        self._m2 = None if shape is None else _np.zeros(shape)
+
+    def add(self, x):
+        """adds the array ``x`` to the statistics"""
+        x = _np.asarray(x, dtype=_np.float64)
+        if self.mean is None:
+            self.mean, self._m2 = _np.zeros(x.shape), _np.zeros(x.shape)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta/self.n
+        self._m2 += delta*(x - self.mean)
+
+    @property
+    def variance(self):
+        """unbiased variance of the arrays (``NaN`` for less than 2 arrays)"""
+        if self.mean is None:
+            return None
+        if self.n < 2:
+            return _np.full_like(self.mean, _np.nan)
+        return self._m2/(self.n - 1)
+
+    @property
+    def std(self):
+        """standard deviation of the arrays"""
+        if self.mean is None:
+            return None
+        return _np.sqrt(self.variance)
+
+    @property
+    def stderr(self):
+        """standard error of the mean"""
+        if self.mean is None:
+            return None
+        return self.std/_np.sqrt(self.n) if self.n else self.std
+
+    def relativeNoise(self):
+        """returns the relative noise of the mean, i.e. the sum of the
+        standard errors of the pixels divided by the sum of their means,
+        which is the mean relative error of the pixels weighted by their
+        flux (``inf`` for less than 2 arrays or a null mean)"""
+        total = abs(self.mean).sum() if self.mean is not None else 0
+        if self.n < 2 or total == 0:
+            return _np.inf
+        return float(self.stderr.sum()/total)
+
+def _startJob(link, seed, surfNum, srcNum, detectors, dtype, traceArgs, timeout):
+    """clears the detectors and starts the trace of a job on a link"""
+    link.zNSCDetectorClear(surfNum)
+    trace = link.zNSCTraceAsync(surfNum, srcNum, randomSeed=seed, timeout=timeout,
+                                **traceArgs)
+    return trace.then(lambda ln: [ln.zGetDetectorArray(surfNum, det, dtype)
+                                  for det in detectors])
+
+def runMonteCarlo(links, detectors, surfNum=1, srcNum=0, relNoise=0.01, minJobs=4,
+                  maxJobs=100, seeds=None, dtype=0, traceArgs=None, timeout=3600,
+                  pollInterval=0.5, callback=None):
+    """runs independent NSC traces until the detector data reach a target
+    relative noise
+
+    Parameters
+    ----------
+    links : PyZDDE object or sequence of PyZDDE objects
+        links to Zemax instances that have the same lens loaded. Every link
+        runs one trace at a time.
+    detectors : integer or sequence of integers
+        object numbers of the Detector Rectangles to accumulate
+    surfNum : integer, optional
+        surface number of the NSC group (1 for pure NSC systems)
+    srcNum : integer, optional
+        object number of the source; 0 (default) traces all sources
+    relNoise : float, optional
+        target relative noise of the mean of every detector (see
+        ``RunningStatistics.relativeNoise()``). Use 0 to run all the jobs
+    minJobs : integer, optional
+        minimum number of jobs before the noise is tested (at least 2)
+    maxJobs : integer, optional
+        maximum number of jobs
+    seeds : sequence of integers, optional
+        seeds of the random number generator of Zemax, one per job (non
+        zero). Default is ``1, 2, ..., maxJobs``
+    dtype : integer, optional
+        data of the detectors (see ``zGetDetectorArray()``)
+    traceArgs : dict, optional
+        other arguments of ``zNSCTraceAsync()`` (``split``, ``scatter``,
+        ``usePolar``, ``ignoreErrors``, ...)
+    timeout : integer, optional
+        timeout of every trace in seconds
+    pollInterval : float, optional
+        time in seconds between two checks of the running traces
+    callback : callable, optional
+        function called as ``callback(nJobs, relNoise)`` after each job,
+        with the dictionary of the relative noise of the detectors
+
+    Returns
+    -------
+    result : namedtuple
+        ``monteCarloResult`` with the fields:
+
+        * mean, std, stderr : dictionaries of the 2-D arrays of the mean,
+          standard deviation and standard error of the mean of the
+          detectors over the jobs (``None`` if no job succeeded)
+        * relNoise : dictionary of the relative noise of the detectors
+        * nJobs : number of jobs accumulated
+        * seeds : seeds of the jobs accumulated, in order of completion
+        * failed : list of (seed, status) tuples of the failed jobs, where
+          status is the error code of the trace, or the exception raised
+          by the trace or by the readout of the detectors
+        * converged : ``True`` if the target noise was reached
+        * history : list of the maximum relative noise after each job
+
+    Notes
+    -----
+    1. Each job clears the detectors of its link, so the data of a job is
+       that of one trace. The mean over ``n`` jobs has the noise of a
+       single trace with ``n`` times more rays, and the standard errors
+       estimate its noise.
+    2. Once the target noise is reached, no job is started, but the jobs
+       already running are accumulated as they finish (Zemax can't stop a
+       trace).
+    3. A job that fails with an error code of Zemax is skipped. A job
+       that raises an exception (for example a DDE error, or an error
+       reading the detectors) is skipped too, and its link isn't used for
+       the next jobs; the run goes on with the other links.
+    4. PyZDDE can connect to at most ``zdde._MAX_PARALLEL_CONV`` Zemax
+       instances at once.
+
+    Examples
+    --------
+    >>> links = [pyz.createLink(), pyz.createLink()]
+    >>> for ln in links:
+    ...     ln.zLoadFile(lensFile)
+    >>> mc = runMonteCarlo(links, [5, 6], relNoise=0.02,
+    ...                    traceArgs=dict(split=1, scatter=1))
+    >>> irradiance = mc.mean[5]
+    """
+    links = list(links) if isinstance(links, (list, tuple)) else [links]
+    detectors = [detectors] if _np.ndim(detectors) == 0 else list(detectors)
+    traceArgs = dict(traceArgs or {})
+    minJobs = max(2, minJobs)
+    pending = iter(list(range(1, maxJobs + 1)) if seeds is None else list(seeds)[:maxJobs])
+    stats = dict((det, RunningStatistics()) for det in detectors)
+    done, failed, history = [], [], []
+    noise = dict((det, _np.inf) for det in detectors)
+    converged = False
+    active = {}   # link index : (seed, trace)
+    def start(i):
+        for seed in pending:
+            try:
+                active[i] = (seed, _startJob(links[i], seed, surfNum, srcNum, detectors,
+                                             dtype, traceArgs, timeout))
+            except Exception as err:   # the link is not used anymore
+                failed.append((seed, err))
+            return
+    for i in range(len(links)):
+        start(i)
+    while active:
+        finished = [i for i in active if active[i][1].done()]
+        if not finished:
+            _time.sleep(pollInterval)
+            continue
+        for i in finished:
+            seed, trace = active.pop(i)
+            try:
+                result = trace.result()
+            except Exception as err:   # the link is not used anymore
+                failed.append((seed, err))
+                continue
+            if result.status != 0:
+                failed.append((seed, result.status))
+            else:
+                for det, data in zip(detectors, result.data[0]):
+                    stats[det].add(data)
+                done.append(seed)
+                noise = dict((det, stats[det].relativeNoise()) for det in detectors)
+                history.append(max(noise.values()))
+                if callback is not None:
+                    callback(len(done), noise)
+                converged = converged or (len(done) >= minJobs and history[-1] <= relNoise)
+            if not converged:
+                start(i)
+    return monteCarloResult(dict((det, s.mean) for det, s in stats.items()),
+                            dict((det, s.std) for det, s in stats.items()),
+                            dict((det, s.stderr) for det, s in stats.items()),
+                            noise, len(done), done, failed, converged, history)
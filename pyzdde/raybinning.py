@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Name:        raybinning.py
+# Purpose:     Streaming binning of the ray segments of ZRD files into
+#              irradiance, angular intensity and polar intensity maps.
+# Licence:     MIT License
+#              This file is subject to the terms and conditions of the MIT License.
+#              For further details, please refer to LICENSE.txt
+#-------------------------------------------------------------------------------
+'''Detector-like binning of the rays saved in ZRD files, without Zemax.
+
+The segments of a ZRD file are read by chunks of rays (see
+``zfileutils.ZRDFile``), filtered by hit object, hit face and level, and their
+intensities are accumulated into 2-D histograms, such that the memory used
+doesn't depend on the size of the file. The chunks can be binned in parallel
+by a pool of processes, each process reading its own part of the file.
+
+Three kinds of bins are provided:
+
+* ``IrradianceBins`` : power per unit area over a plane (flux/area)
+* ``AngularBins`` : power per unit solid angle over the direction cosines
+* ``PolarBins`` : power per unit solid angle over the polar and azimuth angles
+
+Since the ZRD file holds all the rays, new maps (for example at a different
+resolution) are obtained by binning the file again, without another NSC
+trace. ``extractHits()`` keeps only the filtered segments in memory, so that
+they can be binned many times with ``binHits()``.
+'''
+from __future__ import print_function, division
+import collections as _co
+import multiprocessing as _multiprocessing
+import numpy as _np
+
+import pyzdde.zfileutils as _zfu
+
+# binned data of a detector
+detectorData = _co.namedtuple('detectorData', ['kind', 'uEdges', 'vEdges', 'power',
+                                               'hits', 'data'])
+
+# fields of the segments used by the bins
+_hitFields = ('x', 'y', 'z', 'l', 'm', 'n', 'intensity')
+
+#%% Bins
+
+class _Bins(object):
+    """base class of the bins; the sub-classes define ``kind``, the bin
+    edges and the coordinates of the segments"""
+    kind = None
+
+    def __init__(self, nu, nv, ulim, vlim, rotation=None):
+        self.nu, self.nv = int(nu), int(nv)
+        self.uEdges = _np.linspace(ulim[0], ulim[1], self.nu + 1)
+        self.vEdges = _np.linspace(vlim[0], vlim[1], self.nv + 1)
+        self.rotation = None if rotation is None else _np.asarray(rotation, dtype=_np.float64)
+
+    def _local(self, a, b, c):
+        """components of the global vectors (a, b, c) in the local frame"""
+        if self.rotation is None:
+            return a, b, c
+        R = self.rotation
+        return (R[0, 0]*a + R[0, 1]*b + R[0, 2]*c, R[1, 0]*a + R[1, 1]*b + R[1, 2]*c,
+                R[2, 0]*a + R[2, 1]*b + R[2, 2]*c)
+
+    def accumulate(self, hits):
+        """returns the power and the number of hits per bin of the segments
+        ``hits`` (structured array with the fields x, y, z, l, m, n and
+        intensity)"""
+        u, v = self.coordinates(hits)
+        edges = (self.uEdges, self.vEdges)
+        power = _np.histogram2d(u, v, edges, weights=hits['intensity'])[0]
+        count = _np.histogram2d(u, v, edges)[0].astype(_np.int64)
+        return power, count
+
+    def binSize(self):
+        """returns the area (or solid angle) of every bin"""
+        raise NotImplementedError
+
+    def result(self, power, count):
+        """returns the ``detectorData`` of the accumulated power and hits"""
+        with _np.errstate(divide='ignore', invalid='ignore'):
+            data = power/self.binSize()
+        return detectorData(self.kind, self.uEdges, self.vEdges, power, count, data)
+
+class IrradianceBins(_Bins):
+    """rectangular bins of the positions of the segments on a plane
+
+    Parameters
+    ----------
+    nx, ny : integer
+        number of bins along the local x and y axes
+    xlim, ylim : 2-tuple
+        (min, max) limits of the bins, in lens units
+    origin : 3-tuple, optional
+        global coordinates of the origin of the local frame
+    rotation : ndarray, optional
+        3x3 rotation matrix whose rows are the local x, y and z axes in
+        global coordinates. Default is the identity (global axes)
+
+    Notes
+    -----
+    The positions of the segments (the coordinates of their intercept) are
+    projected along the local z-axis. The ``data`` of the result is the
+    irradiance (power per unit area), indexed ``[x bin, y bin]``.
+    """
+    kind = 'irradiance'
+
+    def __init__(self, nx, ny, xlim, ylim, origin=(0.0, 0.0, 0.0), rotation=None):
+        _Bins.__init__(self, nx, ny, xlim, ylim, rotation)
+        self.origin = _np.asarray(origin, dtype=_np.float64)
+
+    def coordinates(self, hits):
+        o = self.origin
+        u, v, _ = self._local(hits['x'] - o[0], hits['y'] - o[1], hits['z'] - o[2])
+        return u, v
+
+    def binSize(self):
+        return _np.outer(_np.diff(self.uEdges), _np.diff(self.vEdges))
+
+class AngularBins(_Bins):
+    """rectangular bins of the direction cosines of the segments
+
+    Parameters
+    ----------
+    nl, nm : integer
+        number of bins along the local direction cosines l and m
+    llim, mlim : 2-tuple, optional
+        (min, max) limits of the bins, default (-1, 1)
+    rotation : ndarray, optional
+        3x3 rotation matrix whose rows are the local x, y and z axes in
+        global coordinates. Default is the identity
+
+    Notes
+    -----
+    The ``data`` of the result is the intensity (power per unit solid
+    angle) of the directions with a positive local n, indexed
+    ``[l bin, m bin]``. The solid angle of a bin is ``dl*dm/n`` at its
+    center, and the bins beyond the unit circle are ``NaN``.
+    """
+    kind = 'angular'
+
+    def __init__(self, nl, nm, llim=(-1.0, 1.0), mlim=(-1.0, 1.0), rotation=None):
+        _Bins.__init__(self, nl, nm, llim, mlim, rotation)
+
+    def coordinates(self, hits):
+        l, m, n = self._local(hits['l'], hits['m'], hits['n'])
+        forward = n > 0
+        return _np.where(forward, l, _np.nan), _np.where(forward, m, _np.nan)
+
+    def binSize(self):
+        lc = 0.5*(self.uEdges[1:] + self.uEdges[:-1])
+        mc = 0.5*(self.vEdges[1:] + self.vEdges[:-1])
+        n2 = 1 - lc[:, None]**2 - mc[None, :]**2
+        with _np.errstate(invalid='ignore'):
+            n = _np.where(n2 > 0, _np.sqrt(n2), _np.nan)
+        return _np.outer(_np.diff(self.uEdges), _np.diff(self.vEdges))/n
+
+class PolarBins(_Bins):
+    """bins of the polar (from the local z-axis) and azimuth angles of the
+    directions of the segments
+
+    Parameters
+    ----------
+    ntheta : integer
+        number of bins of the polar angle
+    nphi : integer, optional
+        number of bins of the azimuth angle (default 1, i.e. a polar
+        histogram)
+    thetaMax : float, optional
+        maximum polar angle in degrees (default 180)
+    rotation : ndarray, optional
+        3x3 rotation matrix whose rows are the local x, y and z axes in
+        global coordinates. Default is the identity
+
+    Notes
+    -----
+    The angles are in degrees, the azimuth being in [0, 360). The ``data``
+    of the result is the intensity (power per unit solid angle), indexed
+    ``[theta bin, phi bin]``.
+    """
+    kind = 'polar'
+
+    def __init__(self, ntheta, nphi=1, thetaMax=180.0, rotation=None):
+        _Bins.__init__(self, ntheta, nphi, (0.0, thetaMax), (0.0, 360.0), rotation)
+
+    def coordinates(self, hits):
+        l, m, n = self._local(hits['l'], hits['m'], hits['n'])
+        theta = _np.degrees(_np.arccos(_np.clip(n, -1, 1)))
+        phi = _np.degrees(_np.arctan2(m, l)) % 360.0
+        return theta, phi
+
+    def binSize(self):
+        cosTheta = _np.cos(_np.radians(self.uEdges))
+        return _np.outer(cosTheta[:-1] - cosTheta[1:], _np.radians(_np.diff(self.vEdges)))
+
+#%% Filtering and binning
+
+def _matches(values, wanted):
+    """mask of the ``values`` equal to the scalar or in the sequence ``wanted``"""
+    if _np.ndim(wanted):
+        return _np.isin(values, wanted)
+    return values == wanted
+
+def _filterSegments(segments, hit_object=None, hit_face=None, level=None):
+    """returns the fields of the segments that pass the filters"""
+    mask = _np.ones(len(segments), dtype=bool)
+    for name, wanted in (('hit_object', hit_object), ('hit_face', hit_face),
+                         ('level', level)):
+        if wanted is not None:
+            mask &= _matches(segments[name], wanted)
+    hits = _np.empty(mask.sum(), dtype=[(name, _np.float64) for name in _hitFields])
+    for name in _hitFields:
+        hits[name] = segments[name][mask]
+    return hits
+
+def _rayRanges(nRays, chunkSize):
+    return [(start, min(start + chunkSize, nRays)) for start in range(0, nRays, chunkSize)]
+
+def _binRange(args):
+    """bins the rays ``start`` to ``stop`` of a file (run by the processes)"""
+    file_name, start, stop, chunkSize, bins, filters = args
+    totals = [None]*len(bins)
+    with _zfu.ZRDFile(file_name) as zrd:
+        for first, last in _rayRanges(stop - start, chunkSize):
+            hits = _filterSegments(zrd.segments(start + first, start + last), **filters)
+            for k, b in enumerate(bins):
+                power, count = b.accumulate(hits)
+                if totals[k] is None:
+                    totals[k] = [power, count]
+                else:
+                    totals[k][0] += power
+                    totals[k][1] += count
+    return totals
+
+def binZRDFile(file_name, bins, hit_object=None, hit_face=None, level=None,
+               chunkSize=100000, processes=None):
+    """bins the segments of a ZRD file
+
+    Parameters
+    ----------
+    file_name : string
+        name of the (uncompressed or compressed) zrd file
+    bins : bins object or list of bins objects
+        ``IrradianceBins``, ``AngularBins`` or ``PolarBins``
+    hit_object, hit_face, level : integer or sequence of integers, optional
+        only the segments with these hit object, hit face and level
+        numbers are binned. ``None`` (default) doesn't filter the field
+    chunkSize : integer, optional
+        number of rays read at once (per process)
+    processes : integer, optional
+        number of processes binning parts of the file in parallel. If
+        ``None`` (default), the file is binned in the calling process
+
+    Returns
+    -------
+    data : namedtuple or list of namedtuples
+        ``detectorData`` (one per bins object) with the fields:
+
+        * kind : 'irradiance', 'angular' or 'polar'
+        * uEdges, vEdges : edges of the bins along the first and second
+          coordinates
+        * power : 2-D array of the power (sum of the intensities of the
+          segments) of every bin
+        * hits : 2-D array of the number of segments of every bin
+        * data : 2-D array of the irradiance or intensity (see the bins)
+
+    Notes
+    -----
+    1. The intensity of a segment is the power of the ray along the
+       segment, i.e. the power arriving at its intercept, and its
+       direction cosines are those of the segment.
+    2. The index of the file (see ``zfileutils.ZRDFile``) is written before
+       the processes are started, such that they don't scan the file
+       again. On Windows, the processes are spawned, so the function must
+       be called under a ``if __name__ == '__main__':`` guard in scripts.
+
+    Examples
+    --------
+    >>> irr, polar = binZRDFile('straylight.zrd',
+    ...                         [IrradianceBins(200, 200, (-5, 5), (-5, 5)),
+    ...                          PolarBins(90, thetaMax=90)],
+    ...                         hit_object=7, processes=4)
+    """
+    single = not isinstance(bins, (list, tuple))
+    bins = [bins] if single else list(bins)
+    filters = dict(hit_object=hit_object, hit_face=hit_face, level=level)
+    with _zfu.ZRDFile(file_name) as zrd:
+        nRays = len(zrd)
+    if processes is None or processes <= 1:
+        parts = [_binRange((file_name, 0, nRays, chunkSize, bins, filters))]
+    else:
+        raysPerTask = max(chunkSize, -(-nRays//processes))
+        tasks = [(file_name, start, stop, chunkSize, bins, filters)
+                 for start, stop in _rayRanges(nRays, raysPerTask)]
+        pool = _multiprocessing.Pool(processes)
+        try:
+            parts = pool.map(_binRange, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    results = []
+    for k, b in enumerate(bins):
+        power = _np.zeros((b.nu, b.nv))
+        count = _np.zeros((b.nu, b.nv), dtype=_np.int64)
+        for part in parts:
+            if part[k] is not None:
+                power += part[k][0]
+                count += part[k][1]
+        results.append(b.result(power, count))
+    return results[0] if single else results
+
+def extractHits(file_name, hit_object=None, hit_face=None, level=None,
+                chunkSize=100000):
+    """returns the positions, directions and intensities of the segments of
+    a ZRD file that pass the filters
+
+    Parameters
+    ----------
+    file_name : string
+        name of the (uncompressed or compressed) zrd file
+    hit_object, hit_face, level : integer or sequence of integers, optional
+        filters of the segments (see ``binZRDFile()``)
+    chunkSize : integer, optional
+        number of rays read at once
+
+    Returns
+    -------
+    hits : ndarray
+        structured array with the fields x, y, z, l, m, n and intensity of
+        the filtered segments, which can be binned with ``binHits()``
+    """
+    parts = []
+    with _zfu.ZRDFile(file_name) as zrd:
+        for chunk in zrd.iterChunks(chunkSize):
+            parts.append(_filterSegments(chunk.segments, hit_object, hit_face, level))
+    if not parts:
+        return _np.zeros(0, dtype=[(name, _np.float64) for name in _hitFields])
+    return _np.concatenate(parts)
+
+def binHits(hits, bins):
+    """bins the segments returned by ``extractHits()``
+
+    Parameters
+    ----------
+    hits : ndarray
+        structured array with the fields x, y, z, l, m, n and intensity
+    bins : bins object or list of bins objects
+        ``IrradianceBins``, ``AngularBins`` or ``PolarBins``
+
+    Returns
+    -------
+    data : namedtuple or list of namedtuples
+        ``detectorData`` (see ``binZRDFile()``)
+    """
+    single = not isinstance(bins, (list, tuple))
+    results = [b.result(*b.accumulate(hits)) for b in ([bins] if single else bins)]
+    return results[0] if single else results
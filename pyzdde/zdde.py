@@ -29,6 +29,12 @@ import re as _re
 import shutil as _shutil
 import warnings as _warnings
 import codecs as _codecs
+import locale as _locale
+import bisect as _bisect
+import functools as _functools
+import inspect as _inspect
+import uuid as _uuid
+import threading as _threading
 
 # Try to import IPython if it is available (for notebook helper functions)
 try:
@@ -56,6 +62,13 @@ except ImportError:
     _global_mpl_img_load = False
 else:
     _global_mpl_img_load = True
+# Try to import Numpy (for returning analysis data as arrays)
+try:
+    import numpy as _np
+except ImportError:
+    _global_np = False
+else:
+    _global_np = True
 
 # The first module to import that is not one of the standard modules MUST
 # be the config module as it sets up the different global and settings variables
@@ -101,12 +114,14 @@ import pyzdde.zcodes.zemaxbuttons as zb
 import pyzdde.zcodes.zemaxoperands as zo
 import pyzdde.utils.pyzddeutils as _putils
 import pyzdde.zfileutils as _zfu
+import pyzdde.analysiscache as _acache
 
 #%% Constants
 _DEBUG_PRINT_LEVEL = 0 # 0 = No debug prints, but allow all essential prints
                        # 1 to 2 levels of debug print, 2 = print all
 
 _MAX_PARALLEL_CONV = 2  # Max no of simul. conversations possible with Zemax
+_DETECTOR_CHUNK = 4096  # pixels read per chunk by zGetDetectorArray()
 _system_aperture = {0 : 'EPD',
                     1 : 'Image space F/#',
                     2 : 'Object space NA',
@@ -170,6 +185,87 @@ def autopushandrefresh(func):
         return reply
     return wrapped 
 
+# DDE commands (prefixes) that don't modify the lens in the DDE server. Any
+# other command marks the lens as modified for the analysis cache.
+_lensPreservingCmds = ('Get', 'PushLens', 'ModifySettings', 'FindLabel',
+                       'Window', 'ReleaseWindow', 'ExportCheck', 'OpenWindow')
+
+def _isLensPreservingCmd(cmd):
+    return cmd.startswith(_lensPreservingCmds) and not cmd.startswith('GetRefresh')
+
+def _nscTraceCommand(surfNum, srcNum, split, scatter, usePolar, ignoreErrors,
+                     randomSeed, save, saveFilename, oFilter):
+    """returns the NSCTrace command, or ``None`` if ``saveFilename`` is
+    invalid"""
+    requiredArgs = ("{:d},{:d},{:d},{:d},{:d},{:d},{:d},{:d}"
+    .format(surfNum,srcNum, split, scatter, usePolar, ignoreErrors,
+            randomSeed, save))
+    if save:
+        isAbsPath = _os.path.isabs(saveFilename)
+        isRightExt = _os.path.splitext(saveFilename)[1] in ('.ZRD',)
+        if isRightExt and not isAbsPath:
+            if oFilter:
+                optionalArgs = ",{},{}".format(saveFilename,oFilter)
+            else:
+                optionalArgs = ",{}".format(saveFilename)
+            return "NSCTrace,"+requiredArgs+optionalArgs
+        return None
+    return "NSCTrace,"+requiredArgs
+
+def _nscTraceStatus(reply):
+    """returns the status code of the reply to a NSCTrace command"""
+    if 'OK' in reply.split():
+        return 0
+    elif 'BAD COMMAND' in reply.rstrip():
+        return -1
+    else:
+        return int(float(reply.rstrip()))  # return error code sent by zemax.
+
+# decorator for caching the results of the analysis functions, see
+# zSetAnalysisCache(). ``anaTypeOf`` returns the 3-letter analysis code from
+# the dictionary of the call arguments.
+def _cachedAnalysis(anaTypeOf, ignore=('settingsFile', 'txtFile', 'keepFile', 'timeout')):
+    def decorator(func):
+        try:
+            spec = _inspect.getfullargspec(func)
+        except AttributeError: # Python 2
+            spec = _inspect.getargspec(func)
+        argNames = spec.args[1:]
+        defaults = spec.defaults or ()
+        defaults = dict(zip(argNames[len(argNames) - len(defaults):], defaults))
+        @_functools.wraps(func)
+        def wrapped(self, *args, **kwargs):
+            cache = self._anaCache
+            if cache is None:
+                return func(self, *args, **kwargs)
+            callArgs = dict(defaults)
+            callArgs.update(zip(argNames, args))
+            callArgs.update(kwargs)
+            anaType = anaTypeOf(callArgs)
+            # bypass the cache if the caller wants the text file
+            if callArgs.get('txtFile') or callArgs.get('keepFile') or not anaType:
+                return func(self, *args, **kwargs)
+            lensFile = self.zGetFile()
+            lensFingerprint = self._lensFingerprint(lensFile)
+            if lensFingerprint is None:
+                return func(self, *args, **kwargs)
+            cfgFile, _ = _settingsFileToUse(self, callArgs.get('settingsFile'),
+                                            anaType, lensFile)
+            # Zemax uses the settings in the "lens.CFG" file if no settings
+            # file is passed
+            settingsHash = _acache.fileHash(cfgFile or
+                                            _os.path.splitext(lensFile)[0] + '.CFG')
+            params = tuple(sorted((k, v) for k, v in callArgs.items()
+                                  if k not in ignore))
+            key = cache.makeKey(lensFingerprint, anaType, settingsHash, params)
+            result = cache.get(key)
+            if result is None:
+                result = func(self, *args, **kwargs)
+                cache.put(key, result)
+            return result
+        return wrapped
+    return decorator
+
 
 _global_dde_linkObj = {}
 
@@ -594,7 +690,11 @@ class PyZDDE(object):
         self._appNum = PyZDDE.__chNum # unique & immutable identity of each instance
         self._connection = False  # 1/0 depending on successful connection or not
         self._macroPath = None    # variable to store macro path
-        self._filesCreated = set()   # .cfg & other files to be cleaned at session end
+        self._scratch = _zfu.ScratchFileManager() # temporary text, .cfg & other files
+        self._anaCache = None     # analysis results cache, see zSetAnalysisCache()
+        self._lensGeneration = 1  # no. of lens changes since last load/save (1 = unknown)
+        self._sessionId = _uuid.uuid4().hex
+        self._prescription = (None, None) # (lens fingerprint, Prescription), see zGetPrescription()
         self._apr = apr
 
     def __repr__(self):
@@ -789,6 +889,163 @@ class PyZDDE(object):
         self._conversation.SetDDETimeout(round(time))
         return self._conversation.GetDDETimeout()
 
+    def zSetScratchDir(self, directory=None):
+        """Set the directory for the temporary (scratch) files, such as the
+        text files of the analysis windows, created by PyZDDE
+
+        Parameters
+        ----------
+        directory : string, optional
+            full path of the directory, for example a directory on a RAM
+            disk. If ``None`` (default), the directory of the lens file is
+            used.
+
+        Returns
+        -------
+        directory : string or None
+            the set directory
+
+        Notes
+        -----
+        Zemax must be able to write in the directory. Each temporary file
+        gets a unique name, and is deleted in the background once read.
+        The text files kept with ``keepFile=True`` (and no ``txtFile``)
+        are saved under their default names, such as 'popData.txt'.
+
+        See Also
+        --------
+        zGetScratchDir()
+        """
+        if directory is not None and not _os.path.isdir(directory):
+            raise ValueError('Directory {} does not exist'.format(directory))
+        self._scratch.directory = directory
+        return self._scratch.directory
+
+    def zGetScratchDir(self):
+        """Returns the directory set for the temporary (scratch) files
+
+        Returns
+        -------
+        directory : string or None
+            the directory set using ``zSetScratchDir()``. ``None`` if the
+            directory of the lens file is used.
+
+        See Also
+        --------
+        zSetScratchDir()
+        """
+        return self._scratch.directory
+
+    def zSetAnalysisCache(self, enable=True, maxSize=32, cacheDir=None):
+        """Enable or disable the cache of the results of the functions
+        ``zGetPOP()``, ``zGetPSF()``, ``zGetPSFCrossSec()``, ``zGetMTF()``,
+        ``zGetZernike()`` and ``zGetDetectorViewer()``
+
+        When enabled, calling one of these functions again with the same
+        parameters returns the stored result without running the analysis
+        in Zemax, as long as neither the lens nor the settings file has
+        changed.
+
+        Parameters
+        ----------
+        enable : bool, optional
+            ``True`` (default) to enable the cache, ``False`` to disable it
+            (and release the cached results from memory)
+        maxSize : integer, optional
+            maximum number of results kept in memory (LRU)
+        cacheDir : string, optional
+            directory for storing the results persistently (as ``.npz``
+            files) across sessions. If ``None`` (default), the results
+            are only kept in memory.
+
+        Returns
+        -------
+        cache : object or None
+            the ``analysiscache.AnalysisCache`` object
+
+        Notes
+        -----
+        1. The cache key is made of a fingerprint of the lens, the analysis
+           code, the content hash of the settings (.CFG) file that is used,
+           and the other arguments of the call.
+        2. The fingerprint of the lens is the lens file name and the hash of
+           its content. Any DDE command that may change the lens (``Set*``,
+           ``Insert*``, ``Delete*``, ``GetRefresh``, ``NSCTrace``, macros,
+           etc.) is counted, and the count since the last ``zLoadFile()``
+           or ``zSaveFile()`` is part of the fingerprint (with an identifier
+           of the session). Therefore, results are shared across sessions
+           (disk tier) only for unmodified lenses loaded with
+           ``zLoadFile()``.
+        3. Changes that are not seen by PyZDDE, such as the ones made to
+           the glass catalogs or by other DDE clients, are not detected;
+           use ``zInvalidateAnalysisCache()`` in such cases. The cache is
+           bypassed if automatic push and refresh (``apr``) is enabled, and
+           for calls with ``txtFile`` or ``keepFile``.
+        4. When a result is found in the cache, its numpy arrays are
+           read-only views of the cached arrays; copy them before modifying.
+           Otherwise the computed result is returned as is, and the cache
+           stores copies of its arrays.
+
+        See Also
+        --------
+        zGetAnalysisCache(), zInvalidateAnalysisCache()
+        """
+        if enable:
+            self._anaCache = _acache.AnalysisCache(maxSize, cacheDir)
+        else:
+            self._anaCache = None
+        return self._anaCache
+
+    def zGetAnalysisCache(self):
+        """Returns the analysis results cache object, or ``None`` if the cache
+        is not enabled
+
+        See Also
+        --------
+        zSetAnalysisCache(), zInvalidateAnalysisCache()
+        """
+        return self._anaCache
+
+    def zInvalidateAnalysisCache(self, anaType=None, lensChanged=True):
+        """Invalidate the cached analysis results
+
+        Parameters
+        ----------
+        anaType : string or list of strings, optional
+            3-letter code(s) of the analyses ('Pop', 'Fps', 'Hps', 'Pcs',
+            'Hcs', 'Mtf', 'Hmf', 'Zfr', 'Zst', 'Zat', 'Dvw') whose results
+            are removed from the cache (memory and disk). If ``None``
+            (default), all results are removed.
+        lensChanged : bool, optional
+            if ``True`` (default), the lens is also marked as modified, so
+            that no previously cached result is used until the lens is
+            loaded again
+
+        Returns
+        -------
+        None
+
+        See Also
+        --------
+        zSetAnalysisCache()
+        """
+        if lensChanged:
+            self._lensGeneration += 1
+        if self._anaCache is not None:
+            self._anaCache.invalidate(anaType)
+
+    def _lensFingerprint(self, lensFile=None):
+        """returns the fingerprint of the lens used for the analysis cache,
+        or ``None`` if it cannot be determined
+        """
+        if self.apr:
+            return None
+        lensFile = lensFile or self.zGetFile()
+        fingerprint = (lensFile, _acache.fileHash(lensFile))
+        if self._lensGeneration:
+            fingerprint += (self._sessionId, self._lensGeneration)
+        return fingerprint
+
     def zGetTimeout(self):
         """Returns the current value of the global timeout in seconds
 
@@ -808,6 +1065,10 @@ class PyZDDE(object):
         """Method to send command to DDE client
         """
         global _global_pyver3
+        if cmd.startswith(('LoadFile', 'SaveFile')) and cmd.count(',') < 2:
+            self._lensGeneration = 0   # the lens is the same as the file
+        elif not _isLensPreservingCmd(cmd):
+            self._lensGeneration += 1
         reply = self._conversation.Request(cmd, timeout)
         if _global_pyver3:
             reply = reply.decode('ascii').rstrip()
@@ -1351,6 +1612,65 @@ class PyZDDE(object):
         """
         return self._sendDDEcommand('GetDate').rstrip()
 
+    def zGetDetectorArray(self, surfNum, detectNum, dtype=0, chunkSize=None,
+                          callback=None):
+        """Returns the data of all the pixels of an NSC Detector Rectangle
+        as an array
+
+        Parameters
+        ----------
+        surfNum : integer
+            the surface number of the NSC group (1 for pure NSC systems).
+        detectNum : integer
+            the object number of the Detector Rectangle
+        dtype : integer, optional
+            0 = flux (default); 1 = flux/area; 2 = flux/solid angle (see
+            ``zNSCDetectorData()``)
+        chunkSize : integer, optional
+            number of pixels read per chunk (default ``_DETECTOR_CHUNK``)
+        callback : callable, optional
+            function called as ``callback(nRead, nPixels)`` after each
+            chunk, for example to report the progress of large detectors
+
+        Returns
+        -------
+        data : ndarray
+            2-D array of shape (number of y pixels, number of x pixels) of
+            the data of the pixels. ``data.flat[p - 1]`` is the data of the
+            pixel number ``p`` of ``zNSCDetectorData()``
+
+        Notes
+        -----
+        1. The pixels are read with ``zNSCDetectorData()``, one DDE call per
+           pixel, by chunks of ``chunkSize`` pixels written into the
+           preallocated array. If the detector holds no flux, the pixels
+           aren't read.
+        2. The detector files saved by ``zSaveDetector()`` aren't read,
+           since their format isn't documented.
+        3. Requires Numpy.
+
+        Examples
+        --------
+        >>> ln.zNSCTrace(1, 0, split=1, scatter=1)
+        >>> irradiance = ln.zGetDetectorArray(1, 5, dtype=1)
+        """
+        if not _global_np:
+            raise ImportError('zGetDetectorArray requires Numpy')
+        nx = int(self.zGetNSCParameter(surfNum, detectNum, 3))
+        ny = int(self.zGetNSCParameter(surfNum, detectNum, 4))
+        nPixels = nx*ny
+        data = _np.zeros(nPixels)
+        if self.zNSCDetectorData(surfNum, detectNum, 0, 0) == 0:
+            return data.reshape(ny, nx)
+        chunkSize = max(1, int(chunkSize or _DETECTOR_CHUNK))
+        for start in range(0, nPixels, chunkSize):
+            stop = min(start + chunkSize, nPixels)
+            data[start:stop] = [self.zNSCDetectorData(surfNum, detectNum, pixel, dtype)
+                                for pixel in range(start + 1, stop + 1)]
+            if callback is not None:
+                callback(stop, nPixels)
+        return data.reshape(ny, nx)
+
     def zGetExtra(self, surfNum, colNum):
         """Returns extra surface data from the Extra Data Editor
 
@@ -4169,6 +4489,40 @@ class PyZDDE(object):
         reply = self._sendDDEcommand(cmd)
         return int(float(reply.rstrip()))
 
+    def _modifySettingsItems(self, settingsFile, items, localWrite=False):
+        """modify the settings of a settings file, and return the status
+        tuple of the ``zModify*Settings()`` functions
+
+        ``items`` is a list of (key, value) tuples, or of lists of (key,
+        value) tuples for the settings with several values, whose status
+        codes are grouped in a tuple. If ``localWrite`` is ``True``, the
+        settings whose location is known (see ``zfileutils.cfgKeys``) are
+        written to the file in a single write, with the status code 0, and
+        the other settings are set using ``zModifySettings()``.
+        """
+        status = {}
+        if localWrite:
+            cfg = _zfu.readCFGFile(settingsFile)
+            known = cfg.keys()
+            local = dict(kv for item in items
+                         for kv in (item if isinstance(item, list) else [item])
+                         if kv[0] in known)
+            if local:
+                cfg.update(local)
+                cfg.save()
+                status.update(dict.fromkeys(local, 0))
+        def modify(key, value):
+            if key in status:
+                return status[key]
+            return self.zModifySettings(settingsFile, key, value)
+        sTuple = [] # status tuple
+        for item in items:
+            if isinstance(item, list):
+                sTuple.append(tuple(modify(key, value) for key, value in item))
+            else:
+                sTuple.append(modify(*item))
+        return tuple(sTuple)
+
     def zNewLens(self):
         """Erases the current lens
 
@@ -4269,6 +4623,10 @@ class PyZDDE(object):
         -----
         Only ``dtype`` values 0 & 1 (for flux & flux/area) are supported
         for faceted detectors.
+
+        See Also
+        --------
+        zGetDetectorArray() : data of all the pixels of a detector at once
         """
         cmd = ("NSCDetectorData,{:d},{:d},{:d},{:d}"
                .format(surfNum, detectNum, pixel, dtype))
@@ -4390,31 +4748,82 @@ class PyZDDE(object):
 
         See Also
         -------- 
-        zNSCDetectorClear()
-        """
-        requiredArgs = ("{:d},{:d},{:d},{:d},{:d},{:d},{:d},{:d}"
-        .format(surfNum,srcNum, split, scatter, usePolar, ignoreErrors,
-                randomSeed, save))
-        if save:
-            isAbsPath = _os.path.isabs(saveFilename)
-            isRightExt = _os.path.splitext(saveFilename)[1] in ('.ZRD',)
-            if isRightExt and not isAbsPath:
-                if oFilter:
-                    optionalArgs = ",{},{}".format(saveFilename,oFilter)
-                else:
-                    optionalArgs = ",{}".format(saveFilename)
-                cmd = "NSCTrace,"+requiredArgs+optionalArgs
-            else:
-                return -1 # either full path present in saveFileName or extension is not .ZRD
-        else:
-            cmd = "NSCTrace,"+requiredArgs
+        zNSCDetectorClear(), zNSCTraceAsync()
+        """
+        cmd = _nscTraceCommand(surfNum, srcNum, split, scatter, usePolar,
+                               ignoreErrors, randomSeed, save, saveFilename, oFilter)
+        if cmd is None:
+            return -1 # either full path present in saveFileName or extension is not .ZRD
         reply = self._sendDDEcommand(cmd, timeout)
-        if 'OK' in reply.split():
-            return 0
-        elif 'BAD COMMAND' in reply.rstrip():
-            return -1
-        else:
-            return int(float(reply.rstrip()))  # return error code sent by zemax.
+        return _nscTraceStatus(reply)
+
+    def zNSCTraceAsync(self, surfNum, srcNum, split=0, scatter=0, usePolar=0,
+                       ignoreErrors=0, randomSeed=0, save=0, saveFilename=None,
+                       oFilter=None, timeout=3600, detectors=(), pollInterval=5.0):
+        """Starts an NSC trace and returns immediately, without waiting for
+        the end of the trace.
+
+        Parameters
+        ----------
+        surfNum, srcNum, split, scatter, usePolar, ignoreErrors, randomSeed,
+        save, saveFilename, oFilter :
+            see ``zNSCTrace()``
+        timeout : integer, optional
+            timeout of the trace in seconds (default = 3600 seconds)
+        detectors : sequence of integers, optional
+            object numbers of the detectors whose total flux and number of
+            hits are returned by ``NSCTraceFuture.progress()``
+        pollInterval : float, optional
+            minimum time in seconds between two reads of the detectors
+
+        Returns
+        -------
+        trace : NSCTraceFuture object
+            future of the trace, with the methods ``done()``,
+            ``progress()``, ``result()``, ``cancel()`` and ``then()``
+
+        Notes
+        -----
+        1. The trace is requested by a background thread, through a DDE
+           conversation of its own with the Zemax server of the link, such
+           that the link isn't blocked by the trace.
+        2. Zemax serves the DDE requests one at a time: the requests sent
+           through the link during the trace, including the reads of the
+           detectors by ``progress()``, are answered after the trace on
+           most versions of Zemax. The totals of the detectors are
+           therefore normally not available while the trace runs: the
+           first read is sent with a short timeout, and once it has timed
+           out, ``progress()`` doesn't read the detectors anymore and
+           returns only the elapsed time.
+        3. Zemax can't be told to stop a trace through DDE. ``cancel()``
+           only abandons the trace (see ``NSCTraceFuture.cancel()``).
+
+        Examples
+        --------
+        >>> trace = ln.zNSCTraceAsync(1, 0, split=1, detectors=[5])
+        >>> trace.then(lambda link: link.zGetDetectorArray(1, 5))
+        >>> while not trace.done():
+        ...     print(trace.progress())
+        ...     time.sleep(10)
+        >>> status, elapsed, (irradiance,) = trace.result()
+
+        See Also
+        --------
+        zNSCTrace()
+        """
+        cmd = _nscTraceCommand(surfNum, srcNum, split, scatter, usePolar,
+                               ignoreErrors, randomSeed, save, saveFilename, oFilter)
+        if cmd is None:
+            raise ValueError('saveFilename must be a file name with the extension'
+                             ' .ZRD, without path')
+        return NSCTraceFuture(self, cmd, timeout, surfNum, detectors, pollInterval)
+
+    def _newConversation(self):
+        """returns a new DDE conversation with the Zemax server of the link;
+        the conversation must be used only by the thread that created it"""
+        conversation = _dde.CreateConversation(PyZDDE.__server)
+        conversation.ddec = _dde.DDEClient(self._appName, conversation.ddeClientName)
+        return conversation
 
     def zOpenWindow(self, analysisType, zplMacro=False, timeout=None):
         """Open a new analysis window in the main Zemax application screen.
@@ -7166,8 +7575,9 @@ class PyZDDE(object):
         return (x, y, z, intensity)
 
     # POP analysis functions
+    @_cachedAnalysis(lambda a: 'Pop')
     def zGetPOP(self, settingsFile=None, displayData=False, txtFile=None,
-                keepFile=False, timeout=None):
+                keepFile=False, timeout=None, asArray=False):
         """Returns Physical Optics Propagation (POP) data
 
         Parameters
@@ -7197,10 +7607,15 @@ class PyZDDE(object):
             after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the POP text file will be
-            saved in the same directory as the lens (provided the required
-            folder access permissions are available)
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()`` (provided the
+            required folder access permissions are available)
         timeout : integer, optional
             timeout in seconds
+        asArray : bool, optional
+            if ``True``, the 2D display data is returned as a float64
+            ndarray instead of a 2D list. Requires Numpy. Default is
+            ``False``
 
         Returns
         -------
@@ -7246,9 +7661,10 @@ class PyZDDE(object):
                 widthY : float
                     width along Y in lens units
 
-            powerGrid : 2D list/ None
-                a two-dimensional list of the powers in the analysis grid
-                if ``displayData`` is ``true``
+            powerGrid : 2D list/ ndarray/ None
+                a two-dimensional list (or ndarray if ``asArray`` is
+                ``True``) of the powers in the analysis grid if
+                ``displayData`` is ``true``
 
         Notes
         -----
@@ -7261,20 +7677,19 @@ class PyZDDE(object):
         --------
         zSetPOPSettings(), zModifyPOPSettings()
         """
-        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, 'Pop')
+        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, 'Pop', keepFile)
         textFileName, cfgFile, getTextFlag = settings
         ret = self.zGetTextFile(textFileName, 'Pop', cfgFile, getTextFlag,
                                 timeout)
         assert ret == 0
-        # get line list
-        line_list = _readLinesFromFile(_openFile(textFileName))
+        # get the indexed line list
+        line_list = _TextFileIndex.fromFile(textFileName)
 
         # Get data type ... phase or Irradiance?
-        find_irr_data = _getFirstLineOfInterest(line_list, 'POP Irradiance Data',
-                                                patAtStart=False)
+        find_irr_data = line_list.find('POP Irradiance Data', patAtStart=False)
         data_is_irr = False if find_irr_data is None else True
         # Get the Surface number and Grid size
-        grid_line_num = _getFirstLineOfInterest(line_list, 'Grid size')
+        grid_line_num = line_list.find('Grid size')
         surf_line = line_list[grid_line_num - 1]
         surf = int(_re.findall(r'\d{1,4}', surf_line)[0]) # assume: first int num in the line 
                                  # is surf number. surf comment can have int or float nums 
@@ -7282,7 +7697,7 @@ class PyZDDE(object):
         grid_x, grid_y = [int(i) for i in _re.findall(r'\d{2,5}', grid_line)]
 
         # Point spacing
-        pts_line = line_list[_getFirstLineOfInterest(line_list, 'Point spacing')]
+        pts_line = line_list[line_list.find('Point spacing')]
         pat = r'-?\d\.\d{4,6}[Ee][-\+]\d{2,3}'
         pts_x, pts_y =  [float(i) for i in _re.findall(pat, pts_line)]
 
@@ -7293,7 +7708,7 @@ class PyZDDE(object):
             # Peak Irradiance and Total Power
             pat_i = r'-?\d\.\d{4,6}[Ee][-\+]\d{2,3}' # pattern for P. Irr, T. Pow,
             peakIrr, totPow = None, None
-            pi_tp_line = _getFirstLineOfInterest(line_list, 'Peak Irradiance') 
+            pi_tp_line = line_list.find('Peak Irradiance') 
             if pi_tp_line: # Transfer magnitude doesn't have Peak Irradiance info
                 pi_tp_line = line_list[pi_tp_line]
                 pi_info, tp_info = pi_tp_line.split(',')
@@ -7307,8 +7722,8 @@ class PyZDDE(object):
             # Center Phase
             pat_p = r'-?\d+\.\d{4,6}' # pattern for Center Phase Info
             centerPhase = None
-            #cp_line = line_list[_getFirstLineOfInterest(line_list, 'Center Phase')]
-            cp_line = _getFirstLineOfInterest(line_list, 'Center Phase')
+            #cp_line = line_list[line_list.find('Center Phase')]
+            cp_line = line_list.find('Center Phase')
             if cp_line: # Transfer magnitude / Phase doesn't have Center Phase info
                 cp_line = line_list[cp_line]
                 cp = _re.search(pat_p, cp_line)
@@ -7319,7 +7734,7 @@ class PyZDDE(object):
         pat_fe = r'\d\.\d{6}'   # pattern for fiber efficiency
         pat_pi = r'-?\d\.\d{4,6}[Ee][-\+]\d{2,3}' # pattern for Pilot size/waist
         pilotSize, pilotWaist, pos, rayleigh = None, None, None, None
-        pilot_line = line_list[_getFirstLineOfInterest(line_list, 'Pilot')]
+        pilot_line = line_list[line_list.find('Pilot')]
         p_size_info, p_waist_info, p_pos_info, p_rayleigh_info = pilot_line.split(',')
         p_size = _re.search(pat_pi, p_size_info)
         p_waist = _re.search(pat_pi, p_waist_info)
@@ -7336,7 +7751,7 @@ class PyZDDE(object):
 
         # Fiber Efficiency, Coupling [... if enabled in settings]
         fibEffSys, fibEffRec, coupling = None, None, None
-        effi_coup_line_num = _getFirstLineOfInterest(line_list, 'Fiber Efficiency')
+        effi_coup_line_num = line_list.find('Fiber Efficiency')
         if effi_coup_line_num:
             efficiency_coupling_line = line_list[effi_coup_line_num]
             efs_info, fer_info, cou_info = efficiency_coupling_line.split(',')
@@ -7354,11 +7769,12 @@ class PyZDDE(object):
             # Get the 2D data
             pat = (r'(-?\d\.\d{4,6}[Ee][-\+]\d{2,3}\s*)' + r'{{{num}}}'
                    .format(num=grid_x))
-            start_line = _getFirstLineOfInterest(line_list, pat)
-            powerGrid = _get2DList(line_list, start_line, grid_y)
+            start_line = line_list.findData(pat)
+            get2DData = _get2DArray if asArray else _get2DList
+            powerGrid = get2DData(line_list, start_line, grid_y)
 
         if not keepFile:
-            _deleteFile(textFileName)
+            self._scratch.remove(textFileName)
 
         if data_is_irr: # Irradiance data
             popi = _co.namedtuple('POPinfo', ['surf', 'peakIrr', 'totPow',
@@ -7389,7 +7805,7 @@ class PyZDDE(object):
                            sampx=None, sampy=None, srcFile=None, widex=None,
                            widey=None, fibComp=None, fibFile=None, fibType=None,
                            fparamN=((),()), ignPol=None, pos=None, tiltx=None,
-                           tilty=None):
+                           tilty=None, localWrite=False):
         """Modify an existing POP settings (configuration) file
 
         Only those parameters that are non-None or non-zero-length (in
@@ -7472,6 +7888,11 @@ class PyZDDE(object):
             tilt about X in degrees (in Fiber Data Tab)
         tilty : float, optional
             tilt about Y in degrees (in Fiber Data Tab)
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -7487,65 +7908,76 @@ class PyZDDE(object):
 
         See Also
         --------
-        zSetPOPSettings(), zGetPOP()
+        zSetPOPSettings(), zGetPOP(), zCalibrateSettingsKey()
         """
-        sTuple = [] # status tuple
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
-        if startSurf is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_START", startSurf))
-        if endSurf is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_END", endSurf))
-        if field is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_FIELD", field))
-        if wave is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_WAVE", wave))
-        if auto is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_AUTO", auto))
-        if beamType is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_BEAMTYPE", beamType))
-        if paramN[0]:
-            tst = []
-            for i, j in _izip(paramN[0], paramN[1]):
-                tst.append(self.zModifySettings(dst, "POP_PARAM{}".format(i), j))
-            sTuple.append(tuple(tst))
-        if pIrr is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_PEAKIRRAD", pIrr))
-        if tPow is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_POWER", tPow))
-        if sampx is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_SAMPX", sampx))
-        if sampy is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_SAMPY", sampy))
-        if srcFile is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_SOURCEFILE", srcFile))
-        if widex is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_WIDEX", widex))
-        if widey is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_WIDEY", widey))
-        if fibComp is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_COMPUTE", fibComp))
-        if fibFile is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_FIBERFILE", fibFile))
-        if fibType is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_FIBERTYPE", fibType))
-        if fparamN[0]:
-            tst = []
-            for i, j in _izip(fparamN[0], fparamN[1]):
-                tst.append(self.zModifySettings(dst, "POP_FPARAM{}".format(i), j))
-            sTuple.append(tuple(tst))
-        if ignPol is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_IGNOREPOL", ignPol))
-        if pos is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_POSITION", pos))
-        if tiltx is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_TILTX", tiltx))
-        if tilty is not None:
-            sTuple.append(self.zModifySettings(dst, "POP_TILTY", tilty))
-        return tuple(sTuple)
+        # list of (key, value), or list of lists of (key, value) for paramN
+        # and fparamN, in the order of the status tuple
+        items = []
+        for key, value in (("POP_START", startSurf), ("POP_END", endSurf),
+                           ("POP_FIELD", field), ("POP_WAVE", wave),
+                           ("POP_AUTO", auto), ("POP_BEAMTYPE", beamType),
+                           ("POP_PARAM", paramN), ("POP_PEAKIRRAD", pIrr),
+                           ("POP_POWER", tPow), ("POP_SAMPX", sampx),
+                           ("POP_SAMPY", sampy), ("POP_SOURCEFILE", srcFile),
+                           ("POP_WIDEX", widex), ("POP_WIDEY", widey),
+                           ("POP_COMPUTE", fibComp), ("POP_FIBERFILE", fibFile),
+                           ("POP_FIBERTYPE", fibType), ("POP_FPARAM", fparamN),
+                           ("POP_IGNOREPOL", ignPol), ("POP_POSITION", pos),
+                           ("POP_TILTX", tiltx), ("POP_TILTY", tilty)):
+            if key in ("POP_PARAM", "POP_FPARAM"):
+                if value[0]:
+                    items.append([("{}{}".format(key, i), j)
+                                  for i, j in _izip(value[0], value[1])])
+            elif value is not None:
+                items.append((key, value))
+        return self._modifySettingsItems(dst, items, localWrite)
+
+    def zCalibrateSettingsKey(self, settingsFile, key, value):
+        """Find the location of a setting in the settings (.CFG) files of an
+        analysis, such that it can then be changed locally (without DDE
+        calls) using ``zfileutils.CFGFile`` or the ``localWrite`` option of
+        the ``zModify*Settings()`` functions
+
+        A copy of ``settingsFile`` is modified by Zemax using
+        ``zModifySettings()``, and compared with the original file. The
+        location found is added to ``zfileutils.cfgKeys`` for the session.
+
+        Parameters
+        ----------
+        settingsFile : string
+            a settings file of the analysis, with full path
+        key : string
+            the name of the setting (see the ZPL command MODIFYSETTINGS)
+        value : integer, float or string
+            a distinctive value of the setting that is different from the
+            value in ``settingsFile`` (such as 1.2345 for float settings)
+
+        Returns
+        -------
+        offset : integer
+            offset of the setting in the file, in bytes
+        fmt : string
+            format of the setting ('i', 'd' or 'U<n>')
+
+        See Also
+        --------
+        zModifySettings(), zModifyPOPSettings()
+        """
+        tmpFile = self._scratch.newFileName('calibrate.CFG',
+                                            _os.path.dirname(settingsFile))
+        _shutil.copy(settingsFile, tmpFile)
+        try:
+            ret = self.zModifySettings(tmpFile, key, value)
+            if ret != 0:
+                raise ValueError('zModifySettings() returned {}'.format(ret))
+            return _zfu.calibrateCFGKey(key, settingsFile, tmpFile, value)
+        finally:
+            self._scratch.remove(tmpFile)
 
     def zSetPOPSettings(self, data=0, settingsFile=None, startSurf=None,
                         endSurf=None, field=None, wave=None, auto=None,
@@ -7553,7 +7985,7 @@ class PyZDDE(object):
                         sampx=None, sampy=None, srcFile=None, widex=None,
                         widey=None, fibComp=None, fibFile=None, fibType=None,
                         fparamN=((),()), ignPol=None, pos=None, tiltx=None,
-                        tilty=None):
+                        tilty=None, localWrite=False):
         """Create and set a new settings file starting from the "reset"
         settings state of the most basic lens in Zemax.
 
@@ -7645,6 +8077,9 @@ class PyZDDE(object):
             tilt about X in degrees (in Fiber Data Tab)
         tilty : float, optional
             tilt about Y in degrees (in Fiber Data Tab)
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyPOPSettings()``
 
         Returns
         -------
@@ -7679,7 +8114,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_POP.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -7689,12 +8124,14 @@ class PyZDDE(object):
             self.zModifyPOPSettings(dst, startSurf, endSurf, field, wave, auto,
                                     beamType, paramN, pIrr, tPow, sampx, sampy,
                                     srcFile, widex, widey, fibComp, fibFile,
-                                    fibType, fparamN, ignPol, pos, tiltx, tilty)
+                                    fibType, fparamN, ignPol, pos, tiltx, tilty,
+                                    localWrite)
             return dst
 
     # FFT and Huygens PSF, MTF analysis functions
+    @_cachedAnalysis(lambda a: 'Hcs' if a['which'] == 'huygens' else 'Pcs')
     def zGetPSFCrossSec(self, which='fft', settingsFile=None, txtFile=None,
-                        keepFile=False, timeout=120):
+                        keepFile=False, timeout=120, asArray=False):
         """Returns the cross-section data of FFT or Huygens PSF analysis
 
         Parameters
@@ -7726,19 +8163,23 @@ class PyZDDE(object):
             after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the PSF text file will be
-            saved in the same directory as the lens (provided the required
-            folder access permissions are available)
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()`` (provided the
+            required folder access permissions are available)
         timeout : integer, optional
             timeout in seconds. Note that Huygens PSF calculations
             may take few minutes to complete
+        asArray : bool, optional
+            if ``True``, the data are returned as 1-D ndarrays instead of
+            lists. Requires Numpy. Default is ``False``
 
         Returns
         -------
-        indices : list
+        indices : list/ ndarray
             row index of the data
-        position : list
+        position : list/ ndarray
             position in microns
-        value : list
+        value : list/ ndarray
             the value of the FFT/Huygens based PSF
 
         Notes
@@ -7756,29 +8197,33 @@ class PyZDDE(object):
             anaType = 'Hcs'
         else:
             anaType = 'Pcs'
-        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, anaType)
+        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, anaType, keepFile)
         textFileName, cfgFile, getTextFlag = settings
         ret = self.zGetTextFile(textFileName, anaType, cfgFile, getTextFlag,
                                 timeout)
         assert ret == 0
-        line_list = _readLinesFromFile(_openFile(textFileName))
+        line_list = _TextFileIndex.fromFile(textFileName)
         # Get Image grid size
-        img_grid_line = line_list[_getFirstLineOfInterest(line_list,
-                                 'Image grid size')]
+        img_grid_line = line_list[line_list.find('Image grid size')]
         _, img_grid_y = [int(i) for i in _re.findall(r'\d{2,5}', img_grid_line)]
         pat = (r'\d{1,5}\s*(-?\d{1,3}\.\d{4,6}\s*)' + r'{{{num}}}'.format(num=2))
-        start_line = _getFirstLineOfInterest(line_list, pat)
-        data_mat = _get2DList(line_list, start_line, img_grid_y*2 + 1)
-        data_matT = _transpose2Dlist(data_mat)
-        indices = [int(i) for i in data_matT[0]]
+        start_line = line_list.findData(pat)
+        if asArray:
+            data_matT = _get2DArray(line_list, start_line, img_grid_y*2 + 1).T
+            indices = data_matT[0].astype(int)
+        else:
+            data_mat = _get2DList(line_list, start_line, img_grid_y*2 + 1)
+            data_matT = _transpose2Dlist(data_mat)
+            indices = [int(i) for i in data_matT[0]]
         position = data_matT[1]
         value = data_matT[2]
         if not keepFile:
-            _deleteFile(textFileName)
+            self._scratch.remove(textFileName)
         return indices, position, value
 
+    @_cachedAnalysis(lambda a: 'Hps' if a['which'] == 'huygens' else 'Fps')
     def zGetPSF(self, which='fft', settingsFile=None, txtFile=None,
-                keepFile=False, timeout=120):
+                keepFile=False, timeout=120, asArray=False):
         """Returns FFT or Huygens PSF data
 
         Parameters
@@ -7808,12 +8253,16 @@ class PyZDDE(object):
             after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the PSF text file will be
-            saved in the same directory as the lens (provided the required
-            folder access permissions are available)
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()`` (provided the
+            required folder access permissions are available)
         timeout : integer, optional
             timeout in seconds. Note that Huygens PSF/MTF calculations with
             ``pupil_sample`` and/or ``image_sample`` greater than 4
             usually take several minutes to complete
+        asArray : bool, optional
+            if ``True``, the PSF data is returned as a float64 ndarray
+            instead of a 2D list. Requires Numpy. Default is ``False``
 
         Returns
         -------
@@ -7821,8 +8270,9 @@ class PyZDDE(object):
             meta data about the PSF analysis data, such as data spacing
             (microns), data area (microns wide), pupil and image grid
             sizes, center point, and center/reference coordinate information
-        psfGridData : 2D list
-            the two-dimensional list of the PSF data
+        psfGridData : 2D list/ ndarray
+            the two-dimensional list (or ndarray if ``asArray`` is ``True``)
+            of the PSF data
 
         See Also
         --------
@@ -7833,35 +8283,36 @@ class PyZDDE(object):
             anaType = 'Hps'
         else:
             anaType = 'Fps'
-        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, anaType)
+        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, anaType, keepFile)
         textFileName, cfgFile, getTextFlag = settings
         ret = self.zGetTextFile(textFileName, anaType, cfgFile, getTextFlag,
                                 timeout)
         assert ret == 0
-        line_list = _readLinesFromFile(_openFile(textFileName))
+        line_list = _TextFileIndex.fromFile(textFileName)
 
         # Meta data
-        data_spacing_line = line_list[_getFirstLineOfInterest(line_list, 'Data spacing')]
+        data_spacing_line = line_list[line_list.find('Data spacing')]
         data_spacing = float(_re.search(r'\d{1,3}\.\d{2,6}', data_spacing_line).group())
-        data_area_line = line_list[_getFirstLineOfInterest(line_list, 'Data area')]
+        data_area_line = line_list[line_list.find('Data area')]
         data_area = float(_re.search(r'\d{1,5}\.\d{2,6}', data_area_line).group())
         if which=='huygens':
-            ctr_ref_line = line_list[_getFirstLineOfInterest(line_list, 'Center coordinates')]
+            ctr_ref_line = line_list[line_list.find('Center coordinates')]
         else:
-            ctr_ref_line = line_list[_getFirstLineOfInterest(line_list, 'Reference Coordinates')]
+            ctr_ref_line = line_list[line_list.find('Reference Coordinates')]
         ctr_ref_x, ctr_ref_y = [float(i) for i in _re.findall('-?\d\.\d{4,10}[Ee][-\+]\d{2,3}', ctr_ref_line)]
-        img_grid_line = line_list[_getFirstLineOfInterest(line_list, 'Image grid size')]
+        img_grid_line = line_list[line_list.find('Image grid size')]
         img_grid_x, img_grid_y = [int(i) for i in _re.findall(r'\d{2,5}', img_grid_line)]
-        pupil_grid_line = line_list[_getFirstLineOfInterest(line_list, 'Pupil grid size')]
+        pupil_grid_line = line_list[line_list.find('Pupil grid size')]
         pupil_grid_x, pupil_grid_y = [int(i) for i in _re.findall(r'\d{2,5}', pupil_grid_line)]
-        center_point_line = line_list[_getFirstLineOfInterest(line_list, 'Center point')]
+        center_point_line = line_list[line_list.find('Center point')]
         center_point_x, center_point_y = [int(i) for i in _re.findall(r'\d{2,5}', center_point_line)]
 
         # The 2D data
         pat = (r'(-?\d\.\d{4,6}[Ee][-\+]\d{2,3}\s*)' + r'{{{num}}}'
                .format(num=img_grid_x))
-        start_line = _getFirstLineOfInterest(line_list, pat)
-        psfGridData = _get2DList(line_list, start_line, img_grid_y)
+        start_line = line_list.findData(pat)
+        get2DData = _get2DArray if asArray else _get2DList
+        psfGridData = get2DData(line_list, start_line, img_grid_y)
 
         if which=='huygens':
                 psfi = _co.namedtuple('PSFinfo', ['dataSpacing', 'dataArea', 'pupilGridX',
@@ -7879,12 +8330,13 @@ class PyZDDE(object):
                                ctr_ref_x, ctr_ref_y)
 
         if not keepFile:
-            _deleteFile(textFileName)
+            self._scratch.remove(textFileName)
         return (psfInfo, psfGridData)
 
     def zModifyFFTPSFCrossSecSettings(self, settingsFile, dtype=None, row=None,
                                       sample=None, wave=None, field=None,
-                                      pol=None, norm=None, scale=None):
+                                      pol=None, norm=None, scale=None,
+                                      localWrite=False):
         """Modify an existing FFT PSF Cross section analysis settings
         (configuration) file
 
@@ -7913,6 +8365,11 @@ class PyZDDE(object):
             normalization. 0 for unnormalized, 1 for unity normalization
         scale : float, optional
             the plot scale
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -7932,33 +8389,33 @@ class PyZDDE(object):
             to create and set FFT PSF Crosssection settings
         zGetPSFCrossSec(),
         """
-        sTuple = [] # status tuple
+        items = [] # (key, value) of the settings to modify
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
         if dtype is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_TYPE", dtype))
+            items.append(("PSF_TYPE", dtype))
         if row is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_ROW", row))
+            items.append(("PSF_ROW", row))
         if sample is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_SAMP", sample))
+            items.append(("PSF_SAMP", sample))
         if wave is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_WAVE", wave))
+            items.append(("PSF_WAVE", wave))
         if field is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_FIELD", field))
+            items.append(("PSF_FIELD", field))
         if pol is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_POLARIZATION", pol))
+            items.append(("PSF_POLARIZATION", pol))
         if norm is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_NORMALIZE", norm))
+            items.append(("PSF_NORMALIZE", norm))
         if scale is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_PLOTSCALE", scale))
-        return tuple(sTuple)
+            items.append(("PSF_PLOTSCALE", scale))
+        return self._modifySettingsItems(dst, items, localWrite)
 
     def zSetFFTPSFCrossSecSettings(self, settingsFile=None, dtype=None, row=None,
                                    sample=None, wave=None, field=None, pol=None,
-                                   norm=None, scale=None):
+                                   norm=None, scale=None, localWrite=False):
         """create and set a new FFT PSF Crosssection settings file starting
         from the "reset" settings state of the most basic lens in Zemax
 
@@ -7996,6 +8453,9 @@ class PyZDDE(object):
             normalization. 0 for unnormalized, 1 for unity normalization
         scale : float, optional
             the plot scale
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyFFTPSFCrossSecSettings()``
 
         Returns
         -------
@@ -8026,7 +8486,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_FFTPSFCS.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -8034,12 +8494,12 @@ class PyZDDE(object):
             return
         else:
             self.zModifyFFTPSFCrossSecSettings(dst, dtype, row, sample, wave,
-                                               field, pol, norm, scale)
+                                               field, pol, norm, scale, localWrite)
             return dst
 
     def zModifyFFTPSFSettings(self, settingsFile, dtype=None, sample=None,
                               wave=None, field=None, surf=None, pol=None,
-                              norm=None, imgDelta=None):
+                              norm=None, imgDelta=None, localWrite=False):
         """Modify an existing FFT PSF analysis settings (configuration)
         file
 
@@ -8067,6 +8527,11 @@ class PyZDDE(object):
             normalization. 0 for unnormalized, 1 for unity normalization
         imgDelta : float, optional
             the image point spacing in micrometers
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -8088,33 +8553,33 @@ class PyZDDE(object):
         --------
         zSetFFTPSFSettings(), zGetPSF()
         """
-        sTuple = [] # status tuple
+        items = [] # (key, value) of the settings to modify
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
         if dtype is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_TYPE", dtype))
+            items.append(("PSF_TYPE", dtype))
         if sample is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_SAMP", sample))
+            items.append(("PSF_SAMP", sample))
         if wave is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_WAVE", wave))
+            items.append(("PSF_WAVE", wave))
         if field is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_FIELD", field))
+            items.append(("PSF_FIELD", field))
         if surf is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_SURFACE", surf))
+            items.append(("PSF_SURFACE", surf))
         if pol is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_POLARIZATION", pol))
+            items.append(("PSF_POLARIZATION", pol))
         if norm is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_NORMALIZE", norm))
+            items.append(("PSF_NORMALIZE", norm))
         if imgDelta is not None:
-            sTuple.append(self.zModifySettings(dst, "PSF_IMAGEDELTA", imgDelta))
-        return tuple(sTuple)
+            items.append(("PSF_IMAGEDELTA", imgDelta))
+        return self._modifySettingsItems(dst, items, localWrite)
 
     def zSetFFTPSFSettings(self, settingsFile=None, dtype=None, sample=None,
                            wave=None, field=None, surf=None, pol=None,
-                           norm=None, imgDelta=None):
+                           norm=None, imgDelta=None, localWrite=False):
         """create and set a new FFT PSF analysis settings file starting
         from the "reset" settings state of the most basic lens in Zemax
 
@@ -8149,6 +8614,9 @@ class PyZDDE(object):
             normalization. 0 for unnormalized, 1 for unity normalization
         imgDelta : float, optional
             the image point spacing in micrometers
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyFFTPSFSettings()``
 
         Returns
         -------
@@ -8180,7 +8648,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_FFTPSF.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -8188,12 +8656,13 @@ class PyZDDE(object):
             return
         else:
             self.zModifyFFTPSFSettings(dst, dtype, sample, wave, field, surf, pol,
-                                       norm, imgDelta)
+                                       norm, imgDelta, localWrite)
             return dst
 
     def zModifyHuygensPSFCrossSecSettings(self, settingsFile, pupilSample=None,
                                           imgSample=None, wave=None, field=None,
-                                          imgDelta=None, dtype=None):
+                                          imgDelta=None, dtype=None,
+                                          localWrite=False):
         """Modify an existing Huygens PSF Cross section analysis settings
         (configuration) file
 
@@ -8219,6 +8688,11 @@ class PyZDDE(object):
             0 = x-linear, 1 = y-log, 2 = y-linear, 3 = y-log, 4 = x-real,
             5 = y-real, 6 = x-imaginary, 7 = y-imaginary, 8 = x-phase,
             9 = y-phase.
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -8238,29 +8712,29 @@ class PyZDDE(object):
             to create and set Huygens PSF Crosssection settings
         zGetPSFCrossSec(),
         """
-        sTuple = [] # status tuple
+        items = [] # (key, value) of the settings to modify
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
         if pupilSample is not None:
-            sTuple.append(self.zModifySettings(dst, "HPC_PUPILSAMP", pupilSample))
+            items.append(("HPC_PUPILSAMP", pupilSample))
         if imgSample is not None:
-            sTuple.append(self.zModifySettings(dst, "HPC_IMAGESAMP", imgSample))
+            items.append(("HPC_IMAGESAMP", imgSample))
         if wave is not None:
-            sTuple.append(self.zModifySettings(dst, "HPC_WAVE", wave))
+            items.append(("HPC_WAVE", wave))
         if field is not None:
-            sTuple.append(self.zModifySettings(dst, "HPC_FIELD", field))
+            items.append(("HPC_FIELD", field))
         if imgDelta is not None:
-            sTuple.append(self.zModifySettings(dst, "HPC_IMAGEDELTA", imgDelta))
+            items.append(("HPC_IMAGEDELTA", imgDelta))
         if dtype is not None:
-            sTuple.append(self.zModifySettings(dst, "HPC_TYPE", dtype))
-        return tuple(sTuple)
+            items.append(("HPC_TYPE", dtype))
+        return self._modifySettingsItems(dst, items, localWrite)
 
     def zSetHuygensPSFCrossSecSettings(self, settingsFile=None, pupilSample=None,
                                        imgSample=None, wave=None, field=None,
-                                       imgDelta=None, dtype=None):
+                                       imgDelta=None, dtype=None, localWrite=False):
         """create and set a new Huygens PSF Crosssection settings file
         starting from the "reset" settings state of the most basic lens in
         Zemax.
@@ -8296,6 +8770,9 @@ class PyZDDE(object):
             0 = x-linear, 1 = y-log, 2 = y-linear, 3 = y-log, 4 = x-real,
             5 = y-real, 6 = x-imaginary, 7 = y-imaginary, 8 = x-phase,
             9 = y-phase.
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyHuygensPSFCrossSecSettings()``
 
         Returns
         -------
@@ -8326,7 +8803,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_HUYGENSPSFCS.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -8334,12 +8811,13 @@ class PyZDDE(object):
             return
         else:
             self.zModifyHuygensPSFCrossSecSettings(dst, pupilSample, imgSample,
-                                                   wave, field, imgDelta, dtype)
+                                                   wave, field, imgDelta, dtype,
+                                                   localWrite)
             return dst
 
     def zModifyHuygensPSFSettings(self, settingsFile, pupilSample=None,
                                   imgSample=None, wave=None, field=None,
-                                  imgDelta=None, dtype=None):
+                                  imgDelta=None, dtype=None, localWrite=False):
         """Modify an existing Huygens PSF analysis settings (configuration)
         file
 
@@ -8366,6 +8844,11 @@ class PyZDDE(object):
         dtype : integer (0-8), optional
             0 = linear, 1 = log -1, 2 = log -2, 3 = log -3, 4 = log -4,
             5 = log -5, 6 = real, 7 = imaginary, 8 = phase.
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -8383,29 +8866,29 @@ class PyZDDE(object):
         --------
         zSetHuygensPSFSettings(), zGetPSF()
         """
-        sTuple = [] # status tuple
+        items = [] # (key, value) of the settings to modify
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
         if pupilSample is not None:
-            sTuple.append(self.zModifySettings(dst, "HPS_PUPILSAMP", pupilSample))
+            items.append(("HPS_PUPILSAMP", pupilSample))
         if imgSample is not None:
-            sTuple.append(self.zModifySettings(dst, "HPS_IMAGESAMP", imgSample))
+            items.append(("HPS_IMAGESAMP", imgSample))
         if wave is not None:
-            sTuple.append(self.zModifySettings(dst, "HPS_WAVE", wave))
+            items.append(("HPS_WAVE", wave))
         if field is not None:
-            sTuple.append(self.zModifySettings(dst, "HPS_FIELD", field))
+            items.append(("HPS_FIELD", field))
         if imgDelta is not None:
-            sTuple.append(self.zModifySettings(dst, "HPS_IMAGEDELTA", imgDelta))
+            items.append(("HPS_IMAGEDELTA", imgDelta))
         if dtype is not None:
-            sTuple.append(self.zModifySettings(dst, "HPS_TYPE", dtype))
-        return tuple(sTuple)
+            items.append(("HPS_TYPE", dtype))
+        return self._modifySettingsItems(dst, items, localWrite)
 
     def zSetHuygensPSFSettings(self, settingsFile=None, pupilSample=None,
                                imgSample=None, wave=None, field=None,
-                               imgDelta=None, dtype=None):
+                               imgDelta=None, dtype=None, localWrite=False):
         """create and set a new Huygens PSF analysis settings file starting
         from the "reset" settings state of the most basic lens in Zemax
 
@@ -8439,6 +8922,9 @@ class PyZDDE(object):
         dtype : integer (0-8), optional
             0 = linear, 1 = log -1, 2 = log -2, 3 = log -3, 4 = log -4,
             5 = log -5, 6 = real, 7 = imaginary, 8 = phase.
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyHuygensPSFSettings()``
 
         Returns
         -------
@@ -8469,7 +8955,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_HUYGENSPSF.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -8477,11 +8963,12 @@ class PyZDDE(object):
             return
         else:
             self.zModifyHuygensPSFSettings(dst, pupilSample, imgSample, wave,
-                                           field, imgDelta, dtype)
+                                           field, imgDelta, dtype, localWrite)
             return dst
 
+    @_cachedAnalysis(lambda a: 'Hmf' if a['which'] == 'huygens' else 'Mtf')
     def zGetMTF(self, which='fft', settingsFile=None, txtFile=None,
-                keepFile=False, timeout=120):
+                keepFile=False, timeout=120, asArray=False):
         """Returns FFT or Huygens MTF data
 
         Parameters
@@ -8511,12 +8998,17 @@ class PyZDDE(object):
             after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the MTF text file will be
-            saved in the same directory as the lens (provided the required
-            folder access permissions are available)
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()`` (provided the
+            required folder access permissions are available)
         timeout : integer, optional
             timeout in seconds. Note that Huygens PSF/MTF calculations with
             ``pupil_sample`` and/or ``image_sample`` greater than 4
             usuallly take several minutes to complete
+        asArray : bool, optional
+            if ``True``, the Spatial frequency, Tangential, and Sagittal
+            MTF values are returned as 1-D ndarrays instead of lists.
+            Requires Numpy. Default is ``False``
 
         Returns
         -------
@@ -8552,14 +9044,14 @@ class PyZDDE(object):
             anaType = 'Hmf'
         else:
             anaType = 'Mtf'
-        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, anaType)
+        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, anaType, keepFile)
         textFileName, cfgFile, getTextFlag = settings
         ret = self.zGetTextFile(textFileName, anaType, cfgFile, getTextFlag,
                                 timeout)
         assert ret == 0
-        line_list = _readLinesFromFile(_openFile(textFileName))
+        line_list = _TextFileIndex.fromFile(textFileName)
         pat = r'Field:\s-?\d{1,3}\.\d{1,5},?\s?'
-        fields = _getRePatPosInLineList(line_list, pat)
+        fields = line_list.findAll(pat)
         if len(fields) > 1:
             data_start_pos = [p + 2 for p in fields]
             data_len = [fields[1] - fields[0] - 3]*len(fields)
@@ -8569,19 +9061,23 @@ class PyZDDE(object):
         mtfs = []
         mtf = _co.namedtuple('MTF', ['SpatialFreq', 'Tangential', 'Sagittal'])
         for start, length in zip(data_start_pos, data_len):
-            data_mat = _get2DList(line_list, start, length)
-            data_matT = _transpose2Dlist(data_mat)
+            if asArray:
+                data_matT = _get2DArray(line_list, start, length).T
+            else:
+                data_mat = _get2DList(line_list, start, length)
+                data_matT = _transpose2Dlist(data_mat)
             spat_freq = data_matT[0]
             mtf_tang = data_matT[1]
             mtf_sagi = data_matT[2]
             mtfs.append(mtf(spat_freq, mtf_tang, mtf_sagi))
         if not keepFile:
-            _deleteFile(textFileName)
+            self._scratch.remove(textFileName)
         return tuple(mtfs)
 
     def zModifyFFTMTFSettings(self, settingsFile, sample=None, wave=None,
                               field=None, dtype=None, surf=None, maxFreq=None,
-                              showDiff=None, pol=None, useDash=None):
+                              showDiff=None, pol=None, useDash=None,
+                              localWrite=False):
         """Modify an existing FFT MTF analysis settings (configuration)
         file
 
@@ -8610,6 +9106,11 @@ class PyZDDE(object):
             the polarization. 0 for unpolarized, 1 for polarized.
         useDash : integer (0/1)
             use dashes, 0 for no, 1 for yes
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -8629,35 +9130,35 @@ class PyZDDE(object):
             to create and set FFT MTF settings/configuration file
         zGetMTF(),
         """
-        sTuple = [] # status tuple
+        items = [] # (key, value) of the settings to modify
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
         if sample is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_SAMP", sample))
+            items.append(("MTF_SAMP", sample))
         if wave is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_WAVE", wave))
+            items.append(("MTF_WAVE", wave))
         if field is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_FIELD", field))
+            items.append(("MTF_FIELD", field))
         if dtype is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_TYPE", dtype))
+            items.append(("MTF_TYPE", dtype))
         if surf is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_SURF", surf))
+            items.append(("MTF_SURF", surf))
         if maxFreq is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_MAXF", maxFreq))
+            items.append(("MTF_MAXF", maxFreq))
         if showDiff is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_SDLI", showDiff))
+            items.append(("MTF_SDLI", showDiff))
         if pol is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_POLAR", pol))
+            items.append(("MTF_POLAR", pol))
         if useDash is not None:
-            sTuple.append(self.zModifySettings(dst, "MTF_DASH", useDash))
-        return tuple(sTuple)
+            items.append(("MTF_DASH", useDash))
+        return self._modifySettingsItems(dst, items, localWrite)
 
     def zSetFFTMTFSettings(self, settingsFile=None, sample=None, wave=None,
                            field=None, dtype=None, surf=None, maxFreq=None,
-                           showDiff=None, pol=None, useDash=None):
+                           showDiff=None, pol=None, useDash=None, localWrite=False):
         """create and set a new FFT MTF analysis settings file starting
         from the "reset" settings state of the most basic lens in Zemax
 
@@ -8695,6 +9196,9 @@ class PyZDDE(object):
             the polarization. 0 for unpolarized, 1 for polarized.
         useDash : integer (0/1)
             use dashes, 0 for no, 1 for yes
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyFFTMTFSettings()``
 
         Returns
         -------
@@ -8723,7 +9227,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_FFTMTF.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -8731,13 +9235,13 @@ class PyZDDE(object):
             return
         else:
             self.zModifyFFTMTFSettings(dst, sample, wave, field, dtype, surf,
-                                       maxFreq, showDiff, pol, useDash)
+                                       maxFreq, showDiff, pol, useDash, localWrite)
             return dst
 
     def zModifyHuygensMTFSettings(self, settingsFile, pupilSample=None,
                                   imgSample=None, imgDelta=None, config=None,
                                   wave=None, field=None, dtype=None, maxFreq=None,
-                                  pol=None, useDash=None):
+                                  pol=None, useDash=None, localWrite=False):
         """Modify an existing Huygens MTF analysis settings (configuration)
         file
 
@@ -8771,6 +9275,11 @@ class PyZDDE(object):
             polarization. 0 for no, 1 for yes
         useDash : integer, optional
             use dashes. 0 for no, 1 for yes
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -8788,38 +9297,38 @@ class PyZDDE(object):
         --------
         zSetHuygensMTFSettings(), zGetMTF()
         """
-        sTuple = [] # status tuple
+        items = [] # (key, value) of the settings to modify
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
         if pupilSample is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_PUPILSAMP", pupilSample))
+            items.append(("HMF_PUPILSAMP", pupilSample))
         if imgSample is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_IMAGESAMP", imgSample))
+            items.append(("HMF_IMAGESAMP", imgSample))
         if imgDelta is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_IMAGEDELTA", imgDelta))
+            items.append(("HMF_IMAGEDELTA", imgDelta))
         if config is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_CONFIG", config))
+            items.append(("HMF_CONFIG", config))
         if wave is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_WAVE", wave))
+            items.append(("HMF_WAVE", wave))
         if field is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_FIELD", field))
+            items.append(("HMF_FIELD", field))
         if dtype is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_TYPE", dtype))
+            items.append(("HMF_TYPE", dtype))
         if maxFreq is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_MAXF", maxFreq))
+            items.append(("HMF_MAXF", maxFreq))
         if pol is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_POLAR", pol))
+            items.append(("HMF_POLAR", pol))
         if useDash is not None:
-            sTuple.append(self.zModifySettings(dst, "HMF_DASH", useDash))
-        return tuple(sTuple)
+            items.append(("HMF_DASH", useDash))
+        return self._modifySettingsItems(dst, items, localWrite)
 
     def zSetHuygensMTFSettings(self, settingsFile=None, pupilSample=None,
                                imgSample=None, imgDelta=None, config=None,
                                wave=None, field=None, dtype=None, maxFreq=None,
-                               pol=None, useDash=None):
+                               pol=None, useDash=None, localWrite=False):
         """create and set a new Huygens MTF analysis settings file starting
         from the "reset" settings state of the most basic lens in Zemax
 
@@ -8860,6 +9369,9 @@ class PyZDDE(object):
             polarization. 0 for no, 1 for yes
         useDash : integer, optional
             use dashes. 0 for no, 1 for yes
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyHuygensMTFSettings()``
 
         Returns
         -------
@@ -8890,7 +9402,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_HUYGENSMTF.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -8899,12 +9411,12 @@ class PyZDDE(object):
         else:
             self.zModifyHuygensMTFSettings(dst, pupilSample, imgSample, imgDelta,
                                            config, wave, field, dtype, maxFreq,
-                                           pol, useDash)
+                                           pol, useDash, localWrite)
             return dst
 
     # Image simulation functions
     def zGetImageSimulation(self, settingsFile=None, txtFile=None, keepFile=False,
-                            timeout=120):
+                            timeout=120, asArray=False, outFile=None):
         """Returns image simulation analysis results
 
         Parameters
@@ -8931,10 +9443,21 @@ class PyZDDE(object):
             deleted after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the text file will be
-            saved in the same directory as the lens (provided the required
-            folder access permissions are available)
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()`` (provided the
+            required folder access permissions are available)
         timeout : integer, optional
             timeout in seconds.
+        asArray : bool, optional
+            if ``True``, the image is returned as a uint8 ndarray of shape
+            (height, width, 3) instead of a 3D list. Requires Numpy.
+            Default is ``False``
+        outFile : string, optional
+            if passed (and ``asArray`` is ``True``), the image array is
+            written into a memory-mapped ``.npy`` file of this name (that
+            can be re-opened with ``np.load(outFile, mmap_mode='r')``),
+            and the returned array is the memory map. Use it for very large
+            simulations.
 
         Returns
         -------
@@ -8943,8 +9466,9 @@ class PyZDDE(object):
             'ypix', 'objHeight', 'fieldPos', 'imgW', and 'imgH'. PSF 
             Grid data doesn't have `imgW` and `imgH` and Source bitmap 
             image data only has `xpix` and `ypix`. 
-        imgData : 3D list
-            the 3D list containing the RGB values of the output image.
+        imgData : 3D list/ ndarray
+            the 3D list (or uint8 ndarray if ``asArray`` is ``True``)
+            containing the RGB values of the output image.
             The first dimension of ``imgData`` represents height (rows),
             the second dimension represents width (cols), and the third
             dimension represents the channel (r, g, b)
@@ -8956,8 +9480,7 @@ class PyZDDE(object):
         imshow function after converting the data into a Numpy (np) array.
 
         >>> cfgfile = ln.zSetImageSimulationSettings(image='RGB_CIRCLES.BMP', height=1)
-        >>> img_info, img_data = ln.zGetImageSimulationData(settingsFile=cfgfile)
-        >>> img = np.array(img_data, dtype='uint8')
+        >>> img_info, img = ln.zGetImageSimulation(settingsFile=cfgfile, asArray=True)
         >>> fig, ax = plt.subplots(1,1, figsize=(10, 8))
         >>> if len(img_info)==6: # image simulation data
         >>>     bottom, top = -img_info.imgH/2, img_info.imgH/2
@@ -8991,17 +9514,17 @@ class PyZDDE(object):
         --------
         zModifyImageSimulationSettings(), zSetImageSimulationSettings()
         """
-        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, 'Sim')
+        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, 'Sim', keepFile)
         textFileName, cfgFile, getTextFlag = settings
 
         ret = self.zGetTextFile(textFileName, 'Sim', cfgFile, getTextFlag,
                                 timeout)
         assert ret == 0, 'zGetTextFile() returned error code {}'.format(ret)
-        line_list = _readLinesFromFile(_openFile(textFileName))
+        line_list = _TextFileIndex.fromFile(textFileName)
 
         # Meta data
         data = None
-        data_line = line_list[_getFirstLineOfInterest(line_list, 'Data')]
+        data_line = line_list[line_list.find('Data')]
         dataType = data_line.split(':')[1].strip()
         if dataType == 'Simulated Image':
             data = 'img'
@@ -9010,19 +9533,19 @@ class PyZDDE(object):
         else: # source bitmap
             data = 'src'
         
-        bm_ht_line = line_list[_getFirstLineOfInterest(line_list, 'Bitmap Height')]
+        bm_ht_line = line_list[line_list.find('Bitmap Height')]
         bm_ht = int(_re.search(r'\b\d{1,5}\b', bm_ht_line).group()) # pixels
-        bm_wd_line = line_list[_getFirstLineOfInterest(line_list, 'Bitmap Width')]
+        bm_wd_line = line_list[line_list.find('Bitmap Width')]
         bm_wd = int(_re.search(r'\b\d{1,5}\b', bm_wd_line).group())   # pixels
         
         if data=='img' or data=='psf':
-            obj_ht_line = line_list[_getFirstLineOfInterest(line_list, 'Object Height')]
+            obj_ht_line = line_list[line_list.find('Object Height')]
             obj_ht = float(_re.search(r'\b-?\d{1,3}\.\d{1,5}\b', obj_ht_line).group())
-            fld_pos_line = line_list[_getFirstLineOfInterest(line_list, 'Field position')]
+            fld_pos_line = line_list[line_list.find('Field position')]
             fld_pos = float(_re.search(r'\b-?\d{1,3}\.\d{1,5}\b', fld_pos_line).group())
         
         if data=='img':
-            img_siz_line = line_list[_getFirstLineOfInterest(line_list, 'Image Size')]
+            img_siz_line = line_list[line_list.find('Image Size')]
             pat = r'\d{1,3}\.\d{4,6}'
             img_wd, img_ht = [float(i) for i in _re.findall(pat, img_siz_line)] # physical units
 
@@ -9038,19 +9561,24 @@ class PyZDDE(object):
             img_info = _co.namedtuple('SrcImgInfo', ['xpix', 'ypix'])
             img_info_data = img_info._make([bm_wd, bm_ht])
         
-        img_data = [[[0 for c in range(3)] for i in range(bm_wd)] for j in range(bm_ht)]
-        r, g, b = 0, 1, 2
         pat = r'xpix\s{1,4}ypix\s{1,4}R\s{1,4}G\s{1,4}B'
-        start = _getFirstLineOfInterest(line_list, pat) + 1
-        for xpix in range(bm_wd):      # along width
-            for ypix in range(bm_ht):  # along height
-                pixel_data = line_list[start + xpix*bm_ht + ypix].split()[2:]
-                pix_r, pix_g, pix_b = pixel_data
-                img_data[ypix][xpix][r] = int(pix_r)
-                img_data[ypix][xpix][g] = int(pix_g)
-                img_data[ypix][xpix][b] = int(pix_b)
+        start = line_list.find(pat) + 1
+        if asArray:
+            img_data = _getRGBArray(line_list, start, bm_wd, bm_ht, outFile)
+        elif _global_np:
+            img_data = _getRGBArray(line_list, start, bm_wd, bm_ht).tolist()
+        else:
+            img_data = [[[0 for c in range(3)] for i in range(bm_wd)] for j in range(bm_ht)]
+            r, g, b = 0, 1, 2
+            for xpix in range(bm_wd):      # along width
+                for ypix in range(bm_ht):  # along height
+                    pixel_data = line_list[start + xpix*bm_ht + ypix].split()[2:]
+                    pix_r, pix_g, pix_b = pixel_data
+                    img_data[ypix][xpix][r] = int(pix_r)
+                    img_data[ypix][xpix][g] = int(pix_g)
+                    img_data[ypix][xpix][b] = int(pix_b)
         if not keepFile:
-            _deleteFile(textFileName)
+            self._scratch.remove(textFileName)
         return img_info_data, img_data
 
     def zModifyImageSimulationSettings(self, settingsFile, image=None, height=None,
@@ -9059,7 +9587,8 @@ class PyZDDE(object):
                                        imgSample=None, psfx=None, psfy=None, aberr=None,
                                        pol=None, fixedAper=None, illum=None, showAs=None,
                                        reference=None, suppress=None, pixelSize=None,
-                                       xpix=None, ypix=None, flipSimImg=None, outFile=None):
+                                       xpix=None, ypix=None, flipSimImg=None, outFile=None,
+                                       localWrite=False):
         """Modify an existing image simulation analysis settings
         (configuration) file
 
@@ -9120,6 +9649,11 @@ class PyZDDE(object):
             Use 0 for none, 1 for top-bottom, etc.
         outFile : string, optional
             The output file name or empty string for no output file.
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -9137,61 +9671,61 @@ class PyZDDE(object):
         --------
         zSetImageSimulationSettings(), zGetImageSimulation()
         """
-        sTuple = [] # status tuple
+        items = [] # (key, value) of the settings to modify
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
         if image is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_INPUTFILE", image))
+            items.append(("ISM_INPUTFILE", image))
         if height is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_FIELDHEIGHT", height))
+            items.append(("ISM_FIELDHEIGHT", height))
         if over is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_OVERSAMPLING", over))
+            items.append(("ISM_OVERSAMPLING", over))
         if guard is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_GUARDBAND", guard))
+            items.append(("ISM_GUARDBAND", guard))
         if flip is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_FLIP", flip))
+            items.append(("ISM_FLIP", flip))
         if rotate is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_ROTATE", rotate))
+            items.append(("ISM_ROTATE", rotate))
         if wave is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_WAVE", wave))
+            items.append(("ISM_WAVE", wave))
         if field is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_FIELD", field))
+            items.append(("ISM_FIELD", field))
         if pupilSample is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_PSAMP", pupilSample))
+            items.append(("ISM_PSAMP", pupilSample))
         if imgSample is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_ISAMP", imgSample))
+            items.append(("ISM_ISAMP", imgSample))
         if psfx is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_PSFX", psfx))
+            items.append(("ISM_PSFX", psfx))
         if psfy is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_PSFY", psfy))
+            items.append(("ISM_PSFY", psfy))
         if aberr is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_ABERRATIONS", aberr))
+            items.append(("ISM_ABERRATIONS", aberr))
         if pol is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_POLARIZATION", pol))
+            items.append(("ISM_POLARIZATION", pol))
         if fixedAper is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_FIXEDAPERTURES", fixedAper))
+            items.append(("ISM_FIXEDAPERTURES", fixedAper))
         if illum is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_USERI", illum))
+            items.append(("ISM_USERI", illum))
         if showAs is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_SHOWAS", showAs))
+            items.append(("ISM_SHOWAS", showAs))
         if reference is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_REFERENCE", reference))
+            items.append(("ISM_REFERENCE", reference))
         if suppress is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_SUPPRESS", suppress))
+            items.append(("ISM_SUPPRESS", suppress))
         if pixelSize is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_PIXELSIZE", pixelSize))
+            items.append(("ISM_PIXELSIZE", pixelSize))
         if xpix is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_XSIZE", xpix))
+            items.append(("ISM_XSIZE", xpix))
         if ypix is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_YSIZE", ypix))
+            items.append(("ISM_YSIZE", ypix))
         if flipSimImg is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_FLIPIMAGE", flipSimImg))
+            items.append(("ISM_FLIPIMAGE", flipSimImg))
         if outFile is not None:
-            sTuple.append(self.zModifySettings(dst, "ISM_OUTPUTFILE", outFile))
-        return tuple(sTuple)
+            items.append(("ISM_OUTPUTFILE", outFile))
+        return self._modifySettingsItems(dst, items, localWrite)
 
     def zSetImageSimulationSettings(self, settingsFile=None, image=None, height=None,
                                     over=None, guard=None, flip=None, rotate=None,
@@ -9199,7 +9733,8 @@ class PyZDDE(object):
                                     imgSample=None, psfx=None, psfy=None, aberr=None,
                                     pol=None, fixedAper=None, illum=None, showAs=None,
                                     reference=None, suppress=None, pixelSize=None,
-                                    xpix=None, ypix=None, flipSimImg=None, outFile=None):
+                                    xpix=None, ypix=None, flipSimImg=None, outFile=None,
+                                    localWrite=False):
         """create and set a new image simulation analysis settings file
         starting from the "reset" settings state of the most basic lens in
         Zemax
@@ -9270,6 +9805,9 @@ class PyZDDE(object):
             Use 0 for none, 1 for top-bottom, etc.
         outFile : string, optional
             The output file name or empty string for no output file.
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyImageSimulationSettings()``
 
         Returns
         -------
@@ -9300,7 +9838,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_IMGSIM.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -9312,12 +9850,13 @@ class PyZDDE(object):
                                                 imgSample, psfx, psfy, aberr, pol,
                                                 fixedAper, illum, showAs, reference,
                                                 suppress, pixelSize, xpix, ypix,
-                                                flipSimImg, outFile)
+                                                flipSimImg, outFile, localWrite)
             return dst
 
     # NSC detector viewer data
+    @_cachedAnalysis(lambda a: 'Dvw')
     def zGetDetectorViewer(self, settingsFile=None, displayData=False, txtFile=None,
-                           keepFile=False, timeout=60):
+                           keepFile=False, timeout=60, asArray=False):
         """Returns NSC detector viewer data. 
 
         Please execute `zNSCTrace()` before calling this function.   
@@ -9348,10 +9887,14 @@ class PyZDDE(object):
             deleted after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the detector viewer text file 
-            will be saved in the same directory as the lens (provided the 
-            required folder access permissions are available)
+            will be saved, under its default name, in the same directory as
+            the lens or in the directory set using ``zSetScratchDir()``
+            (provided the required folder access permissions are available)
         timeout : integer, optional
             timeout in seconds.   
+        asArray : bool, optional
+            if ``True``, the display data is returned as float64 ndarrays
+            instead of lists. Requires Numpy. Default is ``False``
 
         Return 
         ------
@@ -9415,17 +9958,18 @@ class PyZDDE(object):
         --------
         zSetDetectorViewerSettings(), zModifyDetectorViewerSettings()
         """
-        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, 'Dvw')
+        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, 'Dvw', keepFile)
         textFileName, cfgFile, getTextFlag = settings
         ret = self.zGetTextFile(textFileName, 'Dvr', cfgFile, getTextFlag,
                                 timeout)
         assert ret == 0, 'zGetTextFile returned {}'.format(ret)
 
         pyz = _sys.modules[__name__]
-        ret = _zfu.readDetectorViewerTextFile(pyz, textFileName, displayData)
+        ret = _zfu.readDetectorViewerTextFile(pyz, textFileName, displayData,
+                                              asArray)
 
         if not keepFile:
-            _deleteFile(textFileName)
+            self._scratch.remove(textFileName)
 
         return ret
         
@@ -9435,7 +9979,7 @@ class PyZDDE(object):
                                       zPlaneNum=None, scale=None, smooth=None, 
                                       dType=None, zrd=None, dfilter=None, 
                                       maxPltScale=None, minPltScale=None, 
-                                      outFileName=None):
+                                      outFileName=None, localWrite=False):
         """Modify an existing detector viewer settings (configuration) file 
 
         Only those parameters that are non-None or non-zero-length (in
@@ -9475,6 +10019,11 @@ class PyZDDE(object):
             the minimim plot scale 
         outFileName : string, optional
             the output file name 
+        localWrite : bool, optional
+            if ``True``, the settings whose location in the file is known
+            (see ``zfileutils.cfgKeys``) are written directly to the file,
+            in a single write and without DDE calls; the other settings
+            are set using ``zModifySettings()``. Default is ``False``.
 
         Returns
         -------
@@ -9492,46 +10041,46 @@ class PyZDDE(object):
         --------
         zSetDetectorViewerSettings(), zGetDetectorViewer()
         """
-        sTuple = [] # status tuple
+        items = [] # (key, value) of the settings to modify
         if (_os.path.isfile(settingsFile) and
             settingsFile.lower().endswith('.cfg')):
             dst = settingsFile
         else:
             return -1
         if surfNum is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_SURFACE", surfNum))
+            items.append(("DVW_SURFACE", surfNum))
         if detectNum is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_DETECTOR", detectNum))
+            items.append(("DVW_DETECTOR", detectNum))
         if showAs is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_SHOW", showAs))
+            items.append(("DVW_SHOW", showAs))
         if rowcolNum is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_ROWCOL", rowcolNum))
+            items.append(("DVW_ROWCOL", rowcolNum))
         if zPlaneNum is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_ZPLANE", zPlaneNum))
+            items.append(("DVW_ZPLANE", zPlaneNum))
         if scale is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_SCALE", scale))
+            items.append(("DVW_SCALE", scale))
         if smooth is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_SMOOTHING", smooth))
+            items.append(("DVW_SMOOTHING", smooth))
         if dType is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_DATA", dType))
+            items.append(("DVW_DATA", dType))
         if zrd is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_ZRD", zrd))
+            items.append(("DVW_ZRD", zrd))
         if dfilter is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_FILTER", dfilter))
+            items.append(("DVW_FILTER", dfilter))
         if maxPltScale is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_MAXPLOT", maxPltScale))
+            items.append(("DVW_MAXPLOT", maxPltScale))
         if minPltScale is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_MINPLOT", minPltScale))
+            items.append(("DVW_MINPLOT", minPltScale))
         if outFileName is not None:
-            sTuple.append(self.zModifySettings(dst, "DVW_OUTPUTFILE", outFileName))
-        return tuple(sTuple)
+            items.append(("DVW_OUTPUTFILE", outFileName))
+        return self._modifySettingsItems(dst, items, localWrite)
 
     def zSetDetectorViewerSettings(self, settingsFile=None, surfNum=None, 
                                    detectNum=None, showAs=None, rowcolNum=None, 
                                    zPlaneNum=None, scale=None, smooth=None, 
                                    dType=None, zrd=None, dfilter=None, 
                                    maxPltScale=None, minPltScale=None, 
-                                   outFileName=None):
+                                   outFileName=None, localWrite=False):
         """Create and set a new detector viewer settings file starting
         from the "reset" settings state of the most basic lens in Zemax 
 
@@ -9576,6 +10125,9 @@ class PyZDDE(object):
             the minimim plot scale 
         outFileName : string, optional
             the output file name 
+        localWrite : bool, optional
+            if ``True``, the known settings are written directly to the
+            file. See ``zModifyDetectorViewerSettings()``
 
         Returns
         -------
@@ -9603,7 +10155,7 @@ class PyZDDE(object):
         else:
             filename_partial = _os.path.splitext(self.zGetFile())[0]
             dst =  filename_partial + '_pyzdde_DVW.CFG'
-            self._filesCreated.add(dst)
+            self._scratch.track(dst)
         try:
             _shutil.copy(src, dst)
         except IOError:
@@ -9612,7 +10164,7 @@ class PyZDDE(object):
         else:
             self.zModifyDetectorViewerSettings(dst, surfNum, detectNum, showAs, 
                 rowcolNum, zPlaneNum, scale, smooth, dType, zrd, dfilter, maxPltScale,
-                minPltScale, outFileName)   
+                minPltScale, outFileName, localWrite)   
             return dst        
 
 
@@ -9637,8 +10189,9 @@ class PyZDDE(object):
             after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the Seidel text file will be
-            saved in the same directory as the lens (provided the required
-            folder access permissions are availabl
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()`` (provided the
+            required folder access permissions are availabl
 
         Returns
         -------
@@ -9651,7 +10204,7 @@ class PyZDDE(object):
               Wavefront aberration coefficients and Seidel aberration
               coefficients is returned.
         """
-        settings = _txtAndSettingsToUse(self, txtFile, 'None', 'Sei')
+        settings = _txtAndSettingsToUse(self, txtFile, 'None', 'Sei', keepFile)
         textFileName, _, _ = settings
         ret = self.zGetTextFile(textFileName,'Sei', 'None', 0)
         assert ret == 0
@@ -9692,7 +10245,7 @@ class PyZDDE(object):
         for k, v in zip(swac_keys02, swac_vals02):
             seidelWaveAberrationCoefficients[k] = float(v)
         if not keepFile:
-            _deleteFile(textFileName)
+            self._scratch.remove(textFileName)
         if which == 'wave':
             return seidelWaveAberrationCoefficients
         elif which == 'aber':
@@ -9702,6 +10255,8 @@ class PyZDDE(object):
         else:
             return None
 
+    @_cachedAnalysis(lambda a: {'fringe':'Zfr', 'standard':'Zst',
+                                'annular':'Zat'}.get(a['which']))
     def zGetZernike(self, which='fringe', settingsFile=None, txtFile=None,
                      keepFile=False, timeout=5):
         """returns the Zernike Fringe, Standard, or Annular coefficients
@@ -9740,8 +10295,9 @@ class PyZDDE(object):
             will be deleted after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the analysis text file will be
-            saved in the same directory as the lens (provided the required
-            folder access permissions are available)
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()`` (provided the
+            required folder access permissions are available)
         timeout : integer, optional
             timeout in seconds.
 
@@ -9781,12 +10337,12 @@ class PyZDDE(object):
         anaTypeDict = {'fringe':'Zfr', 'standard':'Zst', 'annular':'Zat'}
         assert which in anaTypeDict
         anaType = anaTypeDict[which]
-        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, anaType)
+        settings = _txtAndSettingsToUse(self, txtFile, settingsFile, anaType, keepFile)
         textFileName, cfgFile, getTextFlag = settings
         ret = self.zGetTextFile(textFileName, anaType, cfgFile, getTextFlag,
                                 timeout)
         assert ret == 0
-        line_list = _readLinesFromFile(_openFile(textFileName))
+        line_list = _TextFileIndex.fromFile(textFileName)
         line_list_len = len(line_list)
 
         # Extract Meta data
@@ -9801,7 +10357,7 @@ class PyZDDE(object):
         meta = []
         for i, pat in enumerate(meta_patterns):
 
-            line_index = _getFirstLineOfInterest(line_list, pat)
+            line_index = line_list.find(pat)
             if line_index is not None:
                 meta_line = line_list[line_index]
                 meta.append(float(_re.search(r'\d{1,3}\.\d{4,8}', meta_line).group()))
@@ -9815,7 +10371,7 @@ class PyZDDE(object):
 
         # Extract coefficients
         start_line_pat = "Z\s+1\s+-?\d{1,3}\.\d{4,8}"
-        start_line = _getFirstLineOfInterest(line_list, start_line_pat)
+        start_line = line_list.find(start_line_pat)
         if start_line is not None:  # Zernikes obtained successfully
             coeff_pat = _re.compile("-?\d{1,3}\.\d{4,8}")
             zCoeffs = [0] * (line_list_len - start_line)
@@ -9839,7 +10395,7 @@ class PyZDDE(object):
         zCoeff = zCoeffId(*zCoeffs)
 
         if not keepFile:
-            _deleteFile(textFileName)
+            self._scratch.remove(textFileName)
         return zInfo, zCoeff
 
     # -------------------
@@ -10306,6 +10862,64 @@ class PyZDDE(object):
         return self.zGetIndex(surfNum)[prime_wave_num-1]
 
 
+    def zGetPrescription(self, txtFile=None, keepFile=False):
+        """Returns the prescription data of the lens parsed into sections
+
+        The prescription ('Pre') text file is retrieved from Zemax and parsed
+        only once for a given state of the lens; subsequent calls return the
+        same object until the lens is modified.
+
+        Parameters
+        ----------
+        txtFile : string, optional
+            if passed, the prescription file will be named such. Pass a
+            specific ``txtFile`` if you want to dump the file into a
+            separate directory. The file is always (re)generated if
+            ``txtFile`` is passed or ``keepFile`` is ``True``.
+        keepFile : bool, optional
+            if ``False`` (default), the prescription file will be deleted
+            after use.
+            If ``True``, the file will persist. If ``keepFile`` is ``True``
+            but a ``txtFile`` is not passed, the prescription file will be
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()``
+
+        Returns
+        -------
+        pre : object
+            ``Prescription`` object (see ``pyzdde.zfileutils.Prescription``)
+            with the lines of the file and the parsed sections such as
+            ``surfaceDataSummary``, ``globalVertex``, ``cardinalPoints``
+            and ``indices``. Don't modify it, as it is shared by the
+            functions that use the prescription data.
+
+        Notes
+        -----
+        The state of the lens is identified in the same way as for the
+        analysis cache (see ``zSetAnalysisCache()``), i.e. the prescription
+        is retrieved again after any command that may modify the lens in
+        the DDE server. It is not cached if the lens is in the pushed
+        state (``apr`` is ``True``).
+
+        See Also
+        --------
+        zGetHiatus(), ipzGetLDE()
+        """
+        fingerprint = self._lensFingerprint()
+        if (fingerprint is not None and not (txtFile or keepFile)
+            and self._prescription[0] == fingerprint):
+            return self._prescription[1]
+        settings = _txtAndSettingsToUse(self, txtFile, 'None', 'Pre', keepFile)
+        textFileName, _, _ = settings
+        ret = self.zGetTextFile(textFileName, 'Pre', "None", 0)
+        assert ret == 0
+        pre = _zfu.Prescription(_readLinesFromFile(_openFile(textFileName)))
+        if not keepFile:
+            self._scratch.remove(textFileName)
+        if fingerprint is not None:
+            self._prescription = (fingerprint, pre)
+        return pre
+
     def zGetHiatus(self, txtFile=None, keepFile=False):
         """Returns the Hiatus, which is the distance between the two
         principal planes of the optical system
@@ -10321,8 +10935,9 @@ class PyZDDE(object):
             after use.
             If ``True``, the file will persist. If ``keepFile`` is ``True``
             but a ``txtFile`` is not passed, the prescription file will be
-            saved in the same directory as the lens (provided the required
-            folder access permissions are available)
+            saved, under its default name, in the same directory as the lens
+            or in the directory set using ``zSetScratchDir()`` (provided the
+            required folder access permissions are available)
 
         Returns
         -------
@@ -10334,9 +10949,6 @@ class PyZDDE(object):
         The hiatus is also known as the Null space or nodal space or the
         interstitium.
         """
-        settings = _txtAndSettingsToUse(self, txtFile, 'None', 'Pre')
-        textFileName, _, _ = settings
-
         sysProp = self.zGetSystem()
         numSurf = sysProp.numSurf
 
@@ -10347,35 +10959,19 @@ class PyZDDE(object):
                             rayAimingType=sysProp.rayAimingType, temp=sysProp.temp,
                             pressure=sysProp.pressure, globalRefSurf=1)
 
-        ret = self.zGetTextFile(textFileName, 'Pre', "None", 0)
-        assert ret == 0
+        pre = self.zGetPrescription(txtFile, keepFile)
+        hiatus = 0.0
         # The number of expected Principal planes in each Pre file is equal to the
         # number of wavelengths in the general settings of the lens design
-        line_list = _readLinesFromFile(_openFile(textFileName))
-
-        principalPlane_objSpace = 0.0
-        principalPlane_imgSpace = 0.0
-        hiatus = 0.0
-        count = 0
-
-        for line_num, line in enumerate(line_list):
-            # Extract the image surface distance from the global ref sur (surface 1)
-            sectionString = ("GLOBAL VERTEX COORDINATES, ORIENTATIONS,"
-                             " AND ROTATION/OFFSET MATRICES:")
-            if line.rstrip() == sectionString:
-                ima_3 = line_list[line_num + numSurf*4 + 6]
-                ima_z = float(ima_3.split()[3])
-
-            # Extract the Principal plane distances.
-            if "Principal Planes" in line and "Anti" not in line:
-                principalPlane_objSpace += float(line.split()[3])
-                principalPlane_imgSpace += float(line.split()[4])
-                count +=1  #Increment (wavelength) counter for averaging
-
+        principalPlanes = pre.cardinalPoints.get('Principal Planes', [])
+        count = len(principalPlanes)
         # Calculate the average (for all wavelengths) of the principal plane distances
         if count > 0:
-            principalPlane_objSpace = principalPlane_objSpace/count
-            principalPlane_imgSpace = principalPlane_imgSpace/count
+            principalPlane_objSpace = sum(pp[0] for pp in principalPlanes)/count
+            principalPlane_imgSpace = sum(pp[1] for pp in principalPlanes)/count
+            # image surface distance from the global ref surface (surface 1)
+            vertex = pre.globalVertex
+            ima_z = vertex[numSurf].z if numSurf in vertex else list(vertex.values())[-1].z
             # Calculate the hiatus (only if count > 0) as
             hiatus = abs(ima_z + principalPlane_imgSpace - principalPlane_objSpace)
 
@@ -10385,8 +10981,6 @@ class PyZDDE(object):
                             rayAimingType=sysProp.rayAimingType, temp=sysProp.temp,
                             pressure=sysProp.pressure,
                             globalRefSurf=sysProp.globalRefSurf)
-        if not keepFile:
-            _deleteFile(textFileName)
         return hiatus
 
     def zGetPupilMagnification(self):
@@ -11248,7 +11842,7 @@ class PyZDDE(object):
             if not self.zExecuteZPLMacro(macroCode):
                 if _checkFileExist(imgPath):
                     _display(_Image(filename=imgPath))
-                    _deleteFile(imgPath)
+                    self._scratch.remove(imgPath)
                 else:
                     print("Timeout reached before image file was ready.")
                     print("The specified graphic window may not be open in ZEMAX!")
@@ -11347,8 +11941,8 @@ class PyZDDE(object):
                 ext = 'EMF'
             else:
                 ext = 'WMF'
-            tmpMetaImgName = "{tip}\\TEMPGPX.{ext}".format(tip=tmpImgPath, ext=ext)
-            tmpPngImgName = "{tip}\\TEMPGPX.png".format(tip=tmpImgPath)
+            tmpMetaImgName = self._scratch.newFileName('TEMPGPX.' + ext, tmpImgPath)
+            tmpPngImgName = _os.path.splitext(tmpMetaImgName)[0] + '.png'
 
             if _global_use_installed_imageMagick:
                 cd = _global_imageMagick_dir
@@ -11383,15 +11977,15 @@ class PyZDDE(object):
                         if retArr:
                             if _global_mpl_img_load:
                                 arr = _matimg.imread(tmpPngImgName, 'PNG')
-                                _deleteFile(tmpMetaImgName)
-                                _deleteFile(tmpPngImgName)
+                                self._scratch.remove(tmpMetaImgName)
+                                self._scratch.remove(tmpPngImgName)
                                 return arr
                             else:
                                 print("Couldn't import Matplotlib")
                         else: # Display the image if not retArr
                             _display(_Image(filename=tmpPngImgName))
-                            _deleteFile(tmpMetaImgName)
-                            _deleteFile(tmpPngImgName)
+                            self._scratch.remove(tmpMetaImgName)
+                            self._scratch.remove(tmpPngImgName)
                     else:
                         print("Timeout reached before PNG file was ready")
                 else:
@@ -11446,14 +12040,14 @@ class PyZDDE(object):
         if _global_IPLoad:
             # Use the lens file path to store and process temporary images
             tmpTxtPath = self.zGetPath()[1]  # lens file path
-            tmpTxtFile = "{ttp}\\TEMPTXT.txt".format(ttp=tmpTxtPath)
+            tmpTxtFile = self._scratch.newFileName('TEMPTXT.txt', tmpTxtPath)
             if not self.zGetTextFile(tmpTxtFile,analysisType,settingsFile,flag):
                 if _checkFileExist(tmpTxtFile):
                     for line in _getDecodedLineFromFile(_openFile(tmpTxtFile)):
                         if linePrintCount >= sln and linePrintCount <= eln:
                             print(line)  # print in the execution cell
                         linePrintCount += 1
-                    _deleteFile(tmpTxtFile)
+                    self._scratch.remove(tmpTxtFile)
                 else:
                     print("Text file of analysis window not created")
             else:
@@ -11651,27 +12245,19 @@ class PyZDDE(object):
         ----
         Only works in sequential/hybrid mode. Can't retrieve NSC objects.
         """
-        cd = _os.path.dirname(_os.path.realpath(__file__))
-        textFileName = cd +"\\"+"prescriptionFile.txt"
-        ret = self.zGetTextFile(textFileName,'Pre', "None", 0)
-        assert ret == 0
-        recSystemData = self.zGetSystem() # Get the current system parameters
-        numSurf = recSystemData[0]
-        numSurf2show = num if num is not None else numSurf 
-        line_list = _readLinesFromFile(_openFile(textFileName))
-        for line_num, line in enumerate(line_list):
-            sectionString = ("SURFACE DATA SUMMARY:") # to use re later
-            if line.rstrip()== sectionString:
-                for i in range(numSurf2show + 4): # 1 object surf + 3 extra lines before actual data
-                    lde_line = line_list[line_num + i].rstrip()
-                    print(lde_line)
-                break
-        else:
-            raise Exception("Could not find string '{}' in Prescription file."
+        pre = self.zGetPrescription()
+        sectionString = "SURFACE DATA SUMMARY"
+        if sectionString not in pre.sections:
+            raise Exception("Could not find string '{}:' in Prescription file."
             " \n\nPlease check if there is a mismatch in text encoding between"
             " Zemax and PyZDDE, ``Surface Data`` is enabled in prescription"
             " file, and the mode is not pure NSC".format(sectionString))
-        _deleteFile(textFileName)
+        # number of surfaces (excluding the object surface)
+        numSurf = len(pre.surfaceDataSummary) - 1
+        numSurf2show = num if num is not None else numSurf
+        start = pre.sections[sectionString][0]
+        for i in range(numSurf2show + 4): # 1 object surf + 3 extra lines before actual data
+            print(pre.lines[start + i].rstrip())
 
 
     def ipzGetFieldData(self):
@@ -11698,6 +12284,221 @@ class PyZDDE(object):
                    .format(each.xf, each.yf, each.wgt, each.vdx, each.vdy, 
                            each.vcx, each.vcy, each.van)))
 
+#%% Non-blocking NSC trace
+
+try:
+    _TimeoutError = TimeoutError
+except NameError: # Python 2
+    _TimeoutError = RuntimeError
+
+nscTraceProgress = _co.namedtuple('nscTraceProgress', ['elapsed', 'done', 'detectors'])
+nscTraceResult = _co.namedtuple('nscTraceResult', ['status', 'elapsed', 'data'])
+
+class NSCTraceFuture(object):
+    """Future of an NSC trace started by ``PyZDDE.zNSCTraceAsync()``
+
+    Parameters
+    ----------
+    link : PyZDDE object
+        the link that started the trace
+    cmd : string
+        NSCTrace command
+    timeout : float
+        timeout of the trace in seconds
+    surfNum : integer
+        surface number of the NSC group of the detectors
+    detectors : sequence of integers
+        object numbers of the detectors read by ``progress()``
+    pollInterval : float
+        minimum time in seconds between two reads of the detectors
+
+    Notes
+    -----
+    The methods of the future must be called by the thread that owns the
+    link, since the detectors and the readouts chained with ``then()`` use
+    the link.
+    """
+    def __init__(self, link, cmd, timeout, surfNum=1, detectors=(), pollInterval=5.0):
+        self._link = link
+        self._cmd = cmd
+        self._timeout = timeout
+        self._surfNum = surfNum
+        self._detectors = tuple(detectors)
+        self._pollInterval = pollInterval
+        self._readouts = []
+        self._data = None
+        self._status = None
+        self._error = None
+        self._cancelled = False
+        self._lastPoll = (None, {})
+        self._pollTimedOut = False
+        self._finished = _threading.Event()
+        self._start = _time.time()
+        self._stop = None
+        if not _isLensPreservingCmd(cmd):
+            link._lensGeneration += 1
+        self._thread = _threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """requests the trace through a new conversation (background thread)"""
+        try:
+            conversation = self._link._newConversation()
+            reply = conversation.Request(self._cmd, self._timeout)
+            if _global_pyver3:
+                reply = reply.decode('ascii')
+            self._status = _nscTraceStatus(reply.rstrip())
+            del conversation
+        except Exception as err:
+            self._error = err
+        finally:
+            self._stop = _time.time()
+            self._finished.set()
+
+    @property
+    def elapsed(self):
+        """time in seconds since the start of the trace (duration of the
+        trace once it is finished)"""
+        return (self._stop or _time.time()) - self._start
+
+    def done(self):
+        """returns ``True`` if the trace is finished or cancelled"""
+        return self._cancelled or self._finished.is_set()
+
+    def running(self):
+        """returns ``True`` if the trace isn't finished nor cancelled"""
+        return not self.done()
+
+    def cancelled(self):
+        """returns ``True`` if the trace was cancelled"""
+        return self._cancelled
+
+    def cancel(self):
+        """abandons the trace
+
+        Returns
+        -------
+        status : bool
+            ``True`` if the trace was abandoned, ``False`` if it was
+            already finished
+
+        Notes
+        -----
+        Zemax can't be told to stop a trace through DDE, so the trace goes
+        on in Zemax, and the requests sent through the link are answered
+        after its end. The readouts chained with ``then()`` are dropped,
+        and ``result()`` returns the status -2.
+        """
+        if self._finished.is_set():
+            return False
+        self._cancelled = True
+        return True
+
+    def progress(self):
+        """returns the elapsed time and the totals of the detectors
+
+        Returns
+        -------
+        progress : namedtuple
+            ``nscTraceProgress`` with the fields:
+
+            * elapsed : elapsed time in seconds
+            * done : ``True`` if the trace is finished
+            * detectors : dictionary of (total flux, number of hits)
+              tuples of the detectors passed to ``zNSCTraceAsync()``, read
+              at most once per poll interval. The dictionary is empty if the
+              detectors were never read, for example if Zemax doesn't answer
+              during the trace (see ``PyZDDE.zNSCTraceAsync()``)
+
+        Notes
+        -----
+        Once a read of the detectors has timed out (Zemax is busy with the
+        trace), the detectors aren't read anymore, such that the polls
+        don't wait for the timeout (and the DDE client doesn't print its
+        timeout message) again.
+        """
+        lastTime, totals = self._lastPoll
+        now = _time.time()
+        if (self._detectors and not self._cancelled and not self._pollTimedOut
+            and (lastTime is None or now - lastTime >= self._pollInterval)):
+            polled = {}
+            for det in self._detectors:
+                values = []
+                for pixel in (0, -3):
+                    cmd = ("NSCDetectorData,{:d},{:d},{:d},0"
+                           .format(self._surfNum, det, pixel))
+                    reply = self._link._sendDDEcommand(cmd, min(1, self._pollInterval))
+                    try:
+                        value = float(reply.rstrip())
+                    except ValueError:
+                        break
+                    if value == -998:   # timeout
+                        self._pollTimedOut = True
+                        break
+                    values.append(value)
+                if len(values) < 2:
+                    break
+                polled[det] = (values[0], int(values[1]))
+            else:
+                totals = polled
+            self._lastPoll = (now, totals)
+        return nscTraceProgress(self.elapsed, self._finished.is_set(), dict(totals))
+
+    def then(self, readout):
+        """chains a readout after the end of the trace
+
+        Parameters
+        ----------
+        readout : callable
+            function called as ``readout(link)`` by ``result()`` after a
+            successful trace, for example to read the detectors
+
+        Returns
+        -------
+        trace : NSCTraceFuture object
+            the future, such that the calls can be chained
+        """
+        self._readouts.append(readout)
+        return self
+
+    def result(self, timeout=None):
+        """waits for the end of the trace and runs the chained readouts
+
+        Parameters
+        ----------
+        timeout : float, optional
+            maximum time to wait in seconds. If ``None`` (default), waits
+            until the end of the trace
+
+        Returns
+        -------
+        result : namedtuple
+            ``nscTraceResult`` with the fields:
+
+            * status : 0 if successful, -2 if cancelled, or the error code
+              of ``zNSCTrace()``
+            * elapsed : duration of the trace in seconds
+            * data : list of the returns of the readouts chained with
+              ``then()``, in order (empty if the trace failed)
+
+        Raises
+        ------
+        TimeoutError (RuntimeError in Python 2)
+            if the trace isn't finished after ``timeout`` seconds
+        """
+        if self._cancelled:
+            return nscTraceResult(-2, self.elapsed, [])
+        if not self._finished.wait(timeout):
+            raise _TimeoutError('The NSC trace is not finished after {} s'.format(timeout))
+        if self._error is not None:
+            raise self._error
+        if self._data is None:
+            self._data = []
+            if self._status == 0:
+                self._data = [readout(self._link) for readout in self._readouts]
+        return nscTraceResult(self._status, self.elapsed, self._data)
+
 #%% OTHER MODULE HELPER FUNCTIONS THAT DO NOT REQUIRE A RUNNING ZEMAX SESSION
 
 def numAper(aperConeAngle, rIndex=1.0):
@@ -12009,35 +12810,26 @@ def _checkFileExist(filename, mode='r', timeout=.25):
     status : bool
       True = file exist, and file operations are possible;
       False = timeout reached
+
+    Notes
+    -----
+    The file is polled with an exponential backoff (see
+    ``zfileutils.waitForFile()``) instead of fixed sleeps.
     """
-    ti = _datetime.datetime.now()
-    status = True
-    while True:
-        try:
-            f = open(filename, mode)
-        except IOError:
-            timeDelta = _datetime.datetime.now() - ti
-            if timeDelta.total_seconds() > timeout:
-                status = False
-                break
-            else:
-                _time.sleep(0.25)
-        else:
-            f.close()
-            break
-    return status
+    return _zfu.waitForFile(filename, mode, timeout)
 
 def _deleteFile(fileName, n=10):
-    """Cleanly deletes a file. It takes n attempts to delete the file.
+    """Cleanly deletes a file. It retries to delete the file for ``0.2*n``
+    seconds.
 
-    If it can't delete the file in n attempts then it returns fail.
+    If it can't delete the file in that time then it returns fail.
 
     Parameters
     ----------
     fileName : string
         file name of file to be deleted with full path
     n : integer
-        number of times to attempt before giving up
+        the attempts stop after ``0.2*n`` seconds (2 s by default)
 
     Returns
     -------
@@ -12049,31 +12841,19 @@ def _deleteFile(fileName, n=10):
     -----
     It assumes that the file with filename actually exist and doesn't do
     any error checking on its existance. This is OK as this function is
-    for internal use only.
+    for internal use only. The delays between the attempts double from
+    1 ms up to 200 ms (1, 2, 4, ..., 128, 200, 200, ... ms), such that a
+    file released quickly by Zemax is deleted within a few ms; with the
+    default ``n``, about 18 attempts are made over 2 s (see
+    ``zfileutils.removeFile()``).
     """
-    status = False
-    count = 0
-    while not status and count < n:
-        try:
-            _os.remove(fileName)
-        except OSError:
-            count += 1
-            _time.sleep(0.2)
-        else:
-            status = True
-    return status
+    return _zfu.removeFile(fileName, timeout=0.2*n)
 
 def _deleteFilesCreatedDuringSession(self):
     """Helper function to clean up files creatd by PyZDDE during a session.
     Examples of such files include configuration files, etc.
     """
-    filesToDelete = self._filesCreated
-    filesNotDeleted = set()
-    for filename in filesToDelete:
-        if not _deleteFile(filename):
-            filesNotDeleted.add(filename)
-    remaining = filesToDelete.intersection(filesNotDeleted)
-    self._filesCreated = remaining
+    self._scratch.close()
 
 def _process_get_set_NSCProperty(code, reply):
     """Process reply for functions zGetNSCProperty and zSETNSCProperty"""
@@ -12145,7 +12925,7 @@ def _print_dict(data):
         print("{}: {}".format(key.ljust(leftColMaxWidth + 1), value))
 
 def _openFile(fileName):
-    """opens the file in the appropriate mode and returns the file object
+    """opens the file in binary mode and returns the file object
 
     Parameters
     ----------
@@ -12162,58 +12942,86 @@ def _openFile(fileName):
     calling the ``close()`` method of the file object. Alternatively use
     either use a with/as context to close automatically or use
     ``_readLinesFromFile()`` or ``_getDecodedLineFromFile()`` that uses a
-    with context manager to handle exceptions and file close.
+    with context manager to handle exceptions and file close. The text
+    encoding (Unicode or ASCII) is detected when the file content is
+    decoded, see ``_decodeText()``.
     """
-    global _global_use_unicode_text
-    if _global_use_unicode_text:
-        f = open(fileName, u'rb')
+    return open(fileName, 'rb')
+
+def _detectEncoding(raw):
+    """returns the encoding of the bytes ``raw`` of a text file written by
+    Zemax, and the length of its byte order mark (BOM)
+
+    The Unicode (UTF-16) text files have a BOM. If there is no BOM, the
+    encoding is guessed from the position of the null bytes in the first
+    characters; files without null bytes are considered to be ASCII text
+    written with the encoding of the locale.
+    """
+    for bom, encoding in ((_codecs.BOM_UTF16_LE, 'utf-16-le'),
+                          (_codecs.BOM_UTF16_BE, 'utf-16-be'),
+                          (_codecs.BOM_UTF8, 'utf-8')):
+        if raw.startswith(bom):
+            return encoding, len(bom)
+    head = raw[:256]
+    if head.count(b'\x00'):
+        if head[1::2].count(b'\x00') >= head[0::2].count(b'\x00'):
+            return 'utf-16-le', 0
+        return 'utf-16-be', 0
+    return _locale.getpreferredencoding(False) or 'ascii', 0
+
+# numbers with a decimal comma or a decimal point
+_decimalCommaPat = _re.compile(r'\d,\d')
+_decimalPointPat = _re.compile(r'\d\.\d')
+
+def _decodeText(raw):
+    """returns the list of the lines (right stripped) of the content ``raw``
+    of a text file
+
+    The content is decoded in one pass. If the file uses decimal commas
+    (there are numbers with a comma, such as ``1,5``, but none with a
+    decimal point), they are replaced by points in one pass over the whole
+    text (see ``zfileutils.checkDecimalSeparators()``); the commas of the
+    headers and labels don't trigger the (slow) replacement.
+
+    Parameters
+    ----------
+    raw : bytes or string
+        content of the file. If it is a (unicode) string, it is not decoded
+
+    Returns
+    -------
+    lines : list
+        list of lines
+    """
+    if isinstance(raw, bytes):
+        encoding, bomLen = _detectEncoding(raw)
+        text = raw[bomLen:].decode(encoding, 'replace')
     else:
-        f = open(fileName, 'r')
-    return f
+        text = raw
+    if _decimalCommaPat.search(text) and not _decimalPointPat.search(text):
+        text = _zfu.checkDecimalSeparators(text)
+    lines = text.split('\n')
+    if lines and not lines[-1]:
+        lines.pop()
+    return [line.rstrip() for line in lines]
 
 def _getDecodedLineFromFile(fileObj):
     """generator function; yields a decoded (ascii/Unicode) line
     The file is automatically closed when after reading the file or if any
     exception occurs while reading the file.
-    """
-    global _global_pyver3
-    global _global_use_unicode_text
-    global _global_in_IPython_env
 
-    # I am not exactly sure why there is a difference in behavior
-    # between IPython environment and normal Python shell, but it is there!
-    if _global_in_IPython_env:
-        unicode_type = 'utf-16-le'
-    else:
-        unicode_type = 'utf-16'
-
-    if _global_use_unicode_text:
-        fenc = _codecs.EncodedFile(fileObj, unicode_type)
-        with fenc as f:
-            for line in f:
-                decodedLine = line.decode(unicode_type)
-                decodedLine = _zfu.checkDecimalSeparators(decodedLine)
-                yield decodedLine.rstrip()
-    else: # ascii
-        with fileObj as f:
-            for line in f:
-                if _global_pyver3: # ascii and Python 3.x
-                    line = _zfu.checkDecimalSeparators(line)
-                    yield line.rstrip()
-                else:      # ascii and Python 2.x
-                    try:
-                        decodedLine = line.decode('raw-unicode-escape')
-                    except:
-                        decodedLine = line.decode('ascii', 'replace')
-                    decodedLine = _zfu.checkDecimalSeparators(decodedLine)
-                    yield decodedLine.rstrip()
+    The whole file is read and decoded at once, and the lines are yielded
+    from the decoded text.
+    """
+    for line in _readLinesFromFile(fileObj):
+        yield line
 
 def _readLinesFromFile(fileObj):
     """returns a list of lines (as unicode literals) in the file
 
     This function emulates the functionality of ``readlines()`` method of file
     objects. The caller doesn't have to explicitly close the file as it is
-    handled in ``_getDecodedLineFromFile()`` function.
+    closed by this function.
 
     Parameters
     ----------
@@ -12224,8 +13032,9 @@ def _readLinesFromFile(fileObj):
     lines (list) : list of lines (as unicode literals with u'string' notation)
                    from the file
     """
-    lines = list(_getDecodedLineFromFile(fileObj))
-    return lines
+    with fileObj as f:
+        raw = f.read()
+    return _decodeText(raw)
 
 def _getFirstLineOfInterest(line_list, pattern, patAtStart=True):
     """returns the line number (index in the list of lines) that matches the
@@ -12254,9 +13063,9 @@ def _getFirstLineOfInterest(line_list, pattern, patAtStart=True):
     If it is known that the pattern will be matched at the beginning, then
     letting ``patAtStart==True`` is more efficient.
     """
-    pat = _re.compile(pattern) if patAtStart else _re.compile('.*'+pattern)
+    pat = _compilePattern(pattern, patAtStart)
     for line_num, line in enumerate(line_list):
-        if _re.match(pat, line.strip()):
+        if pat.match(line.strip()):
             return line_num
 
 def _get2DList(line_list, start_line, number_of_lines, 
@@ -12289,12 +13098,105 @@ def _get2DList(line_list, start_line, number_of_lines,
         line_list
     """
     data = []
-    end_line = start_line + number_of_lines - 1
-    for lineNum, row in enumerate(line_list):
-        if start_line <= lineNum <= end_line:
-            data.append([float(i) for i in row.split()][startCol:endCol:stride])
+    for row in line_list[start_line:start_line + number_of_lines]:
+        data.append([float(i) for i in row.split()][startCol:endCol:stride])
     return data
 
+def _get2DArray(line_list, start_line, number_of_lines,
+                startCol=None, endCol=None, stride=None):
+    """returns a 2D ndarray of data read between ``start_line`` and
+    ``start_line + number_of_lines`` of a list
+
+    This is the Numpy counterpart of ``_get2DList()``. Only the required
+    lines are sliced from ``line_list``, and all the numbers are converted
+    in bulk into a contiguous float64 array.
+
+    Parameters
+    ----------
+    line_list : list
+        list of lines read from a file using ``_readLinesFromFile()``
+    start_line : integer
+        index of line_list
+    number_of_lines : integer
+        number of lines to read (number of lines which contain the 2D data)
+    startCol : integer, optional
+        the column number to start reading in each row (similar to list
+        slicing pattern). Default is `None`
+    endCol : integer, optional
+        the end column number upto which (but excluding `endCol`) to read
+        in each row (similar to list slicing pattern). Default is `None`
+    stride : integer, optional
+        stride along each column (similar to list slicing pattern).
+        Default is `None`
+
+    Returns
+    -------
+    data : ndarray
+        2-d array of float64 data read from the lines in line_list
+    """
+    if not _global_np:
+        raise ImportError('Numpy is required for returning data as arrays')
+    lines = line_list[start_line:start_line + number_of_lines]
+    if not lines:
+        return _np.empty((0, 0))
+    rows = [line.split() for line in lines]
+    numCols = len(rows[0])
+    if all(len(row) == numCols for row in rows):
+        tokens = [token for row in rows for token in row]
+        data = _np.array(tokens, dtype=_np.float64).reshape(len(rows), numCols)
+        if startCol is not None or endCol is not None or stride is not None:
+            data = _np.ascontiguousarray(data[:, startCol:endCol:stride])
+        return data
+    # rows of unequal length; the selected columns must have the same length
+    rows = [row[startCol:endCol:stride] for row in rows]
+    if any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError('The lines {} to {} have different numbers of columns'
+                         .format(start_line, start_line + len(lines) - 1))
+    return _np.array(rows, dtype=_np.float64).reshape(len(rows), len(rows[0]))
+
+def _getRGBArray(line_list, start_line, width, height, outFile=None,
+                 chunkSize=2**20):
+    """returns the image from the "xpix ypix R G B" block of lines of an
+    image simulation text file as a uint8 array of shape (height, width, 3)
+
+    Parameters
+    ----------
+    line_list : list
+        list of lines read from a file using ``_readLinesFromFile()``
+    start_line : integer
+        index of the first line of pixel data. The ``width*height`` lines
+        of pixel data are ordered along the height for each column.
+    width, height : integer
+        bitmap width and height in pixels
+    outFile : string, optional
+        if passed, the array is created as a memory-mapped ``.npy`` file
+    chunkSize : integer, optional
+        approximate number of lines converted at a time
+
+    Returns
+    -------
+    img : ndarray or memmap
+        uint8 array of shape (height, width, 3)
+    """
+    if not _global_np:
+        raise ImportError('Numpy is required for returning data as arrays')
+    shape = (height, width, 3)
+    if outFile:
+        img = _np.lib.format.open_memmap(outFile, mode='w+', dtype=_np.uint8,
+                                         shape=shape)
+    else:
+        img = _np.empty(shape, dtype=_np.uint8)
+    cols = max(1, chunkSize//max(height, 1))   # image columns per chunk
+    for x0 in xrange(0, width, cols):
+        x1 = min(x0 + cols, width)
+        lines = line_list[start_line + x0*height:start_line + x1*height]
+        data = _np.array(' '.join(lines).split(), dtype=_np.int64)
+        data = data.reshape(x1 - x0, height, 5)[:, :, 2:]
+        img[:, x0:x1, :] = data.transpose(1, 0, 2)
+    if outFile:
+        img.flush()
+    return img
+
 def _transpose2Dlist(mat):
     """transpose a matrix that is constructed as a list of lists in pure
     Python
@@ -12343,12 +13245,173 @@ def _getRePatPosInLineList(line_list, re_pattern):
         the list containing the position of the pattern in the input list
     """
     positions = []
+    pat = _compilePattern(re_pattern)
     for line_number, line in enumerate(line_list):
-        if _re.search(re_pattern, line):
+        if pat.search(line):
             positions.append(line_number)
     return positions
 
-def _txtAndSettingsToUse(self, txtFile, settingsFile, anaType):
+_rePatCache = {}
+
+def _compilePattern(pattern, patAtStart=True):
+    """returns the compiled regex pattern, from a module level cache
+
+    If ``patAtStart`` is ``False``, the pattern is prefixed with ``.*`` so
+    that it can be matched anywhere in the line (see
+    ``_getFirstLineOfInterest()``)
+    """
+    key = (pattern, patAtStart)
+    pat = _rePatCache.get(key)
+    if pat is None:
+        pat = _re.compile(pattern) if patAtStart else _re.compile('.*' + pattern)
+        _rePatCache[key] = pat
+    return pat
+
+# a line of numeric data starts with a number
+_numericLinePat = _re.compile(r'\s*[-+]?\.?\d')
+
+class _TextFileIndex(object):
+    """index of the lines of a Zemax analysis text file built in a single pass
+
+    The lines are classified once into text (header) lines and lines of
+    numeric data. Textual searches then only go through the text lines,
+    and searches for numeric data only through the numeric blocks, such
+    that the parsers of an analysis file can look up several items
+    without re-scanning the whole file.
+
+    Attributes
+    ----------
+    lines : list
+        list of lines in the file returned by ``_readLinesFromFile()``
+    textLines : list
+        line numbers of the non-empty, non-numeric lines
+    blocks : list
+        (start, end) line numbers of the blocks of consecutive lines of
+        numeric data; ``end`` is excluded
+    """
+    def __init__(self, line_list):
+        self.lines = line_list
+        self.textLines = []
+        self.blocks = []
+        isNumeric = _numericLinePat.match
+        blockStart = None
+        for line_num, line in enumerate(line_list):
+            if isNumeric(line):
+                if blockStart is None:
+                    blockStart = line_num
+                continue
+            if blockStart is not None:
+                self.blocks.append((blockStart, line_num))
+                blockStart = None
+            if line.strip():
+                self.textLines.append(line_num)
+        if blockStart is not None:
+            self.blocks.append((blockStart, len(line_list)))
+
+    @classmethod
+    def fromFile(cls, fileName):
+        """returns the index of the lines of the text file ``fileName``"""
+        return cls(_readLinesFromFile(_openFile(fileName)))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, line_num):
+        return self.lines[line_num]
+
+    def find(self, pattern, patAtStart=True, start=0):
+        """returns the line number of the first text line that matches
+        the regex pattern (see ``_getFirstLineOfInterest()``), or ``None``
+
+        Parameters
+        ----------
+        pattern : string
+            regex pattern that should be used to identify the line of interest
+        patAtStart : bool
+            if ``True``, match pattern at the beginning of line string (default)
+        start : integer
+            line number from which to start the search
+        """
+        pat = _compilePattern(pattern, patAtStart)
+        lines = self.lines
+        for line_num in self.textLines[_bisect.bisect_left(self.textLines, start):]:
+            if pat.match(lines[line_num].strip()):
+                return line_num
+
+    def findAll(self, pattern):
+        """returns the line numbers of all the text lines in which the regex
+        pattern is found (see ``_getRePatPosInLineList()``)"""
+        pat = _compilePattern(pattern)
+        lines = self.lines
+        return [line_num for line_num in self.textLines if pat.search(lines[line_num])]
+
+    def findData(self, pattern, start=0):
+        """returns the line number of the first line of numeric data that
+        matches the regex pattern, or ``None``
+        """
+        pat = _compilePattern(pattern)
+        lines = self.lines
+        for blockStart, blockEnd in self.blocks:
+            for line_num in xrange(max(blockStart, start), blockEnd):
+                if pat.match(lines[line_num].strip()):
+                    return line_num
+
+    def block(self, line_num):
+        """returns the (start, end) line numbers of the block of numeric data
+        that contains the line ``line_num``, or ``None``"""
+        i = _bisect.bisect_right(self.blocks, (line_num, len(self.lines)))
+        if i and self.blocks[i - 1][0] <= line_num < self.blocks[i - 1][1]:
+            return self.blocks[i - 1]
+
+# settings files ("lens" + postfix) created by the zSet*Settings() functions
+_anaCfgDict = {'Pop':'_pyzdde_POP.CFG',
+               'Hcs':'_pyzdde_HUYGENSPSFCS.CFG',
+               'Hps':'_pyzdde_HUYGENSPSF.CFG',
+               'Hmf':'_pyzdde_HUYGENSMTF.CFG',
+               'Pcs':'_pyzdde_FFTPSFCS.CFG',
+               'Fps':'_pyzdde_FFTPSF.CFG',
+               'Mtf':'_pyzdde_FFTMTF.CFG',
+               'Sei':'None',
+               'Pre':'None',  # change this to the appropriate file when implemented
+               'Sim':'_pyzdde_IMGSIM.CFG',
+               'Zfr':'_pyzdde_ZFR.CFG',  # Note that currently MODIFYSETTINGS
+               'Zst':'_pyzdde_ZST.CFG',  # is not supported of Aberration
+               'Zat':'_pyzdde_ZAT.CFG',  # coefficients by Zemax extensions
+               'Dvw':'_pyzdde_DVW.CFG',  # NSC detector viewer
+               }
+
+def _settingsFileToUse(self, settingsFile, anaType, lensFile=None):
+    """internal helper function to decide the settings file and the
+    settings flag to use for calling ``zGetTextFile()``
+
+    Parameters
+    ----------
+    self : object
+        pyzdde link object
+    settingsFile : string
+        settings file that may have been passed by the user
+    anaType : string
+        3-letter analysis code
+    lensFile : string, optional
+        lens file name, if already known
+
+    Returns
+    -------
+    cfgFile : string
+        full name and path of the configuration/ settings file to
+        use for calling ``zGetTextFile()``
+    getTextFlag : integer
+        flag to be used for calling ``zGetTextFile()``
+    """
+    if settingsFile:
+        return settingsFile, 1
+    lensFile = lensFile or self.zGetFile()
+    f = _os.path.splitext(lensFile)[0] + _anaCfgDict[anaType]
+    if _os.path.isfile(f): # use "*_pyzdde_XXX.CFG" settings file
+        return f, 1
+    return '', 0     # use default settings file
+
+def _txtAndSettingsToUse(self, txtFile, settingsFile, anaType, keepFile=False):
     """internal helper function for use by zGet type of functions
     that call ``zGetTextFile()``, to decide the type of settings
     file and settings flag to use
@@ -12363,9 +13426,15 @@ def _txtAndSettingsToUse(self, txtFile, settingsFile, anaType):
         settings file that may have been passed by the user
     anaType : string
         3-letter analysis code
+    keepFile : bool, optional
+        if ``True`` and ``txtFile`` is ``None``, the text file is given its
+        default name (such as 'popData.txt'), such that the user can find
+        it; otherwise a unique name is generated for the temporary file
 
     Returns
     -------
+    textFileName : string
+        full name and path of the text file
     cfgFile : string
         full name and path of the configuration/ settings file to
         use for calling ``zGetTextFile()``
@@ -12373,7 +13442,7 @@ def _txtAndSettingsToUse(self, txtFile, settingsFile, anaType):
         flag to be used for calling ``zGetTextFile()``
     """
     # note to the developer -- maintain exactly same keys in both
-    # txtFileDict and anaCfgDict. Note that some analysis have common
+    # txtFileDict and _anaCfgDict. Note that some analysis have common
     # txt file and settings files associated with them. Of course they
     # may be changed if required in future.
     txtFileDict =  {'Pop':'popData.txt',
@@ -12391,43 +13460,21 @@ def _txtAndSettingsToUse(self, txtFile, settingsFile, anaType):
                     'Zat':'zernikeAnnularAnalysisFile.txt',  # Zernike Annular coefficients
                     'Dvw':'detectorViewerFile.txt',  # NSC detector viewer         
                     }
-
-    anaCfgDict  = {'Pop':'_pyzdde_POP.CFG',
-                   'Hcs':'_pyzdde_HUYGENSPSFCS.CFG',
-                   'Hps':'_pyzdde_HUYGENSPSF.CFG',
-                   'Hmf':'_pyzdde_HUYGENSMTF.CFG',
-                   'Pcs':'_pyzdde_FFTPSFCS.CFG',
-                   'Fps':'_pyzdde_FFTPSF.CFG',
-                   'Mtf':'_pyzdde_FFTMTF.CFG',
-                   'Sei':'None',
-                   'Pre':'None',  # change this to the appropriate file when implemented
-                   'Sim':'_pyzdde_IMGSIM.CFG',
-                   'Zfr':'_pyzdde_ZFR.CFG',  # Note that currently MODIFYSETTINGS
-                   'Zst':'_pyzdde_ZST.CFG',  # is not supported of Aberration
-                   'Zat':'_pyzdde_ZAT.CFG',  # coefficients by Zemax extensions
-                   'Dvw':'_pyzdde_DVW.CFG',  # NSC detector viewer
-                   }
-    assert txtFileDict.keys() == anaCfgDict.keys(), \
+    assert txtFileDict.keys() == _anaCfgDict.keys(), \
            "Dicts don't have matching keys" # for code integrity
-    assert anaType in anaCfgDict
+    assert anaType in _anaCfgDict
 
     #fdir = _os.path.dirname(_os.path.realpath(__file__))
-    fdir = _os.path.dirname(self.zGetFile())
+    lensFile = self.zGetFile()
+    fdir = _os.path.dirname(lensFile)
     if txtFile != None:
         textFileName = txtFile
+    elif keepFile:
+        textFileName = _os.path.join(self._scratch.directory or fdir,
+                                     txtFileDict[anaType])
     else:
-        textFileName = _os.path.join(fdir, txtFileDict[anaType])
-    if settingsFile:
-        cfgFile = settingsFile
-        getTextFlag = 1
-    else:
-        f = _os.path.splitext(self.zGetFile())[0] + anaCfgDict[anaType]
-        if _checkFileExist(f): # use "*_pyzdde_XXX.CFG" settings file
-            cfgFile = f
-            getTextFlag = 1
-        else: # use default settings file
-            cfgFile = ''
-            getTextFlag = 0
+        textFileName = self._scratch.newFileName(txtFileDict[anaType], fdir)
+    cfgFile, getTextFlag = _settingsFileToUse(self, settingsFile, anaType, lensFile)
     return textFileName, cfgFile, getTextFlag
 
 #
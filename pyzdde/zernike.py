@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+#-------------------------------------------------------------------------------
+# Name:        zernike.py
+# Purpose:     Zernike polynomial basis and local least-squares fitting of
+#              sampled wavefront (OPD) maps.
+# Licence:     MIT License
+#              This file is subject to the terms and conditions of the MIT License.
+#              For further details, please refer to LICENSE.txt
+#-------------------------------------------------------------------------------
+'''Zernike Fringe, Standard and Annular polynomials (following the Zemax term
+ordering and normalization) and local fitting of wavefront maps.
+
+The basis matrix and its pseudo-inverse are built once per combination of
+polynomial type, number of terms, pupil sampling and obscuration ratio, and
+are cached, so that fitting the OPD maps of many fields is a single matrix
+product. The wavefront maps are typically obtained from an array ray trace
+with ``want_opd`` (see ``arraytrace.zGetWavefrontMapArray()``).
+'''
+from __future__ import print_function, division
+import math as _math
+import numpy as _np
+
+import pyzdde.config as _config
+_global_pyver3 = _config._global_pyver3
+
+if _global_pyver3:
+   xrange = range
+
+# maximum number of terms supported by Zemax for each type
+_max_terms = {'fringe' : 37, 'standard' : 231, 'annular' : 231}
+
+# cache of the ZernikeFitter objects keyed by (which, nterms, sampling, obscuration)
+_fitter_cache = {}
+_FITTER_CACHE_SIZE = 16
+
+#%% Term indexing
+
+def zernikeNM(j, which='fringe'):
+    """returns the radial order ``n`` and the azimuthal frequency ``m`` of
+    the ``j``-th Zernike term
+
+    Parameters
+    ----------
+    j : integer
+        term number (starting from 1), as used in the Zemax manual
+    which : string, optional
+        ``fringe`` (default), ``standard`` or ``annular``
+
+    Returns
+    -------
+    n : integer
+        radial order
+    m : integer
+        signed azimuthal frequency; ``m > 0`` stands for a ``cos(m*theta)``
+        term, ``m < 0`` for a ``sin(|m|*theta)`` term.
+    """
+    assert which in _max_terms, "which must be 'fringe', 'standard' or 'annular'"
+    if j < 1 or j > _max_terms[which]:
+        raise ValueError('Term {} is out of range for {} Zernikes'.format(j, which))
+    if which == 'fringe':
+        if j == 37:
+            return 12, 0
+        # terms are grouped by k = (n + m)/2; within a group the cos and sin
+        # terms of m = k, k - 1, ..., 1 are followed by the m = 0 term
+        k = int(_math.sqrt(j - 1))
+        p = j - k**2 - 1            # position within the group
+        m = k - p//2
+        n = 2*k - m
+        if m and p % 2:
+            m = -m
+        return n, m
+    else: # Noll ordering used by the Standard and Annular terms
+        n = int((-1 + _math.sqrt(8*(j - 1) + 1))/2)
+        p = j - n*(n + 1)//2 - 1
+        m = n % 2 + 2*((p + (n + 1) % 2)//2)
+        if m and j % 2:
+            m = -m
+        return n, m
+
+#%% Basis functions
+
+def _radial(n, m, rho):
+    """circular Zernike radial polynomial R_n^m(rho), R_n^m(1) = 1"""
+    m = abs(m)
+    rad = _np.zeros_like(rho)
+    for s in xrange((n - m)//2 + 1):
+        c = ((-1)**s*_math.factorial(n - s)/
+             (_math.factorial(s)*_math.factorial((n + m)//2 - s)
+              *_math.factorial((n - m)//2 - s)))
+        rad += c*rho**(n - 2*s)
+    return rad
+
+_annular_coeffs_cache = {}
+
+def _annularRadialCoeffs(n, m, eps):
+    """returns the coefficients that expand the annular radial polynomial
+    R_n^m(rho; eps) in terms of the circular radial polynomials R_k^m,
+    k = m, m + 2, ..., n
+
+    The polynomials are obtained by Gram-Schmidt orthogonalization over the
+    annulus ``eps <= rho <= 1``, normalized such that their mean square
+    over the annulus is ``1/(n + 1)`` (as that of R_n^m over the unit disk)
+    and such that R_n^m(1; eps) > 0.
+    """
+    m = abs(m)
+    key = (m, eps)
+    if key not in _annular_coeffs_cache:
+        ks = list(range(m, 21, 2))  # up to the radial order of Z231
+        # Gauss-Legendre quadrature in u = rho**2 over [eps**2, 1], which is
+        # exact for the products of the radial polynomials
+        nodes, weights = _np.polynomial.legendre.leggauss(32)
+        rho = _np.sqrt(0.5*(1 - eps**2)*nodes + 0.5*(1 + eps**2))
+        w = 0.5*weights  # mean over the annulus
+        coeffs, ortho = [], []
+        for i, k in enumerate(ks):
+            c = _np.zeros(len(ks))
+            c[i] = 1.0
+            v = _radial(k, m, rho)
+            for _ in range(2):  # re-orthogonalize for numerical stability
+                for cj, vj in zip(coeffs, ortho):
+                    proj = _np.sum(w*v*vj)/_np.sum(w*vj*vj)
+                    v = v - proj*vj
+                    c = c - proj*cj
+            norm = _math.sqrt(_np.sum(w*v*v)*(k + 1))
+            if c.sum() < 0:  # R_k^m(1) = 1 for all k
+                norm = -norm
+            coeffs.append(c/norm)
+            ortho.append(v/norm)
+        _annular_coeffs_cache[key] = coeffs
+    return _annular_coeffs_cache[key][(n - m)//2]
+
+def zernikeTerm(j, rho, theta, which='fringe', obscuration=0.0):
+    """returns the value of the ``j``-th Zernike term at the normalized
+    pupil polar coordinates ``rho`` and ``theta``
+
+    Parameters
+    ----------
+    j : integer
+        term number (starting from 1)
+    rho, theta : ndarray
+        normalized radial coordinate and angle (radians, measured from the
+        x-axis)
+    which : string, optional
+        ``fringe`` (default), ``standard`` or ``annular``
+    obscuration : float, optional
+        central obscuration ratio; only used by the ``annular`` terms
+
+    Returns
+    -------
+    z : ndarray
+        Zernike term evaluated at ``rho``, ``theta``. The Fringe terms are
+        not normalized, while the Standard and Annular terms are normalized
+        to unit RMS over the (annular) pupil, consistent with Zemax.
+    """
+    rho = _np.asarray(rho, dtype=_np.float64)
+    theta = _np.asarray(theta, dtype=_np.float64)
+    n, m = zernikeNM(j, which)
+    if which == 'annular' and obscuration > 0:
+        c = _annularRadialCoeffs(n, m, float(obscuration))
+        rad = sum(ck*_radial(abs(m) + 2*k, m, rho)
+                  for k, ck in enumerate(c[:(n - abs(m))//2 + 1]))
+    else:
+        rad = _radial(n, m, rho)
+    if which != 'fringe':
+        rad = rad*_math.sqrt((n + 1)*(1 if m == 0 else 2))
+    if m > 0:
+        return rad*_np.cos(m*theta)
+    elif m < 0:
+        return rad*_np.sin(-m*theta)
+    return rad
+
+def zernikeBasis(rho, theta, nterms=None, which='fringe', obscuration=0.0):
+    """returns the matrix of the first ``nterms`` Zernike terms evaluated at
+    the normalized pupil coordinates ``rho`` and ``theta``
+
+    Parameters
+    ----------
+    rho, theta : ndarray
+        1-D arrays of the normalized radial coordinates and angles
+    nterms : integer, optional
+        number of terms. Default is the maximum number of terms supported
+        by Zemax for the type (37 for ``fringe``, 231 otherwise)
+    which : string, optional
+        ``fringe`` (default), ``standard`` or ``annular``
+    obscuration : float, optional
+        central obscuration ratio; only used by the ``annular`` terms
+
+    Returns
+    -------
+    basis : ndarray
+        matrix of shape (len(rho), nterms)
+    """
+    nterms = nterms or _max_terms[which]
+    rho = _np.ravel(rho)
+    theta = _np.ravel(theta)
+    basis = _np.empty((len(rho), nterms))
+    for j in xrange(1, nterms + 1):
+        basis[:, j-1] = zernikeTerm(j, rho, theta, which, obscuration)
+    return basis
+
+def pupilGrid(sampling, obscuration=0.0):
+    """returns the normalized pupil coordinates of a square grid of
+    ``sampling`` x ``sampling`` points, and the mask of the points within the
+    (annular) pupil
+
+    Parameters
+    ----------
+    sampling : integer
+        number of grid points along each side of the pupil
+    obscuration : float, optional
+        central obscuration ratio. Points with ``rho < obscuration`` are
+        excluded.
+
+    Returns
+    -------
+    px, py : ndarray
+        1-D arrays of the normalized pupil coordinates of the points within
+        the pupil, in row major order (``py`` changes along the rows)
+    mask : ndarray of bool
+        ``sampling`` x ``sampling`` mask of the points within the pupil
+    """
+    p = _np.linspace(-1.0, 1.0, sampling)
+    gx, gy = _np.meshgrid(p, p)
+    rho = _np.hypot(gx, gy)
+    mask = (rho <= 1.0 + 1e-12) & (rho >= obscuration)
+    return gx[mask], gy[mask], mask
+
+#%% Fitting
+
+class ZernikeFitter(object):
+    """least-squares fitting of Zernike terms to wavefront maps sampled on a
+    fixed square pupil grid
+
+    The basis matrix and its pseudo-inverse are computed once on creation.
+    Use ``getZernikeFitter()`` to get a cached fitter.
+
+    Attributes
+    ----------
+    which : string
+        ``fringe``, ``standard`` or ``annular``
+    nterms : integer
+        number of fitted terms
+    sampling : integer
+        grid size
+    obscuration : float
+        central obscuration ratio
+    px, py : ndarray
+        normalized pupil coordinates of the points within the pupil
+    mask : ndarray of bool
+        ``sampling`` x ``sampling`` mask of the points within the pupil
+    basis : ndarray
+        basis matrix of shape (len(px), nterms)
+    pinv : ndarray
+        pseudo-inverse of ``basis``, of shape (nterms, len(px))
+    """
+    def __init__(self, which='fringe', nterms=None, sampling=32, obscuration=0.0):
+        assert which in _max_terms, "which must be 'fringe', 'standard' or 'annular'"
+        self.which = which
+        self.nterms = nterms or _max_terms[which]
+        self.sampling = sampling
+        self.obscuration = obscuration
+        self.px, self.py, self.mask = pupilGrid(sampling, obscuration)
+        rho = _np.hypot(self.px, self.py)
+        theta = _np.arctan2(self.py, self.px)
+        self.basis = zernikeBasis(rho, theta, self.nterms, which, obscuration)
+        self.pinv = _np.linalg.pinv(self.basis)
+
+    def fit(self, opd):
+        """fit the Zernike terms to one or more wavefront maps
+
+        Parameters
+        ----------
+        opd : ndarray
+            wavefront map(s) of shape (sampling, sampling) or
+            (nfields, sampling, sampling). Points outside the pupil are
+            ignored; ``NaN`` values within the pupil (e.g. vignetted rays)
+            are excluded from the fit of the corresponding map.
+
+        Returns
+        -------
+        coeff : ndarray
+            Zernike coefficients of shape (nterms,) or (nfields, nterms)
+        rmsFitErr : float or ndarray
+            RMS of the fit residuals of each map
+        """
+        opd = _np.asarray(opd, dtype=_np.float64)
+        single = opd.ndim == 2
+        maps = opd.reshape(-1, self.sampling, self.sampling)[:, self.mask]
+        valid = _np.isfinite(maps)
+        full = valid.all(axis=1)
+        coeff = _np.empty((len(maps), self.nterms))
+        # maps sampled over the full pupil share the precomputed pseudo-inverse
+        coeff[full] = maps[full].dot(self.pinv.T)
+        for i in _np.flatnonzero(~full):
+            v = valid[i]
+            if v.sum() < self.nterms:
+                coeff[i] = _np.nan
+                continue
+            coeff[i] = _np.linalg.lstsq(self.basis[v], maps[i, v], rcond=None)[0]
+        resid = _np.where(valid, maps - coeff.dot(self.basis.T), 0.0)
+        nvalid = _np.maximum(valid.sum(axis=1), 1)
+        rmsFitErr = _np.sqrt((resid**2).sum(axis=1)/nvalid)
+        if single:
+            return coeff[0], rmsFitErr[0]
+        return coeff, rmsFitErr
+
+    def evaluate(self, coeff):
+        """returns the wavefront map(s) synthesized from Zernike coefficients
+
+        Parameters
+        ----------
+        coeff : ndarray
+            coefficients of shape (nterms,) or (nfields, nterms)
+
+        Returns
+        -------
+        opd : ndarray
+            wavefront map(s) of shape (sampling, sampling) or
+            (nfields, sampling, sampling), with ``NaN`` outside the pupil
+        """
+        coeff = _np.asarray(coeff, dtype=_np.float64)
+        single = coeff.ndim == 1
+        coeff = coeff.reshape(-1, self.nterms)
+        opd = _np.full((len(coeff), self.sampling, self.sampling), _np.nan)
+        opd[:, self.mask] = coeff.dot(self.basis.T)
+        return opd[0] if single else opd
+
+def getZernikeFitter(which='fringe', nterms=None, sampling=32, obscuration=0.0):
+    """returns a (cached) ``ZernikeFitter`` for the given polynomial type,
+    number of terms, pupil sampling and obscuration ratio
+
+    See ``ZernikeFitter`` for the description of the parameters.
+    """
+    key = (which, nterms or _max_terms.get(which), int(sampling), float(obscuration))
+    fitter = _fitter_cache.get(key)
+    if fitter is None:
+        if len(_fitter_cache) >= _FITTER_CACHE_SIZE:
+            _fitter_cache.pop(next(iter(_fitter_cache)))
+        fitter = ZernikeFitter(*key)
+        _fitter_cache[key] = fitter
+    return fitter
+
+def fitZernike(opd, which='fringe', nterms=None, obscuration=0.0):
+    """fit Zernike terms to one or more square wavefront maps
+
+    Parameters
+    ----------
+    opd : ndarray
+        wavefront map(s) of shape (N, N) or (nfields, N, N) sampled over the
+        normalized pupil ``[-1, 1] x [-1, 1]``; ``NaN`` values are ignored
+    which : string, optional
+        ``fringe`` (default), ``standard`` or ``annular``
+    nterms : integer, optional
+        number of terms to fit. Default is the maximum number of terms
+        supported by Zemax for the type
+    obscuration : float, optional
+        central obscuration ratio
+
+    Returns
+    -------
+    coeff : ndarray
+        Zernike coefficients of shape (nterms,) or (nfields, nterms), in
+        the same units as ``opd``
+    rmsFitErr : float or ndarray
+        RMS of the fit residuals
+
+    Examples
+    --------
+    >>> coeff, rmsFitErr = fitZernike(opdMaps, which='standard', nterms=15)
+    """
+    opd = _np.asarray(opd, dtype=_np.float64)
+    fitter = getZernikeFitter(which, nterms, opd.shape[-1], obscuration)
+    return fitter.fit(opd)
@@ -16,14 +16,26 @@ import collections as _co
 import ctypes as _ctypes
 from struct import unpack as _unpack
 from struct import pack as _pack
+from struct import unpack_from as _unpack_from
 import math as _math
 import re as _re
+import time as _time
+import tempfile as _tempfile
+import shutil as _shutil
+import threading as _threading
+import itertools as _itertools
+import mmap as _mmap
 
 import pyzdde.config as _config
 _global_pyver3 = _config._global_pyver3
 
 if _global_pyver3:
    xrange = range
+   import queue as _queue
+   _string_types = (str,)
+else:
+   import Queue as _queue
+   _string_types = (str, unicode)
 
 try:
     import numpy as _np
@@ -38,6 +50,89 @@ class ZemaxRay():
     """ Class that allows the creation and import of Zemax ray files
     
     """
+    # Data fields and number format of a compressed rayfile (class attributes,
+    # shared by all the rays)
+    compressed_zrd = [
+                ('status', _ctypes.c_uint),
+                ('level', _ctypes.c_int),
+                ('hit_object', _ctypes.c_int),
+                ('hit_face', _ctypes.c_int),
+                ('unused', _ctypes.c_int),
+                ('in_object', _ctypes.c_int),
+                ('parent', _ctypes.c_int),
+                ('storage', _ctypes.c_int),
+                ('xybin', _ctypes.c_int),
+                ('lmbin', _ctypes.c_int),
+                ('index', _ctypes.c_float),
+                ('starting_phase', _ctypes.c_float),
+                ('x', _ctypes.c_float),
+                ('y', _ctypes.c_float),
+                ('z', _ctypes.c_float),
+                ('l', _ctypes.c_float),
+                ('m', _ctypes.c_float),
+                ('n', _ctypes.c_float),
+                ('nx', _ctypes.c_float),
+                ('ny', _ctypes.c_float),
+                ('nz', _ctypes.c_float),
+                ('path_to', _ctypes.c_float),
+                ('intensity', _ctypes.c_float),
+                ('phase_of', _ctypes.c_float),
+                ('phase_at', _ctypes.c_float),
+                ('exr', _ctypes.c_float),
+                ('exi', _ctypes.c_float),
+                ('eyr', _ctypes.c_float),
+                ('eyi', _ctypes.c_float),
+                ('ezr', _ctypes.c_float),
+                ('ezi', _ctypes.c_float)
+                ]
+
+    # Data fields and number format of an uncompressed rayfile
+    uncompressed_zrd = [
+                ('status', _ctypes.c_uint),
+                ('level', _ctypes.c_int),
+                ('hit_object', _ctypes.c_int),
+                ('hit_face', _ctypes.c_int),
+                ('unused', _ctypes.c_int),
+                ('in_object', _ctypes.c_int),
+                ('parent', _ctypes.c_int),
+                ('storage', _ctypes.c_int),
+                ('xybin', _ctypes.c_int),
+                ('lmbin', _ctypes.c_int),
+                ('index', _ctypes.c_double),
+                ('starting_phase', _ctypes.c_double),
+                ('x', _ctypes.c_double),
+                ('y', _ctypes.c_double),
+                ('z', _ctypes.c_double),
+                ('l', _ctypes.c_double),
+                ('m', _ctypes.c_double),
+                ('n', _ctypes.c_double),
+                ('nx', _ctypes.c_double),
+                ('ny', _ctypes.c_double),
+                ('nz', _ctypes.c_double),
+                ('path_to', _ctypes.c_double),
+                ('intensity', _ctypes.c_double),
+                ('phase_of', _ctypes.c_double),
+                ('phase_at', _ctypes.c_double),
+                ('exr', _ctypes.c_double),
+                ('exi', _ctypes.c_double),
+                ('eyr', _ctypes.c_double),
+                ('eyi', _ctypes.c_double),
+                ('ezr', _ctypes.c_double),
+                ('ezi', _ctypes.c_double)
+                ]
+
+    # data fields of the Zemax text ray file
+    nsq_source_fields =  [
+                ('x', _ctypes.c_double),
+                ('y', _ctypes.c_double),
+                ('z', _ctypes.c_double),
+                ('l', _ctypes.c_double),
+                ('m', _ctypes.c_double),
+                ('n', _ctypes.c_double),
+                ('intensity', _ctypes.c_double),
+                ('wavelength', _ctypes.c_double)
+                ]
+
     def __init__(self, parent = None):      
         self.file_type = '';
         self.status = []
@@ -75,89 +170,7 @@ class ZemaxRay():
         self.zrd_type = 0
         self.zrd_version = 0
         self.n_segments = 1  # not being used
-        
 
-        self.compressed_zrd = [
-                    ('status', _ctypes.c_uint),
-                    ('level', _ctypes.c_int),
-                    ('hit_object', _ctypes.c_int),
-                    ('hit_face', _ctypes.c_int),
-                    ('unused', _ctypes.c_int),
-                    ('in_object', _ctypes.c_int),
-                    ('parent', _ctypes.c_int),
-                    ('storage', _ctypes.c_int),
-                    ('xybin', _ctypes.c_int),
-                    ('lmbin', _ctypes.c_int),
-                    ('index', _ctypes.c_float),
-                    ('starting_phase', _ctypes.c_float),
-                    ('x', _ctypes.c_float),
-                    ('y', _ctypes.c_float),
-                    ('z', _ctypes.c_float),
-                    ('l', _ctypes.c_float),
-                    ('m', _ctypes.c_float),
-                    ('n', _ctypes.c_float),
-                    ('nx', _ctypes.c_float),
-                    ('ny', _ctypes.c_float),
-                    ('nz', _ctypes.c_float),
-                    ('path_to', _ctypes.c_float),
-                    ('intensity', _ctypes.c_float),
-                    ('phase_of', _ctypes.c_float),
-                    ('phase_at', _ctypes.c_float),
-                    ('exr', _ctypes.c_float),
-                    ('exi', _ctypes.c_float),
-                    ('eyr', _ctypes.c_float),
-                    ('eyi', _ctypes.c_float),
-                    ('ezr', _ctypes.c_float),
-                    ('ezi', _ctypes.c_float)
-                    ]
-
-        # Data fields and number format of a compressed rayfile
-        self.uncompressed_zrd = [
-                    ('status', _ctypes.c_uint),
-                    ('level', _ctypes.c_int),
-                    ('hit_object', _ctypes.c_int),
-                    ('hit_face', _ctypes.c_int),
-                    ('unused', _ctypes.c_int),
-                    ('in_object', _ctypes.c_int),
-                    ('parent', _ctypes.c_int),
-                    ('storage', _ctypes.c_int),
-                    ('xybin', _ctypes.c_int),
-                    ('lmbin', _ctypes.c_int),
-                    ('index', _ctypes.c_double),
-                    ('starting_phase', _ctypes.c_double),
-                    ('x', _ctypes.c_double),
-                    ('y', _ctypes.c_double),
-                    ('z', _ctypes.c_double),
-                    ('l', _ctypes.c_double),
-                    ('m', _ctypes.c_double),
-                    ('n', _ctypes.c_double),
-                    ('nx', _ctypes.c_double),
-                    ('ny', _ctypes.c_double),
-                    ('nz', _ctypes.c_double),
-                    ('path_to', _ctypes.c_double),
-                    ('intensity', _ctypes.c_double),
-                    ('phase_of', _ctypes.c_double),
-                    ('phase_at', _ctypes.c_double),
-                    ('exr', _ctypes.c_double),
-                    ('exi', _ctypes.c_double),
-                    ('eyr', _ctypes.c_double),
-                    ('eyi', _ctypes.c_double),
-                    ('ezr', _ctypes.c_double),
-                    ('ezi', _ctypes.c_double)
-                    ]
-
-        # data fields of the Zemax text ray file
-        self.nsq_source_fields =  [
-                    ('x', _ctypes.c_double),
-                    ('y', _ctypes.c_double),
-                    ('z', _ctypes.c_double),
-                    ('l', _ctypes.c_double),
-                    ('m', _ctypes.c_double),
-                    ('n', _ctypes.c_double),
-                    ('intensity', _ctypes.c_double),
-                    ('wavelength', _ctypes.c_double)
-                    ]
-                    
     def __str__(self):
         if self.file_type == 'uncompressed':
             fields = 'uncompressed_zrd'
@@ -185,10 +198,18 @@ class NSQSource():
         self.rays = [];
 
     def set_rays(self, x, y, z, l, m, n, intensity, wavelength):
+        """append one ``ZemaxRay`` per source ray to ``rays``
+
+        Use ``writeSourceFile()`` or ``SourceFileWriter`` to write large
+        numbers of rays directly from arrays to a source file.
+        """
+        values = dict(x=x, y=y, z=z, l=l, m=m, n=n, intensity=intensity,
+                      wavelength=wavelength)
         for ii in range(0,len(x)):
-            self.rays.append(ZemaxRay())
-            for field in self.rays[-1].nsq_source_fields:
-                 setattr(self.rays[-1],field[0], eval(field[0]+'['+str(ii)+']'))
+            ray = ZemaxRay()
+            for field, _ in ray.nsq_source_fields:
+                setattr(ray, field, values[field][ii])
+            self.rays.append(ray)
                  
 
 def read_n_bytes(fileHandle, formatChar):
@@ -220,8 +241,8 @@ def read_n_bytes(fileHandle, formatChar):
         
 
 def readZRDFile(file_name, max_segs_per_ray=1000):
-    """import a ZRD file into an array of `ZemaxRay`. Currently, the function can only
-    read uncompressed ZRD files.
+    """import a ZRD file into an array of `ZemaxRay`. Without Numpy, the function can
+    only read uncompressed ZRD files.
     
     Usage: ``readZRD(filename [, max_segs_per_ray])``
     
@@ -241,7 +262,13 @@ def readZRDFile(file_name, max_segs_per_ray=1000):
     Examples
     --------
     >>> zrd = readZRD('rays.zrd')
+
+    See Also
+    --------
+    readZRDArray() : columnar (numpy) version, much faster for large files
     """
+    if _global_np:
+        return _zrdArrayToRays(readZRDArray(file_name, max_segs_per_ray))
     zrd = []
     FILE_CURR_POS = 1
     c_int, c_uint = _ctypes.c_int, _ctypes.c_uint 
@@ -249,8 +276,7 @@ def readZRDFile(file_name, max_segs_per_ray=1000):
     format_dict = {c_int:'i', c_uint:'I', c_double:'d', c_float:'f'}
     file_handle = open(file_name, "rb")
     first_int = read_n_bytes(file_handle, formatChar='i')
-    zrd_type = _math.floor(first_int/10000)
-    zrd_version = _math.fmod(first_int,10000) 
+    zrd_type, zrd_version = divmod(first_int, 10000)
     max_n_segments = read_n_bytes(file_handle, formatChar='i')
     if zrd_type == 0:
         file_type = 'uncompressed'
@@ -301,7 +327,8 @@ def writeZRDFile(rayArray, file_name, file_type):
         name of the zrd file (provide full path)
     file_type: string
         type of the zrd file ('uncompressed' or 'compressed'). For compressed type,
-        currently the function only writes as compressed full data (CFD) format
+        the function writes as compressed full data (CFD) format. Without Numpy, only
+        the uncompressed type can be written
     
     Returns
     -------
@@ -310,8 +337,16 @@ def writeZRDFile(rayArray, file_name, file_type):
     Examples
     --------
     >>> writeZRD(rayArray, 'rays.zrd','uncompressed')
+
+    See Also
+    --------
+    writeZRDArray() : writes columnar ray tables, including the CBD format
     """
-    if file_type is not 'uncompressed':  # Temporary .... to remove after complete implementation
+    if _global_np:
+        db = RayDatabase.fromRays(rayArray)
+        writeZRDArray(db, file_name, file_type, rayArray[0].zrd_version)
+        return
+    if file_type != 'uncompressed':  # Temporary .... to remove after complete implementation
         raise NotImplementedError('Function cannot write to compressed file format')
     comp_type = 'uncompressed_zrd' if (file_type == 'uncompressed') else 'compressed_zrd'
     zrd_type = 0 if (file_type == 'uncompressed') else 20000
@@ -330,8 +365,1191 @@ def writeZRDFile(rayArray, file_name, file_type):
                 file_handle.write(_pack(format_char, getattr(ray, field)[ss]))
     file_handle.close()
 
+#%% Vectorized ZRD reading (requires Numpy)
+
+# Data fields and number format of a segment of an uncompressed ZRD file
+_zrdUFDFields = ([('status', 'u4')]
+                 + [(name, 'i4') for name in ('level', 'hit_object', 'hit_face',
+                                              'unused', 'in_object', 'parent',
+                                              'storage', 'xybin', 'lmbin')]
+                 + [(name, 'f8') for name in ('index', 'starting_phase', 'x',
+                                              'y', 'z', 'l', 'm', 'n', 'nx', 'ny',
+                                              'nz', 'path_to', 'intensity',
+                                              'phase_of', 'phase_at', 'exr', 'exi',
+                                              'eyr', 'eyi', 'ezr', 'ezi')])
+
+if _global_np:
+    # numpy structured dtype of a segment of an uncompressed ZRD file (208 bytes)
+    zrdUFDDtype = _np.dtype([(name, '<' + fmt) for name, fmt in _zrdUFDFields])
+
+zrdInfo = _co.namedtuple('zrdInfo', ['file_type', 'zrd_type', 'zrd_version',
+                                     'max_n_segments'])
+zrdArray = _co.namedtuple('zrdArray', ['info', 'segments', 'offsets'])
+
+def _readZRDHeader(header):
+    """returns the ``zrdInfo`` of the first 8 bytes of a ZRD file"""
+    first_int, max_n_segments = _unpack('<ii', header[:8])
+    zrd_type, zrd_version = divmod(first_int, 10000)
+    file_type = {0 : 'uncompressed', 1 : 'compressed basic',
+                 2 : 'compressed full'}.get(zrd_type, 'unknown')
+    return zrdInfo(file_type, zrd_type, zrd_version, max_n_segments)
+
+# number of rays (or segments) of the blocks of the scans of the ZRD files
+_ZRD_SCAN_BLOCK = 2**18
+
+def _iterZRDRayOffsets(buf, start=8, segSize=208, max_segs_per_ray=None,
+                       blockSize=None):
+    """iterate over the byte offsets of the segment data of the rays of an
+    uncompressed ZRD file and the number of segments of the rays, by blocks
+
+    Parameters
+    ----------
+    buf : buffer
+        content of the file (bytes, mmap or numpy uint8 array)
+    start : integer
+        byte offset of the first ray
+    segSize : integer
+        size of a segment in bytes
+    max_segs_per_ray : integer, optional
+        if not ``None``, the scan stops at the first ray having more
+        segments (corrupted or unsupported file)
+    blockSize : integer, optional
+        number of rays per block (default ``_ZRD_SCAN_BLOCK``)
+
+    Returns
+    -------
+    blocks : generator
+        of dictionaries with the int64 arrays 'byteOffsets' (offset of the
+        first segment of every ray) and 'numSegs' (number of segments of
+        every ray). At least one (possibly empty) block is returned
+    """
+    size = len(buf)
+    byteOffsets, numSegs = [], []
+    blockSize = blockSize or _ZRD_SCAN_BLOCK
+    pos = start
+    while pos + 4 <= size:
+        n = _unpack_from('<i', buf, pos)[0]
+        if n < 0 or (max_segs_per_ray is not None and n > max_segs_per_ray):
+            print("n_segments ({}) > {} at byte-offset position {}. Closing file and"
+                  " exiting".format(n, max_segs_per_ray, pos))
+            break
+        if pos + 4 + n*segSize > size:
+            print("Truncated ray at byte-offset position {}".format(pos))
+            break
+        byteOffsets.append(pos + 4)
+        numSegs.append(n)
+        pos += 4 + n*segSize
+        if len(numSegs) >= blockSize:
+            yield {'byteOffsets' : _np.array(byteOffsets, dtype=_np.int64),
+                   'numSegs' : _np.array(numSegs, dtype=_np.int64)}
+            byteOffsets, numSegs = [], []
+    yield {'byteOffsets' : _np.array(byteOffsets, dtype=_np.int64),
+           'numSegs' : _np.array(numSegs, dtype=_np.int64)}
+
+def _rawToNpy(rawName, npyName, dtype, count):
+    """writes the ``count`` values of type ``dtype`` of the raw file
+    ``rawName`` to the ``.npy`` file ``npyName``, without loading them"""
+    header = {'descr' : _np.lib.format.dtype_to_descr(_np.dtype(dtype)),
+              'fortran_order' : False, 'shape' : (count,)}
+    with open(npyName, 'wb') as out:
+        _np.lib.format.write_array_header_1_0(out, header)
+        with open(rawName, 'rb') as raw:
+            _shutil.copyfileobj(raw, out, 2**20)
+
+class ZRDFile(object):
+    """random access to the rays of a ZRD file, without loading the file in
+    memory
+
+    The file is memory-mapped and the byte offset of every ray (and of
+    every segment, for the compressed formats) is found once, when the file
+    is opened. The offsets are written by blocks to an index directory
+    (``<file_name>.idx``) of ``.npy`` files beside the ZRD file, that are
+    memory-mapped too, such that the memory used doesn't grow with the size
+    of the file. The index is reused as long as the size and modification
+    time of the ZRD file don't change.
+
+    Parameters
+    ----------
+    file_name : string
+        name of the (uncompressed or compressed) zrd file
+    useIndex : bool, optional
+        if ``True`` (default), the index is read, or written if it doesn't
+        exist or is outdated. If ``False``, or if the directory of the file
+        isn't writable, the index is written to a temporary directory that
+        is deleted by ``close()``
+    max_segs_per_ray : integer, optional
+        if not ``None``, the rays following the first ray having more
+        segments are ignored
+
+    Attributes
+    ----------
+    info : namedtuple
+        ``zrdInfo`` of the header of the file
+    numSegs : ndarray
+        number of segments of every ray (memory-mapped)
+    offsets : ndarray
+        cumulative number of segments (length ``len(self) + 1``,
+        memory-mapped); the
+        segments of the ray ``i`` have the numbers ``offsets[i]`` to
+        ``offsets[i+1] - 1`` in the file
+
+    Notes
+    -----
+    ``zrd[i]`` returns the segments of the ray ``i`` as a read-only
+    structured array (dtype ``zrdUFDDtype``), that is a view of the file
+    (no copy). Slicing (``zrd[i:j]``) and iteration return such views for
+    every ray. Since the segments of consecutive rays are separated by the
+    segment count in the file, data of several rays cannot be one view;
+    use ``segments()`` or ``iterChunks()`` to get columnar copies of
+    several rays at once. The segments of compressed (CBD, CFD) files are
+    decoded on access, so ``zrd[i]`` is then a copy; the index of these
+    files holds the offset, flags and fields of every segment (10 bytes
+    per segment, memory-mapped).
+
+    Examples
+    --------
+    >>> with ZRDFile('straylight.zrd') as zrd:
+    ...     ray = zrd[12345]
+    ...     print(ray['hit_object'], ray['intensity'])
+    ...     hits = zrd.raysHittingObject(7)
+    """
+    _indexVersion = 2
+
+    def __init__(self, file_name, useIndex=True, max_segs_per_ray=None):
+        if not _global_np:
+            raise ImportError('ZRDFile requires Numpy')
+        self.file_name = file_name
+        self._mm = _np.memmap(file_name, dtype=_np.uint8, mode='r')
+        self.info = _readZRDHeader(self._mm[:8].tobytes())
+        if self.info.zrd_type not in (0, 1, 2):
+            raise NotImplementedError('Unknown ZRD file type {}'.format(self.info.zrd_type))
+        self.compressed = self.info.zrd_type != 0
+        st = _os.stat(file_name)
+        stamp = _np.array([self._indexVersion, st.st_size, st.st_mtime,
+                           -1 if max_segs_per_ray is None else max_segs_per_ray])
+        self._indexNames = (('segStarts', 'flags', 'fields', 'numSegs', 'offsets')
+                            if self.compressed else ('byteOffsets', 'numSegs', 'offsets'))
+        self._tmpIndexDir = None
+        index = self._readIndex(stamp) if useIndex else None
+        if index is None:
+            if self.compressed:
+                with open(file_name, 'rb') as f:
+                    buf = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+                try:
+                    index = self._writeIndex(stamp, _iterCompressedScan(
+                        buf, self.info.zrd_type == 2, 8, max_segs_per_ray), useIndex)
+                finally:
+                    buf.close()
+            else:
+                index = self._writeIndex(stamp, _iterZRDRayOffsets(
+                    self._mm, 8, zrdUFDDtype.itemsize, max_segs_per_ray), useIndex)
+        if self.compressed:
+            self._segStarts, self._flags, self._fields, self.numSegs, self.offsets = index
+        else:
+            self.byteOffsets, self.numSegs, self.offsets = index
+
+    @property
+    def indexFile(self):
+        """name of the index directory"""
+        return self.file_name + '.idx'
+
+    def _loadIndex(self, directory):
+        return tuple(_np.load(_os.path.join(directory, name + '.npy'), mmap_mode='r')
+                     for name in self._indexNames)
+
+    def _readIndex(self, stamp):
+        try:
+            if _np.array_equal(_np.load(_os.path.join(self.indexFile, 'stamp.npy')), stamp):
+                return self._loadIndex(self.indexFile)
+        except (IOError, OSError, ValueError):
+            pass
+        return None
+
+    def _writeIndex(self, stamp, blocks, persistent=True):
+        """writes the blocks of the scan of the file to the index directory
+        (or to a temporary directory), and returns the memory-mapped index.
+        The stamp is written last, such that an interrupted index is
+        rebuilt"""
+        directory = self.indexFile if persistent else None
+        if directory is not None:
+            try:
+                if not _os.path.isdir(directory):
+                    _os.makedirs(directory)
+                stampFile = _os.path.join(directory, 'stamp.npy')
+                if _os.path.exists(stampFile):
+                    _os.remove(stampFile)
+            except (IOError, OSError):
+                directory = None
+        if directory is None:
+            directory = self._tmpIndexDir = _tempfile.mkdtemp(prefix='zrdindex_')
+        rawFiles = dict((name, _os.path.join(directory, name + '.tmp'))
+                        for name in self._indexNames)
+        dtypes = {'offsets' : _np.dtype(_np.int64)}
+        counts = dict.fromkeys(self._indexNames, 0)
+        outs = dict((name, open(rawFiles[name], 'wb')) for name in self._indexNames)
+        try:
+            total = _np.zeros(1, dtype=_np.int64)
+            total.tofile(outs['offsets'])
+            counts['offsets'] = 1
+            for block in blocks:
+                block['numSegs'] = block['numSegs'].astype(_np.int32)
+                block['offsets'] = total[-1] + _np.cumsum(block['numSegs'], dtype=_np.int64)
+                if len(block['offsets']):
+                    total = block['offsets'][-1:]
+                for name in self._indexNames:
+                    values = block[name]
+                    values.tofile(outs[name])
+                    dtypes[name] = values.dtype
+                    counts[name] += len(values)
+        finally:
+            for out in outs.values():
+                out.close()
+        for name in self._indexNames:
+            _rawToNpy(rawFiles[name], _os.path.join(directory, name + '.npy'),
+                      dtypes[name], counts[name])
+            _os.remove(rawFiles[name])
+        _np.save(_os.path.join(directory, 'stamp.npy'), stamp)
+        return self._loadIndex(directory)
+
+    def __len__(self):
+        return len(self.numSegs)
+
+    @property
+    def nSegments(self):
+        """total number of segments in the file"""
+        return int(self.offsets[-1])
+
+    def ray(self, i):
+        """returns the segments of the ray ``i`` as a read-only structured
+        array that is a view of the file (a decoded copy for the compressed
+        files)"""
+        if self.compressed:
+            return self.segments(i, i + 1)
+        return _np.ndarray(shape=(int(self.numSegs[i]),), dtype=zrdUFDDtype,
+                           buffer=self._mm, offset=int(self.byteOffsets[i]))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.ray(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('ray index out of range')
+        return self.ray(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.ray(i)
+
+    def segments(self, start=0, stop=None):
+        """returns the segments of the rays ``start`` to ``stop - 1`` as one
+        (columnar) structured array. The data is copied from the file
+
+        Parameters
+        ----------
+        start, stop : integer, optional
+            range of rays (default all the rays)
+
+        Returns
+        -------
+        segments : ndarray
+            structured array of dtype ``zrdUFDDtype``. The segments of the
+            ray ``i`` are ``segments[offsets[i] - offsets[start]:
+            offsets[i+1] - offsets[start]]``
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        if self.compressed:
+            first, last = self.offsets[start], self.offsets[stop]
+            return _decodeCompressedSegments(self._mm, self.info.zrd_type == 2,
+                                             self._segStarts[first:last],
+                                             self._flags[first:last],
+                                             self._fields[first:last],
+                                             self.offsets[start:stop + 1] - first)
+        numSegs = self.numSegs[start:stop]
+        segSize = zrdUFDDtype.itemsize
+        # byte offset of every segment
+        segStarts = _np.repeat(self.byteOffsets[start:stop], numSegs)
+        segStarts += segSize*(_np.arange(len(segStarts), dtype=_np.int64)
+                              - _np.repeat(self.offsets[start:stop] - self.offsets[start], numSegs))
+        # overlapping rows of segSize bytes starting at every byte of the file
+        rows = _np.lib.stride_tricks.as_strided(self._mm, shape=(max(len(self._mm) - segSize + 1, 0), segSize),
+                                                strides=(1, 1))
+        return _np.ascontiguousarray(rows[segStarts]).view(zrdUFDDtype).reshape(-1)
+
+    def iterChunks(self, chunkSize=100000):
+        """iterate over the file by chunks of rays
+
+        Parameters
+        ----------
+        chunkSize : integer, optional
+            number of rays per chunk
+
+        Returns
+        -------
+        chunks : generator
+            of ``zrdArray`` namedtuples (info, segments, offsets) of the
+            chunks; the ``offsets`` are relative to the chunk
+        """
+        for start in range(0, len(self), chunkSize):
+            stop = min(start + chunkSize, len(self))
+            yield zrdArray(self.info, self.segments(start, stop),
+                           self.offsets[start:stop + 1] - self.offsets[start])
+
+    def read(self):
+        """returns the whole file as a ``zrdArray`` (see ``readZRDArray()``)"""
+        return zrdArray(self.info, self.segments(), self.offsets.copy())
+
+    def raysHittingObject(self, obj, chunkSize=100000):
+        """returns the indices of the rays with at least one segment that
+        hits the object number ``obj``
+
+        Parameters
+        ----------
+        obj : integer
+            object number
+        chunkSize : integer, optional
+            number of rays read at once
+
+        Returns
+        -------
+        rays : ndarray
+            sorted ray indices
+        """
+        rays = []
+        for start, chunk in zip(range(0, len(self), chunkSize), self.iterChunks(chunkSize)):
+            segIdx = _np.flatnonzero(chunk.segments['hit_object'] == obj)
+            rays.append(_np.unique(_np.searchsorted(chunk.offsets, segIdx, 'right') - 1) + start)
+        return _np.concatenate(rays) if rays else _np.zeros(0, dtype=_np.int64)
+
+    def close(self):
+        """release the memory maps of the file and of its index (the views
+        of the rays that are still referenced keep them open), and delete
+        the temporary index"""
+        self._mm = None
+        self.numSegs = self.offsets = None
+        if self.compressed:
+            self._segStarts = self._flags = self._fields = None
+        else:
+            self.byteOffsets = None
+        if self._tmpIndexDir is not None:
+            _shutil.rmtree(self._tmpIndexDir, ignore_errors=True)
+            self._tmpIndexDir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def readZRDArray(file_name, max_segs_per_ray=None):
+    """read a ZRD file into a columnar (numpy structured) array of all the
+    segments of all the rays
+
+    The uncompressed (UFD) and compressed (CBD, CFD) formats are read. The
+    compressed files are decoded into the same columns; the fields that
+    these files don't store are 0 (see the notes on the layout of the
+    compressed segments in the source).
+
+    Usage: ``readZRDArray(file_name [, max_segs_per_ray])``
+
+    Parameters
+    ----------
+    file_name : string
+        name of the zrd file to be imported
+    max_segs_per_ray : integer, optional
+        if not ``None``, the reading stops at the first ray having more
+        segments
+
+    Returns
+    -------
+    zrd : namedtuple
+        ``zrdArray`` with the fields:
+
+        * info : ``zrdInfo`` namedtuple (file_type, zrd_type, zrd_version,
+          max_n_segments) of the file header
+        * segments : structured array of dtype ``zrdUFDDtype`` of all the
+          segments, ray after ray. The fields have the same names as the
+          attributes of ``ZemaxRay``, e.g. ``segments['x']``
+        * offsets : int64 array of length number of rays + 1. The segments
+          of the ray ``i`` are ``segments[offsets[i]:offsets[i+1]]``
+
+    Examples
+    --------
+    >>> zrd = readZRDArray('rays.zrd')
+    >>> nRays = len(zrd.offsets) - 1
+    >>> ray3 = zrd.segments[zrd.offsets[3]:zrd.offsets[4]]
+    >>> xyz = zrd.segments[['x', 'y', 'z']]
+
+    See Also
+    --------
+    ZRDFile : random access to the rays without reading the whole file
+    """
+    if not _global_np:
+        raise ImportError('readZRDArray() requires Numpy')
+    with open(file_name, 'rb') as f:
+        info = _readZRDHeader(f.read(8))
+        if info.zrd_type in (1, 2):
+            f.seek(0)
+            return _decodeCompressedZRD(f.read(), info, max_segs_per_ray)
+    zrdFile = ZRDFile(file_name, useIndex=False, max_segs_per_ray=max_segs_per_ray)
+    try:
+        return zrdFile.read()
+    finally:
+        zrdFile.close()
+
+#%% Compressed ZRD (CBD and CFD) decoding
+#
+# Layout of a segment in the compressed files (little endian):
+#
+# CBD (compressed basic data):
+#   flags (uint8) : bit 0 -> status is uint32 (else uint16); bits 4-7 -> bins
+#   status (uint16 or uint32)
+#   hit_object (high nibble) and parent (low nibble) (uint8)
+#   lmbin, xybin (int32), if bins
+#   x, y, z, intensity (float32)
+#   first segment of a ray only: uint8 (unused) and wavelength (float32)
+#
+# CFD (compressed full data):
+#   flags (uint8) : bit 0 -> status is uint32; bit 5 -> xybin; bit 6 -> lmbin
+#   fields (uint8): bit 2 -> ex, ey, ez; bit 3 -> index; bit 4 -> path_to
+#   status (uint16 or uint32)
+#   hit_object, hit_face, parent, in_object (uint8)
+#   xybin, lmbin (int32), if flagged
+#   exr, exi, eyr, eyi, ezr, ezi, index, path_to (float32), if flagged
+#   x, y, z, intensity, l, m, n, nx, ny, nz (float32)
+#   first segment of a ray only: uint8 (unused)
+#
+# The level isn't stored; it is the level of the parent segment + 1. As in
+# the uncompressed files, ``nx`` of the first segment is the wavelength. The
+# index is 1 if not stored (always in a CBD file); the other fields that
+# aren't stored are 0. Flags and fields bits not listed above are not supported.
+# The parent of a segment must be an earlier segment of the same ray; a
+# parent number that isn't (for example, a parent wider than 4 bits in a CBD
+# file) is rejected, as the layout doesn't describe the segment.
+
+_cbdFlagsKnown, _cfdFlagsKnown, _cfdFieldsKnown = 0xF1, 0x61, 0x1C
+
+def _iterCompressedScan(buf, cfd, start=8, max_segs_per_ray=None,
+                        blockSize=None):
+    """iterate over the byte offset, flags and fields (CFD) bytes of the
+    segments and the number of segments of the rays of a compressed ZRD
+    file, by blocks of whole rays of about ``blockSize`` segments (default
+    ``_ZRD_SCAN_BLOCK``)
+
+    Returns
+    -------
+    blocks : generator
+        of dictionaries with the arrays 'segStarts' (int64), 'flags',
+        'fields' (uint8, empty for CBD files) and 'numSegs' (int64). At
+        least one (possibly empty) block is returned
+    """
+    size = len(buf)
+    segStarts, flags, numSegs = [], [], []
+    blockSize = blockSize or _ZRD_SCAN_BLOCK
+    fields = []
+    def block():
+        return {'segStarts' : _np.array(segStarts, dtype=_np.int64),
+                'flags' : _np.array(flags, dtype=_np.uint8),
+                'fields' : _np.array(fields, dtype=_np.uint8),
+                'numSegs' : _np.array(numSegs, dtype=_np.int64)}
+    pos = start
+    while pos + 4 <= size:
+        n = _unpack_from('<i', buf, pos)[0]
+        if n < 0 or (max_segs_per_ray is not None and n > max_segs_per_ray):
+            print("n_segments ({}) > {} at byte-offset position {}. Closing file and"
+                  " exiting".format(n, max_segs_per_ray, pos))
+            break
+        pos += 4
+        first = len(segStarts)
+        for k in range(n):
+            if pos + 2 > size:
+                pos = size + 1
+                break
+            flag = buf[pos]
+            if isinstance(flag, str):  # Python 2
+                flag = ord(flag)
+            segStarts.append(pos)
+            flags.append(flag)
+            statusSize = 4 if flag & 1 else 2
+            if cfd:
+                field = buf[pos + 1]
+                if isinstance(field, str):
+                    field = ord(field)
+                if flag & ~_cfdFlagsKnown or field & ~_cfdFieldsKnown or not field & 4:
+                    raise NotImplementedError('Unsupported CFD segment encoding (0x{:02x}, '
+                                              '0x{:02x}) at byte-offset position {}'
+                                              .format(flag, field, pos))
+                fields.append(field)
+                pos += (6 + statusSize + 4*(((flag >> 5) & 1) + ((flag >> 6) & 1))
+                        + 4*(10 + 6 + ((field >> 3) & 1) + ((field >> 4) & 1)))
+            else:
+                if flag & ~_cbdFlagsKnown:
+                    raise NotImplementedError('Unsupported CBD segment encoding (0x{:02x}) '
+                                              'at byte-offset position {}'.format(flag, pos))
+                pos += 2 + statusSize + (8 if flag & 0xF0 else 0) + 16
+            if k == 0:
+                pos += 1 if cfd else 5
+        if pos > size:
+            print("Truncated ray at byte-offset position {}".format(segStarts[first]))
+            del segStarts[first:], flags[first:], fields[first:]
+            break
+        numSegs.append(n)
+        if len(segStarts) >= blockSize:
+            yield block()
+            segStarts, flags, fields, numSegs = [], [], [], []
+    yield block()
+
+def _scanCompressedZRD(buf, cfd, start=8, max_segs_per_ray=None):
+    """returns the byte offset, flags and fields (CFD) bytes of every
+    segment and the number of segments of every ray of a compressed ZRD file
+    """
+    blocks = list(_iterCompressedScan(buf, cfd, start, max_segs_per_ray))
+    return tuple(_np.concatenate([b[name] for b in blocks])
+                 for name in ('segStarts', 'flags', 'fields', 'numSegs'))
+
+def _gatherValues(raw, pos, dtype):
+    """returns the values of type ``dtype`` at the byte offsets ``pos`` of
+    the uint8 array ``raw``"""
+    dtype = _np.dtype(dtype)
+    rows = _np.lib.stride_tricks.as_strided(raw, shape=(max(len(raw) - dtype.itemsize + 1, 0),
+                                                        dtype.itemsize), strides=(1, 1))
+    return _np.ascontiguousarray(rows[pos]).view(dtype).reshape(-1)
+
+def _segmentLevels(parent, offsets):
+    """returns the level of every segment from the (ray relative) parent
+    segment numbers"""
+    numSegs = _np.diff(offsets)
+    rayStart = _np.repeat(offsets[:-1], numSegs)
+    root = _np.arange(len(parent)) == rayStart
+    globalParent = _np.where(root, _np.arange(len(parent)), rayStart + parent)
+    globalParent = _np.clip(globalParent, 0, max(len(parent) - 1, 0))
+    level = _np.zeros(len(parent), dtype=_np.int32)
+    while len(level):
+        newLevel = _np.where(root, 0, level[globalParent] + 1)
+        if _np.array_equal(newLevel, level) or newLevel.max() > len(level):
+            break
+        level = newLevel
+    return level
+
+def _decodeCompressedZRD(buf, info, max_segs_per_ray=None):
+    """decode a compressed (CBD or CFD) ZRD file into a ``zrdArray``"""
+    cfd = info.zrd_type == 2
+    segStarts, flags, fields, numSegs = _scanCompressedZRD(buf, cfd, 8, max_segs_per_ray)
+    offsets = _np.zeros(len(numSegs) + 1, dtype=_np.int64)
+    _np.cumsum(numSegs, out=offsets[1:])
+    raw = _np.frombuffer(buf, dtype=_np.uint8)
+    seg = _decodeCompressedSegments(raw, cfd, segStarts, flags, fields, offsets)
+    return zrdArray(info, seg, offsets)
+
+def _decodeCompressedSegments(raw, cfd, segStarts, flags, fields, offsets):
+    """decode the compressed segments (of whole rays) at the byte offsets
+    ``segStarts`` of the uint8 array ``raw``; the ``offsets`` of the rays
+    are relative to the first segment"""
+    numSegs = _np.diff(offsets)
+    seg = _np.zeros(len(segStarts), dtype=zrdUFDDtype)
+    wide = (flags & 1).astype(bool)
+    statusPos = segStarts + (2 if cfd else 1)
+    seg['status'] = _np.where(wide, _gatherValues(raw, statusPos, '<u4'),
+                              _gatherValues(raw, statusPos, '<u2'))
+    pos = statusPos + _np.where(wide, 4, 2)
+    seg['index'] = 1.0
+    if cfd:
+        for k, name in enumerate(('hit_object', 'hit_face', 'parent', 'in_object')):
+            seg[name] = raw[pos + k]
+        pos += 4
+        for bit, name in ((0x20, 'xybin'), (0x40, 'lmbin')):
+            has = (flags & bit).astype(bool)
+            seg[name][has] = _gatherValues(raw, pos[has], '<i4')
+            pos += 4*has
+        for name in ('exr', 'exi', 'eyr', 'eyi', 'ezr', 'ezi'):
+            seg[name] = _gatherValues(raw, pos, '<f4')
+            pos += 4
+        for bit, name in ((0x08, 'index'), (0x10, 'path_to')):
+            has = (fields & bit).astype(bool)
+            seg[name][has] = _gatherValues(raw, pos[has], '<f4')
+            pos += 4*has
+        floatFields = ('x', 'y', 'z', 'intensity', 'l', 'm', 'n', 'nx', 'ny', 'nz')
+    else:
+        hitParent = raw[pos]
+        seg['hit_object'] = hitParent >> 4
+        seg['parent'] = hitParent & 0x0F
+        pos += 1
+        has = (flags & 0xF0).astype(bool)
+        seg['lmbin'][has] = _gatherValues(raw, pos[has], '<i4')
+        seg['xybin'][has] = _gatherValues(raw, pos[has] + 4, '<i4')
+        pos += 8*has
+        floatFields = ('x', 'y', 'z', 'intensity')
+    for name in floatFields:
+        seg[name] = _gatherValues(raw, pos, '<f4')
+        pos += 4
+    if not cfd:
+        # wavelength stored after the first segment of every ray
+        seg['nx'][offsets[:-1][numSegs > 0]] = _gatherValues(raw, pos[offsets[:-1][numSegs > 0]] + 1, '<f4')
+    segNum = _np.arange(len(seg)) - _np.repeat(offsets[:-1], numSegs)
+    bad = _np.flatnonzero((segNum > 0) & (seg['parent'] >= segNum))
+    if len(bad):
+        raise NotImplementedError('Unsupported {} segment encoding at byte-offset position '
+                                  '{} (parent {} of segment {})'
+                                  .format('CFD' if cfd else 'CBD', segStarts[bad[0]],
+                                          seg['parent'][bad[0]], segNum[bad[0]]))
+    seg['level'] = _segmentLevels(seg['parent'], offsets)
+    return seg
+
+#%% Vectorized ZRD writing
+
+def _scatterValues(out, pos, values, dtype):
+    """write the ``values`` as ``dtype`` at the byte offsets ``pos`` of the
+    uint8 array ``out``"""
+    dtype = _np.dtype(dtype)
+    rows = _np.lib.stride_tricks.as_strided(out, shape=(max(len(out) - dtype.itemsize + 1, 0),
+                                                        dtype.itemsize), strides=(1, 1))
+    rows[pos] = _np.ascontiguousarray(values, dtype=dtype).view(_np.uint8).reshape(-1, dtype.itemsize)
+
+def _encodeZRD(segments, offsets, zrd_type):
+    """returns the bytes (uint8 array, without the file header) of the rays
+    of a ZRD file of type ``zrd_type`` (0, 1 or 2)"""
+    numSegs = _np.diff(offsets)
+    nRays, nSegs = len(numSegs), len(segments)
+    rayOfSegment = _np.repeat(_np.arange(nRays), numSegs)
+    first = _np.zeros(nSegs, dtype=bool)
+    first[offsets[:-1][numSegs > 0]] = True
+    if zrd_type == 0:
+        sizes = _np.full(nSegs, zrdUFDDtype.itemsize, dtype=_np.int64)
+    else:
+        status = segments['status']
+        wide = status > 0xFFFF
+        if zrd_type == 1:
+            if (_np.any(segments['hit_object'] > 15) or _np.any(segments['parent'] > 15)
+                or _np.any(segments['hit_object'] < 0) or _np.any(segments['parent'] < 0)):
+                raise NotImplementedError('CBD files with object or parent numbers '
+                                          'larger than 15 are not supported')
+            hasBins = (segments['xybin'] != 0) | (segments['lmbin'] != 0)
+            flags = wide.astype(_np.uint8) | _np.where(hasBins, 0xF0, 0).astype(_np.uint8)
+            sizes = 1 + _np.where(wide, 4, 2) + 1 + 8*hasBins + 16 + 5*first
+        else:
+            for name in ('hit_object', 'hit_face', 'parent', 'in_object'):
+                if _np.any(segments[name] > 255) or _np.any(segments[name] < 0):
+                    raise NotImplementedError('CFD files with {} values larger than '
+                                              '255 are not supported'.format(name))
+            hasXY, hasLM = segments['xybin'] != 0, segments['lmbin'] != 0
+            hasIndex, hasPath = segments['index'] != 1.0, segments['path_to'] != 0.0
+            flags = (wide.astype(_np.uint8) | _np.where(hasXY, 0x20, 0).astype(_np.uint8)
+                     | _np.where(hasLM, 0x40, 0).astype(_np.uint8))
+            fields = (0x04 | _np.where(hasIndex, 0x08, 0)
+                      | _np.where(hasPath, 0x10, 0)).astype(_np.uint8)
+            sizes = (2 + _np.where(wide, 4, 2) + 4 + 4*hasXY + 4*hasLM
+                     + 4*(6 + hasIndex + hasPath + 10) + first)
+    # byte offset of every segment, after the segment count of every ray
+    segStarts = _np.zeros(nSegs, dtype=_np.int64)
+    if nSegs:
+        _np.cumsum(sizes[:-1], out=segStarts[1:])
+    segStarts += 4*(rayOfSegment + 1)
+    out = _np.zeros(int(sizes.sum()) + 4*nRays, dtype=_np.uint8)
+    rayStarts = _np.zeros(nRays, dtype=_np.int64)
+    if nRays:
+        segBefore = _np.zeros(nRays + 1, dtype=_np.int64)
+        segBefore[1:] = _np.cumsum(_np.bincount(rayOfSegment, weights=sizes,
+                                                minlength=nRays).astype(_np.int64))
+        rayStarts = segBefore[:-1] + 4*_np.arange(nRays)
+        _scatterValues(out, rayStarts, numSegs, '<i4')
+    if zrd_type == 0:
+        _scatterValues(out, segStarts, segments, zrdUFDDtype)
+        return out
+    out[segStarts] = flags
+    pos = segStarts + 1
+    if zrd_type == 2:
+        out[pos] = fields
+        pos = pos + 1
+    _scatterValues(out, pos[wide], status[wide], '<u4')
+    _scatterValues(out, pos[~wide], status[~wide], '<u2')
+    pos = pos + _np.where(wide, 4, 2)
+    if zrd_type == 1:
+        out[pos] = (segments['hit_object'] << 4) | segments['parent']
+        pos = pos + 1
+        _scatterValues(out, pos[hasBins], segments['lmbin'][hasBins], '<i4')
+        _scatterValues(out, pos[hasBins] + 4, segments['xybin'][hasBins], '<i4')
+        pos = pos + 8*hasBins
+        floatFields = ('x', 'y', 'z', 'intensity')
+    else:
+        for name in ('hit_object', 'hit_face', 'parent', 'in_object'):
+            out[pos] = segments[name]
+            pos = pos + 1
+        for has, name in ((hasXY, 'xybin'), (hasLM, 'lmbin')):
+            _scatterValues(out, pos[has], segments[name][has], '<i4')
+            pos = pos + 4*has
+        for name in ('exr', 'exi', 'eyr', 'eyi', 'ezr', 'ezi'):
+            _scatterValues(out, pos, segments[name], '<f4')
+            pos = pos + 4
+        for has, name in ((hasIndex, 'index'), (hasPath, 'path_to')):
+            _scatterValues(out, pos[has], segments[name][has], '<f4')
+            pos = pos + 4*has
+        floatFields = ('x', 'y', 'z', 'intensity', 'l', 'm', 'n', 'nx', 'ny', 'nz')
+    for name in floatFields:
+        _scatterValues(out, pos, segments[name], '<f4')
+        pos = pos + 4
+    if zrd_type == 1:
+        # unused byte (0) and wavelength after the first segment of every ray
+        _scatterValues(out, pos[first] + 1, segments['nx'][first], '<f4')
+    return out
+
+def writeZRDArray(zrd, file_name, file_type='uncompressed', zrd_version=None):
+    """write a columnar ray table to a ZRD file
+
+    Usage: ``writeZRDArray(zrd, file_name [, file_type, zrd_version])``
+
+    Parameters
+    ----------
+    zrd : namedtuple or object
+        ``zrdArray`` (see ``readZRDArray()``) or ``RayDatabase``
+    file_name : string
+        name of the zrd file (provide full path)
+    file_type : string, optional
+        'uncompressed' (default), 'compressed full' (CFD) or 'compressed
+        basic' (CBD). 'compressed' is the same as 'compressed full'
+    zrd_version : integer, optional
+        version of the ZRD format written in the header. If ``None``, the
+        version of ``zrd.info`` is used, or 2001 if unknown.
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    1. The whole file is encoded in memory with vectorized operations and
+       written at once.
+    2. The compressed formats store the floating point values in single
+       precision, and the CBD format only stores the status, object and
+       parent numbers, bins, position and intensity of the segments (see
+       the notes on the layout of the compressed segments in the source).
+       The object and parent numbers must be smaller than 16 for CBD, and
+       smaller than 256 for CFD files.
+
+    Examples
+    --------
+    >>> db = RayDatabase.fromFile('rays.zrd')
+    >>> writeZRDArray(db.select(db.raysWhere(db.segmentMask(hit_object=7))),
+    ...               'rays_obj7.zrd', 'compressed full')
+    """
+    if not _global_np:
+        raise ImportError('writeZRDArray() requires Numpy')
+    if hasattr(zrd, 'toZRDArray'):
+        zrd = zrd.toZRDArray()
+    info, segments, offsets = zrd
+    zrd_type = {'uncompressed' : 0, 'compressed basic' : 1, 'compressed full' : 2,
+                'compressed' : 2}[file_type]
+    if zrd_version is None:
+        zrd_version = info.zrd_version if info is not None else 2001
+    if info is not None:
+        max_n_segments = info.max_n_segments
+    else:
+        max_n_segments = max(_np.diff(offsets).tolist() or [0])
+    data = _encodeZRD(segments, _np.asarray(offsets, dtype=_np.int64), zrd_type)
+    with open(file_name, 'wb') as f:
+        f.write(_pack('<ii', zrd_type*10000 + int(zrd_version), max_n_segments))
+        data.tofile(f)
+
+def _zrdArrayToRays(zrd):
+    """returns the list of ``ZemaxRay`` objects of a ``zrdArray``"""
+    info, segments, offsets = zrd
+    columns = dict((name, segments[name].tolist()) for name, _ in _zrdUFDFields)
+    rays = []
+    for i in range(len(offsets) - 1):
+        start, end = int(offsets[i]), int(offsets[i+1])
+        ray = ZemaxRay()
+        ray.zrd_version = info.zrd_version
+        ray.zrd_type = info.zrd_type
+        ray.n_segments = info.max_n_segments
+        ray.file_type = 'uncompressed' if info.zrd_type == 0 else 'compressed'
+        for name, values in columns.items():
+            setattr(ray, name, values[start:end])
+        rays.append(ray)
+    return rays
+
+#%% Columnar ray database
+
+# masks of the bits of the status of the ray segments
+zrdStatusFlags = _co.OrderedDict([('terminated', 1 << 0), ('reflected', 1 << 1),
+                                  ('transmitted', 1 << 2), ('scattered', 1 << 3),
+                                  ('diffracted', 1 << 4), ('ghosted', 1 << 5),
+                                  ('diffracted_from_parent', 1 << 6),
+                                  ('scattered_from_parent', 1 << 7)])
+
+class Ray(object):
+    """light-weight view of the segments of one ray of a ``RayDatabase``
+
+    The fields of the segments (``x``, ``hit_object``, ...) are attributes
+    returning numpy views of the columns of the database. Use ``segments``
+    for the structured array of the segments.
+    """
+    __slots__ = ('db', 'index', 'start', 'stop')
+
+    def __init__(self, db, index):
+        self.db = db
+        self.index = index
+        self.start = int(db.offsets[index])
+        self.stop = int(db.offsets[index + 1])
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getattr__(self, name):
+        if name in zrdUFDDtype.names:
+            return self.db.segments[name][self.start:self.stop]
+        raise AttributeError("'Ray' object has no attribute '{}'".format(name))
+
+    @property
+    def segments(self):
+        """structured array (view) of the segments of the ray"""
+        return self.db.segments[self.start:self.stop]
+
+    @property
+    def wavelength(self):
+        """wavelength of the ray (stored in ``nx`` of the first segment)"""
+        return self.db.segments['nx'][self.start] if self.stop > self.start else None
+
+    def __repr__(self):
+        return 'Ray(index={}, segments={})'.format(self.index, len(self))
+
+class RayDatabase(object):
+    """columnar database of the rays of a ZRD file
+
+    All the segments of all the rays are stored in one structured array
+    (one column per field, dtype ``zrdUFDDtype``), ray after ray, and the
+    rays are delimited by ``offsets``.
+
+    Parameters
+    ----------
+    segments : ndarray
+        structured array of dtype ``zrdUFDDtype``
+    offsets : ndarray
+        integer array of length number of rays + 1; the segments of the ray
+        ``i`` are ``segments[offsets[i]:offsets[i+1]]``
+    info : namedtuple, optional
+        ``zrdInfo`` of the file
+
+    Notes
+    -----
+    ``db['x']`` returns the column ``x`` and ``db[i]`` the ``Ray`` view of
+    the ray ``i``. The ``*Mask()`` functions return boolean arrays over the
+    segments, that can be combined with ``&``, ``|`` and ``~``, and then
+    converted to ray numbers with ``raysWhere()`` or to a new database with
+    ``select()``.
+
+    Examples
+    --------
+    >>> db = RayDatabase.fromFile('straylight.zrd')
+    >>> ghosts = db.statusMask('ghosted') & db.segmentMask(hit_object=7)
+    >>> rays = db.raysWhere(ghosts)
+    >>> det = db.select(rays)
+    >>> after = db.descendantsMask(db.segmentMask(hit_object=3, level=2))
+    """
+    def __init__(self, segments, offsets, info=None):
+        if not _global_np:
+            raise ImportError('RayDatabase requires Numpy')
+        self.segments = segments
+        self.offsets = _np.asarray(offsets, dtype=_np.int64)
+        self.info = info
+        self._rayOfSegment = None
+        self._parentIndex = None
+
+    @classmethod
+    def fromFile(cls, file_name, max_segs_per_ray=None):
+        """returns the ``RayDatabase`` of a (compressed or uncompressed) ZRD
+        file. See ``readZRDArray()``"""
+        return cls.fromZRDArray(readZRDArray(file_name, max_segs_per_ray))
+
+    @classmethod
+    def fromZRDArray(cls, zrd):
+        """returns the ``RayDatabase`` of a ``zrdArray``"""
+        return cls(zrd.segments, zrd.offsets, zrd.info)
+
+    @classmethod
+    def fromRays(cls, rays):
+        """returns the ``RayDatabase`` of a list of ``ZemaxRay`` objects"""
+        numSegs = [len(ray.status) for ray in rays]
+        offsets = _np.zeros(len(rays) + 1, dtype=_np.int64)
+        _np.cumsum(numSegs, out=offsets[1:])
+        segments = _np.zeros(int(offsets[-1]), dtype=zrdUFDDtype)
+        for name in zrdUFDDtype.names:
+            segments[name] = [v for ray in rays for v in getattr(ray, name)]
+        info = None
+        if rays:
+            file_type = {0 : 'uncompressed', 1 : 'compressed basic',
+                         2 : 'compressed full'}.get(rays[0].zrd_type, 'unknown')
+            info = zrdInfo(file_type, rays[0].zrd_type, rays[0].zrd_version,
+                           rays[0].n_segments)
+        return cls(segments, offsets, info)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nSegments(self):
+        """total number of segments"""
+        return len(self.segments)
+
+    @property
+    def fields(self):
+        """names of the columns"""
+        return self.segments.dtype.names
+
+    def __getitem__(self, key):
+        if isinstance(key, _string_types):
+            return self.segments[key]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('ray index out of range')
+        return Ray(self, key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Ray(self, i)
+
+    @property
+    def numSegs(self):
+        """number of segments of every ray"""
+        return _np.diff(self.offsets)
+
+    @property
+    def rayOfSegment(self):
+        """ray number of every segment"""
+        if self._rayOfSegment is None:
+            self._rayOfSegment = _np.repeat(_np.arange(len(self)), self.numSegs)
+        return self._rayOfSegment
+
+    @property
+    def parentIndex(self):
+        """index (in the database) of the parent segment of every segment,
+        -1 for the first segment of the rays"""
+        if self._parentIndex is None:
+            rayStart = self.offsets[:-1][self.rayOfSegment]
+            root = _np.arange(self.nSegments) == rayStart
+            self._parentIndex = _np.where(root, -1, rayStart + self.segments['parent'])
+        return self._parentIndex
+
+    @property
+    def wavelength(self):
+        """wavelength of every ray (``nx`` of the first segment)"""
+        starts = self.offsets[:-1][self.numSegs > 0]
+        wave = _np.zeros(len(self))
+        wave[self.numSegs > 0] = self.segments['nx'][starts]
+        return wave
+
+    def segmentMask(self, **conditions):
+        """returns the boolean mask of the segments whose fields have the
+        given values
+
+        Parameters
+        ----------
+        **conditions : field=value
+            value (scalar) or sequence of allowed values of a field, for
+            example ``hit_object=3, level=[1, 2]``. All the conditions must
+            be true.
+
+        Returns
+        -------
+        mask : ndarray of bool
+        """
+        mask = _np.ones(self.nSegments, dtype=bool)
+        for name, value in conditions.items():
+            if _np.ndim(value):
+                mask &= _np.isin(self.segments[name], value)
+            else:
+                mask &= self.segments[name] == value
+        return mask
+
+    def statusMask(self, flags, anyFlag=False):
+        """returns the boolean mask of the segments whose status has the
+        ``flags`` set
+
+        Parameters
+        ----------
+        flags : integer, string or sequence of strings
+            bit mask or names of the flags in ``zrdStatusFlags``, such as
+            'ghosted' or ['reflected', 'scattered']
+        anyFlag : bool, optional
+            if ``False`` (default) all the flags must be set, else any of
+            them
+
+        Returns
+        -------
+        mask : ndarray of bool
+        """
+        if isinstance(flags, _string_types):
+            flags = [flags]
+        if not isinstance(flags, (int, _np.integer)):
+            flags = sum(zrdStatusFlags[f] for f in flags)
+        status = self.segments['status'] & flags
+        return status != 0 if anyFlag else status == flags
+
+    def descendantsMask(self, mask, includeSelf=True):
+        """returns the mask of the segments that descend (in the parent
+        lineage) from the segments of ``mask``"""
+        parent = self.parentIndex
+        child = parent >= 0
+        result = _np.asarray(mask, dtype=bool).copy()
+        while True:
+            new = result.copy()
+            new[child] |= result[parent[child]]
+            if _np.array_equal(new, result):
+                break
+            result = new
+        return result if includeSelf else result & ~_np.asarray(mask, dtype=bool)
+
+    def ancestorsMask(self, mask, includeSelf=True):
+        """returns the mask of the segments that are ancestors (parent,
+        parent of parent, ...) of the segments of ``mask``"""
+        parent = self.parentIndex
+        result = _np.asarray(mask, dtype=bool).copy()
+        while True:
+            idx = parent[result & (parent >= 0)]
+            if result[idx].all():
+                break
+            result[idx] = True
+        return result if includeSelf else result & ~_np.asarray(mask, dtype=bool)
+
+    def raysWhere(self, mask):
+        """returns the (sorted) numbers of the rays having at least one
+        segment in ``mask``"""
+        return _np.unique(self.rayOfSegment[_np.asarray(mask, dtype=bool)])
+
+    def select(self, rays):
+        """returns a new ``RayDatabase`` with the rays ``rays`` (sequence of
+        ray numbers or boolean mask over the rays)"""
+        rays = _np.arange(len(self))[rays] if _np.asarray(rays).dtype == bool else _np.asarray(rays, dtype=_np.int64)
+        numSegs = self.numSegs[rays]
+        offsets = _np.zeros(len(rays) + 1, dtype=_np.int64)
+        _np.cumsum(numSegs, out=offsets[1:])
+        segIdx = (_np.repeat(self.offsets[:-1][rays] - offsets[:-1], numSegs)
+                  + _np.arange(int(offsets[-1])))
+        return RayDatabase(self.segments[segIdx], offsets, self.info)
+
+    def toZRDArray(self):
+        """returns the database as a ``zrdArray``"""
+        return zrdArray(self.info, self.segments, self.offsets)
+
+    def toRays(self):
+        """returns the list of ``ZemaxRay`` objects of the database"""
+        info = self.info or zrdInfo('uncompressed', 0, 2001, 0)
+        return _zrdArrayToRays(zrdArray(info, self.segments, self.offsets))
+
 #%% Beam file read/write utilities
 
+# header of a Zemax beam file (ZBF)
+zbfHeader = _co.namedtuple('zbfHeader', ['version', 'nx', 'ny', 'ispol', 'units',
+                                         'dx', 'dy', 'zposition_x', 'zposition_y',
+                                         'rayleigh_x', 'rayleigh_y', 'waist_x',
+                                         'waist_y', 'lamda', 'index',
+                                         'receiver_eff', 'system_eff'])
+zbfData = _co.namedtuple('zbfData', ['header', 'Ex', 'Ey'])
+
+def _zbfFields(beam):
+    """returns the fields of a ``zbfData`` beam stacked in an array of shape
+    (npol, ny, nx)"""
+    fields = [beam.Ex] if beam.Ey is None else [beam.Ex, beam.Ey]
+    return _np.array(fields, dtype=_np.complex128)
+
+def _zbfHeaderSize(version):
+    """size in bytes of the header of a beam file"""
+    # 5 ints, 16 bytes of padding, dx, dy and 8 (version 0) or 10 (version 1)
+    # doubles, followed by 8 unused doubles in version 1
+    return 36 + 8*(2 + 8) if version == 0 else 36 + 8*(2 + 10 + 8)
+
+def _readZBFHeader(header):
+    """returns the ``zbfHeader`` of the bytes of the header of a beam file"""
+    version, nx, ny, ispol, units = _unpack('<5i', header[:20])
+    dx, dy = _unpack('<2d', header[36:52])
+    if version == 0:
+        (zposition_x, rayleigh_x, lamda, zposition_y, rayleigh_y, waist_x,
+         waist_y, index) = _unpack('<8d', header[52:116])
+        receiver_eff, system_eff = 0, 0
+    else:
+        (zposition_x, rayleigh_x, waist_x, zposition_y, rayleigh_y, waist_y,
+         lamda, index, receiver_eff, system_eff) = _unpack('<10d', header[52:132])
+    return zbfHeader(version, nx, ny, ispol, units, dx, dy, zposition_x,
+                     zposition_y, rayleigh_x, rayleigh_y, waist_x, waist_y,
+                     lamda, index, receiver_eff, system_eff)
+
+def readBeamFileArray(beamfilename, mmap=False):
+    """Read a Zemax Beam file (ZBF) into complex numpy arrays
+
+    Parameters
+    ----------
+    beamfilename : string
+        the filename of the beam file to read
+    mmap : bool, optional
+        if ``True``, the fields are returned as read-only memory-mapped
+        views of the file instead of being read in memory
+
+    Returns
+    -------
+    beam : namedtuple
+        ``zbfData`` with the fields:
+
+        * header : ``zbfHeader`` namedtuple (version, nx, ny, ispol, units,
+          dx, dy, zposition_x, zposition_y, rayleigh_x, rayleigh_y, waist_x,
+          waist_y, lamda, index, receiver_eff, system_eff)
+        * Ex : complex128 array of shape (ny, nx) of the x polarization
+        * Ey : complex128 array of shape (ny, nx) of the y polarization, or
+          ``None`` if the beam isn't polarized
+
+    Notes
+    -----
+    The first index of the arrays is the y sample and the second the x
+    sample, as stored in the file. Use ``beamFileAxes()`` to get the
+    coordinates of the samples.
+
+    Examples
+    --------
+    >>> beam = readBeamFileArray('gaussian.zbf')
+    >>> irradiance = abs(beam.Ex)**2
+    >>> x, y = beamFileAxes(beam.header)
+    """
+    if not _global_np:
+        raise ImportError('readBeamFileArray() requires Numpy')
+    with open(beamfilename, 'rb') as f:
+        header = _readZBFHeader(f.read(_zbfHeaderSize(1)))
+    offset = _zbfHeaderSize(header.version)
+    shape = (header.ny, header.nx)
+    dtype = _np.dtype('<c16')  # interleaved (real, imag) doubles
+    npol = 2 if header.ispol else 1
+    if mmap:
+        data = _np.memmap(beamfilename, dtype=dtype, mode='r', offset=offset,
+                          shape=(npol,) + shape)
+    else:
+        with open(beamfilename, 'rb') as f:
+            f.seek(offset)
+            data = _np.fromfile(f, dtype=dtype, count=npol*header.nx*header.ny)
+        data = data.reshape((npol,) + shape)
+    return zbfData(header, data[0], data[1] if header.ispol else None)
+
+def beamFileAxes(header):
+    """returns the x and y coordinates of the samples of a beam file
+
+    Parameters
+    ----------
+    header : namedtuple
+        ``zbfHeader`` of the beam file (see ``readBeamFileArray()``)
+
+    Returns
+    -------
+    x : ndarray
+        1-D array of the ``nx`` x coordinates
+    y : ndarray
+        1-D array of the ``ny`` y coordinates
+
+    Notes
+    -----
+    The sample ``(nx//2, ny//2)`` is at the origin. Use
+    ``numpy.meshgrid(x, y)`` if the coordinates of every sample are needed.
+    """
+    x = (_np.arange(header.nx) - header.nx//2)*header.dx
+    y = (_np.arange(header.ny) - header.ny//2)*header.dy
+    return x, y
+
 def readBeamFile(beamfilename):
     """Read in a Zemax Beam file
 
@@ -372,7 +1590,27 @@ def readBeamFile(beamfilename):
         a tuple containing two dimensional lists with the real and
         imaginary parts of the x and y polarizations of the beam
 
+    See Also
+    --------
+    readBeamFileArray() : reads the fields into complex arrays (much faster)
     """
+    if _global_np:
+        hdr, Ex, Ey = readBeamFileArray(beamfilename)
+        nx, ny, dx, dy = hdr.nx, hdr.ny, hdr.dx, hdr.dy
+        xc, yc = 1 + nx/2, 1 + ny/2
+        # the lists are indexed [x sample][y sample]
+        x_matrix = _np.repeat(((_np.arange(nx) - xc)*dx)[:, None], ny, axis=1).tolist()
+        y_matrix = _np.repeat(((_np.arange(ny) - yc)*dy)[None, :], nx, axis=0).tolist()
+        if hdr.ispol:
+            Ey_real, Ey_imag = Ey.real.T.tolist(), Ey.imag.T.tolist()
+        else:
+            Ey_real = [[0 for x in xrange(nx)] for x in xrange(ny)]
+            Ey_imag = [[0 for x in xrange(nx)] for x in xrange(ny)]
+        efield = (Ex.real.T.tolist(), Ex.imag.T.tolist(), Ey_real, Ey_imag)
+        return (hdr.version, (nx, ny), hdr.ispol, hdr.units, (dx, dy),
+                (hdr.zposition_x, hdr.zposition_y), (hdr.rayleigh_x, hdr.rayleigh_y),
+                (hdr.waist_x, hdr.waist_y), hdr.lamda, hdr.index, hdr.receiver_eff,
+                hdr.system_eff, (x_matrix, y_matrix), efield)
     f = open(beamfilename, "rb")
     # zemax version number
     version = _unpack('i', f.read(4))[0]
@@ -401,10 +1639,10 @@ def readBeamFile(beamfilename):
         print("zposition_y: "+str(zposition_y))
         rayleigh_y = _unpack('d', f.read(8))[0]
         print("rayleigh_y: "+str(rayleigh_y))
-        waist_y = _unpack('d', f.read(8))[0]
-        print("waist_y: "+str(waist_y))
         waist_x=_unpack('d', f.read(8))[0]
         print("waist_x: "+str(waist_x))
+        waist_y = _unpack('d', f.read(8))[0]
+        print("waist_y: "+str(waist_y))
         index=_unpack('d', f.read(8))[0]
         print("index: "+str(index))#f.read(64);
         receiver_eff = 0
@@ -470,6 +1708,80 @@ def readBeamFile(beamfilename):
         (rayleigh_x, rayleigh_y), (waist_x, waist_y), lamda, index, receiver_eff, system_eff,
         (x_matrix, y_matrix), (Ex_real, Ex_imag, Ey_real, Ey_imag))
 
+def _packZBFHeader(header):
+    """returns the bytes of the header of a beam file"""
+    h = header
+    buf = (_pack('<5i', h.version, h.nx, h.ny, int(h.ispol), h.units)
+           + _pack('<4i', 4, 5, 6, 7)  # 16 bytes of padding
+           + _pack('<2d', h.dx, h.dy))
+    if h.version == 0:
+        buf += _pack('<8d', h.zposition_x, h.rayleigh_x, h.lamda, h.zposition_y,
+                     h.rayleigh_y, h.waist_x, h.waist_y, h.index)
+    elif h.version == 1:
+        buf += _pack('<10d', h.zposition_x, h.rayleigh_x, h.waist_x, h.zposition_y,
+                     h.rayleigh_y, h.waist_y, h.lamda, h.index, h.receiver_eff,
+                     h.system_eff)
+        buf += _pack('<8d', 1, 2, 3, 4, 5, 6, 7, 8)  # 8 unused doubles
+    return buf
+
+def _complexField(real, imag):
+    """returns the complex array of the real and imaginary parts (copied
+    exactly, including signed zeros and non-finite values)"""
+    real, imag = _np.asarray(real, dtype=_np.float64), _np.asarray(imag, dtype=_np.float64)
+    field = _np.empty(real.shape, dtype=_np.complex128)
+    field.real, field.imag = real, imag
+    return field
+
+def _writeZBF(beamfilename, header, fields):
+    """writes the header and the complex ``fields`` (in C order) of a beam
+    file with one buffered write per field"""
+    with open(beamfilename, 'wb') as f:
+        f.write(_packZBFHeader(header))
+        for field in fields:
+            _np.ascontiguousarray(field, dtype='<c16').tofile(f)
+
+def writeBeamFileArray(beamfilename, header, Ex, Ey=None):
+    """Write complex field arrays to a Zemax Beam file (ZBF)
+
+    Parameters
+    ----------
+    beamfilename : string
+        the filename of the beam file to write
+    header : namedtuple
+        ``zbfHeader`` (see ``readBeamFileArray()``). The number of samples
+        ``nx``, ``ny`` and ``ispol`` are set from the arrays.
+    Ex : ndarray
+        complex array of shape (ny, nx) of the x polarization, or 2-tuple
+        of the real and imaginary parts
+    Ey : ndarray, optional
+        complex array of shape (ny, nx) of the y polarization (or 2-tuple of
+        the real and imaginary parts). If ``None`` (default), the beam is
+        not polarized.
+
+    Returns
+    -------
+    None
+
+    Examples
+    --------
+    >>> beam = readBeamFileArray('gaussian.zbf')
+    >>> writeBeamFileArray('tilted.zbf', beam.header, beam.Ex*_np.exp(1j*phase))
+    """
+    if not _global_np:
+        raise ImportError('writeBeamFileArray() requires Numpy')
+    fields = []
+    for E in (Ex, Ey):
+        if E is None:
+            continue
+        if isinstance(E, (tuple, list)) and len(E) == 2:
+            E = _complexField(*E)
+        fields.append(_np.asarray(E))
+    if fields[0].ndim != 2 or any(E.shape != fields[0].shape for E in fields):
+        raise ValueError('The fields must be 2-D arrays of the same shape')
+    ny, nx = fields[0].shape
+    header = header._replace(nx=nx, ny=ny, ispol=int(len(fields) == 2))
+    _writeZBF(beamfilename, header, fields)
+
 def writeBeamFile(beamfilename, version, n, ispol, units, d, zposition, rayleigh,
                  waist, lamda, index, receiver_eff, system_eff, efield):
     """Write a Zemax Beam file
@@ -503,15 +1815,42 @@ def writeBeamFile(beamfilename, version, n, ispol, units, d, zposition, rayleigh
     system_eff : double
         the system efficiency. Zero if fiber coupling is not computed.
     efield : 4-tuple of 2D lists, (Ex_real, Ex_imag, Ey_real, Ey_imag)
-        a tuple containing two dimensional lists with the real and
-        imaginary parts of the x and y polarizations of the beam
+        a tuple containing two dimensional lists (or arrays) with the real
+        and imaginary parts of the x and y polarizations of the beam. With
+        Numpy, ``efield`` may also be a complex array ``Ex`` or a 2-tuple
+        ``(Ex, Ey)`` of complex arrays of shape (ny, nx)
 
     Returns
     -------
     status : integer
         0 = success; -997 = file write failure; -996 = couldn't convert
         data to integer, -995 = unexpected error.
+
+    See Also
+    --------
+    writeBeamFileArray()
     """
+    if _global_np:
+        try:
+            header = zbfHeader(version, n[0], n[1], ispol, units, d[0], d[1],
+                               zposition[0], zposition[1], rayleigh[0], rayleigh[1],
+                               waist[0], waist[1], lamda, index, receiver_eff, system_eff)
+            if isinstance(efield, (tuple, list)) and len(efield) == 4:
+                # legacy lists, written in the order [i][j], i < n[0], j < n[1]
+                parts = [_np.asarray(p, dtype=_np.float64)[:n[0], :n[1]] for p in
+                         (efield[:4] if ispol else efield[:2])]
+                fields = [_complexField(parts[k], parts[k+1]) for k in range(0, len(parts), 2)]
+            else:
+                Ex, Ey = efield if isinstance(efield, (tuple, list)) else (efield, None)
+                fields = [_np.asarray(Ex)] + ([_np.asarray(Ey)] if ispol else [])
+            _writeZBF(beamfilename, header, fields)
+            return 0
+        except IOError as e:
+            print("I/O error({0}): {1}".format(e.errno, e.strerror))
+            return -997
+        except ValueError:
+            print("Could not convert data to an integer.")
+            return -996
     try:
         f = open(beamfilename, "wb")
         # zemax version number
@@ -572,13 +1911,113 @@ def writeBeamFile(beamfilename, version, n, ispol, units, d, zposition, rayleigh
 
 #%% Reading text files outputted by Zemax
 
-# passing pyz object to readDetectorViewerTextFile() is hackish; however
-# it is probably the best option right now. It will probably take some effort
-# to move the relevant functions from the zdde module to here. 
-def readDetectorViewerTextFile(pyz, textFileName, displayData=False):
-    """read text file outputted from NSC detector viewer window
+_dvwInfo = _co.namedtuple('dvwInfo', ['surfNum', 'detNum', 'width', 'height',
+                                      'xPix', 'yPix', 'totHits', 'peakIrr',
+                                      'totPow', 'smooth', 'dType', 'x', 'y', 
+                                      'z', 'tiltX', 'tiltY', 'tiltZ', 'posUnits', 
+                                      'units', 'rowOrCol', 'rowColNum', 'rowColVal'])
 
-    Parameters
+_dvwHeaderPat = r'Detector\s*\d{1,4}\s*,\s*NSCG\sSurface\s*\d{1,4}'
+
+def _detectorSections(line_list):
+    """returns the (start, end) line numbers of the sections of the detectors
+    in the indexed lines of a detector viewer text file"""
+    starts = line_list.findAll(_dvwHeaderPat)
+    # the pattern may be found anywhere in the line by ``findAll()``
+    starts = [n for n in starts if _re.match(_dvwHeaderPat, line_list[n].strip())]
+    return list(zip(starts, starts[1:] + [len(line_list)]))
+
+def _readDetectorViewerInfo(pyz, line_list, start=0, end=None):
+    """parse the meta-data of the detector whose text starts at the line
+    ``start`` (and ends before ``end``) of the indexed ``line_list``
+
+    Returns
+    -------
+    detInfo : named tuple
+        see ``readDetectorViewerTextFile()``
+    dataStart : integer or None
+        line number of the first line of the numeric data
+    """
+    end = len(line_list) if end is None else end
+    def find(pattern, start=start):
+        line_num = line_list.find(pattern, start=start)
+        return line_num if line_num is not None and line_num < end else None
+
+    detNumSurfNum = line_list[find(_dvwHeaderPat)]
+    detNum = int(pyz._re.search(r'\d{1,4}', detNumSurfNum.split(',')[0]).group())
+    nscgSurfNum = int(pyz._re.search(r'\d{1,4}', detNumSurfNum.split(',')[1]).group())
+    sizePixelsHitsPat = r'Size[0-9a-zA-Z\s\,\.]*Pixels[0-9a-zA-Z\s\,\.]*Total\sHits'
+    sizePixelsHits = line_list[find(sizePixelsHitsPat)]
+    sizeinfo, pixelsinfo , hitsinfo =  sizePixelsHits.split(',')
+    #note: width<-->rows<-->xPix;; height<-->cols<-->yPix 
+    width, height = [float(each) for each in pyz._re.findall(r'\d{1,4}\.\d{1,8}', sizeinfo)]
+    xPix, yPix =  [int(each) for each in pyz._re.findall(r'\d{1,6}', pixelsinfo)]
+    totHits = int(pyz._re.search(r'\d{1,10}', hitsinfo).group())
+
+    #peak irradiance and total power. only present for irradiance types
+    peakIrr, totPow = None, None 
+    peakIrrLineNum = find(r'Peak\sIrradiance')
+    if peakIrrLineNum:
+        peakIrr = float(pyz._re.search(r'\d{1,4}\.\d{3,8}[Ee][-\+]\d{3}', 
+                                       line_list[peakIrrLineNum]).group())
+        totPow = float(pyz._re.search(r'\d{1,4}\.\d{3,8}[Ee][-\+]\d{3}', 
+                                      line_list[peakIrrLineNum + 1]).group())
+
+    # section of text starting with 'Smoothing' (common to all)
+    smoothLineNum = find('Smoothing')
+    smooth = line_list[smoothLineNum].split(':')[1].strip()
+    smooth = 0 if smooth == 'None' else int(smooth)
+    dType = line_list[smoothLineNum + 1].split(':')[1].strip()
+    posX = float(line_list[smoothLineNum + 2].split(':')[1].strip()) # 'Detector X'
+    posY = float(line_list[smoothLineNum + 3].split(':')[1].strip()) # 'Detector Y'
+    posZ = float(line_list[smoothLineNum + 4].split(':')[1].strip()) # 'Detector Z'
+    tiltX = float(line_list[smoothLineNum + 5].split(':')[1].strip())
+    tiltY = float(line_list[smoothLineNum + 6].split(':')[1].strip())
+    tiltZ = float(line_list[smoothLineNum + 7].split(':')[1].strip())
+    posUnits = line_list[smoothLineNum + 8].split(':')[1].strip()
+    units =  line_list[smoothLineNum + 9].split(':')[1].strip()
+
+    # determine "showAs" type 
+    rowPat = r'Row\s[0-9A-Za-z]*,\s*Y'
+    colPat = r'Column\s[0-9A-Za-z]*,\s*X'
+    rowColPat = '|'.join([rowPat, colPat])
+    showAsRowCol = find(rowColPat)
+
+    if showAsRowCol:
+        # exatract specific meta data
+        rowOrColPosLine = line_list[showAsRowCol]
+        rowOrColIndicator = rowOrColPosLine.split(' ', 2)[0]
+        assert rowOrColIndicator in ('Row', 'Column'), 'Error: Unable to determine '
+        '"Row" or "Column" type for the cross section plot'
+        rowOrCol = 'row' if rowOrColIndicator == 'Row' else 'col' 
+        rowColNum = pyz._re.search(r'\d{1,4}|Center', rowOrColPosLine).group()
+        rowColNum = 0 if rowColNum=='Center' else int(rowColNum)
+        rowColVal = pyz._re.search(r'-?\d{1,4}\.\d{3,8}[Ee][-\+]\d{3}', 
+                                   rowOrColPosLine).group()
+        rowColVal = float(rowColVal)
+        dataPat = (r'\s*(-?\d{1,4}\.\d{3,8}[Ee][-\+]\d{3}\s*)' + r'{{{num}}}'
+                   .format(num=2)) # coordinate, value
+    else:
+        # note: it is still possible to 1d data here if `showAsRowCol` was corrupted
+        rowOrCol, rowColNum, rowColVal = None, None, None # meta-data not available for 2D data
+        dataPat = (r'\s*\d{1,4}\s*(-?\d{1,4}\.\d{3,8}([Ee][-\+]\d{3,8})*\s*)' 
+                   + r'{{{num}}}'.format(num=xPix))
+    dataStart = line_list.findData(dataPat, start=smoothLineNum)
+    if dataStart is not None and dataStart >= end:
+        dataStart = None
+
+    detInfo = _dvwInfo(nscgSurfNum, detNum, width, height, xPix, yPix, totHits,
+                       peakIrr, totPow, smooth, dType, posX, posY, posZ, tiltX, 
+                       tiltY, tiltZ, posUnits, units, rowOrCol, rowColNum, rowColVal)
+    return detInfo, dataStart
+
+# passing pyz object to readDetectorViewerTextFile() is hackish; however
+# it is probably the best option right now. It will probably take some effort
+# to move the relevant functions from the zdde module to here. 
+def readDetectorViewerTextFile(pyz, textFileName, displayData=False, asArray=False):
+    """read text file outputted from NSC detector viewer window
+
+    Parameters
     ----------
     pyz : module object 
         the `pyzdde.zdde` module object. This is bit of a hack. See Examples  
@@ -588,6 +2027,10 @@ def readDetectorViewerTextFile(pyz, textFileName, displayData=False):
         whether to return display data. if `False` (default) then only 
         the meta-data associated with the detector viewer window data 
         is returned 
+    asArray : bool
+        if `True`, the display data is returned as float64 ndarrays 
+        instead of lists (using the fast reader, see 
+        ``iterDetectorViewerData()``). Requires Numpy. Default is `False`
 
     Return 
     ------
@@ -649,102 +2092,496 @@ def readDetectorViewerTextFile(pyz, textFileName, displayData=False):
     >>> # following line assumes 2d data 
     >>> info, gridData = zfu.readDetectorViewerTextFile(pyz, textFileName, True)         
     """
-    line_list = pyz._readLinesFromFile(pyz._openFile(textFileName))
-    # Meta data
-    detNumSurfNumPat = r'Detector\s*\d{1,4}\s*,\s*NSCG\sSurface\s*\d{1,4}'
-    detNumSurfNum = line_list[pyz._getFirstLineOfInterest(line_list, detNumSurfNumPat)]
-    detNum = int(pyz._re.search(r'\d{1,4}', detNumSurfNum.split(',')[0]).group())
-    nscgSurfNum = int(pyz._re.search(r'\d{1,4}', detNumSurfNum.split(',')[1]).group())
-    sizePixelsHitsPat = r'Size[0-9a-zA-Z\s\,\.]*Pixels[0-9a-zA-Z\s\,\.]*Total\sHits'
-    sizePixelsHits = line_list[pyz._getFirstLineOfInterest(line_list, sizePixelsHitsPat)]
-    sizeinfo, pixelsinfo , hitsinfo =  sizePixelsHits.split(',')
-    #note: width<-->rows<-->xPix;; height<-->cols<-->yPix 
-    width, height = [float(each) for each in pyz._re.findall(r'\d{1,4}\.\d{1,8}', sizeinfo)]
-    xPix, yPix =  [int(each) for each in pyz._re.findall(r'\d{1,6}', pixelsinfo)]
-    totHits = int(pyz._re.search(r'\d{1,10}', hitsinfo).group())
+    line_list = pyz._TextFileIndex.fromFile(textFileName)
+    if asArray:
+        dvw = next(iterDetectorViewerData(pyz, line_list))
+        if not displayData:
+            return dvw.info
+        if dvw.info.rowOrCol:
+            return (dvw.info, dvw.coordinates, dvw.values)
+        return (dvw.info, dvw.grid)
+    # only the first detector is read (see iterDetectorViewerData())
+    start, end = _detectorSections(line_list)[0]
+    detInfo, start_line = _readDetectorViewerInfo(pyz, line_list, start, end)
+    if displayData:
+        if detInfo.rowOrCol:
+            data_mat = pyz._get2DList(line_list, start_line, detInfo.yPix)
+            data_matT = pyz._transpose2Dlist(data_mat)
+            return (detInfo, data_matT[0], data_matT[1])
+        else:
+            gridData = pyz._get2DList(line_list, start_line, detInfo.yPix, startCol=1)
+            return (detInfo, gridData)
+    else:
+        return detInfo
 
-    #peak irradiance and total power. only present for irradiance types
-    peakIrr, totPow = None, None 
-    peakIrrLineNum = pyz._getFirstLineOfInterest(line_list, 'Peak\sIrradiance')
-    if peakIrrLineNum:
-        peakIrr = float(pyz._re.search(r'\d{1,4}\.\d{3,8}[Ee][-\+]\d{3}', 
-                                       line_list[peakIrrLineNum]).group())
-        totPow = float(pyz._re.search(r'\d{1,4}\.\d{3,8}[Ee][-\+]\d{3}', 
-                                      line_list[peakIrrLineNum + 1]).group())
+class DetectorViewerData(object):
+    """data of one detector of a detector viewer text file
 
-    # section of text starting with 'Smoothing' (common to all)
-    smoothLineNum = pyz._getFirstLineOfInterest(line_list, 'Smoothing')
-    smooth = line_list[smoothLineNum].split(':')[1].strip()
-    smooth = 0 if smooth == 'None' else int(smooth)
-    dType = line_list[smoothLineNum + 1].split(':')[1].strip()
-    posX = float(line_list[smoothLineNum + 2].split(':')[1].strip()) # 'Detector X'
-    posY = float(line_list[smoothLineNum + 3].split(':')[1].strip()) # 'Detector Y'
-    posZ = float(line_list[smoothLineNum + 4].split(':')[1].strip()) # 'Detector Z'
-    tiltX = float(line_list[smoothLineNum + 5].split(':')[1].strip())
-    tiltY = float(line_list[smoothLineNum + 6].split(':')[1].strip())
-    tiltZ = float(line_list[smoothLineNum + 7].split(':')[1].strip())
-    posUnits = line_list[smoothLineNum + 8].split(':')[1].strip()
-    units =  line_list[smoothLineNum + 9].split(':')[1].strip()
+    The numeric data is parsed lazily: the full grid is converted to a
+    numpy array (in bulk) only when ``grid`` is accessed, while ``row()``
+    and ``col()`` only parse the lines (or the column of each line) that
+    they need.
 
-    # determine "showAs" type 
-    rowPat = r'Row\s[0-9A-Za-z]*,\s*Y'
-    colPat = r'Column\s[0-9A-Za-z]*,\s*X'
-    rowColPat = '|'.join([rowPat, colPat])
-    showAsRowCol = pyz._getFirstLineOfInterest(line_list, rowColPat)
+    Attributes
+    ----------
+    info : named tuple
+        meta-data of the detector (see ``readDetectorViewerTextFile()``)
+    lines : list
+        the lines of numeric data of the detector. For 2-D data, each line
+        starts with the row number followed by the ``xPix`` values.
+    """
+    def __init__(self, info, lines):
+        self.info = info
+        self.lines = lines
+        self._grid = None
+        self._crossSection = None
 
-    if showAsRowCol:
-        # exatract specific meta data
-        rowOrColPosLine = line_list[showAsRowCol]
-        rowOrColIndicator = rowOrColPosLine.split(' ', 2)[0]
-        assert rowOrColIndicator in ('Row', 'Column'), 'Error: Unable to determine '
-        '"Row" or "Column" type for the cross section plot'
-        rowOrCol = 'row' if rowOrColIndicator == 'Row' else 'col' 
-        #rowColNum = line_list[showAsRowCol].split(' ', 2)[1]
-        rowColNum = pyz._re.search(r'\d{1,4}|Center', rowOrColPosLine).group()
-        rowColNum = 0 if rowColNum=='Center' else int(rowColNum)
-        rowColVal = pyz._re.search(r'-?\d{1,4}\.\d{3,8}[Ee][-\+]\d{3}', 
-                                   rowOrColPosLine).group()
-        rowColVal = float(rowColVal)
+    @property
+    def isCrossSection(self):
+        """``True`` if the data is a row or column cross-section"""
+        return self.info.rowOrCol is not None
 
-        if displayData:
-            dataPat = (r'\s*(-?\d{1,4}\.\d{3,8}[Ee][-\+]\d{3}\s*)' + r'{{{num}}}'
-                       .format(num=2)) # coordinate, value
-            start_line = pyz._getFirstLineOfInterest(line_list, dataPat)
-            data_mat = pyz._get2DList(line_list, start_line, yPix)
-            data_matT = pyz._transpose2Dlist(data_mat)
-            coordinate = data_matT[0]
-            value = data_matT[1]
-    else:
-        # note: it is still possible to 1d data here if `showAsRowCol` was corrupted
-        rowOrCol, rowColNum, rowColVal = None, None, None # meta-data not available for 2D data
-        if displayData:
-            dataPat = (r'\s*\d{1,4}\s*(-?\d{1,4}\.\d{3,8}([Ee][-\+]\d{3,8})*\s*)' 
-                       + r'{{{num}}}'.format(num=xPix))
-            start_line = pyz._getFirstLineOfInterest(line_list, dataPat)
-            gridData = pyz._get2DList(line_list, start_line, yPix, startCol=1)
+    @property
+    def grid(self):
+        """2-D array (``yPix`` rows, ``xPix`` columns) of the detector data"""
+        if self.isCrossSection:
+            raise ValueError('The detector data is a {} cross-section'
+                             .format(self.info.rowOrCol))
+        if self._grid is None:
+            data = _np.array(' '.join(self.lines).split(), dtype=_np.float64)
+            self._grid = _np.ascontiguousarray(data.reshape(len(self.lines), -1)[:, 1:])
+        return self._grid
 
-    deti = _co.namedtuple('dvwInfo', ['surfNum', 'detNum', 'width', 'height',
-                                      'xPix', 'yPix', 'totHits', 'peakIrr',
-                                      'totPow', 'smooth', 'dType', 'x', 'y', 
-                                      'z', 'tiltX', 'tiltY', 'tiltZ', 'posUnits', 
-                                      'units', 'rowOrCol', 'rowColNum', 'rowColVal'])
-    detInfo = deti(nscgSurfNum, detNum, width, height, xPix, yPix, totHits,
-                   peakIrr, totPow, smooth, dType, posX, posY, posZ, tiltX, 
-                   tiltY, tiltZ, posUnits, units, rowOrCol, rowColNum, rowColVal)
+    def _crossSectionData(self):
+        if not self.isCrossSection:
+            raise ValueError('The detector data is not a cross-section')
+        if self._crossSection is None:
+            data = _np.array(' '.join(self.lines).split(), dtype=_np.float64)
+            self._crossSection = data.reshape(-1, 2).T.copy()
+        return self._crossSection
 
-    if displayData:
-        if showAsRowCol:
-            return (detInfo, coordinate, value)
+    @property
+    def coordinates(self):
+        """1-D array of the coordinates of the cross-section data"""
+        return self._crossSectionData()[0]
+
+    @property
+    def values(self):
+        """1-D array of the values of the cross-section data"""
+        return self._crossSectionData()[1]
+
+    def row(self, i):
+        """returns the ``i``-th row (starting from 0) of the 2-D data as 1-D
+        array, parsing only that row if the grid was not read"""
+        if self._grid is not None:
+            return self._grid[i]
+        if self.isCrossSection:
+            raise ValueError('The detector data is a {} cross-section'
+                             .format(self.info.rowOrCol))
+        return _np.array(self.lines[i].split()[1:], dtype=_np.float64)
+
+    def col(self, j):
+        """returns the ``j``-th column (starting from 0) of the 2-D data as
+        1-D array, without converting the whole grid if it was not read"""
+        if self._grid is not None:
+            return self._grid[:, j]
+        if self.isCrossSection:
+            raise ValueError('The detector data is a {} cross-section'
+                             .format(self.info.rowOrCol))
+        return _np.array([line.split()[j + 1] for line in self.lines],
+                         dtype=_np.float64)
+
+    def crossSection(self, which='row', index=None):
+        """returns a row or column cross-section of the 2-D data
+
+        Parameters
+        ----------
+        which : string, optional
+            'row' (default) or 'col'
+        index : integer, optional
+            row or column number (starting from 0). If ``None`` (default),
+            the center row or column is returned.
+
+        Returns
+        -------
+        coordinates : ndarray
+            the x (for rows) or y (for columns) coordinates of the pixel
+            centers, in position units
+        values : ndarray
+            the values of the pixels
+        """
+        info = self.info
+        if which == 'row':
+            n, size = info.xPix, info.width
+            index = info.yPix//2 if index is None else index
+            values = self.row(index)
         else:
-            return (detInfo, gridData)
+            n, size = info.yPix, info.height
+            index = info.xPix//2 if index is None else index
+            values = self.col(index)
+        delta = size/n
+        coordinates = -size/2 + delta*(_np.arange(n) + 0.5)
+        return coordinates, values
+
+def iterDetectorViewerData(pyz, textFile):
+    """generator of the data of the detectors in a detector viewer text file
+
+    The file is read and indexed only once. Every detector section (starting
+    with a "Detector n, NSCG Surface m" line) yields a
+    ``DetectorViewerData`` object, whose numeric data is converted to numpy
+    arrays only when needed. Requires Numpy.
+
+    Parameters
+    ----------
+    pyz : module object 
+        the `pyzdde.zdde` module object (see ``readDetectorViewerTextFile()``)
+    textFile : string or object
+        full filename of the text file, or the file already indexed using 
+        ``pyz._TextFileIndex``
+
+    Yields
+    ------
+    dvw : DetectorViewerData object
+        with the attribute ``info`` (meta-data named tuple), the properties
+        ``grid`` (2-D data), ``coordinates`` and ``values`` (cross-section
+        data), and the methods ``row()``, ``col()`` and ``crossSection()``
+
+    Examples
+    --------
+    >>> import pyzdde.zdde as pyz 
+    >>> import pyzdde.zfileutils as zfu 
+    >>> for dvw in zfu.iterDetectorViewerData(pyz, textFileName):
+    >>>     print(dvw.info.detNum, dvw.grid.sum(), dvw.row(10).max())
+    """
+    if not _global_np:
+        raise ImportError('Numpy is required for reading the detector data')
+    if isinstance(textFile, pyz._TextFileIndex):
+        line_list = textFile
     else:
-        return detInfo
+        line_list = pyz._TextFileIndex.fromFile(textFile)
+    for start, end in _detectorSections(line_list):
+        info, dataStart = _readDetectorViewerInfo(pyz, line_list, start, end)
+        if dataStart is None:
+            lines = []
+        else:
+            blockEnd = min(line_list.block(dataStart)[1], end)
+            nLines = blockEnd - dataStart
+            if info.rowOrCol is None:
+                nLines = min(nLines, info.yPix)
+            lines = line_list.lines[dataStart:dataStart + nLines]
+        yield DetectorViewerData(info, lines)
+
+def readDetectorViewerData(pyz, textFile):
+    """returns the list of the ``DetectorViewerData`` objects of all the
+    detectors in a detector viewer text file. See ``iterDetectorViewerData()``
+    """
+    return list(iterDetectorViewerData(pyz, textFile))
 
         
+_preSectionPat = _re.compile(r'[A-Z][A-Z0-9 ,/#\-\(\)\.]*:$')
+_globalVertex = _co.namedtuple('globalVertex', ['R', 'x', 'y', 'z'])
+_preIndices = _co.namedtuple('indexData', ['wavelengths', 'surfaces'])
+
+def _preLabel(token):
+    """surface label (OBJ, STO, IMA) or surface number"""
+    return int(token) if token.isdigit() else token
+
+class Prescription(object):
+    """prescription data (text of the 'Pre' analysis) parsed once into
+    sections
+
+    The lines of the file are split into sections (identified by their
+    headings, such as "SURFACE DATA SUMMARY:") when the object is created,
+    and every section is parsed, once, the first time that it is accessed.
+
+    Parameters
+    ----------
+    lines : list
+        lines of the prescription text file (see ``zdde._readLinesFromFile()``)
+
+    Attributes
+    ----------
+    lines : list
+        lines of the file
+    sections : dict
+        section heading (without the ':') mapped to the (start, end) line
+        numbers of the section; ``start`` is the line of the heading
+
+    Examples
+    --------
+    >>> pre = ln.zGetPrescription()
+    >>> pre.cardinalPoints['Principal Planes']   # per wavelength
+    >>> pre.globalVertex[3].z
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self.sections = {}
+        self._parsed = {}
+        heading, start = None, 0
+        for line_num, line in enumerate(lines):
+            if line and not line[0].isspace() and _preSectionPat.match(line):
+                if heading is not None:
+                    self.sections.setdefault(heading, (start, line_num))
+                heading, start = line[:-1].strip(), line_num
+        if heading is not None:
+            self.sections.setdefault(heading, (start, len(lines)))
+
+    def sectionLines(self, heading):
+        """returns the lines of the section ``heading`` (including the
+        heading), or an empty list if the section is not in the file"""
+        start, end = self.sections.get(heading, (0, 0))
+        return self.lines[start:end]
+
+    def _section(self, name, parser):
+        if name not in self._parsed:
+            self._parsed[name] = parser()
+        return self._parsed[name]
+
+    @property
+    def generalLensData(self):
+        """dictionary of the items ("key : value" lines) of the GENERAL LENS
+        DATA section. The values are strings"""
+        def parse():
+            data = _co.OrderedDict()
+            for line in self.sectionLines('GENERAL LENS DATA')[1:]:
+                key, sep, value = line.partition(':')
+                if sep and key.strip() and key.strip() not in data:
+                    data[key.strip()] = value.strip()
+            return data
+        return self._section('general', parse)
+
+    @property
+    def surfaceDataSummary(self):
+        """rows of the SURFACE DATA SUMMARY section
+
+        A list of 2-tuples ``(label, tokens)`` for every surface, where
+        ``label`` is the surface number or 'OBJ', 'STO', 'IMA', and ``tokens``
+        is the list of the other (white space separated) fields of the row
+        (type, radius, thickness, glass, diameter, conic, comment; empty
+        fields are omitted by Zemax)
+        """
+        def parse():
+            rows = []
+            for line in self.sectionLines('SURFACE DATA SUMMARY')[1:]:
+                tokens = line.split()
+                if tokens and (tokens[0].isdigit() or tokens[0] in ('OBJ', 'STO', 'IMA')):
+                    rows.append((_preLabel(tokens[0]), tokens[1:]))
+            return rows
+        return self._section('summary', parse)
+
+    @property
+    def globalVertex(self):
+        """dictionary of the global vertex data of the surfaces (GLOBAL VERTEX
+        COORDINATES... section), mapping the surface number to a named tuple
+        ``(R, x, y, z)``, where ``R`` is the 3x3 rotation matrix (as a tuple
+        of rows)
+        """
+        def parse():
+            vertex = _co.OrderedDict()
+            heading = [h for h in self.sections if h.startswith('GLOBAL VERTEX')]
+            label, rows = None, []
+            for line in self.sectionLines(heading[0] if heading else None)[1:]:
+                tokens = line.split()
+                try:
+                    if len(tokens) == 5:
+                        label, rows = _preLabel(tokens[0]), [[float(t) for t in tokens[1:]]]
+                    elif len(tokens) == 4 and label is not None:
+                        rows.append([float(t) for t in tokens])
+                    else:
+                        continue
+                except ValueError:
+                    label, rows = None, []
+                    continue
+                if len(rows) == 3:
+                    R = tuple(tuple(row[:3]) for row in rows)
+                    vertex[label] = _globalVertex(R, rows[0][3], rows[1][3], rows[2][3])
+                    label, rows = None, []
+            return vertex
+        return self._section('vertex', parse)
+
+    @property
+    def cardinalPoints(self):
+        """dictionary of the CARDINAL POINTS data mapping the item name (such
+        as 'Focal Length', 'Focal Planes', 'Principal Planes', 'Nodal
+        Planes', 'Anti-Principal Planes') to the list, one element per
+        wavelength, of the (object space, image space) values
+        """
+        def parse():
+            data = _co.OrderedDict()
+            lines = self.sectionLines('CARDINAL POINTS') or self.lines
+            for line in lines:
+                key, sep, value = line.partition(':')
+                key = key.strip()
+                if not sep or not (key.endswith('Planes') or key == 'Focal Length'):
+                    continue
+                try:
+                    values = tuple(float(t) for t in value.split()[:2])
+                except ValueError:
+                    continue
+                data.setdefault(key, []).append(values)
+            return data
+        return self._section('cardinal', parse)
+
+    @property
+    def indices(self):
+        """the INDEX OF REFRACTION DATA as a named tuple ``(wavelengths,
+        surfaces)``, where ``surfaces`` maps the surface number to a 2-tuple
+        ``(glass, indices)``; ``indices`` are the indices at the
+        ``wavelengths``
+        """
+        def parse():
+            waves, surfaces = (), _co.OrderedDict()
+            for line in self.sectionLines('INDEX OF REFRACTION DATA')[1:]:
+                tokens = line.split()
+                if tokens and tokens[0] == 'Surf':
+                    waves = []
+                    for t in tokens[1:]:
+                        try:
+                            waves.append(float(t))
+                        except ValueError:
+                            pass
+                    waves = tuple(waves)
+                elif waves and tokens and tokens[0].isdigit():
+                    try:
+                        idx = tuple(float(t) for t in tokens[-len(waves):])
+                    except ValueError:
+                        continue
+                    rest = tokens[1:-len(waves)]
+                    glass = rest[0] if rest and not _re.match(r'-?\d', rest[0]) else ''
+                    surfaces[int(tokens[0])] = (glass, idx)
+            return _preIndices(waves, surfaces)
+        return self._section('indices', parse)
+
 #%% Zemax surface modifier utilities
 
+# number of data lines of the grid sag files formatted at once
+_GRID_SAG_CHUNK = 2**16
+
+# ASCII codes of the 4-digit numbers 0000 to 9999, as little-endian uint32
+_digits4 = None
+
+def _formatE9(values):
+    """returns the ``'% 12.9E'`` formatting of the float ``values`` as an
+    array of shape (len(values), 16) of ASCII codes, or ``None`` if some
+    values are not finite or have 3-digit exponents
+
+    The decimal digits are computed with integer arithmetic on the whole
+    array. The few values whose correct rounding cannot be decided from
+    the double precision mantissa are formatted by Python.
+    """
+    global _digits4
+    if _digits4 is None:
+        codes = [('%04d' % i).encode('ascii') for i in xrange(10000)]
+        _digits4 = _np.frombuffer(b''.join(codes), dtype='<u4').copy()
+    v = _np.asarray(values, dtype=_np.float64)
+    a = _np.abs(v)
+    if not _np.isfinite(a).all():
+        return None
+    nonzero = a > 0
+    e = _np.floor(_np.log10(_np.where(nonzero, a, 1.0))).astype(_np.int64)
+    if len(e) and _np.abs(e).max() > 98:
+        return None
+    m = a/10.0**e
+    # fix the exponents rounded by log10
+    hi = m >= 10
+    e[hi] += 1
+    m[hi] /= 10
+    lo = nonzero & (m < 1)
+    e[lo] -= 1
+    m[lo] *= 10
+    scaled = m*1e9
+    n = _np.rint(scaled).astype(_np.int64)  # 10 significant digits
+    carry = n >= 10**10
+    n[carry] //= 10
+    e[carry] += 1
+    if len(e) and _np.abs(e).max() > 99:
+        return None
+    out = _np.empty((len(v), 16), dtype=_np.uint8)
+    out[:, 0] = _np.where(_np.signbit(v), ord('-'), ord(' '))
+    top = n//10**8
+    out[:, 1] = top//10 + ord('0')
+    out[:, 2] = ord('.')
+    out[:, 3] = top%10 + ord('0')
+    words = out.view('<u4')
+    words[:, 1] = _digits4[(n//10**4)%10**4]
+    words[:, 2] = _digits4[n%10**4]
+    out[:, 12] = ord('E')
+    out[:, 13] = _np.where(e < 0, ord('-'), ord('+'))
+    absE = _np.abs(e)
+    out[:, 14] = absE//10 + ord('0')
+    out[:, 15] = absE%10 + ord('0')
+    for i in _np.flatnonzero(_np.abs(scaled - _np.floor(scaled) - 0.5) < 1e-4):
+        out[i] = bytearray(('% 12.9E' % v[i]).encode('ascii'))
+    return out
+
+def _formatE9Lines(rows):
+    """returns the text of the rows of a 2-D array, formatted as lines of
+    ``'% 12.9E'`` fields separated by single spaces"""
+    rows = _np.asarray(rows, dtype=_np.float64)
+    nrows, ncols = rows.shape
+    fields = _formatE9(rows.ravel())
+    if fields is None:
+        lineFmt = ' '.join(['% 12.9E']*ncols) + '\n'
+        return (lineFmt*nrows) % tuple(rows.ravel().tolist())
+    # fields of 16 characters followed by a space, or a newline for the last
+    lines = _np.empty((nrows, 17*ncols), dtype=_np.uint8)
+    lines[:, 16::17] = ord(' ')
+    lines[:, -1] = ord('\n')
+    for k in range(ncols):
+        lines[:, 17*k:17*k+16] = fields[k::ncols]
+    return lines.tobytes().decode('ascii')
+
+def _gridFilesDir():
+    """default directory of the grid sag files of Zemax"""
+    return _os.path.join(_os.path.expandvars("%userprofile%"), 'Documents',
+                         'Zemax', 'Objects', 'Grid Files')
+
+def gridSagDerivatives(sag, delx, dely):
+    """computes the derivative columns of a grid sag file from a sag map
+    using (second order accurate) finite differences
+
+    Parameters
+    ----------
+    sag : ndarray
+        2-dim ndarray of shape (ny, nx) of the sag values, in the order of
+        the grid sag file, i.e. the first row is at the top (maximum y)
+        and x increases along the rows
+    delx : float
+        grid spacing along x
+    dely : float
+        grid spacing along y
+
+    Returns
+    -------
+    dzBydx : ndarray
+        1-dim ndarray of dz/dx values of length ``nx*ny``
+    dzBydy : ndarray
+        1-dim ndarray of dz/dy values of length ``nx*ny``
+    d2zBydxdy : ndarray
+        1-dim ndarray of d^2(z)/dx.dy values of length ``nx*ny``
+
+    Notes
+    -----
+    The derivatives are computed with ``numpy.gradient()``: central
+    differences at the interior points and one-sided differences at the
+    edges. The values are in the order of the data lines of the grid sag
+    file (see ``gridSagFile()``).
+
+    Examples
+    --------
+    >>> dzdx, dzdy, d2zdxdy = gridSagDerivatives(sag, delx, dely)
+    >>> gridSagFile(sag.ravel(), dzdx, dzdy, d2zdxdy, nx, ny, delx, dely)
+    """
+    sag = _np.asarray(sag, dtype=_np.float64)
+    # the row index increases with decreasing y
+    dzBydx = _np.gradient(sag, delx, axis=1, edge_order=2)
+    dzBydy = -_np.gradient(sag, dely, axis=0, edge_order=2)
+    d2zBydxdy = -_np.gradient(dzBydx, dely, axis=0, edge_order=2)
+    return dzBydx.ravel(), dzBydy.ravel(), d2zBydxdy.ravel()
+
 def gridSagFile(z, dzBydx, dzBydy, d2zBydxdy, nx, ny, delx, dely, unitflag=0, 
-                        xdec=0, ydec=0, fname='gridsag', comment=None, fext='.DAT'):
+                        xdec=0, ydec=0, fname='gridsag', comment=None, fext='.DAT',
+                        fdir=None):
     """generates Grid Sag ASCII file for specifying the additional sag terms of the 
     grid sag surface
     
@@ -770,14 +2607,17 @@ def gridSagFile(z, dzBydx, dzBydy, d2zBydxdy, nx, ny, delx, dely, unitflag=0,
         decenter along y (default=0)
     fname : string, optional
         filename, without extension and absolute path, of the sag file to. 
-        If `None`, the name `gridsag` is used. The file is saved at:
-        "C:\\Users\\%userprofile%\\Documents\\Zemax\\Objects\\Grid Files\\<fname>.xxx``
-        where the exact extension is determined by ``fext``
+        If `None`, the name `gridsag` is used. The file is saved in the
+        directory ``fdir``, with the extension ``fext``
     comment : string, optional
         top comment 
     fext : string, optional
         specifies the file extension. Use ``.DAT`` (default) for sequential
         objects, and ``.GRD`` for NSC object
+    fdir : string, optional
+        directory of the sag file. If `None` (default), the file is saved
+        in the grid files directory of Zemax:
+        "C:\\Users\\%userprofile%\\Documents\\Zemax\\Objects\\Grid Files"
 
     Returns
     -------
@@ -791,15 +2631,22 @@ def gridSagFile(z, dzBydx, dzBydy, d2zBydxdy, nx, ny, delx, dely, unitflag=0,
        therefore, the ``nodata`` field is not set for any of the data points 
        in the file, i.e. all data is valid.
     3. The file is read in Zemax using the Extra Data Editor "Import" feature.
+    4. The data lines are formatted in chunks of rows, so that large grids
+       (millions of points) are written quickly and without copying all the
+       columns at once. Use ``gridSagDerivatives()`` to compute the
+       derivative columns from a sag map.
     
     See Also
     --------
-    randomGridSagFile()
+    randomGridSagFile(), gridSagDerivatives()
     """
     fname = 'gridsag' if not fname else fname
-    filename = _os.path.join(_os.path.expandvars("%userprofile%"), 'Documents',
-                             'Zemax\\Objects\\Grid Files', fname + fext)
-    arr = _np.hstack((z, dzBydx, dzBydy, d2zBydxdy))
+    fdir = _gridFilesDir() if fdir is None else fdir
+    filename = _os.path.join(fdir, fname + fext)
+    cols = [_np.ravel(c) for c in (z, dzBydx, dzBydy, d2zBydxdy)]
+    n = len(cols[0])
+    if any(len(c) != n for c in cols):
+        raise ValueError('The sag and derivative columns must have the same length')
     with open(filename, 'w') as f:
         f.write('! {}\n'.format(comment))
         f.write('! {} {} {} {} {} {} {}  <-- First data line\n'
@@ -808,12 +2655,14 @@ def gridSagFile(z, dzBydx, dzBydy, d2zBydxdy, nx, ny, delx, dely, unitflag=0,
                 .format('z', 'dz/dx', 'dz/dy', 'd2z/dxdy'))
         f.write('{:d} {:d} {: 12.9E} {: 12.9E} {:d} {: 12.9E} {: 12.9E}\n'
                 .format(nx, ny, delx, dely, unitflag, xdec, ydec))
-        for row in arr:
-            f.write('{: 12.9E} {: 12.9E} {: 12.9E} {: 12.9E}\n'.format(*row))
+        for start in xrange(0, n, _GRID_SAG_CHUNK):
+            chunk = _np.column_stack([c[start:start+_GRID_SAG_CHUNK] for c in cols])
+            f.write(_formatE9Lines(chunk))
     return filename
     
 def randomGridSagFile(mu=0, sigma=1, semidia=1, nx=201, ny=201, unitflag=0, 
-                         xdec=0, ydec=0, fname='gridsag_randn', comment=None, fext='.DAT'):
+                         xdec=0, ydec=0, fname='gridsag_randn', comment=None, fext='.DAT',
+                         fdir=None):
     """generates grid sag ASCII file with Gaussian distributed sag profile
     
     Parameters
@@ -837,13 +2686,16 @@ def randomGridSagFile(mu=0, sigma=1, semidia=1, nx=201, ny=201, unitflag=0,
         semi-diameter of the grid sag surface (note that grid is rectangular) 
     fname : string, optional
         filename, without extension and absolute path, of the sag file to. 
-        If `None`, the name `gridsag_randn` is used. The file is saved at:
-        "C:\\Users\\%userprofile%\\Documents\\Zemax\\Objects\\Grid Files\\<fname>.xxx"
+        If `None`, the name `gridsag_randn` is used. The file is saved in
+        the directory ``fdir``
     fext : string, optional
         specifies the file extension. Use ``.DAT`` (default) for sequential
         objects, and ``.GRD`` for NSC object
     comment : string, optional
         top comment 
+    fdir : string, optional
+        directory of the sag file. If `None` (default), the grid files
+        directory of Zemax is used (see ``gridSagFile()``)
         
     Returns
     -------
@@ -883,7 +2735,7 @@ def randomGridSagFile(mu=0, sigma=1, semidia=1, nx=201, ny=201, unitflag=0,
     
     gridsagfile = gridSagFile(z, dzBydx, dzBydy, d2zBydxdy, nx, ny, 
                               delx, dely, unitflag, xdec, ydec, 
-                              fname, comment, fext)
+                              fname, comment, fext, fdir)
     return z, gridsagfile
 
 
@@ -902,3 +2754,848 @@ def checkDecimalSeparators(string):
     """
     return _re.sub(r'((?<=\d)|(?<=\A)|(?<=-)|(?<=\s)),(?=\d)', r'.', string)
 
+
+#%% NSC source files
+
+# rays of an NSC source, e.g. returned by the source sampling functions
+sourceRays = _co.namedtuple('sourceRays', ['x', 'y', 'z', 'l', 'm', 'n',
+                                           'intensity', 'wavelength'])
+
+# dimension units codes of the binary source files
+_sourceUnits = {'m' : 0, 'in' : 1, 'ft' : 2, 'mm' : 3, 'cm' : 4}
+
+# number of rays converted and written at once
+_SOURCE_CHUNK = 2**16
+
+class SourceFileWriter(object):
+    """Writer of the ray files of the NSC "Source File" object, which
+    streams the rays to the file in chunks
+
+    Parameters
+    ----------
+    file_name : string
+        name of the source file (provide full path). The file should be
+        saved in the ``Objects\\Sources\\Source Files`` folder of Zemax to
+        be used by a "Source File" object.
+    file_format : string, optional
+        ``binary`` (default) or ``text``
+    spectral : bool, optional
+        if ``True`` (default), the rays have a wavelength each (spectral
+        color format), otherwise only a flux (flux only format)
+    description : string, optional
+        description of the source (binary format only, up to 99 characters)
+    units : string or integer, optional
+        units of the positions (binary format only): ``mm`` (default),
+        ``cm``, ``m``, ``in`` or ``ft``, or the integer code in the file
+    flux_type : string, optional
+        ``watts`` (default) or ``lumens`` (binary format only)
+    source_flux : float, optional
+        total flux of the source (binary format only). If ``None``
+        (default), the sum of the intensities of the rays is used
+    normalize : bool, optional
+        if ``True``, the direction cosines are normalized. If ``False``
+        (default), a ``ValueError`` is raised if they are not normalized
+        within ``tol``
+    tol : float, optional
+        tolerance on ``l**2 + m**2 + n**2 - 1``
+
+    Notes
+    -----
+    1. The binary file has a 208 byte header (identifier 1010) followed by
+       the rays, each 7 (flux only) or 8 (spectral color) 4-byte floats
+       ``x, y, z, l, m, n, flux[, wavelength]``. The number of rays, the
+       fluxes, the wavelength, and the ranges of the inclination and
+       azimuth angles of the header are updated when the writer is closed.
+    2. The first line of the text file holds the number of rays and the
+       format (0 for flux only, 2 for spectral color); the following lines
+       hold the rays. The first line is rewritten when the writer is
+       closed.
+    3. The wavelengths are in micrometers.
+
+    Examples
+    --------
+    >>> with SourceFileWriter('led.dat', description='LED') as w:
+    ...     for _ in range(100):
+    ...         w.write(*sampleLambertianSource(10**4, power=0.01, wavelength=0.55))
+    """
+    _headerFmt = '<iI100s3f4fi3f3f3f4f4i'
+
+    def __init__(self, file_name, file_format='binary', spectral=True,
+                 description='', units='mm', flux_type='watts', source_flux=None,
+                 normalize=False, tol=1e-6):
+        if file_format not in ('binary', 'text'):
+            raise ValueError("file_format must be 'binary' or 'text'")
+        self.file_name = file_name
+        self.file_format = file_format
+        self.spectral = spectral
+        self.description = description
+        self.units = _sourceUnits[units] if isinstance(units, _string_types) else units
+        self.flux_type = {'watts' : 0, 'lumens' : 1}[flux_type]
+        self.source_flux = source_flux
+        self.normalize = normalize
+        self.tol = tol
+        self.nrays = 0
+        self._flux = 0.0
+        self._wavelengths = set()
+        self._inclination = [180.0, 0.0]
+        self._azimuth = [360.0, -360.0]
+        if file_format == 'binary':
+            self._file = open(file_name, 'wb')
+            self._file.write(self._header())
+        else:
+            self._file = open(file_name, 'w')
+            self._file.write(self._firstLine())
+
+    def _header(self):
+        """bytes of the header of the binary file"""
+        wavelength = (list(self._wavelengths)[0]
+                      if len(self._wavelengths) == 1 else 0.0)
+        incl = self._inclination if self.nrays else [0.0, 0.0]
+        azim = self._azimuth if self.nrays else [0.0, 0.0]
+        sourceFlux = self._flux if self.source_flux is None else self.source_flux
+        return _pack(self._headerFmt, 1010, self.nrays,
+                     self.description.encode('ascii')[:99], sourceFlux, self._flux,
+                     wavelength, incl[0], incl[1], azim[0], azim[1], self.units,
+                     0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 0, 0, 0,
+                     2 if self.spectral else 0, self.flux_type, 0, 0)
+
+    def _firstLine(self):
+        """first line of the text file, padded to a fixed width so that it
+        can be rewritten in place"""
+        return '{:<20d}{:d}\n'.format(self.nrays, 2 if self.spectral else 0)
+
+    def write(self, x, y, z, l, m, n, intensity, wavelength=None):
+        """write a chunk of rays
+
+        Parameters
+        ----------
+        x, y, z : ndarray
+            1-D arrays of the starting coordinates of the rays
+        l, m, n : ndarray
+            1-D arrays of the direction cosines of the rays
+        intensity : float or ndarray
+            flux of each ray
+        wavelength : float or ndarray, optional
+            wavelength (in micrometers) of each ray; required by the
+            spectral color format
+
+        Returns
+        -------
+        None
+        """
+        cols = [x, y, z, l, m, n, intensity]
+        if self.spectral:
+            if wavelength is None:
+                raise ValueError('The spectral color format requires the wavelengths')
+            cols.append(wavelength)
+        nrays = len(x)
+        cols = [_np.broadcast_to(_np.asarray(c, dtype=_np.float64), (nrays,)) for c in cols]
+        for start in xrange(0, nrays, _SOURCE_CHUNK):
+            self._writeChunk([c[start:start+_SOURCE_CHUNK] for c in cols])
+
+    def _writeChunk(self, cols):
+        l, m, n = cols[3:6]
+        norm2 = l*l + m*m + n*n
+        bad = _np.abs(norm2 - 1) > self.tol
+        if bad.any():
+            if not self.normalize:
+                raise ValueError('{} rays have non-normalized direction cosines'
+                                 .format(bad.sum()))
+            if (norm2 == 0).any():
+                raise ValueError('Rays with null direction cosines')
+            norm = _np.sqrt(norm2)
+            cols[3:6] = l/norm, m/norm, n/norm
+            l, m, n = cols[3:6]
+        self.nrays += len(l)
+        self._flux += float(cols[6].sum())
+        if self.spectral:
+            self._wavelengths.update(_np.unique(cols[7])[:2].tolist())
+        incl = _np.degrees(_np.arccos(_np.clip(n, -1, 1)))
+        azim = _np.degrees(_np.arctan2(m, l))
+        self._inclination = [min(self._inclination[0], incl.min()),
+                             max(self._inclination[1], incl.max())]
+        self._azimuth = [min(self._azimuth[0], azim.min()),
+                         max(self._azimuth[1], azim.max())]
+        rays = _np.column_stack(cols)
+        if self.file_format == 'binary':
+            rays.astype('<f4').tofile(self._file)
+        else:
+            self._file.write(_formatE9Lines(rays))
+
+    def close(self):
+        """update the header (or first line) and close the file"""
+        if self._file.closed:
+            return
+        self._file.seek(0)
+        if self.file_format == 'binary':
+            self._file.write(self._header())
+        else:
+            self._file.write(self._firstLine())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def writeSourceFile(file_name, x, y, z, l, m, n, intensity, wavelength=None,
+                    file_format='binary', **kwargs):
+    """write the rays of a NSC "Source File" object
+
+    Parameters
+    ----------
+    file_name : string
+        name of the source file (provide full path)
+    x, y, z : ndarray
+        1-D arrays of the starting coordinates of the rays
+    l, m, n : ndarray
+        1-D arrays of the direction cosines of the rays
+    intensity : float or ndarray
+        flux of each ray
+    wavelength : float or ndarray, optional
+        wavelength (in micrometers) of each ray. If ``None`` (default), the
+        file is written in the flux only format
+    file_format : string, optional
+        ``binary`` (default) or ``text``
+    **kwargs
+        other arguments of ``SourceFileWriter`` (description, units,
+        flux_type, source_flux, normalize, tol)
+
+    Returns
+    -------
+    nrays : integer
+        number of rays written
+
+    Examples
+    --------
+    >>> rays = sampleGaussianSource(10**6, waist=0.5, divergence=0.001,
+    ...                             wavelength=0.6328)
+    >>> writeSourceFile('laser.dat', *rays, description='HeNe laser')
+    """
+    writer = SourceFileWriter(file_name, file_format, wavelength is not None, **kwargs)
+    try:
+        writer.write(x, y, z, l, m, n, intensity, wavelength)
+    finally:
+        writer.close()
+    return writer.nrays
+
+def readSourceFile(file_name):
+    """read the rays of a binary or text NSC source file
+
+    Parameters
+    ----------
+    file_name : string
+        name of the source file
+
+    Returns
+    -------
+    rays : namedtuple
+        ``sourceRays`` of 1-D arrays; ``wavelength`` is ``None`` for the
+        flux only format
+    header : dict or None
+        fields of the header of a binary file, ``None`` for a text file
+    """
+    with open(file_name, 'rb') as f:
+        first = f.read(208)
+    if len(first) == 208 and _unpack('<i', first[:4])[0] == 1010:
+        values = _unpack(SourceFileWriter._headerFmt, first)
+        header = dict(zip(['identifier', 'nrays', 'description', 'source_flux',
+                           'ray_set_flux', 'wavelength', 'inclination_beg',
+                           'inclination_end', 'azimuth_beg', 'azimuth_end',
+                           'units'], values[:11]))
+        header['description'] = header['description'].split(b'\0')[0].decode('ascii')
+        header['ray_format_type'], header['flux_type'] = values[24:26]
+        ncols = 8 if header['ray_format_type'] == 2 else 7
+        data = _np.fromfile(file_name, dtype='<f4', offset=208).astype(_np.float64)
+    else:
+        header = None
+        with open(file_name) as f:
+            nrays, fmt = [int(v) for v in f.readline().split()[:2]]
+            ncols = 8 if fmt == 2 else 7
+            data = _np.loadtxt(f, ndmin=2)
+    data = data.reshape(-1, ncols)
+    return sourceRays(*(list(data.T) + [None]*(8 - ncols))), header
+
+def _sourceDirections(tx, ty):
+    """direction cosines of the rays of direction tangents ``tx``, ``ty``"""
+    n = 1/_np.sqrt(1 + tx**2 + ty**2)
+    return tx*n, ty*n, n
+
+def sampleLambertianSource(nrays, power=1.0, size=(0.0, 0.0), order=1.0,
+                           wavelength=None, seed=None):
+    """returns the rays of a planar (LED-like) source of ``cos(theta)**order``
+    angular intensity, emitting along the +z-axis
+
+    Parameters
+    ----------
+    nrays : integer
+        number of rays
+    power : float, optional
+        total power of the source, shared equally by the rays
+    size : 2-tuple, optional
+        (x, y) full widths of the rectangular emitting area. Default is a
+        point source
+    order : float, optional
+        exponent of the angular intensity; 1 (default) for a Lambertian
+        source
+    wavelength : float or ndarray, optional
+        wavelength of the rays in micrometers
+    seed : integer, optional
+        seed of the random numbers
+
+    Returns
+    -------
+    rays : namedtuple
+        ``sourceRays`` of 1-D arrays, which can be passed to
+        ``writeSourceFile()``
+    """
+    rs = _np.random.RandomState(seed)
+    x = (rs.random_sample(nrays) - 0.5)*size[0]
+    y = (rs.random_sample(nrays) - 0.5)*size[1]
+    # the intensity per solid angle cos(theta)**order is sampled from the
+    # inverse of its cumulative distribution in cos(theta)
+    cosTheta = rs.random_sample(nrays)**(1.0/(order + 1))
+    sinTheta = _np.sqrt(1 - cosTheta**2)
+    phi = 2*_math.pi*rs.random_sample(nrays)
+    wavelength = None if wavelength is None else _np.broadcast_to(wavelength, (nrays,))
+    return sourceRays(x, y, _np.zeros(nrays), sinTheta*_np.cos(phi),
+                      sinTheta*_np.sin(phi), cosTheta, _np.full(nrays, power/nrays),
+                      wavelength)
+
+def sampleGaussianSource(nrays, waist, divergence, power=1.0, wavelength=None,
+                         seed=None):
+    """returns the rays of a Gaussian (laser) beam at its waist, propagating
+    along the +z-axis
+
+    Parameters
+    ----------
+    nrays : integer
+        number of rays
+    waist : float or 2-tuple
+        1/e^2 radius of the irradiance at the waist, or (x, y) radii
+    divergence : float or 2-tuple
+        far field half angle (radians) at 1/e^2 of the intensity, or (x, y)
+        half angles
+    power : float, optional
+        total power of the source, shared equally by the rays
+    wavelength : float or ndarray, optional
+        wavelength of the rays in micrometers
+    seed : integer, optional
+        seed of the random numbers
+
+    Returns
+    -------
+    rays : namedtuple
+        ``sourceRays`` of 1-D arrays, which can be passed to
+        ``writeSourceFile()``
+
+    Notes
+    -----
+    The positions and the direction tangents of the rays are independent
+    and normally distributed with standard deviations of half the waist
+    and half the divergence (the irradiance being proportional to
+    ``exp(-2*r**2/waist**2)``).
+    """
+    rs = _np.random.RandomState(seed)
+    wx, wy = (waist, waist) if _np.ndim(waist) == 0 else waist
+    dx, dy = (divergence, divergence) if _np.ndim(divergence) == 0 else divergence
+    x = rs.normal(scale=0.5*wx, size=nrays)
+    y = rs.normal(scale=0.5*wy, size=nrays)
+    l, m, n = _sourceDirections(_np.tan(rs.normal(scale=0.5*dx, size=nrays)),
+                                _np.tan(rs.normal(scale=0.5*dy, size=nrays)))
+    wavelength = None if wavelength is None else _np.broadcast_to(wavelength, (nrays,))
+    return sourceRays(x, y, _np.zeros(nrays), l, m, n, _np.full(nrays, power/nrays),
+                      wavelength)
+
+#%% Analysis settings (CFG) files
+
+# analysis id stored in the header (second int) of the settings files
+cfgAnalysisIds = {'Pop' : 522, 'Fps' : 360, 'Pcs' : 361, 'Hps' : 363, 'Hcs' : 364,
+                  'Mtf' : 340, 'Hmf' : 345, 'Sim' : 425, 'Dvw' : 2032}
+
+# Known settings, by analysis id, as ``key : (offset, format)``. The format is
+# a struct format character ('i' or 'd') or 'U<n>' for a null-terminated
+# UTF-16 string field of n characters. The offsets were found by comparing
+# settings files saved by Zemax (see the files in ZMXFILES), and may be
+# extended using ``calibrateCFGKey()``. The keys use the names of the ZPL
+# command MODIFYSETTINGS.
+cfgKeys = {522 : {'POP_SAMPX'      : (0x028, 'i'),
+                  'POP_SAMPY'      : (0x02c, 'i'),
+                  'POP_WIDEX'      : (0x040, 'd'),
+                  'POP_WIDEY'      : (0x048, 'd'),
+                  'POP_SOURCEFILE' : (0x2b4, 'U260'),
+                  'POP_COMPUTE'    : (0x4c0, 'i'),
+                  },
+          }
+
+def _cfgFieldSize(fmt):
+    if fmt.startswith('U'):
+        return 2*int(fmt[1:])
+    return 4 if fmt == 'i' else 8
+
+class CFGFile(object):
+    """Zemax analysis settings (.CFG) file held in memory
+
+    The settings are read and written locally, without any DDE call, and
+    any number of settings can be changed before the file is written once
+    using ``save()``.
+
+    Parameters
+    ----------
+    fileName : string, optional
+        settings file to read. If ``None``, ``data`` must be given.
+    data : bytes, optional
+        content of a settings file
+
+    Examples
+    --------
+    >>> cfg = readCFGFile('lens_pyzdde_POP.CFG')
+    >>> cfg.update(POP_SAMPX=3, POP_SAMPY=3, POP_WIDEX=4.0, POP_WIDEY=4.0)
+    >>> cfg.save()
+    """
+    def __init__(self, fileName=None, data=None):
+        if fileName is not None:
+            with open(fileName, 'rb') as f:
+                data = f.read()
+        if data is None or len(data) < 8:
+            raise ValueError('Invalid settings file')
+        self.fileName = fileName
+        self.data = bytearray(data)
+
+    @property
+    def analysisId(self):
+        """analysis id stored in the header of the file"""
+        return _unpack('i', bytes(self.data[4:8]))[0]
+
+    def keys(self):
+        """returns the list of the known keys for the analysis of the file"""
+        return sorted(cfgKeys.get(self.analysisId, {}))
+
+    def _field(self, key):
+        try:
+            return cfgKeys[self.analysisId][key]
+        except KeyError:
+            raise KeyError('Unknown key {} for the analysis id {}. Use '
+                           'calibrateCFGKey() to add it'.format(key, self.analysisId))
+
+    def getValue(self, offset, fmt):
+        """returns the value of the field at ``offset`` (in bytes)
+
+        Parameters
+        ----------
+        offset : integer
+            offset of the field, in bytes, from the beginning of the file
+        fmt : string
+            'i' (int), 'd' (double) or 'U<n>' (string of n characters)
+        """
+        size = _cfgFieldSize(fmt)
+        raw = bytes(self.data[offset:offset + size])
+        if fmt.startswith('U'):
+            return raw.decode('utf-16-le').split(u'\x00', 1)[0]
+        return _unpack(fmt, raw)[0]
+
+    def setValue(self, offset, fmt, value):
+        """set the value of the field at ``offset`` (in bytes); see
+        ``getValue()``
+        """
+        size = _cfgFieldSize(fmt)
+        if fmt.startswith('U'):
+            raw = value.encode('utf-16-le')
+            if len(raw) >= size:
+                raise ValueError('String {} is too long for the field'.format(value))
+            raw += b'\x00'*(size - len(raw))
+        elif fmt == 'i':
+            raw = _pack(fmt, int(value))
+        else:
+            raw = _pack(fmt, float(value))
+        self.data[offset:offset + size] = raw
+
+    def get(self, key):
+        """returns the value of the setting ``key``, such as 'POP_SAMPX'"""
+        return self.getValue(*self._field(key))
+
+    def set(self, key, value):
+        """set the value of the setting ``key``, such as 'POP_SAMPX'"""
+        offset, fmt = self._field(key)
+        self.setValue(offset, fmt, value)
+
+    def update(self, settings=None, **kwargs):
+        """set several settings at once
+
+        Parameters
+        ----------
+        settings : dict, optional
+            dictionary of ``key : value``
+        **kwargs :
+            settings as keyword arguments
+        """
+        settings = dict(settings or {}, **kwargs)
+        fields = [(self._field(key), value) for key, value in settings.items()]
+        for (offset, fmt), value in fields:
+            self.setValue(offset, fmt, value)
+
+    def copy(self):
+        """returns a copy of the object"""
+        cfg = CFGFile(data=bytes(self.data))
+        cfg.fileName = self.fileName
+        return cfg
+
+    def save(self, fileName=None):
+        """write the settings file (in a single write)
+
+        Parameters
+        ----------
+        fileName : string, optional
+            file name. If ``None``, the file that was read is overwritten.
+        """
+        fileName = fileName or self.fileName
+        if fileName is None:
+            raise ValueError('A file name is required')
+        with open(fileName, 'wb') as f:
+            f.write(bytes(self.data))
+        self.fileName = fileName
+
+def readCFGFile(fileName):
+    """read a Zemax analysis settings (.CFG) file
+
+    Parameters
+    ----------
+    fileName : string
+        file name with full path
+
+    Returns
+    -------
+    cfg : CFGFile object
+    """
+    return CFGFile(fileName)
+
+def writeCFGFile(fileName, settings, outFile=None):
+    """change several settings of a settings (.CFG) file in a single read
+    and write
+
+    Parameters
+    ----------
+    fileName : string
+        settings file with full path
+    settings : dict
+        dictionary of ``key : value``, for example ``{'POP_SAMPX':3,
+        'POP_WIDEX':4.0}``
+    outFile : string, optional
+        file to write. If ``None`` (default), ``fileName`` is overwritten.
+
+    Returns
+    -------
+    cfg : CFGFile object
+    """
+    cfg = CFGFile(fileName)
+    cfg.update(settings)
+    cfg.save(outFile or fileName)
+    return cfg
+
+def diffCFGFiles(cfg1, cfg2):
+    """returns the byte ranges that differ between two settings files
+
+    Parameters
+    ----------
+    cfg1, cfg2 : string or CFGFile object
+        settings files to compare
+
+    Returns
+    -------
+    ranges : list of tuples
+        ``(start, end)`` byte ranges (end excluded)
+    """
+    d1 = (cfg1 if isinstance(cfg1, CFGFile) else CFGFile(cfg1)).data
+    d2 = (cfg2 if isinstance(cfg2, CFGFile) else CFGFile(cfg2)).data
+    ranges, start = [], None
+    for i in xrange(max(len(d1), len(d2))):
+        differ = i >= len(d1) or i >= len(d2) or d1[i] != d2[i]
+        if differ and start is None:
+            start = i
+        elif not differ and start is not None:
+            ranges.append((start, i))
+            start = None
+    if start is not None:
+        ranges.append((start, max(len(d1), len(d2))))
+    return ranges
+
+def calibrateCFGKey(key, before, after, value, strLen=260):
+    """find the location of a setting by comparing two settings files, and
+    add it to the known settings (``cfgKeys``)
+
+    The file ``after`` must be a copy of the file ``before`` in which only
+    the setting ``key`` was changed to ``value``, for example by Zemax
+    using ``zModifySettings()``. The value should be distinctive (such as
+    2.375 for a float setting) such that only one location matches.
+
+    Parameters
+    ----------
+    key : string
+        name of the setting, such as 'POP_FPARAM1'
+    before, after : string or CFGFile object
+        settings files before and after the change
+    value : integer, float or string
+        value of the setting in ``after``. The type of the value determines
+        the type of the field (int, double or UTF-16 string)
+    strLen : integer, optional
+        length (in characters) assumed for string fields
+
+    Returns
+    -------
+    offset : integer
+        offset of the setting in bytes
+    fmt : string
+        format of the field
+    """
+    after = after if isinstance(after, CFGFile) else CFGFile(after)
+    ranges = diffCFGFiles(before, after)
+    if isinstance(value, float):
+        fmt = 'd'
+    elif isinstance(value, int):
+        fmt = 'i'
+    else:
+        fmt = 'U{}'.format(strLen)
+    candidates = set()
+    for start, end in ranges:
+        if fmt.startswith('U'):
+            first = start - start % 2
+            lastChars = len(value)
+            offsets = xrange(max(first - 2*lastChars, 0), first + 2, 2)
+        else:
+            size = _cfgFieldSize(fmt)
+            offsets = xrange(max(start - size + 1, 0) & ~3, end, 4)
+        for offset in offsets:
+            if offset + _cfgFieldSize(fmt) > len(after.data):
+                continue
+            if after.getValue(offset, fmt) == value:
+                candidates.add(offset)
+    if len(candidates) != 1:
+        raise ValueError('Found {} candidate locations for {}; use another value'
+                         .format(len(candidates), key))
+    offset = candidates.pop()
+    cfgKeys.setdefault(after.analysisId, {})[key] = (offset, fmt)
+    return offset, fmt
+
+#%% Scratch (temporary) file management
+
+# shared by all the ScratchFileManager objects of the process, such that
+# multiple links never generate the same file name
+_scratch_counter = _itertools.count(1)
+
+def waitForFile(fileName, mode='r', timeout=0.25, maxDelay=0.05):
+    """wait until the file ``fileName`` exist and can be opened in ``mode``
+
+    The file is polled with an exponentially increasing delay (starting at
+    1 ms, and limited to ``maxDelay``) so that a file that is ready is
+    detected almost immediately.
+
+    Parameters
+    ----------
+    fileName : string
+        filename with full path
+    mode : string, optional
+        mode for opening file
+    timeout : float, optional
+        timeout in seconds. If ``0``, the file is checked only once.
+    maxDelay : float, optional
+        maximum delay in seconds between two attempts
+
+    Returns
+    -------
+    status : bool
+      True = file exist, and file operations are possible;
+      False = timeout reached
+    """
+    delay = 0.001
+    end = _time.time() + timeout
+    while True:
+        try:
+            f = open(fileName, mode)
+        except IOError:
+            remaining = end - _time.time()
+            if remaining <= 0:
+                return False
+            _time.sleep(min(delay, remaining))
+            delay = min(2*delay, maxDelay)
+        else:
+            f.close()
+            return True
+
+def removeFile(fileName, timeout=2.0, maxDelay=0.2):
+    """delete the file ``fileName``, retrying with an exponentially
+    increasing delay while the file is in use (for example, while Zemax is
+    still holding it)
+
+    Parameters
+    ----------
+    fileName : string
+        filename with full path
+    timeout : float, optional
+        time in seconds after which to give up
+    maxDelay : float, optional
+        maximum delay in seconds between two attempts
+
+    Returns
+    -------
+    status : bool
+        True if the file was deleted or doesn't exist, False otherwise
+    """
+    delay = 0.001
+    end = _time.time() + timeout
+    while True:
+        try:
+            _os.remove(fileName)
+        except OSError:
+            if not _os.path.exists(fileName):
+                return True
+            remaining = end - _time.time()
+            if remaining <= 0:
+                return False
+            _time.sleep(min(delay, remaining))
+            delay = min(2*delay, maxDelay)
+        else:
+            return True
+
+class ScratchFileManager(object):
+    """Manager of the scratch files (text and metafiles from analysis
+    windows, temporary settings files, etc.) created during a session
+
+    The manager generates unique file names per call, such that concurrent
+    analyses don't collide, places them in a configurable directory (for
+    example, a RAM disk), deletes them in a background thread, and keeps
+    track of the files that must be deleted at the end of the session.
+
+    Parameters
+    ----------
+    directory : string, optional
+        directory for the scratch files. If ``None`` (default), the
+        directory passed to ``newFileName()`` is used, or the system's
+        temporary directory.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._tracked = set()
+        self._lock = _threading.Lock()
+        self._queue = _queue.Queue()
+        self._worker = None
+
+    def newFileName(self, name, directory=None):
+        """returns a unique file name (with full path) for a scratch file
+
+        Parameters
+        ----------
+        name : string
+            base name of the file, such as 'popData.txt'. A unique suffix
+            is inserted before the extension.
+        directory : string, optional
+            directory to use if the manager doesn't have a directory set
+
+        Returns
+        -------
+        fileName : string
+            file name with full path
+        """
+        fdir = self.directory or directory or _tempfile.gettempdir()
+        stem, ext = _os.path.splitext(_os.path.basename(name))
+        uniqueName = '{}_{}_{}{}'.format(stem, _os.getpid(), next(_scratch_counter), ext)
+        return _os.path.join(fdir, uniqueName)
+
+    def track(self, fileName):
+        """register a file to be deleted at the end of the session"""
+        with self._lock:
+            self._tracked.add(fileName)
+
+    def untrack(self, fileName):
+        """stop tracking a file registered with ``track()``"""
+        with self._lock:
+            self._tracked.discard(fileName)
+
+    @property
+    def trackedFiles(self):
+        """set of the files to be deleted at the end of the session"""
+        with self._lock:
+            return set(self._tracked)
+
+    def remove(self, fileName, background=True):
+        """delete a scratch file
+
+        Parameters
+        ----------
+        fileName : string
+            filename with full path
+        background : bool, optional
+            if ``True`` (default), the file is deleted asynchronously by a
+            background thread, and the function returns immediately. Files
+            that couldn't be deleted are tracked and deleted at the end of
+            the session.
+
+        Returns
+        -------
+        status : bool
+            always ``True`` if ``background`` is ``True``, else the status
+            of the deletion
+        """
+        if not background:
+            status = removeFile(fileName)
+            if not status:
+                self.track(fileName)
+            return status
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = _threading.Thread(target=self._removeWorker,
+                                                 name='pyzdde-scratch-cleanup')
+                self._worker.daemon = True
+                self._worker.start()
+        self._queue.put(fileName)
+        return True
+
+    def _removeWorker(self):
+        while True:
+            fileName = self._queue.get()
+            try:
+                if fileName is None:    # stop sentinel put by close()
+                    return
+                if not removeFile(fileName, timeout=5.0):
+                    self.track(fileName)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """wait until all the pending background deletions are done"""
+        self._queue.join()
+
+    def cleanup(self):
+        """delete all the tracked files (and wait for the pending background
+        deletions). Called at the end of the session
+
+        Returns
+        -------
+        remaining : set
+            files that couldn't be deleted (they remain tracked)
+        """
+        self.flush()
+        remaining = set()
+        for fileName in self.trackedFiles:
+            if removeFile(fileName):
+                self.untrack(fileName)
+            else:
+                remaining.add(fileName)
+        return remaining
+
+    def close(self):
+        """stop the background thread once the pending deletions are done,
+        and delete all the tracked files (see ``cleanup()``). Called at the
+        end of the session; a later ``remove()`` starts a new thread
+
+        Returns
+        -------
+        remaining : set
+            files that couldn't be deleted (they remain tracked)
+        """
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None and worker.is_alive():
+            self._queue.put(None)
+            worker.join()
+        return self.cleanup()